@@ -0,0 +1,254 @@
+"""
+Кэш ответов бота на типовые вопросы.
+
+Большая часть входящих — одни и те же вопросы («сколько стоит маникюр?»,
+«адрес?», «до скольки работаете?»), и каждый шёл полным вызовом Gemini с
+промптом в несколько тысяч токенов. Ключ кэша:
+(company_id, язык, нормализованный вопрос, версия каталога, версия настроек),
+поэтому правка услуг/мастеров (триггеры bot_catalog_versions) или настроек
+бота (`invalidate_settings_cache`, в том числе по Pub/Sub) сразу отправляет
+вопрос мимо старых ответов.
+
+Кэш применяется только к «справочным» ходам, открывающим сессию; остальные
+идут обычным путём:
+- за последние BOT_ANSWER_CACHE_SESSION_GAP_MINUTES был ответ бота или
+  менеджера (короткие «да», «маникюр», «а сколько?» — продолжение диалога);
+- есть прогресс записи или флаги контекста (незавершённая запись, срочность);
+- в сообщении дата, время, день недели или номер телефона;
+- сообщение длиннее BOT_ANSWER_CACHE_MAX_QUESTION_CHARS.
+
+Промпт остаётся обычным (история, статистика клиента, слоты), а дайджест
+клиентского контекста промпта входит в ключ: ответ переиспользуется только
+клиентами с тем же контекстом (например, новыми). Не кэшируются ответы с
+командами ([BOOKING_CONFIRMED] и т.п.) и обещаниями позвать менеджера.
+
+Счётчики (попадания, промахи, обходы, сэкономленное время upstream) пишутся
+пачками в bot_answer_cache_daily (db/bot_analytics.py) и видны в аналитике
+бота; сводка по воркеру — `answer_cache_stats()`.
+"""
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from bot.constants import ESCALATION_PROMISES
+from utils.cache import TTLCache
+from utils.logger import log_error
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
+ANSWER_CACHE_ENABLED = _env_flag("BOT_ANSWER_CACHE_ENABLED", default=True)
+ANSWER_CACHE_TTL_SECONDS = max(1, _read_int_env("BOT_ANSWER_CACHE_TTL_SECONDS", 3600))
+ANSWER_CACHE_MAX_ENTRIES = max(1, _read_int_env("BOT_ANSWER_CACHE_MAX_ENTRIES", 4096))
+ANSWER_CACHE_MAX_QUESTION_CHARS = max(1, _read_int_env("BOT_ANSWER_CACHE_MAX_QUESTION_CHARS", 160))
+ANSWER_CACHE_SESSION_GAP_MINUTES = max(1, _read_int_env("BOT_ANSWER_CACHE_SESSION_GAP_MINUTES", 360))
+
+_answers = TTLCache(maxsize=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL_SECONDS)
+
+# Даты, время, относительные дни и дни недели (ru/en/ar), номера телефонов
+_DATE_TIME_RE = re.compile(
+    r"\d{1,2}\s*[:.\-/]\s*\d{1,2}"
+    r"|\d{1,2}\s*(?:am|pm|ч\b|час|h\b|hour)"
+    r"|(?:\bв|\bat|\bна|\bк)\s+\d{1,2}\b"
+    r"|\d{1,2}\s+(?:янв|фев|мар|апр|ма[йя]|июн|июл|авг|сен|окт|ноя|дек|jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)"
+    r"|\+?\d[\d\s\-()]{5,}\d"
+    r"|сегодня|завтра|послезавтра|today|tomorrow|tonight|weekend|выходн"
+    r"|понедельн|вторник|сред[уаы]\b|четверг|пятниц|суббот|воскресен"
+    r"|monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+    r"|اليوم|غدا|بكرة|السبت|الأحد|الاثنين|الثلاثاء|الأربعاء|الخميس|الجمعة",
+    re.IGNORECASE,
+)
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Нижний регистр, NFKC, ё→е, без пунктуации и эмодзи, одиночные пробелы."""
+    normalized = unicodedata.normalize("NFKC", text or "").lower().replace("ё", "е")
+    normalized = _PUNCTUATION_RE.sub(" ", normalized).replace("_", " ")
+    return _SPACES_RE.sub(" ", normalized).strip()
+
+
+def _message_time(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        moment = value
+    else:
+        try:
+            moment = datetime.fromisoformat(str(value))
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def is_session_opening(history: Optional[List[Tuple]], now: Optional[datetime] = None) -> bool:
+    """
+    Ход открывает сессию: в истории (message, sender, timestamp, ...) нет ответа
+    бота или менеджера за последние ANSWER_CACHE_SESSION_GAP_MINUTES.
+    Сообщение без читаемого времени считается недавним.
+    """
+    cutoff = (now or datetime.now()) - timedelta(minutes=ANSWER_CACHE_SESSION_GAP_MINUTES)
+    for message in history or []:
+        if len(message) < 3 or message[1] == "client":
+            continue
+        moment = _message_time(message[2])
+        if moment is None or moment >= cutoff:
+            return False
+    return True
+
+
+def bypass_reason(
+    question: str,
+    booking_progress: Optional[Dict] = None,
+    context_flags: Optional[Dict] = None,
+    history: Optional[List[Tuple]] = None,
+) -> Optional[str]:
+    """Почему ход нельзя обслужить из кэша; None — можно."""
+    if not ANSWER_CACHE_ENABLED:
+        return "disabled"
+    if history is not None and not is_session_opening(history):
+        return "in_conversation"
+    if booking_progress and any(booking_progress.values()):
+        return "booking_progress"
+    if context_flags and any(context_flags.values()):
+        return "context_flags"
+    if len(question or "") > ANSWER_CACHE_MAX_QUESTION_CHARS:
+        return "too_long"
+    if _DATE_TIME_RE.search(question or ""):
+        return "date_time"
+    if not normalize_question(question):
+        return "empty"
+    return None
+
+
+def is_cacheable_answer(answer: str) -> bool:
+    if not answer or not answer.strip():
+        return False
+    # Команды вида [BOOKING_CONFIRMED] и обещания позвать менеджера — только для этого клиента
+    if "[" in answer:
+        return False
+    lowered = answer.lower()
+    return not any(promise in lowered for promise in ESCALATION_PROMISES)
+
+
+def _record(company_id: Optional[int], event: str, upstream_ms: float = 0.0) -> None:
+    _stats.record(event, upstream_ms)
+    if company_id is None:
+        return
+    try:
+        from db.bot_analytics import record_answer_cache_event
+        record_answer_cache_event(company_id, event, upstream_ms)
+    except Exception as e:
+        log_error(f"Answer cache event not recorded: {e}", "bot")
+
+
+def answer_cache_key(
+    company_id: Optional[int],
+    question: str,
+    language: str,
+    booking_progress: Optional[Dict] = None,
+    context_flags: Optional[Dict] = None,
+    history: Optional[List[Tuple]] = None,
+    prompt_context: str = "",
+) -> Optional[Tuple]:
+    """
+    Ключ кэша для хода или None, если ход идёт мимо кэша (причина
+    учитывается в статистике). Без компании кэш не используется.
+    `prompt_context` — клиентская часть промпта (статистика, follow-up),
+    в ключ входит её дайджест.
+    """
+    reason = "no_company" if company_id is None else bypass_reason(question, booking_progress, context_flags, history)
+    if reason is not None:
+        _record(company_id, f"bypass:{reason}")
+        return None
+
+    from bot.prompt_cache import get_catalog_version
+    from db.settings import get_settings_version
+
+    try:
+        catalog_version = get_catalog_version(company_id)
+    except Exception as e:
+        log_error(f"Bot catalog version unavailable for company {company_id}: {e}", "bot")
+        _record(company_id, "bypass:catalog_version")
+        return None
+    return (
+        int(company_id),
+        language or "",
+        normalize_question(question),
+        hashlib.sha1((prompt_context or "").encode("utf-8")).hexdigest()[:16],
+        catalog_version,
+        get_settings_version(company_id),
+    )
+
+
+def get_cached_answer(key: Tuple) -> Optional[str]:
+    entry = _answers.get(key)
+    if entry is None:
+        _record(key[0], "miss")
+        return None
+    answer, upstream_ms = entry
+    _record(key[0], "hit", upstream_ms)
+    return answer
+
+
+def store_answer(key: Tuple, answer: str, upstream_ms: float) -> bool:
+    """Сохранить ответ; upstream_ms — сколько занял вызов LLM (экономия на каждом попадании)."""
+    if not is_cacheable_answer(answer):
+        _record(key[0], "rejected")
+        return False
+    _answers.set(key, (answer, float(upstream_ms)))
+    _record(key[0], "stored")
+    return True
+
+
+def clear_answer_cache() -> None:
+    _answers.clear()
+
+
+class _AnswerCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events: Dict[str, int] = {}
+        self.saved_ms = 0.0
+
+    def record(self, event: str, upstream_ms: float = 0.0) -> None:
+        with self._lock:
+            self.events[event] = self.events.get(event, 0) + 1
+            if event == "hit":
+                self.saved_ms += upstream_ms
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            hits = self.events.get("hit", 0)
+            misses = self.events.get("miss", 0)
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "saved_upstream_ms": round(self.saved_ms, 1),
+                "events": dict(self.events),
+            }
+
+
+_stats = _AnswerCacheStats()
+
+
+def answer_cache_stats() -> dict:
+    return {**_stats.as_dict(), "cache": _answers.stats()}
@@ -42,6 +42,13 @@ FALLBACK_PHRASES = [
     "A technical error occurred, our manager will assist you shortly."
 ]
 
+# Фразы в ответе бота, после которых менеджеру уходит уведомление (эскалация)
+ESCALATION_PROMISES = [
+    'менеджер свяжется', 'свяжусь с менеджером', 'передал ваш запрос',
+    'позвал администратора', 'администратор ответит', 'manager will contact',
+    'передаю информацию менеджеру', 'уведомил менеджера', 'менеджер скоро ответит'
+]
+
 # === ЗАГОЛОВКИ ПРОМТОВ (PROMPT HEADERS) ===
 PROMPT_HEADERS = {
     'SALON_INFO': "[SALON CORE INFORMATION]",
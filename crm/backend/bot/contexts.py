@@ -0,0 +1,221 @@
+"""
+Реестр контекстов бота по компаниям.
+
+`SalonBot` один на процесс (ключи, прокси, клиент Gemini), а всё, что
+зависит от компании — настройки салона, настройки бота и `PromptBuilder` —
+живёт в `BotContext`, который собирается лениво при первом обращении
+компании и хранится в LRU на `BOT_CONTEXT_CACHE_SIZE` компаний.
+
+Свежесть проверяется по `db.settings.get_settings_version` (счётчик в памяти,
+без запроса к БД): `update_bot_settings` / `update_company` вызывают
+`invalidate_settings_cache`, которая увеличивает версию в этом воркере и
+рассылает `crm:settings:invalidate` остальным — контекст со старой версией
+пересобирается при следующем сообщении. Явный сброс
+(`/api/bot-settings/reload`) — `invalidate_bot_context`, тоже через Pub/Sub.
+Снимок каталога (услуги, мастера) — секции промпта в bot/prompt_cache.py
+по версии каталога; в контексте запоминается версия, с которой он собран.
+
+Контекст после сборки не меняется, поэтому его можно читать из любого числа
+корутин и потоков; сборка одной компании идёт под её собственным lock,
+параллельные обращения ждут готовый контекст, а не строят свой.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from utils.logger import log_error, log_info
+from utils.tenant_context import get_current_company_id
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+BOT_CONTEXT_CACHE_SIZE = max(1, _read_int_env("BOT_CONTEXT_CACHE_SIZE", 256))
+_BOT_PUBSUB_PREFIX = "crm:bot:"
+
+
+@dataclass
+class BotContext:
+    company_id: Optional[int]
+    salon: dict
+    bot_settings: dict
+    prompt_builder: object
+    settings_version: int
+    catalog_version: int = 0
+    loaded_at: float = field(default_factory=time.time)
+
+
+def _load_catalog_version(company_id: Optional[int]) -> int:
+    if company_id is None:
+        return 0
+    from bot.prompt_cache import get_catalog_version
+    try:
+        return get_catalog_version(company_id)
+    except Exception as e:
+        log_error(f"Bot catalog version unavailable for company {company_id}: {e}", "bot")
+        return 0
+
+
+def build_bot_context(company_id: Optional[int]) -> BotContext:
+    """Собрать контекст компании из БД (настройки берутся через кэш db.settings)."""
+    from db.settings import get_bot_settings, get_salon_settings, get_settings_version
+    from bot.prompts import PromptBuilder
+
+    # Версия снимается ДО загрузки: инвалидация во время сборки не потеряется
+    settings_version = get_settings_version(company_id)
+    salon = get_salon_settings(company_id)
+    bot_settings = get_bot_settings(company_id)
+    return BotContext(
+        company_id=company_id,
+        salon=salon,
+        bot_settings=bot_settings,
+        prompt_builder=PromptBuilder(salon=salon, bot_settings=bot_settings),
+        settings_version=settings_version,
+        catalog_version=_load_catalog_version(company_id),
+    )
+
+
+class BotContextRegistry:
+    """LRU контекстов по company_id с ленивой сборкой и проверкой версии настроек."""
+
+    def __init__(self, maxsize: int = BOT_CONTEXT_CACHE_SIZE):
+        self.maxsize = max(1, int(maxsize))
+        self._contexts: "OrderedDict[Optional[int], BotContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[Optional[int], threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.build_errors = 0
+
+    def _is_fresh(self, context: BotContext) -> bool:
+        from db.settings import get_settings_version
+        return context.settings_version == get_settings_version(context.company_id)
+
+    def _lookup(self, company_id: Optional[int]) -> Optional[BotContext]:
+        with self._lock:
+            context = self._contexts.get(company_id)
+            if context is None:
+                return None
+            if not self._is_fresh(context):
+                self._contexts.pop(company_id, None)
+                self.stale += 1
+                return None
+            self._contexts.move_to_end(company_id)
+            self.hits += 1
+            return context
+
+    def _build_lock(self, company_id: Optional[int]) -> threading.Lock:
+        with self._lock:
+            lock = self._build_locks.get(company_id)
+            if lock is None:
+                lock = self._build_locks[company_id] = threading.Lock()
+            return lock
+
+    def get(self, company_id: Optional[int] = None) -> BotContext:
+        """Контекст компании (по умолчанию текущей из tenant-контекста)."""
+        if company_id is None:
+            company_id = get_current_company_id()
+        company_id = int(company_id) if company_id is not None else None
+
+        context = self._lookup(company_id)
+        if context is not None:
+            return context
+
+        with self._build_lock(company_id):
+            # Пока ждали lock, контекст мог собрать соседний поток
+            context = self._lookup(company_id)
+            if context is not None:
+                return context
+            try:
+                context = build_bot_context(company_id)
+            except Exception:
+                with self._lock:
+                    self.build_errors += 1
+                raise
+            with self._lock:
+                self.misses += 1
+                self._contexts[company_id] = context
+                self._contexts.move_to_end(company_id)
+                while len(self._contexts) > self.maxsize:
+                    evicted_id, _ = self._contexts.popitem(last=False)
+                    self._build_locks.pop(evicted_id, None)
+                    self.evictions += 1
+        return context
+
+    def invalidate(self, company_id: Optional[int]) -> bool:
+        with self._lock:
+            return self._contexts.pop(company_id, None) is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._contexts.clear()
+            self._build_locks.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._contexts),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "build_errors": self.build_errors,
+                "companies": [
+                    {
+                        "company_id": context.company_id,
+                        "settings_version": context.settings_version,
+                        "catalog_version": context.catalog_version,
+                        "age_seconds": round(time.time() - context.loaded_at, 1),
+                    }
+                    for context in self._contexts.values()
+                ],
+            }
+
+
+bot_contexts = BotContextRegistry()
+
+
+def get_bot_context(company_id: Optional[int] = None) -> BotContext:
+    return bot_contexts.get(company_id)
+
+
+def invalidate_bot_context(company_id: Optional[int] = None, broadcast: bool = True) -> None:
+    """Сбросить контекст компании (по умолчанию текущей) в этом воркере и, через Pub/Sub, в остальных."""
+    if company_id is None:
+        company_id = get_current_company_id()
+    company_id = int(company_id) if company_id is not None else None
+    bot_contexts.invalidate(company_id)
+    if broadcast and company_id is not None:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.publish_nowait(f"{_BOT_PUBSUB_PREFIX}invalidate", {"company_id": company_id})
+    log_info(f"Bot context invalidated for company {company_id}", "bot")
+
+
+async def _bot_pubsub_handler(channel: str, data: dict) -> None:
+    company_id = data.get("company_id") if isinstance(data, dict) else None
+    try:
+        company_id = int(company_id)
+    except (TypeError, ValueError):
+        return
+    bot_contexts.invalidate(company_id)
+
+
+def _register_bot_pubsub_handler() -> None:
+    try:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.register_handler(_BOT_PUBSUB_PREFIX, _bot_pubsub_handler)
+    except Exception as e:
+        log_error(f"Bot context Pub/Sub handler not registered: {e}", "bot")
+
+
+_register_bot_pubsub_handler()
@@ -1,23 +1,21 @@
 # backend/bot/core.py
 
 from google import genai
-import httpx
 import os
-import asyncio
+import time
 import logging  # ✅ ДОБАВЛЕНО
 from typing import Dict, Optional, List, Tuple
 from datetime import datetime, timedelta
 from bot.tools import get_available_time_slots, check_time_slot_available
 from utils.datetime_utils import get_current_time
+from services.llm_dispatcher import llm_dispatcher, load_numbered_env
 
 from core.config import DATABASE_NAME
 from db.connection import get_db_connection
-from core.config import GEMINI_API_KEY, GEMINI_MODEL
-from db import (
-    get_salon_settings,
-    get_bot_settings,
-    get_client_by_id,
-)
+from db import get_client_by_id
+from bot.contexts import BotContext, get_bot_context, invalidate_bot_context
+from bot.constants import ESCALATION_PROMISES
+from bot import answer_cache
 from core.config import DEFAULT_HOURS_WEEKDAYS
 
 # ✅ ДОБАВЛЕНО: Инициализация logger
@@ -28,50 +26,30 @@ class SalonBot:
     Главный класс AI-бота для салона красоты
 
     Отвечает за:
-    - Загрузку настроек из БД
-    - Построение промптов
+    - Настройки и построение промптов текущей компании (через bot/contexts.py)
     - Генерацию ответов через Gemini (с прокси)
     - Обработку логики диалогов
     """
 
     def __init__(self):
-        """Инициализация бота - загружаем настройки из БД"""
-        self.reload_settings()
-
+        """Инициализация бота - ключи и прокси; настройки компаний грузятся лениво"""
         # ✅ Настройка прокси для обхода геоблокировки
         environment = os.getenv("ENVIRONMENT", "development")
         
         # Load proxy list (PROXY_URL, PROXY_URL_1, PROXY_URL_2...)
-        self.proxies = []
-        
-        # Legacy/Single proxy
-        legacy_proxy = os.getenv("PROXY_URL")
-        if legacy_proxy:
-            self.proxies.append(legacy_proxy)
-            
-        # Numbered proxies
-        for i in range(1, 10):
-            p = os.getenv(f"PROXY_URL_{i}")
-            if p and p not in self.proxies:
-                self.proxies.append(p)
+        self.proxies = load_numbered_env("PROXY_URL")
 
         print("=" * 50)
         print(f"🔍 ENVIRONMENT: {environment}")
         print(f"🔍 PROXIES LOADED: {len(self.proxies)}")
 
         # ✅ Load API KEYS (GEMINI_API_KEY, GEMINI_API_KEY_1, ...)
-        self.api_keys = []
-        base_key = os.getenv("GEMINI_API_KEY")
-        if base_key:
-            self.api_keys.append(base_key)
-            
-        for i in range(1, 10):
-            k = os.getenv(f"GEMINI_API_KEY_{i}")
-            if k and k not in self.api_keys:
-                self.api_keys.append(k)
-                
+        self.api_keys = load_numbered_env("GEMINI_API_KEY")
         print(f"🔍 API KEYS LOADED: {len(self.api_keys)}")
 
+        # Запросы к Gemini идут через общий диспетчер (services/llm_dispatcher.py)
+        llm_dispatcher.configure(self.api_keys, self.proxies)
+
         # Configure initial client with first key
         if self.api_keys:
              self.client = genai.Client(api_key=self.api_keys[0])
@@ -84,20 +62,26 @@ class SalonBot:
 
         print("✅ Бот инициализирован (Gemini Multi-Key + Proxy Rotation)")
 
-    def reload_settings(self):
-        """Перезагрузить настройки из БД"""
-        from .prompts import PromptBuilder
+    @property
+    def context(self) -> BotContext:
+        """Контекст текущей компании (tenant-контекст запроса)"""
+        return get_bot_context()
 
-        self.salon = get_salon_settings()
-        self.bot_settings = get_bot_settings()
+    @property
+    def salon(self) -> Dict:
+        return self.context.salon
 
-        # ✅ Инициализируем prompt_builder
-        self.prompt_builder = PromptBuilder(
-            salon=self.salon,
-            bot_settings=self.bot_settings
-        )
+    @property
+    def bot_settings(self) -> Dict:
+        return self.context.bot_settings
 
-        print(f"✅ Настройки загружены: {self.salon['name']}")
+    @property
+    def prompt_builder(self):
+        return self.context.prompt_builder
+
+    def reload_settings(self):
+        """Сбросить контекст текущей компании во всех воркерах; пересоберётся при следующем сообщении"""
+        invalidate_bot_context()
 
     def build_system_prompt(
         self,
@@ -107,15 +91,8 @@ class SalonBot:
         client_language: str = 'ru'
     ) -> str:
         """..."""
-        from .prompts import PromptBuilder
-
-        builder = PromptBuilder(
-            salon=self.salon,
-            bot_settings=self.bot_settings
-        )
-
         # ✅ СНАЧАЛА СОЗДАЁМ ПРОМПТ
-        system_prompt = builder.build_full_prompt(
+        system_prompt = self.prompt_builder.build_full_prompt(
             instagram_id=instagram_id,
             history=history,
             booking_progress=booking_progress or {},
@@ -1154,6 +1131,25 @@ class SalonBot:
                 else:
                     print(f"✅ Phone number is valid: {extracted_phone}")
 
+            # ========================================
+            # ✅ КЭШ ОТВЕТОВ НА ТИПОВЫЕ ВОПРОСЫ (bot/answer_cache.py)
+            # ========================================
+            # Только ход, открывающий сессию; контекст клиента входит в ключ
+            answer_cache_key = answer_cache.answer_cache_key(
+                self.context.company_id,
+                user_message,
+                client_language,
+                booking_progress=booking_progress,
+                context_flags=context_flags,
+                history=history,
+                prompt_context=additional_context,
+            )
+            if answer_cache_key is not None:
+                cached_answer = answer_cache.get_cached_answer(answer_cache_key)
+                if cached_answer is not None:
+                    print(f"⚡ Answer cache hit: {cached_answer[:100]}")
+                    return cached_answer
+
             # ========================================
             # Строим промпт
             # ========================================
@@ -1171,7 +1167,16 @@ class SalonBot:
             # ========================================
 
             try:
-                ai_response = await self._generate_via_proxy(full_prompt, instagram_id=instagram_id)
+                upstream_started = time.perf_counter()
+                executed_actions = []
+                ai_response = await self._generate_via_proxy(
+                    full_prompt, instagram_id=instagram_id, executed_actions=executed_actions
+                )
+                # Ответ, к которому было действие (запись и т.п.), относится только к этому клиенту
+                if answer_cache_key is not None and not executed_actions:
+                    answer_cache.store_answer(
+                        answer_cache_key, ai_response, (time.perf_counter() - upstream_started) * 1000
+                    )
             except Exception as e:
                 err_str = str(e)
                 if "Rate limit" in err_str:
@@ -1208,13 +1213,7 @@ class SalonBot:
     async def _check_and_escalate(self, response_text: str, instagram_id: str):
         """Проверка ответа на необходимость эскалации и отправка уведомлений"""
         
-        escalation_promises = [
-            'менеджер свяжется', 'свяжусь с менеджером', 'передал ваш запрос', 
-            'позвал администратора', 'администратор ответит', 'manager will contact',
-            'передаю информацию менеджеру', 'уведомил менеджера', 'менеджер скоро ответит' # Added for fallback
-        ]
-        
-        if any(promise in response_text.lower() for promise in escalation_promises):
+        if any(promise in response_text.lower() for promise in ESCALATION_PROMISES):
             print(f"🔔 Bot promised escalation! Checking if notification needed...")
             
             try:
@@ -1342,15 +1341,24 @@ class SalonBot:
             except Exception as e:
                 print(f"❌ Error in escalation logic: {e}")
 
-    async def _generate_via_proxy(self, full_prompt: str, max_retries: int = 6, instagram_id: str = None) -> str:
-        """Попытка генерации через пул прокси"""
+    async def _generate_via_proxy(
+        self,
+        full_prompt: str,
+        max_retries: int = 6,
+        instagram_id: str = None,
+        executed_actions: Optional[List] = None,
+    ) -> str:
+        """
+        Попытка генерации через пул прокси.
+
+        Блоки [ACTION] выполняются и вырезаются из текста; если передан
+        `executed_actions`, в него добавляется каждый найденный блок.
+        """
         
         # 🔍 LOGGING FULL PROMPT (TRUNCATED) - First 500 + Last 500 chars only
         truncated_prompt = full_prompt[:500] + "\n...\n[SNIPPED]... \n" + full_prompt[-500:] if len(full_prompt) > 1000 else full_prompt
         print(f"\n🧠 SYSTEM PROMPT SENT TO GEMINI (Brief):\n{'-'*50}\n{truncated_prompt}\n{'-'*50}\n")
         
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
-
         # ✅ НАСТРОЙКА ИЗ БД: response_style (concise/detailed/adaptive)
         response_style = self.bot_settings.get('response_style', 'adaptive')
         
@@ -1413,52 +1421,14 @@ class SalonBot:
 
         for attempt in range(max_retries):
             try:
-                # ✅ ROTATION LOGIC: Key & Proxy
-                current_proxy = self.proxies[attempt % len(self.proxies)] if self.proxies else None
-                current_key = self.api_keys[attempt % len(self.api_keys)] if self.api_keys else GEMINI_API_KEY
-                
-                # Construct URL with current rotated key
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={current_key}"
-                
-                # Debug Info
-                proxy_label = current_proxy.split('@')[1] if current_proxy and '@' in current_proxy else (current_proxy[:25] + "..." if current_proxy else "Direct")
-                key_label = f"...{current_key[-6:]}" if current_key else "None"
-                
-                print(f"🌐 Попытка {attempt + 1}/{max_retries} | Proxy: {proxy_label} | Key: {key_label}")
-
-                if current_proxy:
-                    async with httpx.AsyncClient(timeout=60.0, follow_redirects=True, proxy=current_proxy) as client:
-                        response = await client.post(url, json=payload)
-                        data = response.json()
-                else:
-                    async with httpx.AsyncClient(timeout=60.0, follow_redirects=True) as client:
-                        response = await client.post(url, json=payload)
-                        data = response.json()
+                # ✅ Ключ и прокси выбирает общий диспетчер: токен-бакеты, здоровье пар,
+                # очередь по компаниям; 429/403/сбои сети он сам повторяет на другой паре
+                data = await llm_dispatcher.generate(payload, company_id=self.context.company_id)
 
-                # ✅ ПРОВЕРКА 429 - RATE LIMIT
                 if "error" in data:
                     error_code = data["error"].get("code")
                     error_msg = data["error"].get("message", "")
-
-                    if error_code == 429:
-                        print(f"⚠️ Rate limit 429 (Key: {key_label})")
-                        if attempt < max_retries - 1:
-                            # Exponential backoff: 2s, 4s, 8s...
-                            wait_time = 2 ** (attempt + 1)
-                            print(f"⏳ Waiting {wait_time}s before next attempt...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        raise Exception(f"Rate limit exceeded after {max_retries} retries")
-                    
-                    elif error_code == 403:
-                        print(f"⚠️ Gemini 403 (Key: {key_label}). Пробуем другой ключ/прокси...")
-                        if attempt < max_retries - 1:
-                            await asyncio.sleep(1) 
-                            continue
-                        raise Exception(f"Gemini API error 403 after retries")
-                        
-                    else:
-                        raise Exception(f"Gemini API error {error_code}: {error_msg}")
+                    raise Exception(f"Gemini API error {error_code}: {error_msg}")
 
                 # Извлекаем текст ответа
                 if "candidates" in data and len(data["candidates"]) > 0:
@@ -1482,6 +1452,8 @@ class SalonBot:
                             import json
                             action_match = re.search(r'\[ACTION\](.*?)\[/ACTION\]', response_text, re.DOTALL)
                             if action_match:
+                                if executed_actions is not None:
+                                    executed_actions.append(action_match.group(1).strip())
                                 try:
                                     action_json = action_match.group(1).strip()
                                     # Fix common json errors (like single quotes)
@@ -1520,7 +1492,7 @@ class SalonBot:
                             # Очистка от markdown
                             response_text = response_text.replace('*', '').replace('`', '').strip()
 
-                            print(f"✅ Успешно получен ответ (попытка {attempt + 1}, прокси {attempt % len(self.proxies) + 1 if self.proxies else 'direct'})")
+                            print(f"✅ Успешно получен ответ (попытка {attempt + 1})")
 
                             return response_text
                             
@@ -1533,17 +1505,7 @@ class SalonBot:
                 print(f"⚠️ Unexpected response structure: {str(data)[:500]}")
                 raise Exception(f"Unexpected Gemini response structure: {str(data)[:100]}")
 
-            except httpx.HTTPError as e:
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt) * 5
-                    print(f"❌ HTTP Error (попытка {attempt + 1}/{max_retries}): {e}, retry через {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                    continue
-                print(f"❌ HTTP Error после {max_retries} попыток: {e}")
-                raise
             except Exception as e:
-                if "Rate limit" in str(e) and attempt < max_retries - 1:
-                    continue
                 print(f"❌ Unexpected error: {e}")
                 raise
             
@@ -0,0 +1,137 @@
+"""
+Кэш статических секций системного промпта бота.
+
+Информация о салоне, список услуг и список мастеров одинаковы для всех
+клиентов компании и меняются только вместе с каталогом или настройками,
+поэтому собираются один раз на ключ
+(company_id, язык, версия каталога, версия настроек):
+
+- версия каталога — `bot_catalog_versions`, её увеличивают триггеры на
+  services / users / user_services (db/init.py), читается одним запросом
+  по первичному ключу на ход;
+- версия настроек — `db.settings.get_settings_version` (растёт при
+  `invalidate_settings_cache`, в том числе по Pub/Sub из других воркеров).
+
+TTL — страховка для правок, которые не проходят через эти таблицы
+(переводы в locales/*.json). Время сборки промпта и число SQL-запросов на
+ход копятся в `prompt_build_stats()` (/api/diagnostics/bot-prompt).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from db.connection import get_db_connection
+from utils.cache import TTLCache
+from utils.logger import log_error
+from utils.query_profiler import current_request_profile, finish_request_profile, start_request_profile
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+PROMPT_SECTIONS_TTL_SECONDS = max(1, _read_int_env("BOT_PROMPT_SECTIONS_TTL_SECONDS", 600))
+
+_sections_cache = TTLCache(maxsize=256, ttl=PROMPT_SECTIONS_TTL_SECONDS)
+
+
+def get_catalog_version(company_id: int) -> int:
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT version FROM bot_catalog_versions WHERE company_id = %s", (company_id,))
+        row = c.fetchone()
+        return int(row[0]) if row else 0
+    finally:
+        conn.close()
+
+
+def get_prompt_sections(
+    company_id: Optional[int],
+    language: str,
+    build: Callable[[], Dict[str, str]],
+) -> Dict[str, str]:
+    """Секции из кэша или `build()`; без компании (нет tenant-контекста) — всегда `build()`."""
+    if company_id is None:
+        return build()
+
+    from db.settings import get_settings_version
+
+    try:
+        key = (company_id, language, get_catalog_version(company_id), get_settings_version(company_id))
+    except Exception as e:
+        log_error(f"Bot catalog version unavailable for company {company_id}: {e}", "bot")
+        return build()
+
+    sections = _sections_cache.get(key)
+    if sections is None:
+        sections = build()
+        _sections_cache.set(key, sections)
+    return sections
+
+
+def clear_prompt_sections() -> None:
+    _sections_cache.clear()
+
+
+class _PromptBuildStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.last: Dict[str, float] = {}
+
+    def record(self, duration_ms: float, queries: Optional[int]) -> None:
+        with self._lock:
+            self.builds += 1
+            self.total_ms += duration_ms
+            self.max_ms = max(self.max_ms, duration_ms)
+            if queries is not None:
+                self.queries += queries
+                self.max_queries = max(self.max_queries, queries)
+            self.last = {"duration_ms": round(duration_ms, 2), "queries": queries}
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "builds": self.builds,
+                "avg_ms": round(self.total_ms / self.builds, 2) if self.builds else 0.0,
+                "max_ms": round(self.max_ms, 2),
+                "avg_queries": round(self.queries / self.builds, 2) if self.builds else 0.0,
+                "max_queries": self.max_queries,
+                "last": dict(self.last),
+            }
+
+
+_build_stats = _PromptBuildStats()
+
+
+@contextmanager
+def measure_prompt_build():
+    """Время и число SQL-запросов одной сборки промпта."""
+    profile = current_request_profile()
+    token = None if profile is not None else start_request_profile()
+    if token is not None:
+        profile = current_request_profile()
+    queries_before = profile.query_count if profile is not None else 0
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        queries = profile.query_count - queries_before if profile is not None else None
+        if token is not None:
+            finish_request_profile(token, "BOT build_full_prompt")
+        _build_stats.record(duration_ms, queries)
+
+
+def prompt_build_stats() -> dict:
+    return {"builds": _build_stats.as_dict(), "sections_cache": _sections_cache.stats()}
@@ -15,9 +15,12 @@ from bot.constants import (
 )
 
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from db.services import get_all_services
+from bot.prompt_cache import get_prompt_sections, measure_prompt_build
 from core.config import APP_NAME
 from utils.datetime_utils import get_current_time
+from utils.tenant_context import get_current_company_id
 from utils.transliteration import transliterate_name
 
 logger = logging.getLogger(__name__)
@@ -120,10 +123,9 @@ from utils.language_utils import get_localized_name
 class PromptBuilder:
     def __init__(self, salon: dict = None, bot_settings: dict = None):
         if salon is None or bot_settings is None:
-            from db.settings import get_salon_settings
-            from bot.core import SalonBot
+            from db.settings import get_bot_settings, get_salon_settings
             self.salon = salon or get_salon_settings()
-            self.bot_settings = bot_settings or SalonBot().bot_settings
+            self.bot_settings = bot_settings or get_bot_settings()
         else:
             self.salon = salon
             self.bot_settings = bot_settings
@@ -152,6 +154,29 @@ class PromptBuilder:
                           client_language: str = 'ru',
                           additional_context: str = "") -> str:
         """Сборка основного системного промта"""
+        with measure_prompt_build():
+            return self._build_full_prompt(
+                instagram_id,
+                history,
+                booking_progress=booking_progress,
+                client_language=client_language,
+                additional_context=additional_context,
+            )
+
+    def _build_catalog_sections(self, client_language: str) -> Dict[str, str]:
+        """Секции, общие для всех клиентов компании: салон, услуги, мастера"""
+        return {
+            'salon_info': self._build_salon_info(client_language),
+            'services_list': self._build_services_list(client_language),
+            'masters_list': self._build_masters_list(client_language),
+        }
+
+    def _build_full_prompt(self,
+                           instagram_id: str,
+                           history: List[Tuple],
+                           booking_progress: Optional[dict] = None,
+                           client_language: str = 'ru',
+                           additional_context: str = "") -> str:
         from datetime import datetime, timedelta
         
         # Получаем текущую дату и завтрашнюю для промпта
@@ -176,13 +201,16 @@ class PromptBuilder:
         if hours_weekends and hours_weekends != hours_weekdays:
             hours_display = f"{hours_weekdays} (Weekdays), {hours_weekends} (Weekends)" if client_language != 'ru' else f"{hours_weekdays} (Будни), {hours_weekends} (Выходные)"
             
-        base_info = self._build_salon_info(client_language)
-        
-        # 2. Список услуг (ДИНАМИЧЕСКИЙ) с локализацией
-        services_list = self._build_services_list(client_language)
-        
-        # 3. Список мастеров (ДИНАМИЧЕСКИЙ)
-        masters_list = self._build_masters_list(client_language)
+        # 1-3. Салон, услуги (с локализацией) и мастера — общие для всех клиентов,
+        # берутся из кэша секций компании (bot/prompt_cache.py)
+        catalog_sections = get_prompt_sections(
+            get_current_company_id(),
+            client_language,
+            lambda: self._build_catalog_sections(client_language),
+        )
+        base_info = catalog_sections['salon_info']
+        services_list = catalog_sections['services_list']
+        masters_list = catalog_sections['masters_list']
         
         # 4. Проверка доступности (если есть запрос)
         # Получаем instagram_id из контекста или ищем в истории
@@ -580,56 +608,71 @@ Google Maps: {self.salon.get('google_maps', '')}
 
     def _build_masters_list(self, client_language: str = 'ru') -> str:
         """Список мастеров салона С ИХ УСЛУГАМИ из БД"""
-        from db.employees import get_all_employees
-        
-        # Получаем всех сотрудников (провайдеров услуг)
+        from utils.language_utils import validate_language, build_coalesce_query, get_dynamic_translation
+
+        # Мастера и их услуги — два запроса на одном соединении вместо запроса на каждого мастера
         conn = get_db_connection()
-        c = conn.cursor()
+        try:
+            c = conn.cursor()
 
-        # Check if secondary_role column exists
-        c.execute("""
-            SELECT COUNT(*) FROM information_schema.columns
-            WHERE table_name = 'users' AND column_name = 'secondary_role'
-        """)
-        has_secondary_role = c.fetchone()[0] > 0
+            # Check if secondary_role column exists
+            if column_exists("users", "secondary_role", c):
+                role_filter = "(role = 'employee' OR secondary_role = 'employee')"
+            else:
+                role_filter = "role = 'employee'"
 
-        if has_secondary_role:
-            c.execute("""
-                SELECT id, full_name, position,
-                       experience, years_of_experience
-                FROM users
-                WHERE is_service_provider = TRUE AND is_active = TRUE
-                AND (role = 'employee' OR secondary_role = 'employee')
-                ORDER BY full_name ASC
-            """)
-        else:
-            c.execute("""
+            c.execute(f"""
                 SELECT id, full_name, position,
                        experience, years_of_experience
                 FROM users
                 WHERE is_service_provider = TRUE AND is_active = TRUE
-                AND role = 'employee'
+                AND {role_filter}
                 ORDER BY full_name ASC
             """)
-        
-        employees = c.fetchall()
+            employees = c.fetchall()
 
-        if not employees:
-            return ""
+            if not employees:
+                return ""
+
+            client_language = validate_language(client_language)
+
+            # ✅ УСЛУГИ ВСЕХ МАСТЕРОВ С ЦЕНАМИ ОДНИМ ЗАПРОСОМ
+            # Универсальный запрос с COALESCE для любого языка
+            service_name_coalesce = build_coalesce_query('name', client_language)
+
+            c.execute(f"""
+                SELECT us.user_id, {service_name_coalesce} as service_name,
+                       s.category, us.price, us.price_min, us.price_max,
+                       us.duration, us.is_online_booking_enabled
+                FROM user_services us
+                JOIN services s ON us.service_id = s.id
+                WHERE us.user_id = ANY(%s) AND s.is_active = TRUE
+                ORDER BY us.user_id, us.is_online_booking_enabled DESC, s.category, service_name
+            """, ([emp[0] for emp in employees],))
+
+            services_by_master: Dict[int, List[tuple]] = {}
+            for row in c.fetchall():
+                services_by_master.setdefault(row[0], []).append(row[1:])
+        finally:
+            conn.close()
 
         masters_text = f"{self.prompt_headers.get('MASTERS', PROMPT_HEADERS['MASTERS'])}\n"
         masters_text += "⚠️ ПРОВЕРЯЙ ЭТОТ СПИСОК КОГДА КЛИЕНТ СПРАШИВАЕТ ПРО МАСТЕРА!\n"
         masters_text += "⚠️ ВСЕГДА используй ТОЧНЫЕ имена мастеров из списка выше на языке клиента (не транслит, не другие языки)!\n\n"
 
-        conn = get_db_connection()
-        c = conn.cursor()
+        from utils.currency import get_salon_currency
+        currency = self.salon.get('currency', get_salon_currency())
+        position_label = "Position" if client_language != 'ru' else "Должность"
+        exp_label = "Experience" if client_language != 'ru' else "Опыт"
 
         for emp in employees:
             emp_id = emp[0]
-            
-            from utils.language_utils import validate_language, build_coalesce_query, get_dynamic_translation
-            client_language = validate_language(client_language)
-            
+            services = services_by_master.get(emp_id)
+
+            # Если у мастера нет услуг - пропускаем его, чтобы не путать AI
+            if not services:
+                continue
+
             # Name and Position via dynamic translations
             emp_name_display = get_dynamic_translation(
                 table='users',
@@ -648,34 +691,9 @@ Google Maps: {self.salon.get('google_maps', '')}
             )
             
             experience = emp[3] or emp[4] # experience or years_of_experience
-            
-
-            # ✅ ПОЛУЧАЕМ УСЛУГИ ЭТОГО МАСТЕРА ИЗ БД С ЦЕНАМИ
-            # Универсальный запрос с COALESCE для любого языка
-            service_name_coalesce = build_coalesce_query('name', client_language)
-            
-            c.execute(f"""
-                SELECT {service_name_coalesce} as service_name, 
-                       s.category, us.price, us.price_min, us.price_max, 
-                       us.duration, us.is_online_booking_enabled
-                FROM user_services us
-                JOIN services s ON us.service_id = s.id
-                WHERE us.user_id = %s AND s.is_active = TRUE
-                ORDER BY us.is_online_booking_enabled DESC, s.category, service_name
-            """, (emp_id,))
-
-            services = c.fetchall()
-            
-            # Если у мастера нет услуг - пропускаем его, чтобы не путать AI
-            if not services:
-                continue
 
             # ✅ ОПТИМИЗАЦИЯ: Краткий формат мастеров
-            from utils.currency import get_salon_currency
-            currency = self.salon.get('currency', get_salon_currency())
             masters_text += f"👤 {emp_name_display}\n"
-            position_label = "Position" if client_language != 'ru' else "Должность"
-            exp_label = "Experience" if client_language != 'ru' else "Опыт"
             masters_text += f"   {position_label}: {emp_position_display}\n"
             if experience:
                 masters_text += f"   {exp_label}: {experience}\n"
@@ -701,7 +719,6 @@ Google Maps: {self.salon.get('google_maps', '')}
 
             masters_text += "\n"
 
-        conn.close()
         return masters_text
 
     def _build_history(self, history: List[Tuple]) -> str:
@@ -1347,6 +1364,11 @@ Google Maps: {self.salon.get('google_maps', '')}
         # ✅ INIT SMART SCHEDULER
         from services.smart_scheduler import SmartScheduler
         scheduler = SmartScheduler()
+        try:
+            # Один диапазонный запрос на всех мастеров услуги вместо запросов на каждого мастера и день
+            scheduler.preload([emp[0] for emp in employees], preferred_date or None)
+        except Exception as e:
+            logger.warning(f"⚠️ Availability preload failed, falling back to per-master lookups: {e}")
         
         # ... (lines skipped)
         
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from core.config import DEFAULT_HOURS_WEEKDAYS
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from services.master_schedule import MasterScheduleService
 
 def get_available_time_slots(
@@ -50,11 +51,7 @@ def get_available_time_slots(
         # Если нет - берем всех активных
 
         # Check if secondary_role column exists
-        c.execute("""
-            SELECT COUNT(*) FROM information_schema.columns
-            WHERE table_name = 'users' AND column_name = 'secondary_role'
-        """)
-        has_secondary_role = c.fetchone()[0] > 0
+        has_secondary_role = column_exists("users", "secondary_role", c)
 
         if service_id:
             # Get only masters who provide this service AND have online booking enabled
@@ -23,9 +23,10 @@ from db.companies import (
     get_company_by_access_code,
     update_company,
 )
+from utils.blocking import run_blocking
 from utils.logger import log_info, log_error, log_warning
 from utils.utils import require_auth, validate_password
-import httpx
+from utils.http_clients import get_http_client
 import os
 
 router = APIRouter(tags=["Auth"])
@@ -268,12 +269,12 @@ async def google_login(data: dict):
     user_info = {'email': 'Unknown', 'full_name': 'Google User'}
     try:
         # 1. Проверяем токен через Google API
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(f"https://oauth2.googleapis.com/tokeninfo?id_token={token}")
-            if resp.status_code != 200:
-                log_warning(f"Invalid Google token: {resp.text}", "auth")
-                raise ValueError(f"Невалидный Google токен: {resp.text[:100]}")
-            google_data = resp.json()
+        client = get_http_client("https://oauth2.googleapis.com")
+        resp = await client.get(f"https://oauth2.googleapis.com/tokeninfo?id_token={token}")
+        if resp.status_code != 200:
+            log_warning(f"Invalid Google token: {resp.text}", "auth")
+            raise ValueError(f"Невалидный Google токен: {resp.text[:100]}")
+        google_data = resp.json()
 
         email = google_data.get("email")
         if not email:
@@ -410,7 +411,6 @@ async def register_client_api(
 ):
     """API: Регистрация клиента (упрощенная)"""
     import os
-    import httpx
 
     # Проверка hCaptcha (если включена)
     hcaptcha_secret = os.getenv('HCAPTCHA_SECRET_KEY')
@@ -421,21 +421,21 @@ async def register_client_api(
                 status_code=400
             )
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    'https://hcaptcha.com/siteverify',
-                    data={
-                        'secret': hcaptcha_secret,
-                        'response': captcha_token
-                    }
+            client = get_http_client("https://hcaptcha.com/siteverify")
+            response = await client.post(
+                'https://hcaptcha.com/siteverify',
+                data={
+                    'secret': hcaptcha_secret,
+                    'response': captcha_token
+                }
+            )
+            result = response.json()
+            if not result.get('success'):
+                log_warning(f"hCaptcha verification failed for {email}: {result}", "auth")
+                return JSONResponse(
+                    {"error": "error_captcha_failed"},
+                    status_code=400
                 )
-                result = response.json()
-                if not result.get('success'):
-                    log_warning(f"hCaptcha verification failed for {email}: {result}", "auth")
-                    return JSONResponse(
-                        {"error": "error_captcha_failed"},
-                        status_code=400
-                    )
         except Exception as e:
             log_error(f"hCaptcha verification error: {e}", "auth")
             # В случае ошибки сети - пропускаем проверку, чтобы не блокировать регистрацию
@@ -475,7 +475,6 @@ async def register_employee_api(
     """API: Регистрация сотрудника (с выбором роли)"""
     from db.newsletter import add_subscriber
     import os
-    import httpx
 
     # Проверка hCaptcha (если включена)
     hcaptcha_secret = os.getenv('HCAPTCHA_SECRET_KEY')
@@ -486,21 +485,21 @@ async def register_employee_api(
                 status_code=400
             )
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    'https://hcaptcha.com/siteverify',
-                    data={
-                        'secret': hcaptcha_secret,
-                        'response': captcha_token
-                    }
+            client = get_http_client("https://hcaptcha.com/siteverify")
+            response = await client.post(
+                'https://hcaptcha.com/siteverify',
+                data={
+                    'secret': hcaptcha_secret,
+                    'response': captcha_token
+                }
+            )
+            result = response.json()
+            if not result.get('success'):
+                log_warning(f"hCaptcha verification failed for {email}: {result}", "auth")
+                return JSONResponse(
+                    {"error": "error_captcha_failed"},
+                    status_code=400
                 )
-                result = response.json()
-                if not result.get('success'):
-                    log_warning(f"hCaptcha verification failed for {email}: {result}", "auth")
-                    return JSONResponse(
-                        {"error": "error_captcha_failed"},
-                        status_code=400
-                    )
         except Exception as e:
             log_error(f"hCaptcha verification error: {e}", "auth")
             # В случае ошибки сети - пропускаем проверку, чтобы не блокировать регистрацию
@@ -571,7 +570,7 @@ async def notify_admin_registration(user_data: dict, success: bool = True, error
     if success:
         admin_email = os.getenv('FROM_EMAIL') or os.getenv('SMTP_USER')
         if admin_email:
-            send_admin_notification_email(admin_email, user_data)
+            await run_blocking(send_admin_notification_email, admin_email, user_data)
 
 
 @router.post("/register")
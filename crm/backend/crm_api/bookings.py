@@ -17,6 +17,7 @@ from db import (
     get_booking_stats
 )
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.utils import require_auth
 from utils.logger import log_error, log_warning, log_info
 from utils.cache import cache
@@ -513,38 +514,9 @@ def get_booking_detail(
         conn = get_db_connection()
         c = conn.cursor()
 
-        c.execute(
-            """
-            SELECT 1
-            FROM information_schema.columns
-            WHERE table_name = 'bookings'
-              AND column_name = 'master_user_id'
-            LIMIT 1
-            """
-        )
-        has_master_user_id = bool(c.fetchone())
-
-        c.execute(
-            """
-            SELECT 1
-            FROM information_schema.columns
-            WHERE table_name = 'bookings'
-              AND column_name = 'promo_code'
-            LIMIT 1
-            """
-        )
-        has_promo_code = bool(c.fetchone())
-
-        c.execute(
-            """
-            SELECT 1
-            FROM information_schema.columns
-            WHERE table_name = 'bookings'
-              AND column_name = 'source'
-            LIMIT 1
-            """
-        )
-        has_source = bool(c.fetchone())
+        has_master_user_id = column_exists("bookings", "master_user_id", c)
+        has_promo_code = column_exists("bookings", "promo_code", c)
+        has_source = column_exists("bookings", "source", c)
 
         # Построение безопасной выборки полей
         select_fields = [
@@ -886,6 +858,7 @@ def create_booking_api(
                 {
                     "error": "slot_unavailable",
                     "reason": reason,
+                    "conflict": getattr(e, "conflict", None) or None,
                     "nearest_slots": nearest_slots,
                 },
                 status_code=409
@@ -1211,15 +1184,7 @@ async def update_booking_api(
 
         has_master_user_id = False
         master_user_id = None
-        c.execute(
-            """
-            SELECT 1
-            FROM information_schema.columns
-            WHERE table_name = 'bookings' AND column_name = 'master_user_id'
-            LIMIT 1
-            """
-        )
-        has_master_user_id = bool(c.fetchone())
+        has_master_user_id = column_exists("bookings", "master_user_id", c)
         if has_master_user_id and new_master:
             c.execute(
                 """
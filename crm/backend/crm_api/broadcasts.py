@@ -1,13 +1,24 @@
 """
 API для массовых рассылок
 """
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional, Union, Tuple
 
 import json
 
 from db.connection import get_db_connection
+from services.broadcast_engine import (
+    broadcast_runner,
+    cancel_broadcast_job,
+    claim_broadcast_job,
+    enqueue_broadcast_job,
+    get_broadcast_job,
+    list_broadcast_jobs,
+    run_broadcast_job,
+    serialize_job,
+)
+from utils.blocking import offload_blocking, run_blocking
 from utils.utils import get_current_user
 from utils.logger import log_info, log_error
 from utils.language_utils import get_localized_name
@@ -433,174 +444,83 @@ async def preview_broadcast(
 @router.post("/broadcasts/send")
 async def send_broadcast(
     broadcast: BroadcastRequest,
-    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Отправить массовую рассылку (фоновая задача)
+    Поставить массовую рассылку в очередь (services/broadcast_engine.py).
+    Прогресс приходит через notifications WebSocket и GET /broadcasts/jobs/{job_id}.
     """
     if current_user.get('role') not in ['admin', 'director']:
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    # Add task to background
-    background_tasks.add_task(process_broadcast_sending, broadcast, current_user['id'], current_user.get('company_id'))
+    job_id = await run_blocking(
+        enqueue_broadcast_job,
+        broadcast.model_dump(),
+        current_user['id'],
+        current_user.get('company_id'),
+    )
+    broadcast_runner.wake()
 
     return {
         "success": True,
+        "job_id": job_id,
         "message": "Рассылка запущена" if not broadcast.is_test else "Тестовая рассылка отправлена"
     }
 
-async def process_broadcast_sending(broadcast: BroadcastRequest, sender_id: int, company_id: int = None):
-    """
-    Асинхронная отправка рассылки через UniversalMessenger (Users + Clients)
-    """
-    from services.universal_messenger import send_universal_message
-    conn = None
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        sent_count = 0
-        failed_count = 0
-        staff_ids, client_ids = _split_target_ids(broadcast.user_ids)
 
-        # Collect targets
-        targets = [] # List of (id, name, email, tg_id, platform_id, type)
+@router.get("/broadcasts/jobs")
+@offload_blocking
+def get_broadcast_jobs(
+    limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """Последние задачи рассылок компании со статусом и счётчиками."""
+    if current_user.get('role') not in ['admin', 'director']:
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+    jobs = list_broadcast_jobs(current_user.get('company_id'), limit)
+    return {"jobs": [serialize_job(job) for job in jobs]}
 
-        if broadcast.is_test:
-            c.execute("SELECT id, full_name, email, telegram_chat_id, instagram_username FROM users WHERE id = %s", (sender_id,))
-            row = c.fetchone()
-            if row: targets.append((row[0], row[1], row[2], row[3], row[4], 'staff'))
-        else:
-            # 1. Staff
-            if not broadcast.target_role or broadcast.target_role != 'client':
-                query_users = """
-                    SELECT u.id, u.full_name, u.email, u.telegram_chat_id, u.instagram_username
-                    FROM users u
-                    LEFT JOIN marketing_unsubscriptions s ON u.id = s.user_id AND s.mailing_type = %s
-                    WHERE u.is_active = TRUE AND s.id IS NULL
-                """
-                params = [broadcast.subscription_type]
-                
-                if company_id:
-                    query_users += " AND u.company_id = %s"
-                    params.append(company_id)
-
-                if broadcast.user_ids:
-                    if staff_ids:
-                        query_users += " AND u.id IN ({})".format(','.join(['%s'] * len(staff_ids)))
-                        params.extend(staff_ids)
-                    else:
-                        query_users += " AND FALSE"
-                elif broadcast.target_role and broadcast.target_role != 'all':
-                    query_users += " AND u.role = %s"
-                    params.append(broadcast.target_role)
-                
-                c.execute(query_users, params)
-                for r in c.fetchall(): targets.append((r[0], r[1], r[2], r[3], r[4], 'staff'))
-
-            # 2. Clients
-            if not broadcast.target_role or broadcast.target_role in ['all', 'client']:
-                query_clients = """
-                    SELECT c.instagram_id, c.name, c.email, c.telegram_id, c.instagram_id
-                    FROM clients c
-                    LEFT JOIN marketing_unsubscriptions s ON (
-                        c.instagram_id = s.client_id OR 
-                        c.telegram_id = s.client_id OR 
-                        (c.email IS NOT NULL AND c.email = s.email)
-                    ) AND s.mailing_type = %s
-                    WHERE s.id IS NULL
-                """
-                params = [broadcast.subscription_type]
-
-                if company_id:
-                    query_clients += " AND c.company_id = %s"
-                    params.append(company_id)
-
-                if broadcast.user_ids:
-                    if client_ids:
-                        placeholders = ','.join(['%s'] * len(client_ids))
-                        query_clients += f" AND (c.instagram_id IN ({placeholders}) OR c.id::text IN ({placeholders}))"
-                        params.extend(client_ids)
-                        params.extend(client_ids)
-                    else:
-                        query_clients += " AND FALSE"
-
-                c.execute(query_clients, params)
-                for r in c.fetchall(): targets.append((r[0], r[1], r[2], r[3], r[4], 'client'))
-
-        # 3. Handle additional emails (manual entry)
-        if broadcast.additional_emails and 'email' in broadcast.channels:
-            for email in broadcast.additional_emails:
-                if not email or '@' not in email: continue
-                # target_id, name, email, tg, ig, type
-                # Use email as ID for manual
-                targets.append((0, "Anonymous", email.strip(), None, None, 'manual'))
-        
-        # 4. Handle manual contacts (new feature)
-        if broadcast.manual_contacts:
-            for contact in broadcast.manual_contacts:
-                name = contact.get('name', 'Manual Contact')
-                email = contact.get('email')
-                telegram = contact.get('telegram')
-                instagram = contact.get('instagram')
-                whatsapp = contact.get('whatsapp')
-                
-                # Добавляем контакт только если есть хотя бы один канал связи
-                if email or telegram or instagram or whatsapp:
-                    targets.append((0, name, email, telegram, instagram, 'manual'))
-
-        # Проверяем квоту сообщений перед отправкой
-        if company_id and not broadcast.is_test:
-            try:
-                from db.companies import ensure_company_quota
-                ensure_company_quota(int(company_id), "messages", len(targets))
-            except Exception as quota_err:
-                from utils.logger import log_error
-                log_error(f"Message quota exceeded for company {company_id}: {quota_err}", "broadcasts")
-                return  # Прерываем рассылку
-
-        # Sending
-        for target in targets:
-            t_id, t_name, t_email, t_tg, t_ig, t_type = target
-            context = {"name": t_name or "Client", "lang": "ru"}
-
-            for channel in broadcast.channels:
-                recipient = None
-                platform = None
-                
-                if channel == "email" and t_email:
-                    recipient, platform = t_email, "email"
-                    context["unsubscribe_link"] = "/unsubscribe?email={}&type={}&channel=email".format(t_email, broadcast.subscription_type)
-                elif channel == "telegram" and t_tg:
-                    recipient, platform = str(t_tg), "telegram"
-                elif channel == "instagram" and t_ig:
-                    recipient, platform = t_ig, "instagram"
-                elif channel == "notification" and t_type == 'staff':
-                    recipient, platform = str(t_id), "in_app"
-                
-                if not recipient: continue
-
-                res = await send_universal_message(
-                    recipient_id=recipient,
-                    text=broadcast.message,
-                    subject=broadcast.subject,
-                    context=context,
-                    platform=platform,
-                    template_name=broadcast.template_name
-                )
-                if res.get("success"): sent_count += 1
-                else: failed_count += 1
 
-        # Save History
-        c.execute("""
-            INSERT INTO broadcast_history (sender_id, subscription_type, channels, subject, message, total_sent, results)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (sender_id, broadcast.subscription_type, ','.join(broadcast.channels), broadcast.subject, broadcast.message, sent_count, json.dumps({"success": sent_count, "failed": failed_count})))
-        conn.commit()
-    except Exception as e:
-        log_error(f"Error in broadcast process: {e}", "broadcasts")
-    finally:
-        if conn: conn.close()
+@router.get("/broadcasts/jobs/{job_id}")
+@offload_blocking
+def get_broadcast_job_status(
+    job_id: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """Статус и прогресс рассылки."""
+    if current_user.get('role') not in ['admin', 'director']:
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+    job = get_broadcast_job(job_id, current_user.get('company_id'))
+    if not job:
+        raise HTTPException(status_code=404, detail="Рассылка не найдена")
+    return serialize_job(job)
+
+
+@router.post("/broadcasts/jobs/{job_id}/cancel")
+@offload_blocking
+def cancel_broadcast(
+    job_id: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """Отменить рассылку: уже отправленные сообщения остаются, остальные не уходят."""
+    if current_user.get('role') not in ['admin', 'director']:
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+    if not cancel_broadcast_job(job_id, current_user.get('company_id')):
+        raise HTTPException(status_code=409, detail="Рассылка уже завершена или не найдена")
+    log_info(f"Администратор {current_user['username']} отменил рассылку #{job_id}", "broadcasts")
+    return {"success": True}
+
+
+async def process_broadcast_sending(broadcast: BroadcastRequest, sender_id: int, company_id: int = None):
+    """
+    Поставить рассылку в очередь и выполнить её в текущем процессе до конца
+    (для скриптов и тестов, где раннер не запущен).
+    """
+    job_id = await run_blocking(enqueue_broadcast_job, broadcast.model_dump(), sender_id, company_id)
+    job = await run_blocking(claim_broadcast_job, broadcast_runner.worker_id, job_id)
+    if job is None:
+        return None
+    return await run_broadcast_job(job, broadcast_runner.worker_id)
 
 @router.post("/unsubscribe")
 async def unsubscribe_v2(
@@ -1,23 +1,15 @@
 from datetime import datetime
 from fastapi import APIRouter, Request, Cookie, HTTPException
 from fastapi.responses import JSONResponse
-from typing import Any, Optional, Set
+from typing import Any, Optional
 from db.connection import get_db_connection
+from db.schema_catalog import get_table_columns
 from utils.utils import require_auth
 from utils.logger import log_info, log_error
 
 router = APIRouter(tags=["Challenges"])
 
 
-def _get_table_columns(cursor, table_name: str) -> Set[str]:
-    cursor.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = %s
-    """, (table_name,))
-    return {row[0] for row in cursor.fetchall()}
-
-
 def _coerce_bool(value: Any, fallback: bool = True) -> bool:
     if isinstance(value, bool):
         return value
@@ -60,7 +52,7 @@ async def get_challenges():
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        challenge_columns = _get_table_columns(c, "active_challenges")
+        challenge_columns = get_table_columns("active_challenges", c)
         reward_column = "points_reward" if "points_reward" in challenge_columns else ("bonus_points" if "bonus_points" in challenge_columns else "NULL")
         type_column = "challenge_type" if "challenge_type" in challenge_columns else ("reward_type" if "reward_type" in challenge_columns else "NULL")
         target_value_column = "target_value" if "target_value" in challenge_columns else "NULL"
@@ -152,7 +144,7 @@ async def create_challenge(request: Request, session_token: Optional[str] = Cook
 
         conn = get_db_connection()
         c = conn.cursor()
-        challenge_columns = _get_table_columns(c, "active_challenges")
+        challenge_columns = get_table_columns("active_challenges", c)
         insert_fields = ["title", "description", "is_active"]
         insert_values = [title, description, is_active]
         placeholders = ["%s", "%s", "%s"]
@@ -213,7 +205,7 @@ async def update_challenge(challenge_id: int, request: Request, session_token: O
         data = await request.json()
         conn = get_db_connection()
         c = conn.cursor()
-        challenge_columns = _get_table_columns(c, "active_challenges")
+        challenge_columns = get_table_columns("active_challenges", c)
 
         updates = []
         params = []
@@ -15,6 +15,7 @@ from services.universal_messenger import send_universal_message
 from utils.utils import require_auth, get_total_unread
 from utils.logger import log_error,log_info,log_warning
 from services.conversation_context import ConversationContext
+from services.conversation_state import invalidate_conversation_state
 from core.config import BASE_URL
 from utils.cache import cache
 import time
@@ -167,6 +168,8 @@ async def send_chat_message(
         
         if "error" not in result:
             save_message(instagram_id, message, "bot")
+            # Менеджер ответил — горячее состояние диалога бота перечитается из БД
+            invalidate_conversation_state(instagram_id)
             log_activity(user["id"], "send_message", "client", instagram_id, 
                         f"Message sent by {user['role']}")
             return {"success": True, "message": "Message sent"}
@@ -370,6 +373,7 @@ async def send_chat_file(
             "bot", 
             message_type=file_type
         )
+        invalidate_conversation_state(instagram_id)
         
         # ✅ Логируем активность
         log_activity(
@@ -2,6 +2,7 @@
 Дополнительные endpoints для client_auth.py
 Добавить в файл client_auth.py после register_client endpoint
 """
+from db.schema_catalog import column_exists
 
 # Модель для верификации email
 class VerifyClientEmailRequest(BaseModel):
@@ -17,11 +18,7 @@ async def verify_client_email(data: VerifyClientEmailRequest):
     
     try:
         # Проверяем есть ли колонка verification_code в таблице clients
-        c.execute("""
-            SELECT column_name FROM information_schema.columns 
-            WHERE table_name='clients' AND column_name='verification_code'
-        """)
-        has_verification_column = c.fetchone() is not None
+        has_verification_column = column_exists('clients', 'verification_code', c)
         
         if has_verification_column:
             # Используем колонку в таблице clients
@@ -156,11 +153,7 @@ async def resend_client_verification(email: str):
         code_expires = get_code_expiry()
         
         # Проверяем есть ли колонка verification_code
-        c.execute("""
-            SELECT column_name FROM information_schema.columns 
-            WHERE table_name='clients' AND column_name='verification_code'
-        """)
-        has_verification_column = c.fetchone() is not None
+        has_verification_column = column_exists('clients', 'verification_code', c)
         
         if has_verification_column:
             # Обновляем в таблице clients
@@ -5,53 +5,15 @@ Recency / Frequency / Monetary анализ + сегментация
 from fastapi import APIRouter, Query, Cookie
 from fastapi.responses import JSONResponse
 from typing import Optional
-from datetime import datetime, date, timedelta
+from datetime import datetime
 
 from db.connection import get_db_connection
+from services.client_scoring import SEGMENTS, score_company
+from utils.blocking import run_blocking
 from utils.utils import require_auth
 
 router = APIRouter(tags=["Client Scoring"])
 
-SEGMENTS = {
-    "champion":     {"label": "Чемпионы",          "color": "#22c55e", "r": (4,5), "f": (4,5), "m": (4,5)},
-    "loyal":        {"label": "Лояльные",           "color": "#3b82f6", "r": (3,5), "f": (3,5), "m": (3,5)},
-    "potential":    {"label": "Потенциальные",      "color": "#8b5cf6", "r": (3,5), "f": (1,3), "m": (1,3)},
-    "at_risk":      {"label": "Под угрозой",        "color": "#f59e0b", "r": (2,3), "f": (3,5), "m": (3,5)},
-    "hibernating":  {"label": "Спящие",             "color": "#94a3b8", "r": (1,2), "f": (1,3), "m": (1,3)},
-    "lost":         {"label": "Потерянные",         "color": "#ef4444", "r": (1,2), "f": (1,2), "m": (1,2)},
-    "new":          {"label": "Новые",              "color": "#06b6d4", "r": (4,5), "f": (1,1), "m": (1,3)},
-    "promising":    {"label": "Перспективные",      "color": "#10b981", "r": (3,4), "f": (1,1), "m": (1,3)},
-}
-
-
-def _assign_segment(r: int, f: int, m: int) -> str:
-    if r >= 4 and f >= 4 and m >= 4:
-        return "champion"
-    if r >= 4 and f == 1:
-        return "new"
-    if r >= 3 and f == 1:
-        return "promising"
-    if r >= 3 and f >= 3 and m >= 3:
-        return "loyal"
-    if r >= 3 and f <= 2 and m <= 2:
-        return "potential"
-    if r <= 2 and f >= 3 and m >= 3:
-        return "at_risk"
-    if r <= 2 and f <= 2 and m <= 2:
-        return "lost"
-    return "hibernating"
-
-
-def _score_to_quintile(values: list, val) -> int:
-    if not values or val is None:
-        return 1
-    sorted_v = sorted(set(values))
-    n = len(sorted_v)
-    if n == 1:
-        return 3
-    idx = sorted_v.index(min(sorted_v, key=lambda x: abs(x - val)))
-    return max(1, min(5, int(idx / n * 4) + 1))
-
 
 @router.post("/client-scoring/calculate")
 async def calculate_scores(session_token: Optional[str] = Cookie(None)):
@@ -63,62 +25,11 @@ async def calculate_scores(session_token: Optional[str] = Cookie(None)):
         return JSONResponse({"error": "Forbidden"}, status_code=403)
 
     company_id = user.get("company_id")
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        today = date.today()
-        # Собираем данные
-        c.execute("""
-            SELECT instagram_id,
-                   MAX(DATE(datetime)) AS last_visit,
-                   COUNT(*) AS freq,
-                   COALESCE(SUM(revenue),0) AS monetary
-            FROM bookings
-            WHERE company_id=%s AND status='completed' AND instagram_id IS NOT NULL
-            GROUP BY instagram_id
-        """, (company_id,))
-        raw = c.fetchall()
-        if not raw:
-            return JSONResponse({"success": True, "scored": 0})
-
-        recencies = [(today - r[1]).days if r[1] else 999 for r in raw]
-        freqs = [r[2] for r in raw]
-        moneys = [float(r[3]) for r in raw]
-
-        # Чем меньше recency — тем лучше, инвертируем
-        max_r = max(recencies) or 1
-        recency_inv = [max_r - r for r in recencies]
-
-        updated = 0
-        for i, row in enumerate(raw):
-            iid = row[0]
-            r_score = _score_to_quintile(recency_inv, recency_inv[i])
-            f_score = _score_to_quintile(freqs, freqs[i])
-            m_score = _score_to_quintile(moneys, moneys[i])
-            rfm = r_score + f_score + m_score
-            segment = _assign_segment(r_score, f_score, m_score)
-            churn = max(0.0, min(1.0, recencies[i] / 180))
-            ltv = moneys[i] / max(1, (today - row[1]).days / 30) * 12 if row[1] else 0
-
-            c.execute("""
-                INSERT INTO client_scores
-                  (company_id,client_instagram_id,rfm_recency,rfm_frequency,rfm_monetary,
-                   rfm_score,segment,churn_risk,ltv_predicted,last_calculated_at)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())
-                ON CONFLICT (company_id, client_instagram_id) DO UPDATE SET
-                  rfm_recency=%s,rfm_frequency=%s,rfm_monetary=%s,rfm_score=%s,
-                  segment=%s,churn_risk=%s,ltv_predicted=%s,last_calculated_at=NOW()
-            """, (company_id, iid, r_score, f_score, m_score, rfm, segment, churn, ltv,
-                  r_score, f_score, m_score, rfm, segment, churn, ltv))
-            updated += 1
-
-        conn.commit()
-        return JSONResponse({"success": True, "scored": updated})
+        scored = await run_blocking(score_company, company_id)
+        return JSONResponse({"success": True, "scored": scored})
     except Exception as e:
-        conn.rollback()
         return JSONResponse({"error": str(e)}, status_code=500)
-    finally:
-        conn.close()
 
 
 @router.get("/client-scoring")
@@ -4,19 +4,25 @@ API Endpoints для работы с клиентами
 from fastapi import APIRouter, Request, Cookie, HTTPException, Query
 from fastapi.responses import JSONResponse
 from typing import Optional
+from datetime import datetime
+import base64
+import json
 import time
 
+from psycopg2.extras import RealDictCursor
+
 from core.config import DATABASE_NAME
 from db.companies import QuotaExceededError
 from db.connection import get_db_connection
 from db import (
-    get_all_clients, get_client_by_id, get_or_create_client,
+    get_client_by_id, get_or_create_client,
     update_client_info, update_client_status, pin_client,
     delete_client, get_chat_history, get_all_bookings,
     log_activity,update_client_bot_mode
 )
 from utils.utils import require_auth, get_total_unread, get_client_display_name, hash_password
 from utils.logger import log_error,log_info
+from utils.blocking import offload_blocking
 from services.smart_assistant import SmartAssistant, get_smart_greeting, get_smart_suggestion
 
 router = APIRouter(tags=["Clients"])
@@ -101,185 +107,222 @@ def get_client_messengers(client_id: str):
     conn.close()
     return messengers
 
-def get_clients_by_messenger(messenger_type: str = 'instagram'):
-    """Получить клиентов по типу мессенджера"""
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    if messenger_type == 'instagram':
-        # Для Instagram - оптимизированный запрос с JOIN вместо подзапросов (N+1 fix)
-        c.execute("""
-            SELECT DISTINCT
-                c.instagram_id, c.username, c.phone, c.name, c.first_contact,
-                c.last_contact, COALESCE(ch.client_messages, 0) + COALESCE(mm.client_messages, 0) as total_messages, c.labels, c.status, c.lifetime_value,
-                c.profile_pic, c.notes, c.is_pinned, c.gender, 1 as has_messages,
-                c.created_at,
-                COALESCE(b.total_spend, 0) as total_spend,
-                COALESCE(b.total_bookings, 0) as total_bookings,
-                c.temperature,
-                c.email
-            FROM clients c
-            LEFT JOIN (
-                SELECT instagram_id, COUNT(*) as client_messages
-                FROM chat_history
-                WHERE sender = 'client'
-                GROUP BY instagram_id
-            ) ch ON c.instagram_id = ch.instagram_id
-            LEFT JOIN (
-                SELECT client_id, COUNT(*) as client_messages
-                FROM messenger_messages
-                WHERE sender_type = 'client'
-                GROUP BY client_id
-            ) mm ON c.instagram_id = mm.client_id
-            LEFT JOIN (
-                SELECT instagram_id,
-                       SUM(revenue) as total_spend,
-                       COUNT(*) as total_bookings
-                FROM bookings
-                WHERE COALESCE(status, '') <> 'cancelled'
-                  AND deleted_at IS NULL
-                GROUP BY instagram_id
-            ) b ON c.instagram_id = b.instagram_id
-            WHERE EXISTS (
-                SELECT 1 FROM chat_history ch WHERE ch.instagram_id = c.instagram_id
-            ) OR EXISTS (
-                SELECT 1 FROM messenger_messages mm WHERE mm.client_id = c.instagram_id AND mm.messenger_type = 'instagram'
-            )
-            ORDER BY c.is_pinned DESC, c.last_contact DESC
-        """)
-    else:
-        # Для других мессенджеров - оптимизированный запрос с JOIN (N+1 fix)
-        c.execute("""
-            SELECT DISTINCT
-                c.instagram_id, c.username, c.phone, c.name, c.first_contact,
-                c.last_contact, COALESCE(ch.client_messages, 0) + COALESCE(mm.client_messages, 0) as total_messages, c.labels, c.status, c.lifetime_value,
-                c.profile_pic, c.notes, c.is_pinned, c.gender, 1 as has_messages,
-                c.created_at,
-                COALESCE(b.total_spend, 0) as total_spend,
-                COALESCE(b.total_bookings, 0) as total_bookings,
-                c.temperature,
-                c.email
-            FROM clients c
-            LEFT JOIN (
-                SELECT instagram_id, COUNT(*) as client_messages
-                FROM chat_history
-                WHERE sender = 'client'
-                GROUP BY instagram_id
-            ) ch ON c.instagram_id = ch.instagram_id
-            LEFT JOIN (
-                SELECT client_id, COUNT(*) as client_messages
-                FROM messenger_messages
-                WHERE sender_type = 'client'
-                GROUP BY client_id
-            ) mm ON c.instagram_id = mm.client_id
-            LEFT JOIN (
-                SELECT instagram_id,
-                       SUM(revenue) as total_spend,
-                       COUNT(*) as total_bookings
-                FROM bookings
-                WHERE COALESCE(status, '') <> 'cancelled'
-                  AND deleted_at IS NULL
-                GROUP BY instagram_id
-            ) b ON c.instagram_id = b.instagram_id
-            JOIN messenger_messages mmsg ON c.instagram_id = mmsg.client_id
-            WHERE mmsg.messenger_type = %s
-            ORDER BY c.is_pinned DESC, c.last_contact DESC
-        """, (messenger_type,))
-
-    clients = c.fetchall()
-    conn.close()
-    return clients
+CLIENTS_PAGE_MAX_LIMIT = 500
+
+# Ключи сортировки: выражения совпадают с индексами idx_clients_list_* в db/init.py
+_CLIENT_SORT_EXPRESSIONS = {
+    "last_contact": "COALESCE(c.last_contact, TIMESTAMP '1970-01-01')",
+    "created_at": "COALESCE(c.created_at, TIMESTAMP '1970-01-01')",
+    "name": "LOWER(COALESCE(NULLIF(c.name, ''), c.username, c.instagram_id))",
+    "total_messages": "COALESCE(c.inbound_messages_count, 0)",
+    "total_bookings": "COALESCE(c.active_bookings_count, 0)",
+    "total_spend": "COALESCE(c.active_bookings_spend, 0)",
+}
+# Сортировки, раскрывающие финансы, недоступны ролям без доступа к ним
+_FINANCIAL_SORTS = {"total_spend"}
+
+CLIENT_LIST_FIELDS = (
+    "id", "instagram_id", "username", "phone", "name", "display_name",
+    "first_contact", "last_contact", "total_messages", "status", "lifetime_value",
+    "profile_pic", "notes", "is_pinned", "gender", "created_at", "total_spend",
+    "total_bookings", "temperature", "email", "messenger",
+)
 
-def get_clients_by_master(master_name: str):
+class InvalidClientsCursor(ValueError):
+    pass
+
+def _client_temperature_sql(bookings_sql: str, messages_sql: str) -> str:
+    """SQL-версия _resolve_client_temperature, чтобы фильтр и ответ совпадали."""
+    stored = "LOWER(TRIM(COALESCE(c.temperature, '')))"
+    return f"""CASE
+        WHEN {bookings_sql} >= 4 THEN 'hot'
+        WHEN {bookings_sql} >= 1 OR {messages_sql} >= 8 THEN
+            CASE WHEN {stored} = 'hot' THEN 'hot' ELSE 'warm' END
+        WHEN {stored} IN ('hot', 'warm', 'cold') THEN {stored}
+        ELSE 'warm'
+    END"""
+
+def encode_clients_cursor(sort: str, order: str, row: dict) -> str:
+    key = row["sort_key"]
+    if isinstance(key, datetime):
+        key = key.isoformat()
+    payload = {"s": sort, "o": order, "k": [bool(row["pin_key"]), key, row["instagram_id"]]}
+    raw = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_clients_cursor(cursor: str, sort: str, order: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        values = payload["k"]
+    except Exception as e:
+        raise InvalidClientsCursor("invalid_cursor") from e
+    if payload.get("s") != sort or payload.get("o") != order or not isinstance(values, list) or len(values) != 3:
+        raise InvalidClientsCursor("cursor_sort_mismatch")
+    return values
+
+def get_clients_page(
+    scope: str = "full",
+    master_name: Optional[str] = None,
+    messenger: str = "all",
+    statuses: Optional[list] = None,
+    temperatures: Optional[list] = None,
+    pinned: Optional[bool] = None,
+    sort: str = "last_contact",
+    order: str = "desc",
+    after: Optional[list] = None,
+    limit: Optional[int] = None,
+) -> list:
     """
-    Получить клиентов конкретного мастера (для employee)
-    Возвращает только тех клиентов, у которых есть записи к данному мастеру
-    БЕЗ контактных данных и финансовой аналитики
+    Список клиентов одним запросом с keyset-пагинацией.
+
+    Счётчики сообщений и записей берутся из поддерживаемых триггерами колонок
+    clients.inbound_messages_count / active_bookings_count / active_bookings_spend.
+    scope: full (admin), limited (sales, без контактов и финансов),
+    master (employee, только клиенты с записями к master_name).
+    Возвращает словари со служебными pin_key/sort_key для курсора; при limit
+    выбирается limit + 1 строка, чтобы вызывающий понял, есть ли следующая страница.
     """
-    from utils.logger import log_info
-    
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute("""
-        SELECT DISTINCT
-            c.instagram_id, 
-            c.username, 
-            NULL as phone,  -- ❌ Скрываем телефон
-            c.name, 
-            c.first_contact,
-            c.last_contact, 
-            c.total_messages, 
-            c.labels, 
-            c.status, 
-            0 as lifetime_value,  -- ❌ Скрываем финансы
-            c.profile_pic, 
-            c.notes, 
-            c.is_pinned, 
-            c.gender, 
-            1 as has_messages,
-            c.created_at,
-            0 as total_spend,  -- ❌ Скрываем выручку
-            COALESCE((SELECT COUNT(*) FROM bookings WHERE instagram_id = c.instagram_id AND COALESCE(status, '') <> 'cancelled' AND deleted_at IS NULL AND master = %s), 0) as total_bookings,
-            c.temperature
-        FROM clients c
-        INNER JOIN bookings b ON c.instagram_id = b.instagram_id
-        WHERE b.master = %s
-        ORDER BY c.is_pinned DESC, c.last_contact DESC
-    """, (master_name, master_name))
-    
-    clients = c.fetchall()
-    conn.close()
-    
-    log_info(f"📋 Получено {len(clients)} клиентов для мастера {master_name} (без контактов)", "clients")
-    
-    return clients
-
-def get_clients_limited():
+    restricted = scope != "full"
+    params = []
+    joins = ""
+    bookings_sql = "COALESCE(c.active_bookings_count, 0)"
+    messages_sql = "COALESCE(c.inbound_messages_count, 0)"
+    conditions = ["c.deleted_at IS NULL"]
+
+    if scope == "master":
+        joins = """
+            LEFT JOIN LATERAL (
+                SELECT COUNT(*) AS bookings
+                FROM bookings b
+                WHERE b.instagram_id = c.instagram_id
+                  AND b.master = %s
+                  AND COALESCE(b.status, '') <> 'cancelled'
+                  AND b.deleted_at IS NULL
+            ) mb ON TRUE
+        """
+        params.append(master_name)
+        bookings_sql = "mb.bookings"
+        conditions.append("EXISTS (SELECT 1 FROM bookings b WHERE b.instagram_id = c.instagram_id AND b.master = %s)")
+    elif scope == "limited":
+        conditions.append("""(
+            EXISTS (SELECT 1 FROM chat_history ch WHERE ch.instagram_id = c.instagram_id)
+            OR EXISTS (SELECT 1 FROM messenger_messages mm WHERE mm.client_id = c.instagram_id)
+        )""")
+
+    spend_sql = "0" if restricted else "COALESCE(c.active_bookings_spend, 0)"
+    sort_sql = _CLIENT_SORT_EXPRESSIONS[sort]
+    columns = f"""
+        c.instagram_id, c.username,
+        {"NULL" if restricted else "c.phone"} AS phone,
+        c.name, c.first_contact, c.last_contact,
+        {messages_sql} AS total_messages,
+        c.status, c.profile_pic, c.notes, c.is_pinned, c.gender, c.created_at,
+        {spend_sql} AS total_spend,
+        {bookings_sql} AS total_bookings,
+        {_client_temperature_sql(bookings_sql, messages_sql)} AS temperature,
+        {"NULL" if restricted else "c.email"} AS email,
+        COALESCE(c.is_pinned, FALSE) AS pin_key,
+        {sort_sql} AS sort_key
     """
-    Получить всех клиентов БЕЗ контактных данных и финансов (для sales)
+
+    if scope == "master":
+        params.append(master_name)
+
+    if messenger == "instagram":
+        conditions.append("""(
+            EXISTS (SELECT 1 FROM chat_history ch WHERE ch.instagram_id = c.instagram_id)
+            OR EXISTS (
+                SELECT 1 FROM messenger_messages mm
+                WHERE mm.client_id = c.instagram_id AND mm.messenger_type = 'instagram'
+            )
+        )""")
+    elif messenger and messenger != "all":
+        conditions.append("""EXISTS (
+            SELECT 1 FROM messenger_messages mm
+            WHERE mm.client_id = c.instagram_id AND mm.messenger_type = %s
+        )""")
+        params.append(messenger)
+    if statuses:
+        conditions.append("c.status = ANY(%s)")
+        params.append(list(statuses))
+    if pinned is not None:
+        conditions.append("COALESCE(c.is_pinned, FALSE) = %s")
+        params.append(bool(pinned))
+
+    outer_conditions = []
+    if temperatures:
+        outer_conditions.append("listing.temperature = ANY(%s)")
+        params.append(list(temperatures))
+
+    direction = "ASC" if order == "asc" else "DESC"
+    if after is not None:
+        if direction == "DESC":
+            outer_conditions.append("(listing.pin_key, listing.sort_key, listing.instagram_id) < (%s, %s, %s)")
+            params.extend(after)
+        else:
+            # Закреплённые всегда первыми, поэтому направление pin_key не совпадает с остальными
+            outer_conditions.append("""(
+                listing.pin_key < %s
+                OR (listing.pin_key = %s AND (listing.sort_key, listing.instagram_id) > (%s, %s))
+            )""")
+            params.extend([after[0], after[0], after[1], after[2]])
+
+    query = f"""
+        SELECT * FROM (
+            SELECT {columns}
+            FROM clients c
+            {joins}
+            WHERE {" AND ".join(conditions)}
+        ) AS listing
+        {"WHERE " + " AND ".join(outer_conditions) if outer_conditions else ""}
+        ORDER BY listing.pin_key DESC, listing.sort_key {direction}, listing.instagram_id {direction}
     """
-    from utils.logger import log_info
-    
+    if limit:
+        query += " LIMIT %s"
+        params.append(int(limit) + 1)
+
     conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute("""
-        SELECT DISTINCT
-            c.instagram_id, 
-            c.username, 
-            NULL as phone,  -- ❌ Скрываем телефон
-            c.name, 
-            c.first_contact,
-            c.last_contact, 
-            c.total_messages, 
-            c.labels, 
-            c.status, 
-            0 as lifetime_value,  -- ❌ Скрываем финансы
-            c.profile_pic, 
-            c.notes, 
-            c.is_pinned, 
-            c.gender, 
-            1 as has_messages,
-            c.created_at,
-            0 as total_spend,  -- ❌ Скрываем выручку
-            COALESCE((SELECT COUNT(*) FROM bookings WHERE instagram_id = c.instagram_id AND COALESCE(status, '') <> 'cancelled' AND deleted_at IS NULL), 0) as total_bookings,
-            c.temperature
-        FROM clients c
-        WHERE EXISTS (
-            SELECT 1 FROM chat_history ch WHERE ch.instagram_id = c.instagram_id
-        ) OR EXISTS (
-            SELECT 1 FROM messenger_messages mm WHERE mm.client_id = c.instagram_id
-        )
-        ORDER BY c.is_pinned DESC, c.last_contact DESC
-    """)
-    
-    clients = c.fetchall()
-    conn.close()
-    
-    log_info(f"📋 Получено {len(clients)} клиентов (ограниченный доступ для sales)", "clients")
-    
-    return clients
+    try:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute(query, params)
+        return c.fetchall()
+    finally:
+        conn.close()
+
+def _serialize_client_row(row: dict, messenger: str, fields: Optional[set] = None) -> dict:
+    spend = row["total_spend"] or 0
+    item = {
+        "id": row["instagram_id"],
+        "instagram_id": row["instagram_id"],
+        "username": row["username"],
+        "phone": row["phone"],
+        "name": row["name"],
+        "display_name": get_client_display_name((row["instagram_id"], row["username"], row["phone"], row["name"])),
+        "first_contact": row["first_contact"],
+        "last_contact": row["last_contact"],
+        "total_messages": row["total_messages"],
+        "status": row["status"],
+        "lifetime_value": spend,
+        "profile_pic": row["profile_pic"],
+        "notes": row["notes"],
+        "is_pinned": row["is_pinned"],
+        "gender": row["gender"],
+        "created_at": row["created_at"],
+        "total_spend": spend,
+        "total_bookings": row["total_bookings"],
+        "temperature": row["temperature"],
+        "email": row["email"],
+        "messenger": messenger,
+    }
+    if fields:
+        return {key: value for key, value in item.items() if key in fields}
+    return item
+
+def _split_query_list(value: Optional[str]) -> list:
+    if not value:
+        return []
+    return [part.strip() for part in value.split(",") if part.strip()]
 
 def get_clients_stats_only():
     """
@@ -317,61 +360,29 @@ def get_clients_stats_only():
         "cold_clients": stats[6] if stats else 0
     }
 
-
-
-def get_clients_all():
-    """Получить ВСЕХ клиентов (независимо от мессенджера)"""
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    c.execute("""
-        SELECT DISTINCT
-            c.instagram_id, c.username, c.phone, c.name, c.first_contact,
-            c.last_contact, COALESCE(ch.client_messages, 0) + COALESCE(mm.client_messages, 0) as total_messages, c.labels, c.status, c.lifetime_value,
-            c.profile_pic, c.notes, c.is_pinned, c.gender,
-            CASE WHEN EXISTS (SELECT 1 FROM chat_history ch WHERE ch.instagram_id = c.instagram_id) THEN 1 ELSE 0 END as has_messages,
-            c.created_at,
-            COALESCE(b.total_spend, 0) as total_spend,
-            COALESCE(b.total_bookings, 0) as total_bookings,
-            c.temperature,
-            c.email
-        FROM clients c
-        LEFT JOIN (
-            SELECT instagram_id, COUNT(*) as client_messages
-            FROM chat_history
-            WHERE sender = 'client'
-            GROUP BY instagram_id
-        ) ch ON c.instagram_id = ch.instagram_id
-        LEFT JOIN (
-            SELECT client_id, COUNT(*) as client_messages
-            FROM messenger_messages
-            WHERE sender_type = 'client'
-            GROUP BY client_id
-        ) mm ON c.instagram_id = mm.client_id
-        LEFT JOIN (
-            SELECT instagram_id,
-                   SUM(revenue) as total_spend,
-                   COUNT(*) as total_bookings
-            FROM bookings
-            WHERE COALESCE(status, '') <> 'cancelled'
-              AND deleted_at IS NULL
-            GROUP BY instagram_id
-        ) b ON c.instagram_id = b.instagram_id
-        WHERE c.deleted_at IS NULL
-        ORDER BY c.is_pinned DESC, c.last_contact DESC
-    """)
-
-    clients = c.fetchall()
-    conn.close()
-    return clients
-
 @router.get("/clients")
-async def list_clients(
+@offload_blocking
+def list_clients(
     session_token: Optional[str] = Cookie(None),
     messenger: Optional[str] = Query('all'), # Default to 'all' here too, or keep as is and let frontend drive
-    master_id: Optional[int] = Query(None)
+    master_id: Optional[int] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=CLIENTS_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = Query(None),
+    sort: Optional[str] = Query('last_contact'),
+    order: Optional[str] = Query('desc'),
+    status: Optional[str] = Query(None),
+    temperature: Optional[str] = Query(None),
+    pinned: Optional[bool] = Query(None),
+    fields: Optional[str] = Query(None)
 ):
-    """Получить всех клиентов с фильтрацией по мессенджеру и/или мастеру"""
+    """
+    Получить клиентов с фильтрацией по мессенджеру и/или мастеру.
+
+    Без limit/cursor возвращается весь список (как раньше). С limit — страница
+    в порядке закреплённые → sort/order и next_cursor для следующего запроса.
+    status/temperature принимают несколько значений через запятую, fields — список
+    полей ответа (id возвращается всегда).
+    """
     user = require_auth(session_token)
     if not user:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
@@ -397,61 +408,65 @@ async def list_clients(
         messenger = 'all'
 
     # RBAC: Разные уровни доступа в зависимости от роли
+    master_name = None
     if user["role"] == "employee":
         # Employee видит только своих клиентов (без контактов)
-        from utils.logger import log_info
-        full_name = user.get("full_name", "")
+        master_name = user.get("full_name", "")
         log_info(f"🔒 Employee {user['username']} запрашивает своих клиентов", "clients")
-        clients = get_clients_by_master(full_name)
+        scope = "master"
     elif user["role"] == "sales":
         # Sales видит всех клиентов БЕЗ контактов и финансов
-        from utils.logger import log_info
         log_info(f"🔒 Sales {user['username']} запрашивает клиентов (ограниченный доступ)", "clients")
-        clients = get_clients_limited()
+        scope = "limited"
     elif user["role"] == "marketer":
         # Marketer видит только статистику
-        from utils.logger import log_info
         log_info(f"📊 Marketer {user['username']} запрашивает статистику клиентов", "clients")
         stats = get_clients_stats_only()
         return {"clients_stats": stats, "access_level": "stats_only"}
     else:
         # Admin/Manager/Director видят всех клиентов с полными данными
-        if messenger == 'all':
-            clients = get_clients_all()
-        else:
-            clients = get_clients_by_messenger(messenger)
+        scope = "full"
+
+    if sort not in _CLIENT_SORT_EXPRESSIONS or (scope != "full" and sort in _FINANCIAL_SORTS):
+        sort = "last_contact"
+    order = "asc" if str(order).lower() == "asc" else "desc"
+    page_size = limit or (CLIENTS_PAGE_MAX_LIMIT if cursor else None)
+
+    after = None
+    if cursor:
+        try:
+            after = decode_clients_cursor(cursor, sort, order)
+        except InvalidClientsCursor as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+    projection = None
+    requested_fields = _split_query_list(fields)
+    if requested_fields:
+        projection = {field for field in requested_fields if field in CLIENT_LIST_FIELDS}
+        projection.add("id")
+
+    rows = get_clients_page(
+        scope=scope,
+        master_name=master_name,
+        messenger=messenger,
+        statuses=_split_query_list(status),
+        temperatures=[value.lower() for value in _split_query_list(temperature)],
+        pinned=pinned,
+        sort=sort,
+        order=order,
+        after=after,
+        limit=page_size,
+    )
+
+    next_cursor = None
+    if page_size and len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_clients_cursor(sort, order, rows[-1])
+
     return {
-        "clients": [
-            {
-                "id": c[0],
-                "instagram_id": c[0],
-                "username": c[1],
-                "phone": c[2],
-                "name": c[3],
-                "display_name": get_client_display_name(c),
-                "first_contact": c[4],
-                "last_contact": c[5],
-                "total_messages": c[6],
-                "status": c[8] if len(c) > 8 else "new",
-                "lifetime_value": c[16] if len(c) > 16 else (c[9] if len(c) > 9 else 0),
-                "profile_pic": c[10] if len(c) > 10 else None,
-                "notes": c[11] if len(c) > 11 else "",
-                "is_pinned": c[12] if len(c) > 12 else 0,
-                "gender": c[13] if len(c) > 13 else "female",
-                "created_at": c[15] if len(c) > 15 else None,
-                "total_spend": c[16] if len(c) > 16 else (c[9] if len(c) > 9 else 0),
-                "total_bookings": c[17] if len(c) > 17 else 0,
-                "temperature": _resolve_client_temperature(
-                    c[18] if len(c) > 18 else None,
-                    c[17] if len(c) > 17 else 0,
-                    c[6] if len(c) > 6 else 0
-                ),
-                "email": c[19] if len(c) > 19 else None,
-                "messenger": messenger
-            }
-            for c in clients
-        ],
-        "count": len(clients),
+        "clients": [_serialize_client_row(row, messenger, projection) for row in rows],
+        "count": len(rows),
+        "next_cursor": next_cursor,
         "unread_count": get_total_unread(),
         "messenger": messenger
     }
@@ -910,13 +925,14 @@ async def delete_client_api(
 
 
 @router.get("/search")
-async def search_clients(
+@offload_blocking
+def search_clients(
     q: str,
     type: str = "all",  # all, clients, messages, bookings
     limit: int = 50,
     session_token: Optional[str] = Cookie(None)
 ):
-    """Расширенный поиск по клиентам, сообщениям и записям"""
+    """Расширенный поиск по клиентам, сообщениям и записям (ранжированный, по индексам)"""
     user = require_auth(session_token)
     if not user:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
@@ -924,30 +940,14 @@ async def search_clients(
     if not q or len(q.strip()) < 2:
         return JSONResponse({"error": "Query too short"}, status_code=400)
     
-    search_query = f"%{q.strip()}%"
+    search_query = q.strip()
     results = {"clients": [], "messages": [], "bookings": []}
     
     try:
         if type in ["all", "clients"]:
             # Поиск клиентов
-            clients = get_all_clients()
-            for c in clients:
-                if (search_query.lower() in (c[1] or "").lower() or  # username
-                    search_query.lower() in (c[3] or "").lower() or  # name
-                    search_query.lower() in (c[2] or "").lower() or  # phone
-                    search_query.lower() in (c[0] or "").lower()):   # instagram_id
-                    results["clients"].append({
-                        "id": c[0],
-                        "instagram_id": c[0],
-                        "username": c[1],
-                        "name": c[3],
-                        "phone": c[2],
-                        "display_name": get_client_display_name(c),
-                        "status": c[8] if len(c) > 8 else "new",
-                        "total_messages": c[6],
-                        "lifetime_value": c[9] if len(c) > 9 else 0,
-                        "profile_pic": c[10] if len(c) > 10 else None
-                    })
+            from db.search import search_clients as search_clients_index
+            results["clients"] = search_clients_index(search_query, limit)
         
         if type in ["all", "messages"]:
             # Поиск сообщений
@@ -973,11 +973,12 @@ async def search_clients(
         return JSONResponse({"error": str(e)}, status_code=500)
 
 @router.get("/search/suggestions")
-async def get_search_suggestions(
+@offload_blocking
+def get_search_suggestions(
     q: str,
     session_token: Optional[str] = Cookie(None)
 ):
-    """Получить подсказки для поиска"""
+    """Получить подсказки для поиска (префиксный поиск клиентов и услуг)"""
     user = require_auth(session_token)
     if not user:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
@@ -985,35 +986,9 @@ async def get_search_suggestions(
     if not q or len(q.strip()) < 1:
         return {"suggestions": []}
     
-    search_query = f"%{q.strip()}%"
-    suggestions = []
-    
     try:
-        # Подсказки по именам клиентов
-        clients = get_all_clients()
-        for c in clients[:10]:  # Ограничиваем для производительности
-            name = c[3] or c[1] or ""
-            if search_query.lower() in name.lower():
-                suggestions.append({
-                    "type": "client",
-                    "text": name,
-                    "id": c[0],
-                    "subtitle": f"@{c[1]}" if c[1] else c[0]
-                })
-        
-        # Подсказки по услугам
-        from db.services import get_all_services
-        services = get_all_services()
-        for s in services[:5]:
-            if search_query.lower() in s[1].lower():
-                suggestions.append({
-                    "type": "service",
-                    "text": s[1],
-                    "id": s[0],
-                    "subtitle": f"{s[2]} AED"
-                })
-        
-        return {"suggestions": suggestions[:10]}
+        from db.search import get_search_suggestions as get_index_suggestions
+        return {"suggestions": get_index_suggestions(q.strip(), 10)}
         
     except Exception as e:
         log_error(f"Search suggestions error: {e}", "api")
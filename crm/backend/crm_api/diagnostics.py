@@ -8,9 +8,18 @@ from typing import Optional
 from datetime import datetime
 
 from core.config import DATABASE_NAME
-from db.connection import get_db_connection
+from db.connection import get_db_connection, get_pool_metrics
+from db.analytics_rollups import get_rollup_backlog
 from utils.utils import require_auth
 from utils.logger import log_info, log_error
+from utils.query_profiler import profiler as query_profiler
+from utils.http_clients import http_clients
+from utils.event_buffer import event_buffer_stats
+from utils.blocking import run_blocking
+from utils.tenant_context import platform_access
+from services.webhook_dispatcher import get_outbox_stats, webhook_dispatcher
+from services.instagram_inbox import get_inbox_backlog, instagram_inbox
+from services.llm_dispatcher import llm_dispatcher
 
 router = APIRouter(tags=["Diagnostics"])
 
@@ -260,6 +269,117 @@ def extract_section(text: str, marker: str) -> Optional[str]:
     except:
         return None
 
+@router.get("/diagnostics/pool")
+async def pool_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Метрики пула соединений воркера: занятость, очередь, ожидание, утечки"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    return get_pool_metrics()
+
+@router.get("/diagnostics/http")
+async def http_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Метрики общих HTTP-клиентов воркера: запросы, переиспользование соединений, задержка"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    return {"clients": http_clients.stats()}
+
+@router.get("/diagnostics/webhooks")
+async def webhook_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Диспетчер вебхуков воркера: доставки, повторы, задержки и очередь outbox"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    with platform_access():
+        outbox = await run_blocking(get_outbox_stats)
+    return {"dispatcher": webhook_dispatcher.stats(), "outbox": outbox}
+
+@router.get("/diagnostics/instagram-inbox")
+async def instagram_inbox_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Очередь входящих Instagram: время ответа вебхуку, ожидание в очереди, ходы AI и бэклог"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    with platform_access():
+        backlog = await run_blocking(get_inbox_backlog)
+    return {"worker": instagram_inbox.stats(), "backlog": backlog}
+
+@router.get("/diagnostics/event-buffers")
+async def event_buffer_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Буферы пакетной записи трекинга: очередь, размер пачек, отброшенные события"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    return {"buffers": event_buffer_stats()}
+
+@router.get("/diagnostics/analytics-rollups")
+async def analytics_rollup_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Очередь пересчёта дневных роллапов аналитики: дни, которые пока читаются из сырых таблиц"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    with platform_access():
+        backlog = await run_blocking(get_rollup_backlog)
+    return {"backlog": backlog}
+
+@router.get("/diagnostics/bot-prompt")
+async def bot_prompt_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Сборка системного промпта бота: время и SQL-запросы на ход, кэш секций каталога, контексты компаний, кэш ответов, состояния диалогов"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    from bot.answer_cache import answer_cache_stats
+    from bot.contexts import bot_contexts
+    from bot.prompt_cache import prompt_build_stats
+    from services.conversation_state import conversation_states
+    return {
+        **prompt_build_stats(),
+        "contexts": bot_contexts.stats(),
+        "answer_cache": answer_cache_stats(),
+        "conversations": conversation_states.stats(),
+    }
+
+@router.get("/diagnostics/llm")
+async def llm_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Диспетчер запросов к LLM: очередь, ожидание, время ответа upstream, здоровье ключей и прокси"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    return llm_dispatcher.stats()
+
+@router.get("/diagnostics/queries")
+async def query_diagnostics(
+    sort: str = "total_ms",
+    limit: int = 50,
+    route: Optional[str] = None,
+    session_token: Optional[str] = Cookie(None)
+):
+    """Профиль SQL воркера: худшие отпечатки, маршруты и N+1 (utils.query_profiler)"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    return query_profiler.report(sort=sort, limit=limit, route=route)
+
+@router.post("/diagnostics/queries/reset")
+async def reset_query_diagnostics(session_token: Optional[str] = Cookie(None)):
+    """Сбросить накопленную статистику запросов воркера"""
+    user = require_auth(session_token)
+    if not user or user["role"] not in ["admin", "director"]:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    query_profiler.reset()
+    return {"success": True}
+
 @router.get("/diagnostics/prompt-test")
 async def test_prompt_generation(
     service: str = "Manicure",
@@ -6,7 +6,7 @@ from fastapi.responses import JSONResponse
 from typing import Optional, List
 
 import json
-import httpx
+from utils.http_clients import get_http_client
 
 from core.config import DATABASE_NAME
 from db.companies import QuotaExceededError, ensure_company_quota, get_current_company, update_company
@@ -393,14 +393,14 @@ async def send_messenger_message(
                         }
                         
                         log_info(f"Sending WhatsApp via GreenAPI to {phone}...", "messengers")
-                        async with httpx.AsyncClient() as client:
-                            resp = await client.post(url, json=payload, timeout=10.0)
-                            if resp.status_code == 200:
-                                result = resp.json()
-                                log_info(f"GreenAPI success: {result}", "messengers")
-                                sent_successfully = True
-                            else:
-                                log_error(f"GreenAPI failed: {resp.status_code} {resp.text}", "messengers")
+                        client = get_http_client(url)
+                        resp = await client.post(url, json=payload, timeout=10.0)
+                        if resp.status_code == 200:
+                            result = resp.json()
+                            log_info(f"GreenAPI success: {result}", "messengers")
+                            sent_successfully = True
+                        else:
+                            log_error(f"GreenAPI failed: {resp.status_code} {resp.text}", "messengers")
                     else:
                          log_info("WhatsApp settings found but incomplete or mock mode. Queued locally.", "messengers")
                          sent_successfully = True
@@ -430,15 +430,15 @@ async def send_messenger_message(
                         }
 
                         log_info(f"Sending Instagram via Graph API to {ig_user_id}...", "messengers")
-                        async with httpx.AsyncClient() as client:
-                            # We don't await response validation strictly here to prevent blocking if config is partial
-                            # But implemented correctly.
-                            resp = await client.post(url, json=payload, timeout=10.0)
-                            if resp.status_code == 200:
-                                log_info("Instagram Graph API success", "messengers")
-                                sent_successfully = True
-                            else:
-                                log_error(f"Instagram Graph API failed: {resp.status_code} {resp.text}", "messengers")
+                        client = get_http_client(url)
+                        # We don't await response validation strictly here to prevent blocking if config is partial
+                        # But implemented correctly.
+                        resp = await client.post(url, json=payload, timeout=10.0)
+                        if resp.status_code == 200:
+                            log_info("Instagram Graph API success", "messengers")
+                            sent_successfully = True
+                        else:
+                            log_error(f"Instagram Graph API failed: {resp.status_code} {resp.text}", "messengers")
                     else:
                         sent_successfully = True
              except Exception as e:
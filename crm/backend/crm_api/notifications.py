@@ -7,11 +7,11 @@ from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime, timedelta
 
-import os
 import json
 
 from core.config import DEFAULT_REPORT_TIME
 from db.connection import get_db_connection
+from db.schema_catalog import get_table_columns
 from utils.utils import require_auth
 from utils.logger import log_error, log_info
 from utils.datetime_utils import get_current_time, get_salon_timezone
@@ -28,15 +28,6 @@ def _quote_sql_identifier(identifier: str) -> str:
     return f'"{escaped_identifier}"'
 
 
-def _get_notification_template_columns(cursor) -> set[str]:
-    cursor.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_schema = 'public' AND table_name = 'notification_templates'
-    """)
-    return {row[0] for row in cursor.fetchall()}
-
-
 def _get_template_value_expression(template_columns: set[str], base_column: str) -> str:
     if base_column in template_columns:
         return _quote_sql_identifier(base_column)
@@ -479,12 +470,7 @@ async def save_notification_settings(
             # Используем динамическое обновление чтобы не ломаться если колонок нет
             
             # Сначала проверим какие колонки есть
-            if os.getenv('DATABASE_TYPE') == 'postgresql':
-                c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='notification_settings'")
-                columns = [row[0] for row in c.fetchall()]
-            else:
-                c.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name='notification_settings'")
-                columns = [row[1] for row in c.fetchall()]
+            columns = get_table_columns("notification_settings", c)
             
             update_fields = []
             params = []
@@ -601,7 +587,7 @@ async def get_templates(session_token: Optional[str] = Cookie(None)):
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        template_columns = _get_notification_template_columns(c)
+        template_columns = get_table_columns("notification_templates", c)
         has_legacy_columns = {"title", "message", "notification_type"}.issubset(template_columns)
 
         if has_legacy_columns:
@@ -647,7 +633,7 @@ async def save_template(template: TemplateModel, session_token: Optional[str] =
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        template_columns = _get_notification_template_columns(c)
+        template_columns = get_table_columns("notification_templates", c)
         insert_columns = ["name", "category"]
         insert_values = [template.name, template.category]
         update_clauses = ["category = EXCLUDED.category"]
@@ -708,7 +694,7 @@ async def update_template(
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        template_columns = _get_notification_template_columns(c)
+        template_columns = get_table_columns("notification_templates", c)
         update_clauses = [
             "name = %s",
             "category = %s"
@@ -4,12 +4,13 @@ API для интеграции с платежными системами
 """
 from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, Set
+from typing import Optional, Dict, Any
 from datetime import datetime
 import json
 import base64
 
 from db.connection import get_db_connection
+from db.schema_catalog import get_table_columns
 from utils.logger import log_info, log_error, log_warning
 from utils.utils import get_current_user
 
@@ -41,15 +42,6 @@ def _can_manage_providers(current_user: dict) -> bool:
     return current_user.get("role") in ["director", "admin"]
 
 
-def _get_table_columns(cursor, table_name: str) -> Set[str]:
-    cursor.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = %s
-    """, (table_name,))
-    return {row[0] for row in cursor.fetchall()}
-
-
 # ===== ПРОВАЙДЕРЫ ПЛАТЕЖЕЙ =====
 
 @router.get("/payment-providers")
@@ -61,7 +53,7 @@ async def get_payment_providers(current_user: dict = Depends(get_current_user)):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        provider_columns = _get_table_columns(cursor, "payment_providers")
+        provider_columns = get_table_columns("payment_providers", cursor)
         has_webhook_secret = "webhook_secret" in provider_columns
         has_created_at = "created_at" in provider_columns
         has_updated_at = "updated_at" in provider_columns
@@ -118,7 +110,7 @@ async def create_payment_provider(
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        provider_columns = _get_table_columns(cursor, "payment_providers")
+        provider_columns = get_table_columns("payment_providers", cursor)
         has_webhook_secret = "webhook_secret" in provider_columns
         has_created_at = "created_at" in provider_columns
         has_updated_at = "updated_at" in provider_columns
@@ -303,7 +295,7 @@ async def payment_webhook(provider: str, request: Request):
         body = await request.body()
         headers = dict(request.headers)
 
-        provider_columns = _get_table_columns(cursor, "payment_providers")
+        provider_columns = get_table_columns("payment_providers", cursor)
         has_webhook_secret = "webhook_secret" in provider_columns
 
         if has_webhook_secret:
@@ -411,7 +403,7 @@ async def create_yookassa_payment(transaction_id: int, amount: float, currency:
         return None
 
 async def create_paypal_payment(transaction_id: int, amount: float, currency: str, client_id: str, client_secret: str, return_url: str):
-    import httpx
+    from utils.http_clients import get_http_client
     import os
     
     # Determine PayPal environment
@@ -429,51 +421,51 @@ async def create_paypal_payment(transaction_id: int, amount: float, currency: st
     }
     data = {"grant_type": "client_credentials"}
     
-    async with httpx.AsyncClient() as client:
-        token_resp = await client.post(token_url, data=data, headers=headers)
-        if token_resp.status_code != 200:
-             log_error(f"PayPal Token Error: {token_resp.text}", "payment")
-             raise HTTPException(status_code=500, detail="PayPal Auth Failed")
-        
-        access_token = token_resp.json()["access_token"]
-        
-        # 2. Create Order
-        order_url = f"{base_url}/v2/checkout/orders"
-        order_headers = {
-             "Content-Type": "application/json",
-             "Authorization": f"Bearer {access_token}"
-        }
-        order_payload = {
-            "intent": "CAPTURE",
-            "purchase_units": [{
-                "reference_id": str(transaction_id),
-                "amount": {
-                    "currency_code": currency,
-                    "value": f"{amount:.2f}"
-                }
-            }],
-             "application_context": {
-                "return_url": return_url,
-                "cancel_url": return_url # Simplified
+    client = get_http_client(token_url)
+    token_resp = await client.post(token_url, data=data, headers=headers)
+    if token_resp.status_code != 200:
+         log_error(f"PayPal Token Error: {token_resp.text}", "payment")
+         raise HTTPException(status_code=500, detail="PayPal Auth Failed")
+    
+    access_token = token_resp.json()["access_token"]
+    
+    # 2. Create Order
+    order_url = f"{base_url}/v2/checkout/orders"
+    order_headers = {
+         "Content-Type": "application/json",
+         "Authorization": f"Bearer {access_token}"
+    }
+    order_payload = {
+        "intent": "CAPTURE",
+        "purchase_units": [{
+            "reference_id": str(transaction_id),
+            "amount": {
+                "currency_code": currency,
+                "value": f"{amount:.2f}"
             }
+        }],
+         "application_context": {
+            "return_url": return_url,
+            "cancel_url": return_url # Simplified
         }
-        
-        order_resp = await client.post(order_url, json=order_payload, headers=order_headers)
-        if order_resp.status_code not in [200, 201]:
-             log_error(f"PayPal Order Error: {order_resp.text}", "payment")
-             raise HTTPException(status_code=500, detail="PayPal Order Failed")
-             
-        order_data = order_resp.json()
-        for link in order_data.get("links", []):
-            if link["rel"] == "approve":
-                return link["href"]
-        
-        return None
+    }
+    
+    order_resp = await client.post(order_url, json=order_payload, headers=order_headers)
+    if order_resp.status_code not in [200, 201]:
+         log_error(f"PayPal Order Error: {order_resp.text}", "payment")
+         raise HTTPException(status_code=500, detail="PayPal Order Failed")
+         
+    order_data = order_resp.json()
+    for link in order_data.get("links", []):
+        if link["rel"] == "approve":
+            return link["href"]
+    
+    return None
 
 async def create_tinkoff_payment(transaction_id: int, amount: float, currency: str, terminal_key: str, return_url: str):
     """Создать платеж через Tinkoff"""
     try:
-        import httpx
+        from utils.http_clients import get_http_client
         import hashlib
         import os
 
@@ -518,19 +510,19 @@ async def create_tinkoff_payment(transaction_id: int, amount: float, currency: s
         # Отправляем запрос инициализации
         url = "https://securepay.tinkoff.ru/v2/Init"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, timeout=10.0)
-            data = response.json()
-            
-            if data.get("Success"):
-                payment_url = data.get("PaymentURL")
-                log_info(f"Tinkoff payment created: {data.get('PaymentId')}", "payment")
-                return payment_url
-            else:
-                error_msg = data.get("Message", "Unknown error")
-                details = data.get("Details", "")
-                log_error(f"Tinkoff Init failed: {error_msg} ({details})", "payment")
-                return None
+        client = get_http_client(url)
+        response = await client.post(url, json=payload, timeout=10.0)
+        data = response.json()
+        
+        if data.get("Success"):
+            payment_url = data.get("PaymentURL")
+            log_info(f"Tinkoff payment created: {data.get('PaymentId')}", "payment")
+            return payment_url
+        else:
+            error_msg = data.get("Message", "Unknown error")
+            details = data.get("Details", "")
+            log_error(f"Tinkoff Init failed: {error_msg} ({details})", "payment")
+            return None
                 
     except Exception as e:
         log_error(f"Tinkoff integration error: {e}", "payment")
@@ -10,7 +10,9 @@ from pydantic import BaseModel
 
 from core.auth import get_current_user_or_redirect as get_current_user
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.logger import log_error, log_info
+from utils.blocking import offload_blocking
 from utils.permissions import RoleHierarchy
 
 router = APIRouter(tags=["Payroll"])
@@ -77,20 +79,6 @@ def _require_payroll_role(current_user: Optional[dict]) -> None:
         raise HTTPException(status_code=403, detail="Forbidden")
 
 
-def _column_exists(c, table_name: str, column_name: str) -> bool:
-    c.execute(
-        """
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = %s
-          AND column_name = %s
-        LIMIT 1
-        """,
-        (table_name, column_name),
-    )
-    return bool(c.fetchone())
-
-
 def _parse_date(value: str) -> date:
     try:
         return datetime.strptime(value, "%Y-%m-%d").date()
@@ -223,19 +211,19 @@ def _load_salary_profile(c, employee_id: int, base_salary: float, commission_rat
         "currency": currency,
     }
 
-    if not _column_exists(c, "salary_settings", "user_id"):
+    if not column_exists("salary_settings", "user_id", c):
         return profile
 
-    bonus_rate_select = "bonus_rate" if _column_exists(c, "salary_settings", "bonus_rate") else "0 AS bonus_rate"
-    currency_select = "currency" if _column_exists(c, "salary_settings", "currency") else f"'{currency}' AS currency"
-    kpi_settings_select = "kpi_settings" if _column_exists(c, "salary_settings", "kpi_settings") else "'{}'::jsonb AS kpi_settings"
+    bonus_rate_select = "bonus_rate" if column_exists("salary_settings", "bonus_rate", c) else "0 AS bonus_rate"
+    currency_select = "currency" if column_exists("salary_settings", "currency", c) else f"'{currency}' AS currency"
+    kpi_settings_select = "kpi_settings" if column_exists("salary_settings", "kpi_settings", c) else "'{}'::jsonb AS kpi_settings"
 
     c.execute(
         f"""
         SELECT base_salary, commission_rate, {bonus_rate_select}, {currency_select}, {kpi_settings_select}
         FROM salary_settings
         WHERE user_id = %s
-          AND ({'is_active = TRUE' if _column_exists(c, 'salary_settings', 'is_active') else '1 = 1'})
+          AND ({'is_active = TRUE' if column_exists('salary_settings', 'is_active', c) else '1 = 1'})
         LIMIT 1
         """,
         (employee_id,),
@@ -279,7 +267,7 @@ def _load_salary_profile(c, employee_id: int, base_salary: float, commission_rat
 
 
 def _calculate_scheduled_hours(c, employee_id: int, start_date: date, end_date: date) -> Dict[str, float]:
-    if not _column_exists(c, "user_schedule", "user_id"):
+    if not column_exists("user_schedule", "user_id", c):
         return {"hours": 0.0, "days": 0.0}
 
     c.execute(
@@ -400,13 +388,13 @@ async def update_payroll_settings(
             "penalty_fixed": _safe_float(data.penalty_fixed, current_profile["penalty_fixed"]),
         }
 
-        if _column_exists(c, "salary_settings", "user_id"):
-            has_bonus_rate = _column_exists(c, "salary_settings", "bonus_rate")
-            has_currency = _column_exists(c, "salary_settings", "currency")
-            has_kpi_settings = _column_exists(c, "salary_settings", "kpi_settings")
-            has_is_active = _column_exists(c, "salary_settings", "is_active")
-            has_created_at = _column_exists(c, "salary_settings", "created_at")
-            has_updated_at = _column_exists(c, "salary_settings", "updated_at")
+        if column_exists("salary_settings", "user_id", c):
+            has_bonus_rate = column_exists("salary_settings", "bonus_rate", c)
+            has_currency = column_exists("salary_settings", "currency", c)
+            has_kpi_settings = column_exists("salary_settings", "kpi_settings", c)
+            has_is_active = column_exists("salary_settings", "is_active", c)
+            has_created_at = column_exists("salary_settings", "created_at", c)
+            has_updated_at = column_exists("salary_settings", "updated_at", c)
 
             insert_columns = ["user_id", "base_salary", "commission_rate"]
             insert_values: List[Any] = [employee_id, base_salary, commission_rate]
@@ -484,7 +472,8 @@ async def update_payroll_settings(
 
 
 @router.post("/payroll/calculate")
-async def calculate_payroll(
+@offload_blocking
+def calculate_payroll(
     data: PayrollCalculateRequest,
     current_user: dict = Depends(get_current_user),
 ):
@@ -527,8 +516,8 @@ async def calculate_payroll(
         )
         currency = str(salary_profile["currency"] or _get_salon_currency(c))
 
-        has_master_user_id = _column_exists(c, "bookings", "master_user_id")
-        has_deleted_at = _column_exists(c, "bookings", "deleted_at")
+        has_master_user_id = column_exists("bookings", "master_user_id", c)
+        has_deleted_at = column_exists("bookings", "deleted_at", c)
 
         aliases = sorted(
             {
@@ -714,10 +703,10 @@ async def record_payment(
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        employee_column = "employee_id" if _column_exists(c, "payroll_payments", "employee_id") else "user_id"
-        has_currency = _column_exists(c, "payroll_payments", "currency")
-        has_status = _column_exists(c, "payroll_payments", "status")
-        has_notes = _column_exists(c, "payroll_payments", "notes")
+        employee_column = "employee_id" if column_exists("payroll_payments", "employee_id", c) else "user_id"
+        has_currency = column_exists("payroll_payments", "currency", c)
+        has_status = column_exists("payroll_payments", "status", c)
+        has_notes = column_exists("payroll_payments", "notes", c)
 
         columns = [employee_column, "amount", "period_start", "period_end"]
         values: List[Any] = [data.employee_id, data.amount, data.period_start, data.period_end]
@@ -768,11 +757,11 @@ async def get_payroll_history(
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        employee_column = "employee_id" if _column_exists(c, "payroll_payments", "employee_id") else "user_id"
-        has_currency = _column_exists(c, "payroll_payments", "currency")
-        has_status = _column_exists(c, "payroll_payments", "status")
-        has_created_at = _column_exists(c, "payroll_payments", "created_at")
-        has_payment_date = _column_exists(c, "payroll_payments", "payment_date")
+        employee_column = "employee_id" if column_exists("payroll_payments", "employee_id", c) else "user_id"
+        has_currency = column_exists("payroll_payments", "currency", c)
+        has_status = column_exists("payroll_payments", "status", c)
+        has_created_at = column_exists("payroll_payments", "created_at", c)
+        has_payment_date = column_exists("payroll_payments", "payment_date", c)
 
         currency_select = "currency" if has_currency else "NULL AS currency"
         status_select = "status" if has_status else "'paid' AS status"
@@ -827,7 +816,7 @@ async def update_payment_status(
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        if not _column_exists(c, "payroll_payments", "status"):
+        if not column_exists("payroll_payments", "status", c):
             return {"success": True, "message": "Status column is not available in payroll_payments"}
 
         c.execute("UPDATE payroll_payments SET status = %s WHERE id = %s", (data.status, data.payment_id))
@@ -47,7 +47,7 @@ from db.companies import (
     update_tariff_plan,
 )
 from db.connection import get_db_connection
-from utils.email_service import send_email
+from utils.email_service import send_bulk_emails_async
 from utils.logger import log_info
 from utils.tenant_context import platform_access
 from utils.utils import require_auth
@@ -1041,6 +1041,7 @@ async def create_platform_broadcast(
             failed_count = 0
 
             if payload.send_now:
+                emails = []
                 for company in target_companies:
                     if payload.delivery_channel != "email":
                         failed_count += 1
@@ -1049,16 +1050,16 @@ async def create_platform_broadcast(
                     if not email:
                         failed_count += 1
                         continue
-                    success = send_email(
-                        email,
-                        payload.title,
-                        f"<p>{payload.message}</p>",
-                        payload.message,
-                    )
-                    if success:
-                        sent_count += 1
-                    else:
-                        failed_count += 1
+                    emails.append({
+                        "to_email": email,
+                        "subject": payload.title,
+                        "html_body": f"<p>{payload.message}</p>",
+                        "text_body": payload.message,
+                    })
+                # Один пакет через пул SMTP-сессий вместо соединения на каждую компанию
+                results = await send_bulk_emails_async(emails)
+                sent_count = sum(1 for success in results if success)
+                failed_count += len(results) - sent_count
 
                 c.execute(
                     """
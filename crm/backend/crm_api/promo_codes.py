@@ -8,6 +8,7 @@ from typing import Optional, Set
 from datetime import datetime
 
 from db.connection import get_db_connection
+from db.schema_catalog import get_table_columns
 from utils.utils import require_auth
 from utils.logger import log_error
 from db.promo_codes import validate_promo_code
@@ -103,15 +104,6 @@ def _resolve_client_identifiers(user: dict, cursor) -> Set[str]:
     return {value for value in candidates if value}
 
 
-def _get_promo_code_columns(cursor) -> Set[str]:
-    cursor.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = 'promo_codes'
-    """)
-    return {row[0] for row in cursor.fetchall()}
-
-
 def _validate_promo_payload(promo: PromoCodeModel) -> Optional[str]:
     if promo.code.strip() == "":
         return "Code is required"
@@ -160,7 +152,7 @@ async def list_promo_codes(session_token: Optional[str] = Cookie(None)):
         conn = get_db_connection()
         c = conn.cursor()
         is_admin = user.get("role") in ["admin", "director"]
-        promo_columns = _get_promo_code_columns(c)
+        promo_columns = get_table_columns("promo_codes", c)
         has_target_scope = "target_scope" in promo_columns
         has_target_categories = "target_category_names" in promo_columns
         has_target_services = "target_service_ids" in promo_columns
@@ -256,7 +248,7 @@ async def create_new_promo(promo: PromoCodeModel, session_token: Optional[str] =
 
         conn = get_db_connection()
         c = conn.cursor()
-        promo_columns = _get_promo_code_columns(c)
+        promo_columns = get_table_columns("promo_codes", c)
         supports_targeting = all(
             column_name in promo_columns
             for column_name in ["target_scope", "target_category_names", "target_service_ids", "target_client_ids"]
@@ -331,7 +323,7 @@ async def update_promo(promo_id: int, promo: PromoCodeModel, session_token: Opti
 
         conn = get_db_connection()
         c = conn.cursor()
-        promo_columns = _get_promo_code_columns(c)
+        promo_columns = get_table_columns("promo_codes", c)
         supports_targeting = all(
             column_name in promo_columns
             for column_name in ["target_scope", "target_category_names", "target_service_ids", "target_client_ids"]
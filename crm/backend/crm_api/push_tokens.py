@@ -7,7 +7,7 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
-import httpx
+from utils.http_clients import get_http_client
 
 from db.init import get_db_connection
 from core.auth import require_auth
@@ -148,32 +148,32 @@ async def send_push_notification(
             return False
 
         # Отправить через Expo Push API
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://exp.host/--/api/v2/push/send",
-                json=messages,
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                    "Accept-Encoding": "gzip, deflate",
-                },
-            )
-
-            if response.status_code == 200:
-                result = response.json()
-                # Обработать ошибки для конкретных токенов
-                for i, ticket in enumerate(result.get("data", [])):
-                    if ticket.get("status") == "error":
-                        error_type = ticket.get("details", {}).get("error")
-                        if error_type in ["DeviceNotRegistered", "InvalidCredentials"]:
-                            # Деактивировать невалидный токен
-                            c.execute("""
-                                UPDATE user_push_tokens
-                                SET is_active = FALSE
-                                WHERE token = %s
-                            """, (tokens[i],))
-                conn.commit()
-                return True
+        client = get_http_client("https://exp.host/--/api/v2/push/send")
+        response = await client.post(
+            "https://exp.host/--/api/v2/push/send",
+            json=messages,
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+            },
+        )
+
+        if response.status_code == 200:
+            result = response.json()
+            # Обработать ошибки для конкретных токенов
+            for i, ticket in enumerate(result.get("data", [])):
+                if ticket.get("status") == "error":
+                    error_type = ticket.get("details", {}).get("error")
+                    if error_type in ["DeviceNotRegistered", "InvalidCredentials"]:
+                        # Деактивировать невалидный токен
+                        c.execute("""
+                            UPDATE user_push_tokens
+                            SET is_active = FALSE
+                            WHERE token = %s
+                        """, (tokens[i],))
+            conn.commit()
+            return True
 
         return False
 
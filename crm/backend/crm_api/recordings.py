@@ -9,10 +9,12 @@ API для управления папками и записями (аудио/
 
 from fastapi import APIRouter, Depends, Query, HTTPException, UploadFile, File, Form
 from fastapi.responses import FileResponse, StreamingResponse
-from typing import List, Optional, Dict, Any, Set
+from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from db.connection import get_db_connection
+from db.schema_catalog import get_table_columns
 from utils.utils import get_current_user
+from utils.http_clients import get_http_client
 from datetime import datetime
 import json
 import logging
@@ -89,15 +91,6 @@ def build_folder_tree(folders: List[Dict]) -> List[Dict]:
     return root_folders
 
 
-def _get_table_columns(cursor, table_name: str) -> Set[str]:
-    cursor.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = %s
-    """, (table_name,))
-    return {row[0] for row in cursor.fetchall()}
-
-
 def _get_recording_entry(cursor, source: str, recording_id: int) -> Optional[Dict[str, Any]]:
     if source == "telephony":
         cursor.execute("""
@@ -186,11 +179,11 @@ def _resolve_local_recording_path(recording: Dict[str, Any]) -> Optional[str]:
 
 
 async def _stream_remote_recording(recording_url: str):
-    async with httpx.AsyncClient(follow_redirects=True, timeout=60.0) as client:
-        async with client.stream("GET", recording_url) as response:
-            response.raise_for_status()
-            async for chunk in response.aiter_bytes():
-                yield chunk
+    client = get_http_client(recording_url)
+    async with client.stream("GET", recording_url, follow_redirects=True, timeout=60.0) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            yield chunk
 
 # ==================== FOLDERS ENDPOINTS ====================
 
@@ -361,7 +354,7 @@ async def delete_folder(folder_id: int, current_user: dict = Depends(get_current
             raise HTTPException(status_code=403, detail="Нет прав для удаления этой папки")
 
         parent_id = row[1]
-        call_logs_columns = _get_table_columns(c, "call_logs")
+        call_logs_columns = get_table_columns("call_logs", c)
 
         # Переместить все записи в родительскую папку
         if "folder_id" in call_logs_columns:
@@ -434,7 +427,7 @@ async def get_recordings(
         # Базовый запрос объединяет записи из call_logs и chat_recordings
         is_admin = current_user.get('role') in ['director', 'admin']
         user_name = current_user.get('full_name') or current_user.get('username')
-        call_logs_columns = _get_table_columns(c, "call_logs")
+        call_logs_columns = get_table_columns("call_logs", c)
         has_call_folder = "folder_id" in call_logs_columns
         has_call_custom_name = "custom_name" in call_logs_columns
         has_call_file_size = "file_size" in call_logs_columns
@@ -679,7 +672,7 @@ async def update_recording(
 
     try:
         table = "call_logs" if source == "telephony" else "chat_recordings"
-        table_columns = _get_table_columns(c, table)
+        table_columns = get_table_columns(table, c)
 
         _require_recording_access(c, source, recording_id, current_user)
 
@@ -773,7 +766,7 @@ async def archive_recording(
 
     try:
         table = "call_logs" if source == "telephony" else "chat_recordings"
-        table_columns = _get_table_columns(c, table)
+        table_columns = get_table_columns(table, c)
         if "is_archived" not in table_columns:
             return {"success": True}
 
@@ -1,6 +1,7 @@
 """
 API Endpoints для управления расписанием мастеров
 """
+from datetime import datetime
 from fastapi import APIRouter, Request, Cookie, Query, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from typing import Optional, List, Dict, Any
@@ -8,9 +9,12 @@ from pydantic import BaseModel
 
 from psycopg2.extras import RealDictCursor
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.utils import require_auth
 from utils.logger import log_error
 from services.master_schedule import MasterScheduleService
+from utils.blocking import offload_blocking
+from utils.tenant_context import platform_access, reset_tenant_context, set_tenant_context
 
 router = APIRouter(tags=["Schedule"])
 
@@ -115,6 +119,7 @@ def _collect_requested_service_ids(service_id: Optional[int], raw_service_ids: O
 
 def _resolve_total_duration_minutes(
     cursor,
+    company_id: int,
     requested_service_ids: List[int],
     duration_minutes: Optional[int],
 ) -> int:
@@ -125,8 +130,8 @@ def _resolve_total_duration_minutes(
         return 60
 
     cursor.execute(
-        "SELECT id, duration FROM services WHERE id = ANY(%s)",
-        (requested_service_ids,),
+        "SELECT id, duration FROM services WHERE company_id = %s AND id = ANY(%s)",
+        (company_id, requested_service_ids),
     )
     rows = cursor.fetchall() or []
     duration_by_id = {
@@ -144,6 +149,7 @@ def _resolve_total_duration_minutes(
 
 def _fetch_public_master_ids(
     cursor,
+    company_id: int,
     requested_service_ids: List[int],
     ordered: bool = False,
 ) -> List[int]:
@@ -155,7 +161,8 @@ def _fetch_public_master_ids(
             SELECT u.id
             FROM users u
             INNER JOIN user_services us ON us.user_id = u.id
-            WHERE u.is_active = TRUE
+            WHERE u.company_id = %s
+              AND u.is_active = TRUE
               AND u.is_service_provider = TRUE
               AND u.is_public_visible = TRUE
               AND u.deleted_at IS NULL
@@ -165,20 +172,22 @@ def _fetch_public_master_ids(
             HAVING COUNT(DISTINCT us.service_id) = %s
             {order_clause}
             """,
-            (requested_service_ids, len(requested_service_ids)),
+            (company_id, requested_service_ids, len(requested_service_ids)),
         )
     else:
         cursor.execute(
             f"""
             SELECT u.id
             FROM users u
-            WHERE u.is_active = TRUE
+            WHERE u.company_id = %s
+              AND u.is_active = TRUE
               AND u.is_service_provider = TRUE
               AND u.is_public_visible = TRUE
               AND u.deleted_at IS NULL
               AND u.role != 'director'
             {order_clause}
-            """
+            """,
+            (company_id,),
         )
 
     rows = cursor.fetchall() or []
@@ -205,19 +214,6 @@ class TimeOffCreate(BaseModel):
 # --- New Endpoints for Admin UI (User ID based) ---
 
 
-def _column_exists(cursor, table_name: str, column_name: str) -> bool:
-    cursor.execute(
-        """
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = %s
-          AND column_name = %s
-        LIMIT 1
-        """,
-        (table_name, column_name),
-    )
-    return bool(cursor.fetchone())
-
 # ✅ ИСПОЛЬЗОВАТЬ MasterScheduleService для получения расписания
 @router.get("/schedule/user/{user_id}", response_model=List[WorkScheduleItem])
 async def get_user_schedule(user_id: int):
@@ -303,7 +299,7 @@ async def get_user_time_off(user_id: int):
     try:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        has_type_column = _column_exists(cursor, "user_time_off", "type")
+        has_type_column = column_exists("user_time_off", "type", cursor)
         if has_type_column:
             cursor.execute(
                 """
@@ -336,7 +332,7 @@ async def add_user_time_off(user_id: int, data: TimeOffCreate):
     try:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        has_type_column = _column_exists(cursor, "user_time_off", "type")
+        has_type_column = column_exists("user_time_off", "type", cursor)
         if has_type_column:
             cursor.execute(
                 """
@@ -376,7 +372,7 @@ async def update_time_off(id: int, data: TimeOffCreate):
     conn = get_db_connection()
     try:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        has_type_column = _column_exists(cursor, "user_time_off", "type")
+        has_type_column = column_exists("user_time_off", "type", cursor)
         if has_type_column:
             cursor.execute(
                 """
@@ -583,6 +579,133 @@ async def remove_time_off_api(
         log_error(f"Error removing time off: {e}", "schedule")
         return JSONResponse({"error": str(e)}, status_code=500)
 
+def _resolve_public_company_id(company: str) -> Optional[int]:
+    """Компания публичного календаря по slug или id; None — не найдена или неактивна."""
+    from db.companies import get_company_by_id, get_company_by_slug
+
+    value = str(company or "").strip()
+    if not value:
+        return None
+    with platform_access():
+        record = get_company_by_id(int(value)) if value.isdigit() else get_company_by_slug(value)
+    if not record or str(record.get("status") or "active") != "active":
+        return None
+    return int(record["id"])
+
+
+def _resolve_calendar_request(
+    company_id: int,
+    master_id: Optional[int],
+    service_id: Optional[int],
+    service_ids: Optional[str],
+    duration: Optional[int],
+) -> tuple[List[int], int]:
+    """Мастера (публичные, оказывающие все запрошенные услуги) и суммарная длительность."""
+    requested_service_ids = _collect_requested_service_ids(service_id, service_ids)
+
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        total_duration = _resolve_total_duration_minutes(cursor, company_id, requested_service_ids, duration)
+        master_ids = _fetch_public_master_ids(cursor, company_id, requested_service_ids, ordered=True)
+    finally:
+        conn.close()
+
+    if master_id is not None:
+        master_ids = [mid for mid in master_ids if mid == master_id]
+    return master_ids, total_duration
+
+
+@router.get("/schedule/available-dates")
+@offload_blocking
+def get_available_dates_api(
+    company: str = Query(..., min_length=1, description="slug или id компании"),
+    year: int = Query(..., ge=2000, le=2100),
+    month: int = Query(..., ge=1, le=12),
+    master_id: Optional[int] = Query(None),
+    service_id: Optional[int] = Query(None),
+    service_ids: Optional[str] = Query(None),
+    duration: Optional[int] = Query(None, ge=1),
+    step: Optional[int] = Query(None, ge=5, le=240),
+):
+    """Даты месяца, в которые есть хотя бы одно окно (у мастера или у любого мастера)"""
+    company_id = _resolve_public_company_id(company)
+    if company_id is None:
+        return JSONResponse({"error": "Company not found"}, status_code=404)
+
+    tenant_tokens = set_tenant_context(company_id=company_id, bypass=False)
+    try:
+        master_ids, total_duration = _resolve_calendar_request(company_id, master_id, service_id, service_ids, duration)
+        schedule_service = MasterScheduleService()
+        masters = schedule_service.get_master_records(master_ids)
+        dates = schedule_service.get_available_dates(
+            None, year, month, duration_minutes=total_duration, master_records=masters, slot_step_minutes=step,
+        )
+        return {
+            "year": year,
+            "month": month,
+            "duration": total_duration,
+            "available_dates": dates,
+        }
+    except Exception as e:
+        log_error(f"Error getting available dates: {e}", "schedule")
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        reset_tenant_context(tenant_tokens)
+
+
+@router.get("/schedule/available-slots")
+@offload_blocking
+def get_available_slots_api(
+    company: str = Query(..., min_length=1, description="slug или id компании"),
+    date: str = Query(...),
+    master_id: Optional[int] = Query(None),
+    service_id: Optional[int] = Query(None),
+    service_ids: Optional[str] = Query(None),
+    duration: Optional[int] = Query(None, ge=1),
+    step: Optional[int] = Query(None, ge=5, le=240),
+):
+    """Свободные слоты на день по мастерам (один AvailabilityTimeline на всех)"""
+    try:
+        date_obj = datetime.strptime(date, "%Y-%m-%d").date()
+    except ValueError:
+        return JSONResponse({"error": "Invalid date"}, status_code=400)
+
+    company_id = _resolve_public_company_id(company)
+    if company_id is None:
+        return JSONResponse({"error": "Company not found"}, status_code=404)
+
+    tenant_tokens = set_tenant_context(company_id=company_id, bypass=False)
+    try:
+        master_ids, total_duration = _resolve_calendar_request(company_id, master_id, service_id, service_ids, duration)
+        schedule_service = MasterScheduleService()
+        masters = schedule_service.get_master_records(master_ids)
+        timeline = schedule_service.load_availability(masters, date_obj, date_obj)
+
+        masters_by_id = {int(record["id"]): record for record in masters}
+        result = []
+        for mid in master_ids:
+            record = masters_by_id.get(mid)
+            if not record:
+                continue
+            slots = timeline.get_slots(mid, date, total_duration, return_metadata=True, slot_step_minutes=step)
+            result.append({
+                "master_id": mid,
+                "master_name": record.get("full_name") or record.get("username"),
+                "slots": _normalize_slots(slots),
+            })
+
+        return {
+            "date": date,
+            "duration": total_duration,
+            "masters": result,
+        }
+    except Exception as e:
+        log_error(f"Error getting available slots: {e}", "schedule")
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        reset_tenant_context(tenant_tokens)
+
 @router.get("/salon-settings/working-hours")
 async def get_salon_working_hours():
     """Получить рабочие часы салона из настроек"""
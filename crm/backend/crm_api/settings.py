@@ -18,6 +18,7 @@ from core.config import (
     DEFAULT_REPORT_TIME,
 )
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.logger import log_info, log_error
 from db.settings import (
     get_bot_settings,
@@ -268,12 +269,9 @@ async def reload_bot():
     Перезагрузить бота (очистить кеш)
     """
     try:
-        # Очищаем кеш бота
-        from bot import get_bot
-        bot = get_bot()
-
-        # Перезагружаем настройки из БД
-        bot.reload_settings()
+        # Сбрасываем контекст бота компании во всех воркерах (пересоберётся при следующем сообщении)
+        from bot.contexts import invalidate_bot_context
+        invalidate_bot_context()
 
         log_info("Bot settings reloaded successfully", "settings")
         return {"success": True, "message": "Bot reloaded"}
@@ -772,20 +770,6 @@ class ReferralCampaignCreate(BaseModel):
     end_date: Optional[str] = None
 
 
-def _table_has_column(cursor, table_name: str, column_name: str) -> bool:
-    cursor.execute(
-        """
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = %s
-          AND column_name = %s
-        LIMIT 1
-        """,
-        (table_name, column_name),
-    )
-    return bool(cursor.fetchone())
-
-
 def _build_referral_link_by_token(token: str) -> str:
     normalized_token = str(token or "").strip().lower()
     if not normalized_token:
@@ -937,7 +921,7 @@ async def get_referral_campaigns(session_token: Optional[str] = Cookie(None)):
         conn = get_db_connection()
         c = conn.cursor()
 
-        has_campaign_share_token = _table_has_column(c, "referral_campaigns", "share_token")
+        has_campaign_share_token = column_exists("referral_campaigns", "share_token", c)
         share_select = ", share_token" if has_campaign_share_token else ", NULL AS share_token"
 
         c.execute(f"""
@@ -998,8 +982,8 @@ async def get_referral_campaign_analytics(
         start_date, end_date = _parse_referral_analytics_range(period, date_from, date_to)
         conn = get_db_connection()
         c = conn.cursor()
-        has_campaign_share_token = _table_has_column(c, "referral_campaigns", "share_token")
-        has_user_share_token = _table_has_column(c, "referral_campaign_users", "share_token")
+        has_campaign_share_token = column_exists("referral_campaigns", "share_token", c)
+        has_user_share_token = column_exists("referral_campaign_users", "share_token", c)
 
         if has_campaign_share_token:
             c.execute(
@@ -1342,8 +1326,8 @@ async def create_referral_campaign(campaign: ReferralCampaignCreate, session_tok
         
         campaign_id = c.fetchone()[0]
 
-        has_campaign_share_token = _table_has_column(c, "referral_campaigns", "share_token")
-        has_user_share_token = _table_has_column(c, "referral_campaign_users", "share_token")
+        has_campaign_share_token = column_exists("referral_campaigns", "share_token", c)
+        has_user_share_token = column_exists("referral_campaign_users", "share_token", c)
         if has_campaign_share_token:
             _ensure_campaign_share_token(c, int(campaign_id), None)
 
@@ -1390,8 +1374,8 @@ async def update_referral_campaign(campaign_id: int, campaign: ReferralCampaignC
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        has_campaign_share_token = _table_has_column(c, "referral_campaigns", "share_token")
-        has_user_share_token = _table_has_column(c, "referral_campaign_users", "share_token")
+        has_campaign_share_token = column_exists("referral_campaigns", "share_token", c)
+        has_user_share_token = column_exists("referral_campaign_users", "share_token", c)
         
         criteria_json = json.dumps(campaign.target_criteria) if campaign.target_criteria else None
         
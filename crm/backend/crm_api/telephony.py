@@ -4,7 +4,9 @@ from typing import List, Optional, Dict, Any, Set
 from pydantic import BaseModel
 from db.companies import QuotaExceededError, ensure_company_storage, get_current_company, update_company
 from db.connection import get_db_connection
+from db.schema_catalog import get_table_columns
 from utils.utils import get_current_user
+from utils.blocking import OffloadedRoute
 from datetime import datetime, timedelta
 import json
 import logging
@@ -13,7 +15,7 @@ import shutil
 import asyncio
 import math
 
-router = APIRouter()
+router = APIRouter(route_class=OffloadedRoute)
 logger = logging.getLogger(__name__)
 
 # Директория для хранения записей звонков
@@ -83,15 +85,6 @@ def _has_telephony_access(current_user: dict) -> bool:
     return current_user.get("role") in ALLOWED_TELEPHONY_ROLES
 
 
-def _get_table_columns(cursor, table_name: str) -> Set[str]:
-    cursor.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = %s
-    """, (table_name,))
-    return {row[0] for row in cursor.fetchall()}
-
-
 def _normalize_employee_name(value: Optional[str]) -> str:
     normalized_value = str(value or "").strip()
     if normalized_value:
@@ -308,7 +301,7 @@ def _to_iso_date(ts_value: datetime) -> str:
     return ts_value.date().isoformat()
 
 @router.get("/telephony/settings")
-async def get_telephony_settings(current_user: dict = Depends(get_current_user)):
+def get_telephony_settings(current_user: dict = Depends(get_current_user)):
     # 🔒 Только director, admin, sales могут видеть настройки телефонии
     if not _has_telephony_access(current_user):
         raise HTTPException(status_code=403, detail="Access denied")
@@ -326,7 +319,7 @@ async def get_telephony_settings(current_user: dict = Depends(get_current_user))
         conn.close()
 
 @router.post("/telephony/settings")
-async def save_telephony_settings(settings: TelephonySettings, current_user: dict = Depends(get_current_user)):
+def save_telephony_settings(settings: TelephonySettings, current_user: dict = Depends(get_current_user)):
     if not _has_telephony_access(current_user):
         raise HTTPException(status_code=403, detail="Access denied")
 
@@ -365,7 +358,7 @@ async def test_telephony_integration(settings: TelephonySettings, current_user:
     return {"success": True, "message": f"Соединение с {settings.provider} успешно проверено"}
 
 @router.get("/telephony/calls", response_model=List[CallLogResponse])
-async def get_calls(
+def get_calls(
     limit: int = 50,
     offset: int = 0,
     search: Optional[str] = None,
@@ -491,7 +484,7 @@ async def get_calls(
         conn.close()
 
 @router.get("/telephony/stats")
-async def get_telephony_stats(
+def get_telephony_stats(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
@@ -536,7 +529,7 @@ async def get_telephony_stats(
         conn.close()
 
 @router.get("/telephony/analytics")
-async def get_telephony_analytics(
+def get_telephony_analytics(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     manager_name: Optional[str] = None,
@@ -617,7 +610,7 @@ async def get_telephony_analytics(
 
 
 @router.get("/telephony/performance")
-async def get_telephony_performance(
+def get_telephony_performance(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     status: Optional[str] = None,
@@ -1110,14 +1103,14 @@ async def get_telephony_performance(
 
 
 @router.post("/telephony/calls")
-async def create_call(call: CallLogCreate, current_user: dict = Depends(get_current_user)):
+def create_call(call: CallLogCreate, current_user: dict = Depends(get_current_user)):
     if not _has_telephony_access(current_user):
         raise HTTPException(status_code=403, detail="Access denied")
 
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        call_logs_columns = _get_table_columns(c, "call_logs")
+        call_logs_columns = get_table_columns("call_logs", c)
         has_folder_id = "folder_id" in call_logs_columns
         has_custom_name = "custom_name" in call_logs_columns
         allowed_directions = {"inbound", "outbound"}
@@ -1213,7 +1206,7 @@ async def create_call(call: CallLogCreate, current_user: dict = Depends(get_curr
         conn.close()
 
 @router.post("/telephony/upload-recording/{call_id}")
-async def upload_recording(
+def upload_recording(
     call_id: int,
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
@@ -1250,7 +1243,7 @@ async def upload_recording(
         conn = get_db_connection()
         c = conn.cursor()
         try:
-            call_logs_columns = _get_table_columns(c, "call_logs")
+            call_logs_columns = get_table_columns("call_logs", c)
             update_parts = ["recording_file = %s"]
             update_params = [filename]
 
@@ -1291,7 +1284,7 @@ async def upload_recording(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/telephony/calls/{call_id}")
-async def update_call(call_id: int, update: CallLogUpdate, current_user: dict = Depends(get_current_user)):
+def update_call(call_id: int, update: CallLogUpdate, current_user: dict = Depends(get_current_user)):
     if not _has_telephony_access(current_user):
         raise HTTPException(status_code=403, detail="Access denied")
 
@@ -1355,7 +1348,7 @@ async def update_call(call_id: int, update: CallLogUpdate, current_user: dict =
         conn.close()
 
 @router.delete("/telephony/calls/{call_id}")
-async def delete_call(call_id: int, current_user: dict = Depends(get_current_user)):
+def delete_call(call_id: int, current_user: dict = Depends(get_current_user)):
     if not _has_telephony_access(current_user):
         raise HTTPException(status_code=403, detail="Access denied")
 
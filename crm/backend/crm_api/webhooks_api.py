@@ -7,12 +7,14 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
-import httpx
+from utils.http_clients import get_http_client
 import hmac
 import hashlib
 import json
 
 from db.connection import get_db_connection
+from services.webhook_dispatcher import publish_webhook_event
+from utils.blocking import run_blocking
 from utils.utils import require_auth
 from utils.logger import log_error, log_info
 
@@ -155,7 +157,8 @@ async def toggle_webhook(
     c = conn.cursor()
     try:
         c.execute("""
-            UPDATE webhooks SET is_active = NOT is_active
+            UPDATE webhooks SET is_active = NOT is_active,
+              fail_count = CASE WHEN is_active THEN fail_count ELSE 0 END
             WHERE id=%s AND company_id=%s RETURNING is_active
         """, (wh_id, company_id))
         row = c.fetchone()
@@ -201,8 +204,8 @@ async def test_webhook(
         import asyncio
         start = datetime.now()
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                resp = await client.post(wh["url"], content=payload_str, headers=headers)
+            client = get_http_client(wh["url"])
+            resp = await client.post(wh["url"], content=payload_str, headers=headers, timeout=10)
             duration = int((datetime.now() - start).total_seconds() * 1000)
             status_code = resp.status_code
             response_text = resp.text[:500]
@@ -264,56 +267,11 @@ async def webhook_logs(
 # ─── Внутренняя функция отправки ──────────────────────────────────────────────
 
 async def fire_webhook(company_id: int, event: str, data: dict):
-    """Вызывается из других модулей при событиях"""
-    conn = get_db_connection()
-    c = conn.cursor()
+    """
+    Событие вне бизнес-транзакции: кладётся в outbox, доставляет диспетчер.
+    Внутри транзакции используйте enqueue_webhook_event(cursor, ...) до commit.
+    """
     try:
-        c.execute("""
-            SELECT id, url, secret FROM webhooks
-            WHERE company_id=%s AND is_active=TRUE AND %s = ANY(events)
-        """, (company_id, event))
-        webhooks = c.fetchall()
-        conn.close()
-
-        if not webhooks:
-            return
-
-        payload = {"event": event, "timestamp": datetime.now().isoformat(), "data": data}
-        payload_str = json.dumps(payload, default=str)
-
-        async with httpx.AsyncClient(timeout=5) as client:
-            for wh_id, url, secret in webhooks:
-                headers = {"Content-Type": "application/json", "X-CRM-Event": event}
-                if secret:
-                    sig = hmac.new(secret.encode(), payload_str.encode(), hashlib.sha256).hexdigest()
-                    headers["X-CRM-Signature"] = f"sha256={sig}"
-                try:
-                    start = datetime.now()
-                    resp = await client.post(url, content=payload_str, headers=headers)
-                    duration = int((datetime.now() - start).total_seconds() * 1000)
-                    # Записываем лог (в фоне)
-                    _log_webhook(wh_id, event, payload, resp.status_code, resp.text[:500], duration)
-                except Exception as e:
-                    log_error(f"Webhook {wh_id} fire error: {e}", "webhooks")
+        await run_blocking(publish_webhook_event, company_id, event, data)
     except Exception as e:
         log_error(f"fire_webhook error: {e}", "webhooks")
-
-
-def _log_webhook(wh_id: int, event: str, payload: dict, status: int, response: str, duration: int):
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO webhook_logs (webhook_id, event, payload, status_code, response, duration_ms)
-            VALUES (%s,%s,%s,%s,%s,%s)
-        """, (wh_id, event, json.dumps(payload, default=str), status, response, duration))
-        ok = 200 <= status < 300
-        c.execute("""
-            UPDATE webhooks SET last_triggered_at=NOW(), last_status_code=%s,
-              fail_count = CASE WHEN %s THEN 0 ELSE fail_count+1 END
-            WHERE id=%s
-        """, (status, ok, wh_id))
-        conn.commit()
-        conn.close()
-    except:
-        pass
@@ -9,6 +9,8 @@ import math
 import random
 
 from db.connection import get_db_connection
+from db.analytics_rollups import booking_facts_sql, client_facts_sql
+from db.schema_catalog import get_table_columns
 from utils.datetime_utils import get_current_time
 import psycopg2
 
@@ -53,71 +55,70 @@ def get_stats(comparison_period: str = "7days"):
     period_start = (current_date - timedelta(days=days)).isoformat()
     previous_period_start = (current_date - timedelta(days=days * 2)).isoformat()
     previous_period_end = period_start
-    
-    # === ТЕКУЩИЙ ПЕРИОД ===
-    # Count unique clients who made bookings (not all clients in database)
-    c.execute("SELECT COUNT(DISTINCT instagram_id) FROM bookings WHERE instagram_id IS NOT NULL")
-    total_clients = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM bookings")
-    total_bookings = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM bookings WHERE status='completed'")
-    completed_bookings = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM bookings WHERE status='pending'")
-    pending_bookings = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM chat_history WHERE sender='client'")
-    total_client_messages = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM chat_history WHERE sender='bot'")
-    total_bot_messages = c.fetchone()[0]
-    
-    try:
-        c.execute("SELECT SUM(revenue) FROM bookings WHERE status='completed'")
-        total_revenue = c.fetchone()[0] or 0
-    except psycopg2.OperationalError:
-        total_revenue = 0
-    
-    try:
-        # New clients: unique clients who made their first booking in the current period
-        c.execute("""
-            SELECT COUNT(DISTINCT instagram_id)
-            FROM bookings
-            WHERE created_at >= %s
-            AND instagram_id NOT IN (
-                SELECT DISTINCT instagram_id
-                FROM bookings
-                WHERE created_at < %s AND instagram_id IS NOT NULL
-            )
-        """, (period_start, period_start))
-        new_clients = c.fetchone()[0]
 
+    # Счётчики записей, выручки, сообщений и новых клиентов — из дневных роллапов
+    # (db/analytics_rollups.py), периоды выровнены по дням
+    today = current_date.date()
+    period_start_day = today - timedelta(days=days)
+    previous_period_start_day = today - timedelta(days=days * 2)
+
+    facts_sql, facts_params = booking_facts_sql("created")
+    c.execute(f"""
+        SELECT
+            COALESCE(SUM(bookings), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE status = 'completed'), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE status = 'pending'), 0),
+            COALESCE(SUM(revenue) FILTER (WHERE status = 'completed'), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE day >= %s), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE day >= %s AND status = 'completed'), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE day >= %s AND status = 'pending'), 0),
+            COALESCE(SUM(revenue) FILTER (WHERE day >= %s AND status = 'completed'), 0),
+            COALESCE(SUM(paid_bookings) FILTER (WHERE day >= %s AND status = 'completed'), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE day >= %s AND day < %s), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE day >= %s AND day < %s AND status = 'completed'), 0),
+            COALESCE(SUM(bookings) FILTER (WHERE day >= %s AND day < %s AND status = 'pending'), 0),
+            COALESCE(SUM(revenue) FILTER (WHERE day >= %s AND day < %s AND status = 'completed'), 0),
+            COALESCE(SUM(paid_bookings) FILTER (WHERE day >= %s AND day < %s AND status = 'completed'), 0)
+        FROM ({facts_sql}) facts
+    """, [period_start_day] * 5 + [previous_period_start_day, period_start_day] * 5 + facts_params)
+    # SUM по BIGINT возвращает NUMERIC (Decimal) — приводим к int/float
+    (
+        total_bookings, completed_bookings, pending_bookings, total_revenue,
+        current_bookings, current_completed, current_pending, current_revenue, current_paid,
+        prev_bookings, prev_completed, prev_pending, prev_revenue, prev_paid,
+    ) = [float(value) if index in (3, 7, 12) else int(value) for index, value in enumerate(c.fetchone())]
+    avg_booking_value = current_revenue / current_paid if current_paid else 0
+    prev_avg_booking_value = prev_revenue / prev_paid if prev_paid else 0
+
+    client_sql, client_params = client_facts_sql()
+    c.execute(f"""
+        SELECT
+            COALESCE(SUM(client_messages), 0),
+            COALESCE(SUM(bot_messages), 0),
+            COALESCE(SUM(new_clients), 0),
+            COALESCE(SUM(new_clients) FILTER (WHERE day < %s), 0),
+            COALESCE(SUM(new_clients) FILTER (WHERE day >= %s), 0),
+            COALESCE(SUM(new_clients) FILTER (WHERE day >= %s AND day < %s), 0)
+        FROM ({client_sql}) facts
+    """, [period_start_day, period_start_day, previous_period_start_day, period_start_day] + client_params)
+    (
+        total_client_messages, total_bot_messages, total_clients,
+        prev_total_clients, current_new_clients, prev_new_clients,
+    ) = [int(value) for value in c.fetchone()]
+    new_clients = current_new_clients
+
+    # === Снимки по клиентам (DISTINCT по периоду и статусы клиентов не суммируются по дням) ===
+    try:
         # Leads, customers, VIP from clients table (for those who made bookings)
         c.execute("""
-            SELECT COUNT(DISTINCT c.instagram_id)
-            FROM clients c
-            INNER JOIN bookings b ON c.instagram_id = b.instagram_id
-            WHERE c.status='lead'
-        """)
-        leads = c.fetchone()[0]
-
-        c.execute("""
-            SELECT COUNT(DISTINCT c.instagram_id)
-            FROM clients c
-            INNER JOIN bookings b ON c.instagram_id = b.instagram_id
-            WHERE c.status='customer'
-        """)
-        customers = c.fetchone()[0]
-
-        c.execute("""
-            SELECT COUNT(DISTINCT c.instagram_id)
+            SELECT
+                COUNT(DISTINCT c.instagram_id) FILTER (WHERE c.status = 'lead'),
+                COUNT(DISTINCT c.instagram_id) FILTER (WHERE c.status = 'customer'),
+                COUNT(DISTINCT c.instagram_id) FILTER (WHERE c.status = 'vip')
             FROM clients c
             INNER JOIN bookings b ON c.instagram_id = b.instagram_id
-            WHERE c.status='vip'
         """)
-        vip_clients = c.fetchone()[0]
+        leads, customers, vip_clients = c.fetchone()
 
         # Active clients: made a booking in the last 30 days
         active_threshold = (get_current_time() - timedelta(days=30)).isoformat()
@@ -125,25 +126,10 @@ def get_stats(comparison_period: str = "7days"):
         active_clients = c.fetchone()[0]
 
     except psycopg2.OperationalError:
-        new_clients = total_clients
         leads = 0
         customers = 0
         vip_clients = 0
         active_clients = 0
-    
-    # === ПРЕДЫДУЩИЙ ПЕРИОД (для сравнения) ===
-    # Prev new clients: unique clients who made their first booking in previous period
-    c.execute("""
-        SELECT COUNT(DISTINCT instagram_id)
-        FROM bookings
-        WHERE created_at >= %s AND created_at < %s
-        AND instagram_id NOT IN (
-            SELECT DISTINCT instagram_id
-            FROM bookings
-            WHERE created_at < %s AND instagram_id IS NOT NULL
-        )
-    """, (previous_period_start, previous_period_end, previous_period_start))
-    prev_new_clients = c.fetchone()[0]
 
     # Prev VIP clients who made bookings
     c.execute("""
@@ -154,67 +140,12 @@ def get_stats(comparison_period: str = "7days"):
     """, (previous_period_start, previous_period_end))
     prev_vip_clients = c.fetchone()[0]
 
-    # Previous total clients (unique clients who made bookings before current period)
-    c.execute("SELECT COUNT(DISTINCT instagram_id) FROM bookings WHERE created_at < %s AND instagram_id IS NOT NULL", (period_start,))
-    prev_total_clients = c.fetchone()[0]
-
     # Prev active clients (bookings in previous window)
     prev_active_threshold_start = (get_current_time() - timedelta(days=60)).isoformat()
     prev_active_threshold_end = (get_current_time() - timedelta(days=30)).isoformat()
     c.execute("SELECT COUNT(DISTINCT instagram_id) FROM bookings WHERE created_at >= %s AND created_at < %s",
               (prev_active_threshold_start, prev_active_threshold_end))
     prev_active_clients = c.fetchone()[0]
-    
-    c.execute("""
-        SELECT COUNT(*) FROM bookings 
-        WHERE created_at >= %s AND created_at < %s
-    """, (previous_period_start, previous_period_end))
-    prev_bookings = c.fetchone()[0]
-    
-    c.execute("""
-        SELECT COUNT(*) FROM bookings 
-        WHERE status='completed' AND created_at >= %s AND created_at < %s
-    """, (previous_period_start, previous_period_end))
-    prev_completed = c.fetchone()[0]
-    
-    c.execute("""
-        SELECT COUNT(*) FROM bookings
-        WHERE status='pending'
-        AND created_at >= %s AND created_at < %s
-    """, (previous_period_start, previous_period_end))
-    prev_pending = c.fetchone()[0]
-    
-    try:
-        c.execute("""
-            SELECT SUM(revenue) FROM bookings
-            WHERE status='completed' AND created_at >= %s AND created_at < %s
-        """, (previous_period_start, previous_period_end))
-        prev_revenue = c.fetchone()[0] or 0
-
-        # Average booking value for previous period
-        c.execute("""
-            SELECT COALESCE(AVG(revenue), 0)
-            FROM bookings
-            WHERE status='completed' AND created_at >= %s AND created_at < %s AND revenue > 0
-        """, (previous_period_start, previous_period_end))
-        prev_avg_booking_value = c.fetchone()[0]
-    except psycopg2.OperationalError:
-        prev_revenue = 0
-        prev_avg_booking_value = 0
-    
-    # === ТЕКУЩИЙ ПЕРИОД (новые данные) ===
-    # Current new clients: unique clients who made their first booking in current period
-    c.execute("""
-        SELECT COUNT(DISTINCT instagram_id)
-        FROM bookings
-        WHERE created_at >= %s
-        AND instagram_id NOT IN (
-            SELECT DISTINCT instagram_id
-            FROM bookings
-            WHERE created_at < %s AND instagram_id IS NOT NULL
-        )
-    """, (period_start, period_start))
-    current_new_clients = c.fetchone()[0]
 
     # Current VIP clients who made bookings in current period
     c.execute("""
@@ -230,43 +161,7 @@ def get_stats(comparison_period: str = "7days"):
     # For growth, we compare "clients active in this period" vs "clients active in prev period".
     c.execute("SELECT COUNT(DISTINCT instagram_id) FROM bookings WHERE created_at >= %s", (period_start,))
     current_active_clients_growth = c.fetchone()[0]
-    
-    c.execute("""
-        SELECT COUNT(*) FROM bookings 
-        WHERE created_at >= %s
-    """, (period_start,))
-    current_bookings = c.fetchone()[0]
-    
-    c.execute("""
-        SELECT COUNT(*) FROM bookings 
-        WHERE status='completed' AND created_at >= %s
-    """, (period_start,))
-    current_completed = c.fetchone()[0]
-    
-    c.execute("""
-        SELECT COUNT(*) FROM bookings
-        WHERE status='pending' AND created_at >= %s
-    """, (period_start,))
-    current_pending = c.fetchone()[0]
-    
-    try:
-        c.execute("""
-            SELECT SUM(revenue) FROM bookings
-            WHERE status='completed' AND created_at >= %s
-        """, (period_start,))
-        current_revenue = c.fetchone()[0] or 0
 
-        # Average booking value for current period
-        c.execute("""
-            SELECT COALESCE(AVG(revenue), 0)
-            FROM bookings
-            WHERE status='completed' AND created_at >= %s AND revenue > 0
-        """, (period_start,))
-        avg_booking_value = c.fetchone()[0]
-    except psycopg2.OperationalError:
-        current_revenue = 0
-        avg_booking_value = 0
-    
     conn.close()
     
     # Функция для расчета роста
@@ -379,7 +274,6 @@ def get_analytics_data(days=30, date_from=None, date_to=None, service_name=None,
     """Получить данные для аналитики с периодом"""
     conn = get_db_connection()
     c = conn.cursor()
-    table_columns_cache: Dict[str, Set[str]] = {}
 
     def _extract_section_name(url_value: str) -> str:
         normalized_url = str(url_value or "").strip().lower()
@@ -418,18 +312,6 @@ def get_analytics_data(days=30, date_from=None, date_to=None, service_name=None,
             return False
         return "booking" in normalized_url
 
-    def _get_table_columns(table_name: str) -> Set[str]:
-        if table_name in table_columns_cache:
-            return table_columns_cache[table_name]
-        c.execute("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = %s
-        """, (table_name,))
-        columns = {row[0] for row in c.fetchall()}
-        table_columns_cache[table_name] = columns
-        return columns
-
     def _cramers_v_from_contingency(rows: list) -> Dict[str, float]:
         if not rows:
             return {"chi_square": 0.0, "cramers_v": 0.0}
@@ -486,7 +368,7 @@ def get_analytics_data(days=30, date_from=None, date_to=None, service_name=None,
         variance = sum((value - mean_value) ** 2 for value in values) / float(values_count - 1)
         return math.sqrt(max(variance, 0.0))
 
-    clients_columns = _get_table_columns("clients")
+    clients_columns = get_table_columns("clients", c)
     has_client_country = "country" in clients_columns
     has_client_city = "city" in clients_columns
     if has_client_country and has_client_city:
@@ -879,69 +761,70 @@ def get_analytics_data(days=30, date_from=None, date_to=None, service_name=None,
 
         booking_filters_sql, booking_filters_params = _build_booking_filters("b")
 
+        # Базовые разрезы записей — из дневных роллапов (db/analytics_rollups.py);
+        # фильтр по товару требует join с product_movements, поэтому только по сырым данным
+        if normalized_product_name == "":
+            facts_sql, facts_params = booking_facts_sql("created", start_date, end_date)
+            if normalized_service_name != "":
+                facts_sql = f"""SELECT * FROM ({facts_sql}) service_facts
+                                WHERE COALESCE(NULLIF(TRIM(service_name), ''), 'Unknown') = %s"""
+                facts_params = facts_params + [normalized_service_name]
+            booking_slices_sql = f"({facts_sql}) b"
+            booking_slices_params = facts_params
+            count_sql, revenue_sql, date_sql, service_sql, status_sql, hour_sql, weekday_sql = (
+                "SUM(b.bookings)::INTEGER", "SUM(b.revenue)", "b.day",
+                "NULLIF(b.service_name, '')", "NULLIF(b.status, '')", "b.hour", "b.weekday",
+            )
+        else:
+            booking_slices_sql = f"bookings b WHERE {booking_filters_sql}"
+            booking_slices_params = booking_filters_params
+            count_sql, revenue_sql, date_sql, service_sql, status_sql, hour_sql, weekday_sql = (
+                "COUNT(*)", "SUM(b.revenue)", "DATE(b.created_at)", "b.service_name", "b.status",
+                "EXTRACT(HOUR FROM b.datetime::TIMESTAMP)", "EXTRACT(ISODOW FROM b.datetime::TIMESTAMP)",
+            )
+
         # Записи по дням
-        c.execute(f"""SELECT DATE(b.created_at) as date, COUNT(*) as count
-                     FROM bookings b
-                     WHERE {booking_filters_sql}
-                     GROUP BY DATE(b.created_at)
-                     ORDER BY date""", booking_filters_params)
+        c.execute(f"""SELECT {date_sql} as date, {count_sql} as count
+                     FROM {booking_slices_sql}
+                     GROUP BY 1
+                     ORDER BY date""", booking_slices_params)
         bookings_by_day = c.fetchall()
         if not bookings_by_day:
             bookings_by_day = [(get_current_time().strftime('%Y-%m-%d'), 0)]
 
         # Статистика по услугам
-        c.execute(f"""SELECT b.service_name, COUNT(*) as count, SUM(b.revenue) as revenue
-                     FROM bookings b
-                     WHERE {booking_filters_sql}
-                     GROUP BY b.service_name
-                     ORDER BY count DESC""", booking_filters_params)
+        c.execute(f"""SELECT {service_sql} as service_name, {count_sql} as count, {revenue_sql} as revenue
+                     FROM {booking_slices_sql}
+                     GROUP BY 1
+                     ORDER BY count DESC""", booking_slices_params)
         services_stats = c.fetchall()
         if not services_stats:
             services_stats = [("Нет данных", 0, 0)]
 
         # Статистика по статусам
-        c.execute(f"""SELECT b.status, COUNT(*) as count
-                     FROM bookings b
-                     WHERE {booking_filters_sql}
-                     GROUP BY b.status""", booking_filters_params)
+        c.execute(f"""SELECT {status_sql} as status, {count_sql} as count
+                     FROM {booking_slices_sql}
+                     GROUP BY 1""", booking_slices_params)
         status_stats = c.fetchall()
         if not status_stats:
             status_stats = [("pending", 0)]
 
-        # Среднее время ответа бота
-        c.execute("""
-            WITH client_messages AS (
-                SELECT
-                    id,
-                    instagram_id,
-                    timestamp,
-                    LEAD(timestamp) OVER (PARTITION BY instagram_id ORDER BY timestamp) as next_timestamp,
-                    LEAD(sender) OVER (PARTITION BY instagram_id ORDER BY timestamp) as next_sender
-                FROM chat_history
-                WHERE sender = 'client'
-                AND timestamp >= %s
-                AND timestamp <= %s
-            )
-            SELECT
-                AVG(
-                    EXTRACT(EPOCH FROM (next_timestamp::TIMESTAMP - timestamp::TIMESTAMP)) / 60
-                ) as avg_minutes
-            FROM client_messages
-            WHERE next_sender = 'bot'
-            AND next_timestamp IS NOT NULL
-        """, (start_date, end_date))
+        # Среднее время ответа бота (сообщение бота сразу после сообщения клиента), минуты
+        client_sql, client_params = client_facts_sql(start_date, end_date)
+        c.execute(f"""
+            SELECT SUM(response_seconds) / NULLIF(SUM(responses), 0) / 60
+            FROM ({client_sql}) facts
+        """, client_params)
         avg_response_result = c.fetchone()
         avg_response = avg_response_result[0] if avg_response_result and avg_response_result[0] else 0
 
         # Записи по часу суток (когда чаще всего записываются)
         c.execute(f"""
-            SELECT EXTRACT(HOUR FROM b.datetime::TIMESTAMP) as hour_value, COUNT(*) as count_value
-            FROM bookings b
-            WHERE b.datetime IS NOT NULL
-              AND {booking_filters_sql}
-            GROUP BY EXTRACT(HOUR FROM b.datetime::TIMESTAMP)
+            SELECT {hour_sql} as hour_value, {count_sql} as count_value
+            FROM {booking_slices_sql}
+            GROUP BY 1
             ORDER BY hour_value
-        """, booking_filters_params)
+        """, booking_slices_params)
         bookings_hour_rows = c.fetchall()
         bookings_by_hour_map = {int(row[0]): int(row[1]) for row in bookings_hour_rows}
         bookings_by_hour = [
@@ -951,13 +834,11 @@ def get_analytics_data(days=30, date_from=None, date_to=None, service_name=None,
 
         # Записи по дням недели
         c.execute(f"""
-            SELECT EXTRACT(ISODOW FROM b.datetime::TIMESTAMP) as weekday_value, COUNT(*) as count_value
-            FROM bookings b
-            WHERE b.datetime IS NOT NULL
-              AND {booking_filters_sql}
-            GROUP BY EXTRACT(ISODOW FROM b.datetime::TIMESTAMP)
+            SELECT {weekday_sql} as weekday_value, {count_sql} as count_value
+            FROM {booking_slices_sql}
+            GROUP BY 1
             ORDER BY weekday_value
-        """, booking_filters_params)
+        """, booking_slices_params)
         weekday_rows = c.fetchall()
         weekday_labels = {
             1: "monday",
@@ -1242,8 +1123,8 @@ def get_analytics_data(days=30, date_from=None, date_to=None, service_name=None,
         # ============================================================
         # Extended analytics blocks (10 requested directions)
         # ============================================================
-        bookings_columns = _get_table_columns("bookings")
-        users_columns = _get_table_columns("users")
+        bookings_columns = get_table_columns("bookings", c)
+        users_columns = get_table_columns("users", c)
 
         has_booking_master_user_id = "master_user_id" in bookings_columns
         has_booking_source = "source" in bookings_columns
@@ -1730,7 +1611,7 @@ def get_analytics_data(days=30, date_from=None, date_to=None, service_name=None,
 
         # 5) Unit economics by service / master
         product_cost_by_booking: Dict[int, float] = {}
-        if ("product_movements" in table_columns_cache or True) and filtered_booking_ids:
+        if filtered_booking_ids:
             booking_cost_sql = """
                 SELECT
                     pm.booking_id,
@@ -2495,15 +2376,7 @@ def get_funnel_data():
     c.execute("SELECT COUNT(*) FROM clients WHERE total_messages > 0")
     engaged = c.fetchone()[0]
     
-    c.execute(
-        """
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = 'booking_drafts'
-          AND column_name IN ('instagram_id', 'client_id')
-        """
-    )
-    draft_columns = {row[0] for row in c.fetchall()}
+    draft_columns = get_table_columns("booking_drafts", c)
     started_booking = 0
     if "instagram_id" in draft_columns and "client_id" in draft_columns:
         c.execute("""
@@ -0,0 +1,372 @@
+"""
+Дневные роллапы аналитики.
+
+Дашборды раньше агрегировали сырые bookings/chat_history на каждой загрузке.
+Теперь агрегаты хранятся по дням и компаниям:
+
+- analytics_booking_rollups — записи в разрезе мастер × услуга × статус ×
+  час × день недели визита; в двух базисах: 'created' (день создания записи,
+  как в get_stats / get_analytics_data) и 'visit' (день визита, как в
+  services.analytics.AnalyticsService);
+- analytics_client_rollups — новые и вернувшиеся клиенты (по первой записи),
+  сообщения клиентов/бота и время ответа бота.
+
+Инкрементальность: триггеры на bookings и chat_history (db/init.py) кладут
+затронутые дни в analytics_rollup_queue в той же транзакции, что и запись.
+Задача планировщика `run_analytics_rollups_job` пересчитывает дни из очереди
+(кроме текущего). Чтение (`booking_facts_sql`, `client_facts_sql`) берёт
+роллапы для дней вне очереди и считает по сырым таблицам только дни в
+очереди — сегодняшний и ещё не пересчитанные, поэтому отставания нет.
+"""
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, List, Optional, Sequence, Tuple
+
+from db.connection import get_db_connection
+from utils.logger import log_error, log_info
+from utils.tenant_context import platform_access
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+ANALYTICS_ROLLUP_JOB_SECONDS = max(5, _read_int_env("ANALYTICS_ROLLUP_JOB_SECONDS", 60))
+ANALYTICS_ROLLUP_BATCH_DAYS = max(1, _read_int_env("ANALYTICS_ROLLUP_BATCH_DAYS", 31))
+
+ROLLUP_BASES = ("created", "visit")
+_BASIS_COLUMNS = {"created": "b.created_at", "visit": "b.datetime"}
+
+BOOKING_FACT_COLUMNS = (
+    "company_id", "day", "master", "service_name", "status", "hour", "weekday",
+    "bookings", "paid_bookings", "revenue",
+)
+CLIENT_FACT_COLUMNS = (
+    "company_id", "day", "new_clients", "returning_clients",
+    "client_messages", "bot_messages", "responses", "response_seconds",
+)
+
+
+def as_day(value: Any) -> Optional[date]:
+    """Дата из date/datetime/ISO-строки ('2026-01-31', '2026-01-31 23:59:59', '2026-01-31T10:00+04:00')."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip()[:10])
+
+
+def _booking_source_sql(basis: str, day_condition: str) -> str:
+    """Агрегат сырых bookings в колонках BOOKING_FACT_COLUMNS для дней из day_condition."""
+    column = _BASIS_COLUMNS[basis]
+    return f"""
+        SELECT b.company_id, {column}::date AS day,
+               COALESCE(b.master, '') AS master,
+               COALESCE(b.service_name, '') AS service_name,
+               COALESCE(b.status, '') AS status,
+               EXTRACT(HOUR FROM b.datetime)::SMALLINT AS hour,
+               EXTRACT(ISODOW FROM b.datetime)::SMALLINT AS weekday,
+               COUNT(*) AS bookings,
+               COUNT(*) FILTER (WHERE b.revenue > 0) AS paid_bookings,
+               COALESCE(SUM(b.revenue), 0) AS revenue
+        FROM bookings b
+        WHERE {column} IS NOT NULL AND {day_condition}
+        GROUP BY b.company_id, 2, 3, 4, 5, 6, 7
+    """
+
+
+def _client_source_sql(target_days_sql: str) -> str:
+    """
+    Агрегат сырых chat_history/bookings в колонках CLIENT_FACT_COLUMNS.
+
+    target_days_sql — подзапрос с колонкой day. Новый клиент — первая запись
+    (по created_at) в этот день, вернувшийся — запись в этот день при более
+    ранней первой. Ответ бота — сообщение бота сразу после сообщения клиента.
+    """
+    return f"""
+        WITH target_days AS ({target_days_sql}),
+        bounds AS (SELECT MIN(day) AS lo, MAX(day) + 1 AS hi FROM target_days),
+        messages AS (
+            SELECT ch.company_id, ch.timestamp, ch.sender,
+                   LEAD(ch.sender) OVER w AS next_sender,
+                   LEAD(ch.timestamp) OVER w AS next_timestamp
+            FROM chat_history ch, bounds
+            WHERE ch.timestamp >= bounds.lo AND ch.timestamp < bounds.hi + 1
+            WINDOW w AS (PARTITION BY ch.instagram_id ORDER BY ch.timestamp)
+        ),
+        day_clients AS (
+            SELECT DISTINCT b.company_id, b.instagram_id, b.created_at::date AS day
+            FROM bookings b, bounds
+            WHERE b.instagram_id IS NOT NULL
+              AND b.created_at >= bounds.lo AND b.created_at < bounds.hi
+              AND b.created_at::date IN (SELECT day FROM target_days)
+        ),
+        first_bookings AS (
+            SELECT b.instagram_id, MIN(b.created_at)::date AS first_day
+            FROM bookings b
+            WHERE b.instagram_id IN (SELECT instagram_id FROM day_clients)
+            GROUP BY b.instagram_id
+        )
+        SELECT company_id, day,
+               SUM(new_clients)::INTEGER AS new_clients,
+               SUM(returning_clients)::INTEGER AS returning_clients,
+               SUM(client_messages)::INTEGER AS client_messages,
+               SUM(bot_messages)::INTEGER AS bot_messages,
+               SUM(responses)::INTEGER AS responses,
+               SUM(response_seconds)::DOUBLE PRECISION AS response_seconds
+        FROM (
+            SELECT m.company_id, m.timestamp::date AS day,
+                   0 AS new_clients, 0 AS returning_clients,
+                   COUNT(*) FILTER (WHERE m.sender = 'client') AS client_messages,
+                   COUNT(*) FILTER (WHERE m.sender = 'bot') AS bot_messages,
+                   COUNT(*) FILTER (WHERE m.sender = 'client' AND m.next_sender = 'bot') AS responses,
+                   COALESCE(SUM(EXTRACT(EPOCH FROM (m.next_timestamp - m.timestamp)))
+                            FILTER (WHERE m.sender = 'client' AND m.next_sender = 'bot'), 0) AS response_seconds
+            FROM messages m
+            WHERE m.timestamp::date IN (SELECT day FROM target_days)
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT d.company_id, d.day,
+                   COUNT(*) FILTER (WHERE f.first_day = d.day),
+                   COUNT(*) FILTER (WHERE f.first_day < d.day),
+                   0, 0, 0, 0
+            FROM day_clients d
+            JOIN first_bookings f ON f.instagram_id = d.instagram_id
+            GROUP BY 1, 2
+        ) parts
+        GROUP BY company_id, day
+    """
+
+
+def _day_bounds(date_from: Any, date_to: Any) -> Tuple[Optional[date], Optional[date]]:
+    return as_day(date_from), as_day(date_to)
+
+
+def booking_facts_sql(basis: str = "created", date_from: Any = None, date_to: Any = None) -> Tuple[str, List[Any]]:
+    """
+    Подзапрос «фактов записей» за дни [date_from, date_to] (включительно, границы
+    по дню; None — без ограничения) с колонками BOOKING_FACT_COLUMNS.
+
+    Строки одного разреза могут повторяться (роллап + живой день) — снаружи
+    всегда SUM(...) GROUP BY. master/service_name/status: '' вместо NULL.
+    """
+    if basis not in _BASIS_COLUMNS:
+        raise ValueError(f"Unknown rollup basis: {basis}")
+    column = _BASIS_COLUMNS[basis]
+    first_day, last_day = _day_bounds(date_from, date_to)
+
+    rollup_conditions = ["r.basis = %s", "NOT EXISTS (SELECT 1 FROM analytics_rollup_queue q WHERE q.day = r.day)"]
+    rollup_params: List[Any] = [basis]
+    live_conditions = [
+        f"{column} >= (SELECT MIN(day) FROM analytics_rollup_queue)",
+        f"{column}::date IN (SELECT day FROM analytics_rollup_queue)",
+    ]
+    live_params: List[Any] = []
+    if first_day is not None:
+        rollup_conditions.append("r.day >= %s")
+        rollup_params.append(first_day)
+        live_conditions.append(f"{column} >= %s")
+        live_params.append(first_day)
+    if last_day is not None:
+        rollup_conditions.append("r.day <= %s")
+        rollup_params.append(last_day)
+        live_conditions.append(f"{column} < %s")
+        live_params.append(last_day + timedelta(days=1))
+
+    sql = f"""
+        SELECT {", ".join(f"r.{name}" for name in BOOKING_FACT_COLUMNS)}
+        FROM analytics_booking_rollups r
+        WHERE {" AND ".join(rollup_conditions)}
+        UNION ALL
+        {_booking_source_sql(basis, " AND ".join(live_conditions))}
+    """
+    return sql, rollup_params + live_params
+
+
+def client_facts_sql(date_from: Any = None, date_to: Any = None) -> Tuple[str, List[Any]]:
+    """Подзапрос клиентских/чатовых фактов с колонками CLIENT_FACT_COLUMNS (см. booking_facts_sql)."""
+    first_day, last_day = _day_bounds(date_from, date_to)
+
+    rollup_conditions = ["NOT EXISTS (SELECT 1 FROM analytics_rollup_queue q WHERE q.day = r.day)"]
+    queue_conditions = ["TRUE"]
+    bounds: List[Any] = []
+    if first_day is not None:
+        rollup_conditions.append("r.day >= %s")
+        queue_conditions.append("day >= %s")
+        bounds.append(first_day)
+    if last_day is not None:
+        rollup_conditions.append("r.day <= %s")
+        queue_conditions.append("day <= %s")
+        bounds.append(last_day)
+
+    live_days = f"SELECT day FROM analytics_rollup_queue WHERE {' AND '.join(queue_conditions)}"
+    sql = f"""
+        SELECT {", ".join(f"r.{name}" for name in CLIENT_FACT_COLUMNS)}
+        FROM analytics_client_rollups r
+        WHERE {" AND ".join(rollup_conditions)}
+        UNION ALL
+        SELECT * FROM ({_client_source_sql(live_days)}) live
+    """
+    return sql, bounds + bounds
+
+
+def _refresh_day(cursor, day: date) -> None:
+    """Пересчитать роллапы одного дня (обе таблицы, оба базиса)."""
+    next_day = day + timedelta(days=1)
+    cursor.execute("DELETE FROM analytics_booking_rollups WHERE day = %s", (day,))
+    for basis in ROLLUP_BASES:
+        column = _BASIS_COLUMNS[basis]
+        cursor.execute(
+            f"""
+            INSERT INTO analytics_booking_rollups (basis, {", ".join(BOOKING_FACT_COLUMNS)})
+            SELECT %s, source.* FROM ({_booking_source_sql(basis, f"{column} >= %s AND {column} < %s")}) source
+            """,
+            (basis, day, next_day),
+        )
+    cursor.execute("DELETE FROM analytics_client_rollups WHERE day = %s", (day,))
+    cursor.execute(
+        f"""
+        INSERT INTO analytics_client_rollups ({", ".join(CLIENT_FACT_COLUMNS)})
+        SELECT * FROM ({_client_source_sql("SELECT %s::date AS day")}) source
+        """,
+        (day,),
+    )
+
+
+def refresh_analytics_rollups(max_days: int = ANALYTICS_ROLLUP_BATCH_DAYS) -> int:
+    """
+    Пересчитать до max_days дней из очереди; каждый день — своя транзакция.
+
+    День забирается из очереди (DELETE ... SKIP LOCKED) в той же транзакции,
+    что и пересчёт: при ошибке он остаётся в очереди, а запись в этот день,
+    пришедшая во время пересчёта, снова ставит его в очередь. Текущий день
+    не пересчитывается — он читается из сырых таблиц.
+    """
+    refreshed = 0
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        while refreshed < max_days:
+            c.execute("""
+                DELETE FROM analytics_rollup_queue
+                WHERE day = (
+                    SELECT day FROM analytics_rollup_queue
+                    WHERE day <> CURRENT_DATE
+                    ORDER BY day
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING day
+            """)
+            row = c.fetchone()
+            if row is None:
+                conn.commit()
+                break
+            try:
+                _refresh_day(c, row[0])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            refreshed += 1
+        return refreshed
+    finally:
+        conn.close()
+
+
+def enqueue_analytics_rollup_days(days: Sequence[Any], cursor=None) -> None:
+    """
+    Поставить дни в очередь пересчёта (например, после массового импорта).
+    Как и триггеры, блокирует строку дня до коммита: пересчёт не заберёт
+    день раньше, чем станут видны изменения вызывающей транзакции.
+    """
+    normalized = sorted({as_day(day) for day in days if day})
+    if not normalized:
+        return
+    conn = None
+    c = cursor
+    if c is None:
+        conn = get_db_connection()
+        c = conn.cursor()
+    try:
+        c.execute(
+            f"""
+            INSERT INTO analytics_rollup_queue (day)
+            VALUES {", ".join(["(%s)"] * len(normalized))}
+            ON CONFLICT (day) DO UPDATE SET queued_at = NOW()
+            """,
+            normalized,
+        )
+        if conn is not None:
+            conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def rebuild_analytics_rollups(cursor=None) -> None:
+    """Поставить в очередь все дни, где есть записи или сообщения (первая установка, ручной пересчёт)."""
+    conn = None
+    c = cursor
+    if c is None:
+        conn = get_db_connection()
+        c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO analytics_rollup_queue (day)
+            SELECT created_at::date FROM bookings WHERE created_at IS NOT NULL
+            UNION
+            SELECT datetime::date FROM bookings WHERE datetime IS NOT NULL
+            UNION
+            SELECT timestamp::date FROM chat_history WHERE timestamp IS NOT NULL
+            ON CONFLICT (day) DO UPDATE SET queued_at = NOW()
+        """)
+        if conn is not None:
+            conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def get_rollup_backlog() -> dict:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT COUNT(*), MIN(day), MAX(day), EXTRACT(EPOCH FROM NOW() - MIN(queued_at))
+            FROM analytics_rollup_queue
+            WHERE day <> CURRENT_DATE
+        """)
+        count, oldest_day, newest_day, oldest_age = c.fetchone()
+        return {
+            "queued_days": int(count or 0),
+            "oldest_day": oldest_day.isoformat() if oldest_day else None,
+            "newest_day": newest_day.isoformat() if newest_day else None,
+            "oldest_age_seconds": round(float(oldest_age), 1) if oldest_age is not None else None,
+        }
+    finally:
+        conn.close()
+
+
+def run_analytics_rollups_job(time_budget_seconds: int = ANALYTICS_ROLLUP_JOB_SECONDS) -> int:
+    """Задача планировщика: разбирать очередь, пока есть дни и не исчерпан бюджет времени."""
+    started = time.monotonic()
+    total = 0
+    try:
+        with platform_access():
+            while time.monotonic() - started < time_budget_seconds:
+                refreshed = refresh_analytics_rollups()
+                total += refreshed
+                if refreshed < ANALYTICS_ROLLUP_BATCH_DAYS:
+                    break
+    except Exception as e:
+        log_error(f"Analytics rollup refresh failed: {e}", "analytics")
+    if total:
+        log_info(f"📊 Analytics rollups refreshed for {total} day(s)", "analytics")
+    return total
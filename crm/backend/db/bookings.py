@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Tuple
 
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.datetime_utils import get_current_time, get_salon_timezone
 import psycopg2
 
@@ -22,19 +23,6 @@ def _is_any_master(master_value: Optional[str]) -> bool:
     return normalized in ANY_MASTER_ALIASES
 
 
-def _column_exists(cursor, table_name: str, column_name: str) -> bool:
-    cursor.execute(
-        """
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = %s AND column_name = %s
-        LIMIT 1
-        """,
-        (table_name, column_name),
-    )
-    return bool(cursor.fetchone())
-
-
 def _resolve_master_identity(cursor, master_identifier: Optional[str]) -> Tuple[Optional[str], Optional[int], List[str]]:
     if _is_any_master(master_identifier):
         return None, None, []
@@ -183,6 +171,44 @@ def _estimate_booking_revenue(cursor, service_name: Optional[str]) -> float:
     return 0.0
 
 
+# Статус записи → событие исходящего вебхука (crm_api.webhooks_api.AVAILABLE_EVENTS)
+_BOOKING_STATUS_EVENTS = {
+    "confirmed": "booking.confirmed",
+    "cancelled": "booking.cancelled",
+    "completed": "booking.completed",
+}
+
+_BOOKING_WEBHOOK_COLUMNS = (
+    "id, company_id, instagram_id, service_name, datetime, name, phone, master, status, source, revenue"
+)
+
+
+def _enqueue_booking_webhook(cursor, event: str, row: tuple) -> int:
+    """Событие записи в outbox вебхуков; row — колонки _BOOKING_WEBHOOK_COLUMNS."""
+    from services.webhook_dispatcher import enqueue_webhook_event
+
+    booking_id, company_id, instagram_id, service, booking_datetime, name, phone, master, status, source, revenue = row
+    data = {
+        "booking_id": booking_id,
+        "client_id": instagram_id,
+        "service": service,
+        "datetime": booking_datetime,
+        "client_name": name,
+        "phone": phone,
+        "master": master,
+        "status": status,
+        "source": source,
+        "revenue": _safe_float(revenue, 0.0),
+    }
+    return enqueue_webhook_event(cursor, event, data, company_id=company_id)
+
+
+def _wake_webhook_dispatcher() -> None:
+    from services.webhook_dispatcher import webhook_dispatcher
+
+    webhook_dispatcher.wake()
+
+
 def get_all_bookings(limit: int = 1000, offset: int = 0):
     """Получить все записи с лимитом для оптимизации"""
     conn = get_db_connection()
@@ -248,8 +274,8 @@ def get_filtered_bookings(
     conn = get_db_connection()
     c = conn.cursor()
 
-    has_master_user_id = _column_exists(c, 'bookings', 'master_user_id')
-    has_promo_code = _column_exists(c, 'bookings', 'promo_code')
+    has_master_user_id = column_exists('bookings', 'master_user_id', c)
+    has_promo_code = column_exists('bookings', 'promo_code', c)
     conditions = ["b.deleted_at IS NULL"]
     params = []
 
@@ -369,7 +395,7 @@ def get_booking_stats(
     conn = get_db_connection()
     c = conn.cursor()
 
-    has_master_user_id = _column_exists(c, 'bookings', 'master_user_id')
+    has_master_user_id = column_exists('bookings', 'master_user_id', c)
     conditions = ["b.deleted_at IS NULL"]
     params = []
 
@@ -470,7 +496,7 @@ def get_bookings_by_master(master_name: str):
         if not aliases_upper and canonical_master:
             aliases_upper = [canonical_master.upper()]
 
-        if _column_exists(c, 'bookings', 'master_user_id') and master_user_id is not None:
+        if column_exists('bookings', 'master_user_id', c) and master_user_id is not None:
             c.execute(
                 """
                 SELECT id, instagram_id, service_name, datetime, phone,
@@ -617,45 +643,60 @@ def save_booking(instagram_id: str, service: str, datetime_str: str,
         master_to_store = None
         master_user_id = None
 
-    # Единая проверка доступности слота для будущих записей
+    # Единая проверка доступности слота для будущих записей.
+    # Проверка и INSERT идут в одной транзакции под advisory lock мастера/дня
+    # (services.booking_hold.reserve_slot): параллельные писатели не создадут пересечений.
+    reserved_slot = None
     if master_to_store:
-        try:
-            from services.master_schedule import MasterScheduleService
-            from zoneinfo import ZoneInfo
+        from services.booking_hold import SlotConflictError, lock_master_day, reserve_slot
+        from services.master_schedule import MasterScheduleService
+        from zoneinfo import ZoneInfo
 
-            schedule_service = MasterScheduleService()
-            timezone = ZoneInfo(get_salon_timezone())
-
-            raw_dt = str(datetime_str).strip().replace('T', ' ')
-            if len(raw_dt) == 16:
-                raw_dt = f"{raw_dt}:00"
+        timezone = ZoneInfo(get_salon_timezone())
+        raw_dt = str(datetime_str).strip().replace('T', ' ')
+        if len(raw_dt) == 16:
+            raw_dt = f"{raw_dt}:00"
 
+        try:
             booking_start = datetime.fromisoformat(raw_dt)
-            if booking_start.tzinfo is None:
-                booking_start = booking_start.replace(tzinfo=timezone)
-            else:
-                booking_start = booking_start.astimezone(timezone)
+        except ValueError:
+            conn.close()
+            raise
+        if booking_start.tzinfo is None:
+            booking_start = booking_start.replace(tzinfo=timezone)
+        else:
+            booking_start = booking_start.astimezone(timezone)
 
+        # Lock берётся до savepoint: откат проверки не должен его снимать
+        lock_master_day(c, master_user_id, master_to_store, booking_start.strftime("%Y-%m-%d"))
+        c.execute("SAVEPOINT slot_reservation")
+        try:
+            schedule_service = MasterScheduleService()
             now_dt = get_current_time().astimezone(timezone)
             # Прошлые записи оставляем без жёсткой проверки (история, ручной импорт)
             if booking_start >= (now_dt - timedelta(minutes=1)):
                 resolved_duration_minutes = (
                     int(duration_minutes)
                     if isinstance(duration_minutes, (int, float)) and int(duration_minutes) > 0
-                    else schedule_service.estimate_duration_minutes(service, fallback=60)
+                    else schedule_service.estimate_duration_minutes(service, fallback=60, cursor=c)
                 )
-                slot_check = schedule_service.validate_slot(
+                reserve_slot(
+                    c,
                     master_name=master_to_store,
-                    date=booking_start.strftime("%Y-%m-%d"),
-                    time_str=booking_start.strftime("%H:%M"),
+                    master_user_id=master_user_id,
+                    start_dt=booking_start,
                     duration_minutes=resolved_duration_minutes,
+                    client_id=instagram_id,
+                    schedule_service=schedule_service,
                 )
-                if not slot_check.get("is_available"):
-                    reason = slot_check.get("reason", "unavailable")
-                    raise ValueError(f"slot_unavailable:{reason}")
-        except ValueError:
+                reserved_slot = booking_start
+            c.execute("RELEASE SAVEPOINT slot_reservation")
+        except SlotConflictError:
+            conn.rollback()
+            conn.close()
             raise
         except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT slot_reservation")
             print(f"Booking availability validation warning: {e}")
 
     now = get_current_time().isoformat()
@@ -663,14 +704,14 @@ def save_booking(instagram_id: str, service: str, datetime_str: str,
     if ' ' in datetime_str and 'T' not in datetime_str:
         datetime_str = datetime_str.replace(' ', 'T')
 
-    has_master_user_id = _column_exists(c, "bookings", "master_user_id")
+    has_master_user_id = column_exists("bookings", "master_user_id", c)
     if has_master_user_id:
         c.execute(
             """INSERT INTO bookings
                  (instagram_id, service_name, datetime, phone, name, status,
                   created_at, special_package_id, master, master_user_id, source, user_id, revenue, promo_code)
                  VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                 RETURNING id""",
+                 RETURNING id, company_id""",
             (
                 instagram_id,
                 service,
@@ -694,7 +735,7 @@ def save_booking(instagram_id: str, service: str, datetime_str: str,
                  (instagram_id, service_name, datetime, phone, name, status,
                   created_at, special_package_id, master, source, user_id, revenue, promo_code)
                  VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                 RETURNING id""",
+                 RETURNING id, company_id""",
             (
                 instagram_id,
                 service,
@@ -712,7 +753,18 @@ def save_booking(instagram_id: str, service: str, datetime_str: str,
             ),
         )
     
-    booking_id = c.fetchone()[0]  # ✅ ПОЛУЧАЕМ ID СОЗДАННОЙ ЗАПИСИ
+    booking_id, booking_company_id = c.fetchone()  # ✅ ПОЛУЧАЕМ ID СОЗДАННОЙ ЗАПИСИ
+
+    if reserved_slot is not None:
+        from services.booking_hold import release_client_hold
+        _, _, master_aliases = _resolve_master_identity(c, master_to_store)
+        release_client_hold(
+            c,
+            instagram_id,
+            master_aliases,
+            reserved_slot.strftime("%Y-%m-%d"),
+            reserved_slot.strftime("%H:%M"),
+        )
     
     # ✅ ЛОГИРУЕМ ИСПОЛЬЗОВАНИЕ ПРОМОКОДА
     if promo_code:
@@ -745,9 +797,17 @@ def save_booking(instagram_id: str, service: str, datetime_str: str,
     if special_package_id:
         from .services import increment_package_usage
         increment_package_usage(special_package_id)
+
+    # Вебхук booking.created — в той же транзакции, что и запись
+    webhooks_queued = _enqueue_booking_webhook(c, "booking.created", (
+        booking_id, booking_company_id, instagram_id, service, datetime_str,
+        name, phone, master_to_store, status, source, resolved_revenue,
+    ))
     
     conn.commit()
     conn.close()
+    if webhooks_queued:
+        _wake_webhook_dispatcher()
     
     return booking_id
 
@@ -770,18 +830,26 @@ def update_booking_status(booking_id: int, status: str) -> bool:
                     resolved_revenue = _estimate_booking_revenue(c, booking_row[0])
 
             completed_at = get_current_time().isoformat()
-            c.execute("""UPDATE bookings 
+            c.execute(f"""UPDATE bookings 
                         SET status = %s, completed_at = %s, revenue = COALESCE(NULLIF(%s, 0), revenue)
-                        WHERE id = %s""",
+                        WHERE id = %s
+                        RETURNING {_BOOKING_WEBHOOK_COLUMNS}""",
                       (status, completed_at, resolved_revenue, booking_id))
         else:
-            c.execute("UPDATE bookings SET status = %s WHERE id = %s",
+            c.execute(f"UPDATE bookings SET status = %s WHERE id = %s RETURNING {_BOOKING_WEBHOOK_COLUMNS}",
                       (status, booking_id))
+        booking_row = c.fetchone()
+
+        webhooks_queued = 0
+        event = _BOOKING_STATUS_EVENTS.get(status)
+        if booking_row and event:
+            webhooks_queued = _enqueue_booking_webhook(c, event, booking_row)
         
         conn.commit()
-        success = c.rowcount > 0
         conn.close()
-        return success
+        if webhooks_queued:
+            _wake_webhook_dispatcher()
+        return booking_row is not None
     except Exception as e:
         print(f"Ошибка обновления статуса: {e}")
         conn.close()
@@ -790,23 +858,48 @@ def update_booking_status(booking_id: int, status: str) -> bool:
 # ===== ВРЕМЕННЫЕ ДАННЫЕ ЗАПИСИ =====
 
 def search_bookings(query: str, limit: int = 50):
-    """Поиск записей по тексту"""
+    """Ранжированный поиск записей по услуге, имени, телефону и данным клиента"""
+    from db.search import (
+        SEARCH_CONFIG, MIN_PHONE_DIGITS, build_prefix_tsquery, clamp_search_limit,
+        is_trgm_available, normalize_phone_digits,
+    )
+
+    tsquery = build_prefix_tsquery(query)
+    digits = normalize_phone_digits(query)
+    if not tsquery and len(digits) < MIN_PHONE_DIGITS:
+        return []
+
     conn = get_db_connection()
     c = conn.cursor()
     
     try:
-        c.execute("""
+        # Каждая ветка идёт по своему индексу; OR через JOIN привёл бы к полному скану
+        candidates, params = [], []
+        rank_sql, rank_params = "0", []
+        if tsquery:
+            candidates.append(f"SELECT id FROM bookings WHERE search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s)")
+            candidates.append(f"""
+                SELECT bk.id FROM bookings bk
+                JOIN clients cl ON cl.instagram_id = bk.instagram_id
+                WHERE cl.search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s)
+            """)
+            params.extend([tsquery, tsquery])
+            rank_sql = f"ts_rank(b.search_vector, to_tsquery('{SEARCH_CONFIG}', %s))"
+            rank_params.append(tsquery)
+        if len(digits) >= MIN_PHONE_DIGITS:
+            candidates.append("SELECT id FROM bookings WHERE phone_digits LIKE %s")
+            params.append(f"%{digits}%" if is_trgm_available(c) else f"{digits}%")
+
+        c.execute(f"""
             SELECT b.id, b.instagram_id, c.username, c.name, b.service_name, 
                    b.datetime, b.phone, b.status, b.created_at, b.revenue
             FROM bookings b
             LEFT JOIN clients c ON b.instagram_id = c.instagram_id
-            WHERE (b.service_name LIKE %s OR b.name LIKE %s OR c.username LIKE %s 
-                  OR c.name LIKE %s OR b.phone LIKE %s)
-                  AND b.deleted_at IS NULL
-            ORDER BY b.created_at DESC
-
+            WHERE b.id IN ({" UNION ".join(candidates)})
+              AND b.deleted_at IS NULL
+            ORDER BY {rank_sql} DESC, b.created_at DESC
             LIMIT %s
-        """, (query, query, query, query, query, limit))
+        """, params + rank_params + [clamp_search_limit(limit)])
         
         bookings = c.fetchall()
         
@@ -842,8 +935,8 @@ def get_booking_progress(instagram_id: str) -> Optional[Dict]:
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        key_column = "instagram_id" if _column_exists(c, "booking_drafts", "instagram_id") else "client_id"
-        has_data_column = _column_exists(c, "booking_drafts", "data")
+        key_column = "instagram_id" if column_exists("booking_drafts", "instagram_id", c) else "client_id"
+        has_data_column = column_exists("booking_drafts", "data", c)
 
         if has_data_column:
             c.execute(f"SELECT data FROM booking_drafts WHERE {key_column} = %s", (instagram_id,))
@@ -875,66 +968,87 @@ def get_booking_progress(instagram_id: str) -> Optional[Dict]:
     finally:
         conn.close()
 
+def _booking_drafts_key_column(c) -> str:
+    return "instagram_id" if column_exists("booking_drafts", "instagram_id", c) else "client_id"
+
+
+def booking_draft_row(c, instagram_id: str, progress: Dict) -> tuple:
+    """
+    Колонки и значения строки booking_drafts для прогресса `progress`
+    (мастер приводится к каноническому имени, черновик живёт 30 минут).
+    Возвращает (key_column, columns, values); `progress` дополняется каноническим мастером.
+    """
+    import json
+
+    # Extract fields for database columns
+    # Drafts expire in 30 minutes
+    expires_at = get_current_time() + timedelta(minutes=30)
+
+    # We need to handle time and date carefully
+    # If both are present, we can form a datetime string
+    dt_str = None
+    if progress.get('date') and progress.get('time'):
+        dt_str = f"{progress['date']} {progress['time']}"
+
+    key_column = _booking_drafts_key_column(c)
+    has_master_user_id = column_exists("booking_drafts", "master_user_id", c)
+    has_updated_at = column_exists("booking_drafts", "updated_at", c)
+    has_data_column = column_exists("booking_drafts", "data", c)
+    has_service_id = column_exists("booking_drafts", "service_id", c)
+
+    canonical_master, master_user_id, _ = _resolve_master_identity(c, progress.get("master"))
+    master_to_store = canonical_master
+    if not master_to_store and not _is_any_master(progress.get("master")):
+        master_to_store = str(progress.get("master")).strip()
+    if _is_any_master(progress.get("master")):
+        master_to_store = None
+        master_user_id = None
+    progress["master"] = master_to_store
+
+    service_id_value = progress.get("service_id")
+    if service_id_value is not None:
+        try:
+            service_id_value = int(service_id_value)
+        except Exception:
+            service_id_value = None
+
+    insert_columns = [key_column, "datetime", "master", "expires_at"]
+    insert_values = [instagram_id, dt_str, master_to_store, expires_at]
+
+    if has_data_column:
+        insert_columns.append("data")
+        insert_values.append(json.dumps(progress))
+
+    if has_service_id:
+        insert_columns.append("service_id")
+        insert_values.append(service_id_value)
+
+    if has_master_user_id:
+        insert_columns.append("master_user_id")
+        insert_values.append(master_user_id)
+
+    if has_updated_at:
+        insert_columns.append("updated_at")
+        insert_values.append(get_current_time())
+
+    return key_column, insert_columns, insert_values
+
+
+def _invalidate_conversation_state(instagram_id: str) -> None:
+    from services.conversation_state import invalidate_conversation_state
+    invalidate_conversation_state(instagram_id)
+
+
 def update_booking_progress(instagram_id: str, data: Dict):
     """Обновить прогресс бронирования"""
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        import json
         # Merge with existing data
         current = get_booking_progress(instagram_id) or {}
         current.update(data)
-        
-        # Extract fields for database columns
-        # Drafts expire in 30 minutes
-        expires_at = get_current_time() + timedelta(minutes=30)
-        
-        # We need to handle time and date carefully
-        # If both are present, we can form a datetime string
-        dt_str = None
-        if current.get('date') and current.get('time'):
-            dt_str = f"{current['date']} {current['time']}"
-
-        key_column = "instagram_id" if _column_exists(c, "booking_drafts", "instagram_id") else "client_id"
-        has_master_user_id = _column_exists(c, "booking_drafts", "master_user_id")
-        has_updated_at = _column_exists(c, "booking_drafts", "updated_at")
-        has_data_column = _column_exists(c, "booking_drafts", "data")
-        has_service_id = _column_exists(c, "booking_drafts", "service_id")
-
-        canonical_master, master_user_id, _ = _resolve_master_identity(c, current.get("master"))
-        master_to_store = canonical_master
-        if not master_to_store and not _is_any_master(current.get("master")):
-            master_to_store = str(current.get("master")).strip()
-        if _is_any_master(current.get("master")):
-            master_to_store = None
-            master_user_id = None
-        current["master"] = master_to_store
-
-        service_id_value = current.get("service_id")
-        if service_id_value is not None:
-            try:
-                service_id_value = int(service_id_value)
-            except Exception:
-                service_id_value = None
-
-        insert_columns = [key_column, "datetime", "master", "expires_at"]
-        insert_values = [instagram_id, dt_str, master_to_store, expires_at]
 
-        if has_data_column:
-            insert_columns.append("data")
-            insert_values.append(json.dumps(current))
-
-        if has_service_id:
-            insert_columns.append("service_id")
-            insert_values.append(service_id_value)
-
-        if has_master_user_id:
-            insert_columns.append("master_user_id")
-            insert_values.append(master_user_id)
-
-        if has_updated_at:
-            insert_columns.append("updated_at")
-            insert_values.append(get_current_time())
+        key_column, insert_columns, insert_values = booking_draft_row(c, instagram_id, current)
 
         c.execute(f"DELETE FROM booking_drafts WHERE {key_column} = %s", (instagram_id,))
         c.execute(
@@ -945,6 +1059,7 @@ def update_booking_progress(instagram_id: str, data: Dict):
             tuple(insert_values),
         )
         conn.commit()
+        _invalidate_conversation_state(instagram_id)
     except Exception as e:
         print(f"Error updating booking progress: {e}")
     finally:
@@ -955,9 +1070,10 @@ def clear_booking_progress(instagram_id: str):
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        key_column = "instagram_id" if _column_exists(c, "booking_drafts", "instagram_id") else "client_id"
+        key_column = _booking_drafts_key_column(c)
         c.execute(f"DELETE FROM booking_drafts WHERE {key_column} = %s", (instagram_id,))
         conn.commit()
+        _invalidate_conversation_state(instagram_id)
     except Exception as e:
         print(f"Error clearing booking progress: {e}")
     finally:
@@ -1231,11 +1347,17 @@ def cancel_booking(booking_id: int) -> bool:
     c = conn.cursor()
     
     try:
-        c.execute("UPDATE bookings SET status = 'cancelled' WHERE id = %s", (booking_id,))
+        c.execute(
+            f"UPDATE bookings SET status = 'cancelled' WHERE id = %s RETURNING {_BOOKING_WEBHOOK_COLUMNS}",
+            (booking_id,),
+        )
+        booking_row = c.fetchone()
+        webhooks_queued = _enqueue_booking_webhook(c, "booking.cancelled", booking_row) if booking_row else 0
         conn.commit()
-        success = c.rowcount > 0
         conn.close()
-        return success
+        if webhooks_queued:
+            _wake_webhook_dispatcher()
+        return booking_row is not None
     except Exception as e:
         print(f"❌ Ошибка отмены записи: {e}")
         conn.close()
@@ -1300,7 +1422,7 @@ def update_booking_details(booking_id: int, data: Dict) -> bool:
     
     fields = []
     params = []
-    has_master_user_id = _column_exists(c, "bookings", "master_user_id")
+    has_master_user_id = column_exists("bookings", "master_user_id", c)
     
     if 'date' in data and 'time' in data:
         datetime_str = f"{data['date']} {data['time']}"
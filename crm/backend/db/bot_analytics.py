@@ -6,11 +6,14 @@
 - Сколько эскалаций к менеджеру  
 - Средняя длина диалога
 - Языки клиентов
+- Кэш ответов на типовые вопросы (bot/answer_cache.py): попадания и сэкономленное время LLM
 """
 
 from datetime import datetime
 from db.connection import get_db_connection
+from utils.event_buffer import EventBuffer
 from utils.logger import log_info, log_error
+from utils.tenant_context import platform_access
 
 
 def start_bot_session(instagram_id: str, language: str = None) -> int:
@@ -125,6 +128,80 @@ def end_bot_session(instagram_id: str, outcome: str, booking_id: int = None):
         conn.close()
 
 
+# === КЭШ ОТВЕТОВ ===
+
+_ANSWER_CACHE_COUNTERS = ("hits", "misses", "bypassed", "stored", "rejected", "saved_ms", "upstream_ms")
+
+
+def _answer_cache_totals(events: list) -> dict:
+    """Свернуть события кэша ответов в счётчики по компаниям."""
+    totals = {}
+    for company_id, event, upstream_ms in events:
+        row = totals.setdefault(company_id, dict.fromkeys(_ANSWER_CACHE_COUNTERS, 0))
+        if event == "hit":
+            row["hits"] += 1
+            row["saved_ms"] += upstream_ms
+        elif event == "miss":
+            row["misses"] += 1
+        elif event == "stored":
+            row["stored"] += 1
+            row["upstream_ms"] += upstream_ms
+        elif event == "rejected":
+            row["rejected"] += 1
+        elif event.startswith("bypass:"):
+            row["bypassed"] += 1
+    return totals
+
+
+def flush_answer_cache_events(events: list) -> None:
+    """Пачка событий -> один upsert в bot_answer_cache_daily (день — CURRENT_DATE на момент сброса)."""
+    totals = _answer_cache_totals(events)
+    if not totals:
+        return
+    params = []
+    for company_id, row in totals.items():
+        params.append(company_id)
+        params.extend(int(round(row[name])) for name in _ANSWER_CACHE_COUNTERS)
+
+    with platform_access():
+        conn = get_db_connection()
+        c = conn.cursor()
+        try:
+            c.execute(f"""
+                INSERT INTO bot_answer_cache_daily (company_id, day, {", ".join(_ANSWER_CACHE_COUNTERS)})
+                VALUES {", ".join(["(%s, CURRENT_DATE, %s, %s, %s, %s, %s, %s, %s)"] * len(totals))}
+                ON CONFLICT (company_id, day) DO UPDATE SET
+                    {", ".join(f"{name} = bot_answer_cache_daily.{name} + EXCLUDED.{name}" for name in _ANSWER_CACHE_COUNTERS)}
+            """, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+answer_cache_buffer = EventBuffer("bot_answer_cache", flush_answer_cache_events)
+
+
+def record_answer_cache_event(company_id: int, event: str, upstream_ms: float = 0.0) -> bool:
+    """Событие кэша ответов (hit / miss / stored / rejected / bypass:<причина>) в буфер пакетной записи."""
+    return answer_cache_buffer.add((int(company_id), event, float(upstream_ms or 0.0)))
+
+
+def _answer_cache_summary(row) -> dict:
+    hits, misses, bypassed, stored, saved_ms, upstream_ms = [value or 0 for value in (row or (0,) * 6)]
+    lookups = hits + misses
+    return {
+        "hits": int(hits),
+        "misses": int(misses),
+        "bypassed": int(bypassed),
+        "hit_rate": round(hits / lookups * 100, 1) if lookups else 0,
+        "saved_upstream_seconds": round(saved_ms / 1000, 1),
+        "avg_upstream_ms": round(upstream_ms / stored) if stored else 0,
+    }
+
+
 def get_bot_analytics_summary(days: int = 30) -> dict:
     """Получить сводку по эффективности бота за N дней"""
     conn = get_db_connection()
@@ -190,6 +267,14 @@ def get_bot_analytics_summary(days: int = 30) -> dict:
             ORDER BY 2 DESC
         """)
         languages = [{"language": r[0], "count": r[1]} for r in c.fetchall()]
+
+        # 5. Answer cache
+        c.execute(f"""
+            SELECT SUM(hits), SUM(misses), SUM(bypassed), SUM(stored), SUM(saved_ms), SUM(upstream_ms)
+            FROM bot_answer_cache_daily
+            WHERE day > CURRENT_DATE - {days}
+        """)
+        answer_cache = _answer_cache_summary(c.fetchone())
         
         return {
             "summary": {
@@ -204,7 +289,8 @@ def get_bot_analytics_summary(days: int = 30) -> dict:
             },
             "daily_stats": daily_stats,
             "outcomes": outcomes,
-            "languages": languages
+            "languages": languages,
+            "answer_cache": answer_cache
         }
         
     except Exception as e:
@@ -222,7 +308,8 @@ def get_bot_analytics_summary(days: int = 30) -> dict:
             },
             "daily_stats": [],
             "outcomes": [],
-            "languages": []
+            "languages": [],
+            "answer_cache": _answer_cache_summary(None)
         }
     finally:
         conn.close()
@@ -7,8 +7,13 @@ import re
 from db.companies import ensure_company_quota
 from utils.logger import log_info,log_error
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists, get_table_columns, invalidate_schema_catalog
 import psycopg2
-from utils.tenant_context import get_current_company_id
+from utils.cache import TTLCache
+from utils.tenant_context import get_current_company_id, platform_access
+
+# Компания диалога мессенджера не меняется, повторные ходы её не перечитывают
+_conversation_companies = TTLCache(maxsize=10000, ttl=600)
 
 def get_avatar_url(profile_pic: Optional[str], gender: Optional[str] = 'female') -> str:
     """
@@ -36,12 +41,7 @@ def ensure_client_columns(conn=None):
         
     c = conn.cursor()
     try:
-        c.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='clients'
-        """)
-        existing = {row[0] for row in c.fetchall()}
+        existing = get_table_columns("clients", c)
         new_cols = {
             "total_spend": "REAL DEFAULT 0",
             "total_visits": "INTEGER DEFAULT 0",
@@ -53,16 +53,72 @@ def ensure_client_columns(conn=None):
             "age": "INTEGER",
             "birth_date": "TEXT"
         }
-        for col, definition in new_cols.items():
-            if col not in existing:
-                c.execute(f"ALTER TABLE clients ADD COLUMN {col} {definition}")
+        missing = [col for col in new_cols if col not in existing]
+        for col in missing:
+            c.execute(f"ALTER TABLE clients ADD COLUMN IF NOT EXISTS {col} {new_cols[col]}")
         
         if should_close:
             conn.commit()
+        if missing:
+            invalidate_schema_catalog()
     finally:
         if should_close:
             conn.close()
 
+def rebuild_client_aggregates(cursor=None) -> int:
+    """
+    Пересчитать счётчики клиента, поддерживаемые триггерами
+    (inbound_messages_count, active_bookings_count, active_bookings_spend).
+    Вызывается при первой установке триггеров и вручную после массовых правок.
+    """
+    conn = None
+    c = cursor
+    if c is None:
+        conn = get_db_connection()
+        c = conn.cursor()
+
+    try:
+        c.execute("""
+            UPDATE clients c
+            SET inbound_messages_count = agg.messages,
+                active_bookings_count = agg.bookings,
+                active_bookings_spend = agg.spend
+            FROM (
+                SELECT cl.instagram_id,
+                       COALESCE(ch.messages, 0) + COALESCE(mm.messages, 0) AS messages,
+                       COALESCE(b.bookings, 0) AS bookings,
+                       COALESCE(b.spend, 0) AS spend
+                FROM clients cl
+                LEFT JOIN (
+                    SELECT instagram_id, COUNT(*) AS messages
+                    FROM chat_history
+                    WHERE sender = 'client'
+                    GROUP BY instagram_id
+                ) ch ON ch.instagram_id = cl.instagram_id
+                LEFT JOIN (
+                    SELECT client_id, COUNT(*) AS messages
+                    FROM messenger_messages
+                    WHERE sender_type = 'client'
+                    GROUP BY client_id
+                ) mm ON mm.client_id = cl.instagram_id
+                LEFT JOIN (
+                    SELECT instagram_id, COUNT(*) AS bookings, SUM(COALESCE(revenue, 0)) AS spend
+                    FROM bookings
+                    WHERE COALESCE(status, '') <> 'cancelled'
+                      AND deleted_at IS NULL
+                    GROUP BY instagram_id
+                ) b ON b.instagram_id = cl.instagram_id
+            ) agg
+            WHERE agg.instagram_id = c.instagram_id
+        """)
+        updated = c.rowcount
+        if conn is not None:
+            conn.commit()
+        return updated
+    finally:
+        if conn is not None:
+            conn.close()
+
 def get_all_clients(limit: int = 2000):
     """Получить всех клиентов"""
     conn = get_db_connection()
@@ -367,15 +423,7 @@ def delete_client(instagram_id: str) -> bool:
         c.execute("DELETE FROM chat_history WHERE instagram_id = %s", (instagram_id,))
         c.execute("DELETE FROM booking_reminders_sent WHERE booking_id IN (SELECT id FROM bookings WHERE instagram_id = %s)", (instagram_id,))
         c.execute("DELETE FROM bookings WHERE instagram_id = %s", (instagram_id,))
-        c.execute(
-            """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = 'booking_drafts'
-              AND column_name IN ('instagram_id', 'client_id')
-            """
-        )
-        draft_columns = {row[0] for row in c.fetchall()}
+        draft_columns = get_table_columns("booking_drafts", c)
         if 'instagram_id' in draft_columns and 'client_id' in draft_columns:
             c.execute("DELETE FROM booking_drafts WHERE instagram_id = %s OR client_id = %s", (instagram_id, instagram_id))
         elif 'instagram_id' in draft_columns:
@@ -404,10 +452,49 @@ def delete_client(instagram_id: str) -> bool:
         conn.close()
         return False
 
+def resolve_conversation_company_id(client_id: Optional[str]) -> Optional[int]:
+    """
+    Компания диалога Instagram/Telegram: компания клиента, а для нового
+    клиента — основная компания развёртывания (аккаунты мессенджеров
+    настраиваются на развёртывание, а не на компанию).
+    """
+    cache_key = str(client_id or "")
+    cached = _conversation_companies.get(cache_key)
+    if cached is not None:
+        return cached
+
+    with platform_access():
+        conn = get_db_connection()
+        c = conn.cursor()
+        try:
+            c.execute("""
+                SELECT COALESCE(
+                    (SELECT company_id FROM clients
+                     WHERE instagram_id = %s AND company_id IS NOT NULL
+                     LIMIT 1),
+                    (SELECT id FROM companies
+                     WHERE deleted_at IS NULL
+                     ORDER BY id ASC
+                     LIMIT 1)
+                )
+            """, (cache_key,))
+            row = c.fetchone()
+        finally:
+            conn.close()
+
+    company_id = int(row[0]) if row and row[0] is not None else None
+    if company_id is not None:
+        _conversation_companies.set(cache_key, company_id)
+    return company_id
+
+def _invalidate_conversation_state(instagram_id: str) -> None:
+    from services.conversation_state import invalidate_conversation_state
+    invalidate_conversation_state(instagram_id)
+
 # ===== ЯЗЫКОВЫЕ ФУНКЦИИ =====
 
-def detect_and_save_language(instagram_id: str, message: str) -> str:
-    """Определить язык сообщения и сохранить для клиента"""
+def detect_language(message: str) -> str:
+    """Определить язык сообщения по преобладающему алфавиту (ru / ar / en)"""
     
     # Убираем смайлики и спецсимволы для чистого анализа
     clean_message = re.sub(r'[^\w\s]', '', message)
@@ -423,13 +510,16 @@ def detect_and_save_language(instagram_id: str, message: str) -> str:
     
     # Определяем язык по наибольшему количеству символов
     if cyrillic_count > arabic_count and cyrillic_count > latin_count:
-        language = 'ru'
+        return 'ru'
     elif arabic_count > cyrillic_count and arabic_count > latin_count:
-        language = 'ar'
+        return 'ar'
     elif latin_count > 0:  # Если есть хоть одна латинская буква
-        language = 'en'
-    else:
-        language = 'ru'  # По умолчанию русский
+        return 'en'
+    return 'ru'  # По умолчанию русский
+
+def detect_and_save_language(instagram_id: str, message: str) -> str:
+    """Определить язык сообщения и сохранить для клиента"""
+    language = detect_language(message)
     
     conn = get_db_connection()
     c = conn.cursor()
@@ -439,8 +529,9 @@ def detect_and_save_language(instagram_id: str, message: str) -> str:
     
     conn.commit()
     conn.close()
+    _invalidate_conversation_state(instagram_id)
     
-    log_info(f"✅ Language detected: {language} for {instagram_id} (cyr:{cyrillic_count}, ar:{arabic_count}, lat:{latin_count})", "database")
+    log_info(f"✅ Language detected: {language} for {instagram_id}", "database")
     
     return language
 
@@ -517,6 +608,7 @@ def update_client_bot_mode(instagram_id: str, mode: str) -> bool:
             (mode, instagram_id)
         )
         conn.commit()
+        _invalidate_conversation_state(instagram_id)
         log_info(f"✅ Режим бота обновлен: {instagram_id} -> {mode}", "database")
         return True
     except Exception as e:
@@ -757,16 +849,9 @@ def update_client_temperature(instagram_id: str):
     
     try:
         # Проверяем есть ли колонка temperature
-        c.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='clients'
-        """)
-        columns = [row[0] for row in c.fetchall()]
-        
-        if 'temperature' not in columns:
+        if not column_exists("clients", "temperature", c):
             # Добавляем колонку
-            c.execute("ALTER TABLE clients ADD COLUMN temperature TEXT DEFAULT 'cold'")
+            c.execute("ALTER TABLE clients ADD COLUMN IF NOT EXISTS temperature TEXT DEFAULT 'cold'")
         
         # Обновляем значение
         c.execute("""
@@ -790,15 +875,8 @@ def set_client_temperature(instagram_id: str, temperature: str) -> bool:
     
     try:
         # Проверяем есть ли колонка temperature
-        c.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='clients'
-        """)
-        columns = [row[0] for row in c.fetchall()]
-        
-        if 'temperature' not in columns:
-            c.execute("ALTER TABLE clients ADD COLUMN temperature TEXT DEFAULT 'cold'")
+        if not column_exists("clients", "temperature", c):
+            c.execute("ALTER TABLE clients ADD COLUMN IF NOT EXISTS temperature TEXT DEFAULT 'cold'")
         
         c.execute("""
             UPDATE clients 
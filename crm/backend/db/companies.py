@@ -10,6 +10,7 @@ import re
 from typing import Any, Optional
 
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.logger import log_error, log_info
 from utils.tenant_context import get_current_company_id
 
@@ -194,20 +195,6 @@ def _safe_float(value: Any, default: Optional[float] = None) -> Optional[float]:
         return default
 
 
-def _table_has_column(cursor, table_name: str, column_name: str) -> bool:
-    cursor.execute(
-        """
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = %s
-          AND column_name = %s
-        LIMIT 1
-        """,
-        (table_name, column_name),
-    )
-    return cursor.fetchone() is not None
-
-
 def _build_quota_error_detail(
     company_id: int,
     quota_key: str,
@@ -437,6 +424,23 @@ def get_company_by_access_code(access_code: str) -> Optional[dict[str, Any]]:
         conn.close()
 
 
+def get_company_by_slug(slug: str) -> Optional[dict[str, Any]]:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(
+            "SELECT * FROM companies WHERE LOWER(slug) = LOWER(%s) AND deleted_at IS NULL",
+            (slug,),
+        )
+        row = c.fetchone()
+        if not row:
+            return None
+        columns = [description[0] for description in c.description]
+        return _row_to_company_dict(columns, row)
+    finally:
+        conn.close()
+
+
 def get_current_company() -> Optional[dict[str, Any]]:
     company_id = get_current_company_id()
     if company_id is None:
@@ -1132,7 +1136,7 @@ def get_company_usage(company_id: int) -> dict[str, Any]:
         )
         storage_bytes += _safe_int(c.fetchone()[0], 0) or 0
 
-        if _table_has_column(c, "call_logs", "file_size"):
+        if column_exists("call_logs", "file_size", c):
             c.execute(
                 """
                 SELECT COALESCE(SUM(COALESCE(file_size, 0)), 0)
@@ -1488,7 +1492,7 @@ def update_company(company_id: int, data: dict[str, Any]) -> bool:
         params.append(company_id)
         c.execute(f"UPDATE companies SET {', '.join(updates)} WHERE id = %s AND deleted_at IS NULL", params)
         conn.commit()
-        return c.rowcount > 0
+        updated = c.rowcount > 0
     except Exception as e:
         conn.rollback()
         log_error(f"Error updating company {company_id}: {e}", "companies")
@@ -1496,6 +1500,12 @@ def update_company(company_id: int, data: dict[str, Any]) -> bool:
     finally:
         conn.close()
 
+    if updated:
+        # Настройки салона/бота кэшируются per company (db/settings.py)
+        from db.settings import invalidate_settings_cache
+        invalidate_settings_cache(company_id)
+    return updated
+
 
 def list_companies(
     search: str | None = None,
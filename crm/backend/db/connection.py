@@ -1,14 +1,26 @@
+import asyncio
+import bisect
 import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
 import psycopg2
+import psycopg2.extensions
 from psycopg2 import pool
 from psycopg2.extras import DictCursor, RealDictCursor
 from utils.logger import log_info, log_error, log_warning
+from utils.query_profiler import record_query
 
 # Global connection pool
 _connection_pool = None
 
 
-def _apply_tenant_session_context(raw_conn) -> None:
+def _tenant_session_settings() -> tuple:
     from utils.tenant_context import (
         get_current_company_id,
         get_current_user_id,
@@ -19,10 +31,31 @@ def _apply_tenant_session_context(raw_conn) -> None:
 
     company_id = get_current_company_id()
     user_id = get_current_user_id()
-    user_role = get_current_user_role() or ""
-    is_super_admin = is_super_admin_context()
-    tenant_bypass = is_tenant_bypass_enabled()
+    return (
+        str(company_id) if company_id else "",
+        str(user_id) if user_id else "",
+        get_current_user_role() or "",
+        "on" if is_super_admin_context() else "off",
+        "on" if is_tenant_bypass_enabled() else "off",
+    )
 
+
+def _apply_tenant_session_context(raw_conn) -> None:
+    """
+    Выставить tenant GUC на соединении. Значения кэшируются по соединению
+    пула: если контекст не изменился с прошлой выдачи, запрос не отправляется.
+    Изменённые значения пишутся вне транзакции (autocommit), чтобы их не
+    откатил rollback при возврате соединения в пул и кэш оставался верным.
+    """
+    settings = _tenant_session_settings()
+    pool_obj = _connection_pool
+    if pool_obj is not None and pool_obj.session_settings_current(raw_conn, settings):
+        return
+
+    idle = raw_conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    previous_autocommit = raw_conn.autocommit
+    if idle and not previous_autocommit:
+        raw_conn.autocommit = True
     cursor = raw_conn.cursor()
     try:
         cursor.execute(
@@ -34,16 +67,16 @@ def _apply_tenant_session_context(raw_conn) -> None:
                 set_config('app.is_super_admin', %s, false),
                 set_config('app.tenant_bypass', %s, false)
             """,
-            (
-                str(company_id) if company_id else "",
-                str(user_id) if user_id else "",
-                user_role,
-                "on" if is_super_admin else "off",
-                "on" if tenant_bypass else "off",
-            ),
+            settings,
         )
     finally:
         cursor.close()
+        if raw_conn.autocommit != previous_autocommit:
+            raw_conn.autocommit = previous_autocommit
+
+    if pool_obj is not None:
+        # Внутри открытой транзакции значения могут быть откатены — не кэшируем
+        pool_obj.remember_session_settings(raw_conn, settings if idle else None)
 
 
 def _read_int_env(name: str, default: int) -> int:
@@ -92,6 +125,290 @@ def _resolve_pool_bounds() -> tuple[int, int]:
     per_worker_min = _clamp_int(max(1, per_worker_max // 4), 1, per_worker_max)
     return per_worker_min, per_worker_max
 
+_WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+_HOLD_BUCKETS_MS = (5, 25, 100, 250, 1000, 2500, 10000, 30000, 60000)
+
+
+class _Histogram:
+    """Гистограмма с фиксированными корзинами (мс). Обновляется под локом пула."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, value_ms: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "buckets": buckets,
+        }
+
+
+class _PoolWaiter:
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.granted = False
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+
+def _resolve_waiter_future(future) -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+class FairConnectionPool:
+    """
+    Пул поверх psycopg2 ThreadedConnectionPool со справедливой FIFO-очередью.
+
+    Слот освобождённого соединения передаётся первому ожидающему (потоку или
+    корутине), а не тому, кто первым успеет повторить getconn: без опроса
+    через time.sleep и без обгона очереди. Асинхронные ожидающие ждут future
+    на своём loop, поэтому не блокируют event loop.
+    Ведёт метрики: занятость, очередь, гистограммы ожидания и удержания,
+    владельцев долгих и утёкших соединений.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = pool.ThreadedConnectionPool(minconn=minconn, maxconn=maxconn, **connect_kwargs)
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self._in_use = 0
+        self._checkouts = {}
+        self._session_state = {}
+        self._track_owners = os.getenv("DB_POOL_TRACK_OWNERS", "1").strip().lower() not in {"0", "false", "no", "off"}
+        self._leak_threshold_ms = max(1000, _read_int_env("DB_POOL_LEAK_MS", 30000))
+        self._leaks = deque(maxlen=20)
+        self._wait_histogram = _Histogram(_WAIT_BUCKETS_MS)
+        self._hold_histogram = _Histogram(_HOLD_BUCKETS_MS)
+        self._counters = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "event_loop_checkouts": 0,
+            "session_context_applied": 0,
+            "session_context_skipped": 0,
+            "leaks": 0,
+        }
+
+    # --- слоты ---
+
+    def _try_reserve_locked(self) -> bool:
+        if not self._waiters and self._in_use < self.maxconn:
+            self._in_use += 1
+            return True
+        return False
+
+    def _exhausted_error(self, timeout: float) -> pool.PoolError:
+        self._counters["timeouts"] += 1
+        return pool.PoolError(
+            f"connection pool exhausted: waited {timeout * 1000:.0f}ms "
+            f"(in_use={self._in_use}/{self.maxconn}, waiters={len(self._waiters)})"
+        )
+
+    def _acquire_slot(self, timeout: float) -> float:
+        started = time.monotonic()
+        with self._lock:
+            if self._try_reserve_locked():
+                self._wait_histogram.observe(0.0)
+                return 0.0
+            waiter = _PoolWaiter(event=threading.Event())
+            self._waiters.append(waiter)
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                raise self._exhausted_error(timeout)
+            waited_ms = (time.monotonic() - started) * 1000
+            self._wait_histogram.observe(waited_ms)
+        return waited_ms
+
+    async def _acquire_slot_async(self, timeout: float) -> float:
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_reserve_locked():
+                self._wait_histogram.observe(0.0)
+                return 0.0
+            waiter = _PoolWaiter(loop=loop, future=loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+                    raise self._exhausted_error(timeout)
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+                    raise
+            # Слот уже передан нам — возвращаем его следующему в очереди
+            self._release_slot()
+            raise
+
+        with self._lock:
+            waited_ms = (time.monotonic() - started) * 1000
+            self._wait_histogram.observe(waited_ms)
+        return waited_ms
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                if waiter.event is not None:
+                    waiter.event.set()
+                    return
+                try:
+                    waiter.loop.call_soon_threadsafe(_resolve_waiter_future, waiter.future)
+                    return
+                except RuntimeError:
+                    # loop ожидающего уже закрыт — отдаём слот следующему
+                    waiter.granted = False
+            self._in_use -= 1
+
+    # --- соединения ---
+
+    def _open_checkout(self, owner_frame):
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._release_slot()
+            raise
+
+        owner = None
+        if self._track_owners:
+            owner = traceback.StackSummary.extract(
+                traceback.walk_stack(owner_frame), limit=8, lookup_lines=False
+            )
+        with self._lock:
+            self._counters["checkouts"] += 1
+            self._checkouts[id(conn)] = (time.monotonic(), owner, threading.current_thread().name)
+        return conn
+
+    def getconn(self, timeout: float, owner_frame=None):
+        self._acquire_slot(timeout)
+        return self._open_checkout(owner_frame or sys._getframe(1))
+
+    async def getconn_async(self, timeout: float, owner_frame=None):
+        await self._acquire_slot_async(timeout)
+        return self._open_checkout(owner_frame or sys._getframe(1))
+
+    def putconn(self, conn, close: bool = False) -> None:
+        with self._lock:
+            checkout = self._checkouts.pop(id(conn), None)
+            if checkout is not None:
+                self._hold_histogram.observe((time.monotonic() - checkout[0]) * 1000)
+            if close or conn.closed:
+                self._session_state.pop(id(conn), None)
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._release_slot()
+
+    def note_leak(self, conn) -> None:
+        """Соединение собрано GC без close(): запоминаем владельца для /diagnostics/pool."""
+        with self._lock:
+            checkout = self._checkouts.get(id(conn))
+            self._counters["leaks"] += 1
+            self._leaks.append({
+                "detected_at": time.time(),
+                "held_ms": round((time.monotonic() - checkout[0]) * 1000, 1) if checkout else None,
+                "thread": checkout[2] if checkout else None,
+                "owner": _format_owner(checkout[1]) if checkout else None,
+            })
+
+    def note_event_loop_checkout(self) -> int:
+        with self._lock:
+            self._counters["event_loop_checkouts"] += 1
+            return self._counters["event_loop_checkouts"]
+
+    # --- tenant GUC ---
+
+    def session_settings_current(self, conn, settings: tuple) -> bool:
+        """True, если на этом серверном соединении уже выставлены те же GUC."""
+        state = self._session_state.get(id(conn))
+        current = state is not None and state == (conn.get_backend_pid(), settings)
+        with self._lock:
+            self._counters["session_context_skipped" if current else "session_context_applied"] += 1
+        return current
+
+    def remember_session_settings(self, conn, settings: Optional[tuple]) -> None:
+        if settings is None:
+            self._session_state.pop(id(conn), None)
+        else:
+            self._session_state[id(conn)] = (conn.get_backend_pid(), settings)
+
+    # --- метрики ---
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            held = sorted(
+                (((now - started) * 1000, owner, thread) for started, owner, thread in self._checkouts.values()),
+                key=lambda item: item[0],
+            )
+            long_held = [
+                {"held_ms": round(held_ms, 1), "thread": thread, "owner": _format_owner(owner)}
+                for held_ms, owner, thread in reversed(held)
+                if held_ms >= self._leak_threshold_ms
+            ]
+            return {
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._pool._pool),
+                "waiters": len(self._waiters),
+                "counters": dict(self._counters),
+                "wait_ms": self._wait_histogram.snapshot(),
+                "checkout_ms": self._hold_histogram.snapshot(),
+                "oldest_checkout_ms": round(held[-1][0], 1) if held else 0.0,
+                "leak_threshold_ms": self._leak_threshold_ms,
+                "long_held": long_held,
+                "recent_leaks": list(self._leaks),
+            }
+
+    def closeall(self) -> None:
+        with self._lock:
+            self._session_state.clear()
+            self._checkouts.clear()
+        self._pool.closeall()
+
+
+def _format_owner(owner) -> Optional[list]:
+    if not owner:
+        return None
+    return [f"{frame.filename}:{frame.lineno} in {frame.name}" for frame in owner]
+
+
+def _running_in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
 def init_connection_pool():
     """Initialize the connection pool if it doesn't exist.
 
@@ -108,7 +425,7 @@ def init_connection_pool():
         for attempt in range(max_retries):
             try:
                 minconn, maxconn = _resolve_pool_bounds()
-                _connection_pool = pool.ThreadedConnectionPool(
+                _connection_pool = FairConnectionPool(
                     minconn=minconn,
                     maxconn=maxconn,
                     host=os.getenv('POSTGRES_HOST', 'localhost'),
@@ -144,43 +461,41 @@ def init_connection_pool():
         raise last_error
 
 class CursorWrapper:
-    """Wrapper for psycopg2 cursor to provide consistent interface."""
+    """Wrapper for psycopg2 cursor to provide consistent interface.
+
+    Каждый execute/executemany передаётся в utils.query_profiler
+    (отпечатки, статистика по маршрутам, N+1, Server-Timing).
+    """
     def __init__(self, cursor, conn_obj):
         self._cursor = cursor
         self._conn_obj = conn_obj
 
+    def _observe(self, query, started: float, many: bool) -> None:
+        duration = (time.perf_counter() - started) * 1000
+        try:
+            rows = self._cursor.rowcount
+        except Exception:
+            rows = 0
+        record_query(query, duration, rows if rows and rows > 0 else 0, many=many)
+        if duration > 1000:
+            # Truncate query for logging
+            q_snippet = str(query)[:100].replace('\n', ' ')
+            label = "SLOW EXECUTEMANY" if many else "SLOW QUERY"
+            log_warning(f"🐢 {label} ({duration:.2f}ms): {q_snippet}...", "db_performance")
+
     def execute(self, query, params=None):
-        import time
-        from utils.logger import log_warning
-        
-        if query:
-            query = query.replace('%s', '%s')
-            
-        start_time = time.time()
+        started = time.perf_counter()
         try:
             return self._cursor.execute(query, params)
         finally:
-            duration = (time.time() - start_time) * 1000
-            if duration > 1000:
-                # Truncate query for logging
-                q_snippet = str(query)[:100].replace('\n', ' ')
-                log_warning(f"🐢 SLOW QUERY ({duration:.2f}ms): {q_snippet}...", "db_performance")
+            self._observe(query, started, many=False)
 
     def executemany(self, query, params=None):
-        import time
-        from utils.logger import log_warning
-        
-        if query:
-            query = query.replace('%s', '%s')
-            
-        start_time = time.time()
+        started = time.perf_counter()
         try:
             return self._cursor.executemany(query, params)
         finally:
-            duration = (time.time() - start_time) * 1000
-            if duration > 1000:
-                q_snippet = str(query)[:100].replace('\n', ' ')
-                log_warning(f"🐢 SLOW EXECUTEMANY ({duration:.2f}ms): {q_snippet}...", "db_performance")
+            self._observe(query, started, many=True)
 
     def __getattr__(self, name):
         return getattr(self._cursor, name)
@@ -229,6 +544,8 @@ class ConnectionWrapper:
     def __del__(self):
         if self._conn:
             try:
+                if self._from_pool and _connection_pool is not None:
+                    _connection_pool.note_leak(self._conn)
                 self.close()
             except Exception:
                 pass
@@ -246,11 +563,54 @@ class ConnectionWrapper:
         return False
 
 
+_LOOP_WAIT_LOG_EVERY = 1000
+
+
+def _pool_wait_timeout() -> float:
+    """
+    Сколько ждать свободное соединение: DB_POOL_WAIT_MS (750 мс по умолчанию).
+
+    Вызов прямо на event loop ждёт не дольше DB_POOL_LOOP_WAIT_MS (100 мс):
+    при исчерпанном пуле такой вызов получает PoolError раньше, чем из потока.
+    Первое и каждое 1000-е такое ожидание логируется с местом вызова.
+    """
+    wait_timeout_ms = max(50, _read_int_env("DB_POOL_WAIT_MS", 750))
+    if _running_in_event_loop():
+        # Синхронное ожидание на event loop останавливает весь воркер: ждём меньше
+        loop_wait_ms = min(wait_timeout_ms, max(10, _read_int_env("DB_POOL_LOOP_WAIT_MS", 100)))
+        checkouts = _connection_pool.note_event_loop_checkout()
+        if loop_wait_ms < wait_timeout_ms and checkouts % _LOOP_WAIT_LOG_EVERY == 1:
+            caller = sys._getframe(2)
+            log_warning(
+                f"⏱️ get_db_connection() on the event loop at {caller.f_code.co_filename}:{caller.f_lineno}: "
+                f"pool wait shortened to {loop_wait_ms}ms (DB_POOL_LOOP_WAIT_MS) from {wait_timeout_ms}ms, "
+                f"event-loop checkouts so far: {checkouts}; use run_blocking() or get_db_connection_async()",
+                "db",
+            )
+        wait_timeout_ms = loop_wait_ms
+    return wait_timeout_ms / 1000.0
+
+
+def _checkout_with_context(raw_conn, start_time: float) -> "ConnectionWrapper":
+    try:
+        _apply_tenant_session_context(raw_conn)
+    except Exception:
+        _connection_pool.putconn(raw_conn, close=True)
+        raise
+    duration = (time.monotonic() - start_time) * 1000
+    if duration > 100:
+        log_warning(f"🕒 Connection acquisition took {duration:.2f}ms", "db")
+    return ConnectionWrapper(raw_conn, from_pool=True)
+
+
 def get_db_connection():
     """Get a database connection from the pool.
 
-    IMPORTANT: Do NOT wrap pool.getconn() in threads/timeouts.
-    If the pool is exhausted, psycopg2 raises PoolError; it does not "hang".
+    Waiters are served in FIFO order (FairConnectionPool); PoolError is raised
+    after DB_POOL_WAIT_MS (DB_POOL_LOOP_WAIT_MS when called on the event loop).
+    Coroutines should prefer `await get_db_connection_async()`.
+
+    IMPORTANT: Do NOT wrap pool checkout in threads/timeouts.
     Thread-based timeouts can leak connections (a background thread may still
     acquire a connection and never return it).
     """
@@ -258,33 +618,74 @@ def get_db_connection():
     if _connection_pool is None:
         init_connection_pool()
 
-    import time
-    start_time = time.time()
+    start_time = time.monotonic()
+    wait_timeout = _pool_wait_timeout()
     try:
-        wait_timeout_ms = max(50, _read_int_env("DB_POOL_WAIT_MS", 750))
-        retry_interval_ms = _clamp_int(_read_int_env("DB_POOL_RETRY_MS", 25), 10, 250)
-        deadline = time.monotonic() + (wait_timeout_ms / 1000.0)
-
-        while True:
-            try:
-                conn = _connection_pool.getconn()
-                _apply_tenant_session_context(conn)
-                duration = (time.time() - start_time) * 1000
-                if duration > 100:
-                    log_warning(f"🕒 Connection acquisition took {duration:.2f}ms", "db")
-                return ConnectionWrapper(conn, from_pool=True)
-            except pool.PoolError as error:
-                if time.monotonic() >= deadline:
-                    raise
-                time.sleep(retry_interval_ms / 1000.0)
+        raw_conn = _connection_pool.getconn(wait_timeout, owner_frame=sys._getframe(1))
+        return _checkout_with_context(raw_conn, start_time)
     except pool.PoolError as e:
-        duration = (time.time() - start_time) * 1000
-        log_error(f"❌ Connection pool exhausted after {duration:.2f}ms: {e}", "db")
+        duration = (time.monotonic() - start_time) * 1000
+        log_error(
+            f"❌ Connection pool exhausted after {duration:.2f}ms (wait limit {wait_timeout * 1000:.0f}ms): {e}",
+            "db",
+        )
         raise
     except Exception as e:
         log_error(f"Failed to get connection from pool: {e}", "db")
         raise
 
+
+async def get_db_connection_async():
+    """Awaitable checkout: ожидание свободного слота не блокирует event loop.
+
+    После получения слота соединение выдаётся синхронно: свободное соединение
+    берётся из пула без I/O, а tenant GUC обычно не меняются (кэш по соединению).
+    Сетевой запрос возможен только при росте пула или смене tenant context.
+    """
+    if _connection_pool is None:
+        from utils.blocking import run_blocking
+        await run_blocking(init_connection_pool)
+
+    start_time = time.monotonic()
+    wait_timeout = max(50, _read_int_env("DB_POOL_WAIT_MS", 750)) / 1000.0
+    try:
+        raw_conn = await _connection_pool.getconn_async(wait_timeout, owner_frame=sys._getframe(1))
+        return _checkout_with_context(raw_conn, start_time)
+    except pool.PoolError as e:
+        duration = (time.monotonic() - start_time) * 1000
+        log_error(f"❌ Connection pool exhausted after {duration:.2f}ms: {e}", "db")
+        raise
+
+
+@asynccontextmanager
+async def async_db_connection():
+    """
+    Usage:
+        async with async_db_connection() as conn:
+            c = conn.cursor()
+            ...
+    """
+    conn = await get_db_connection_async()
+    try:
+        yield conn
+    except BaseException:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        conn.close()
+
+
+def get_pool_metrics() -> dict:
+    """Живые метрики пула текущего воркера (для /diagnostics/pool)."""
+    if _connection_pool is None:
+        return {"initialized": False, "pid": os.getpid()}
+    snapshot = _connection_pool.snapshot()
+    snapshot.update({"initialized": True, "pid": os.getpid()})
+    return snapshot
+
 def get_cursor(conn, dict_cursor=False):
     """Get a cursor from connection"""
     if dict_cursor:
@@ -8,6 +8,7 @@ from typing import Optional, List
 from core.config import DATABASE_NAME
 from db.companies import ensure_company_quota
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists, get_table_columns
 from utils.tenant_context import get_current_company_id
 
 def get_avatar_url(profile_pic: Optional[str], gender: Optional[str] = 'female') -> str:
@@ -38,12 +39,7 @@ def get_all_employees(active_only=True, service_providers_only=False):
     c = conn.cursor()
 
     # Check if is_service_provider column exists
-    c.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='users'
-    """)
-    columns = [row[0] for row in c.fetchall()]
+    columns = get_table_columns("users", c)
     
     if 'is_service_provider' in columns:
         # Для бронирования: только те у кого role='employee' или secondary_role='employee'
@@ -226,12 +222,7 @@ def get_employee_services(employee_id: int):
     c = conn.cursor()
     
     # Check if new columns exist in user_services
-    c.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='user_services'
-    """)
-    us_columns = [row[0] for row in c.fetchall()]
+    us_columns = get_table_columns("user_services", c)
     
     has_settings = 'price' in us_columns
     
@@ -316,12 +307,7 @@ def add_employee_service(employee_id: int, service_id: int,
     c = conn.cursor()
     
     # Check if new columns exist
-    c.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='user_services'
-    """)
-    us_columns = [row[0] for row in c.fetchall()]
+    us_columns = get_table_columns("user_services", c)
     
     has_settings = 'price' in us_columns
     
@@ -368,19 +354,10 @@ def get_employees_by_service(service_id: int):
     c = conn.cursor()
 
     # Check if new columns exist in user_services
-    c.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name='user_services'
-    """)
-    us_columns = [row[0] for row in c.fetchall()]
+    us_columns = get_table_columns("user_services", c)
 
     # Check if secondary_role column exists in users
-    c.execute("""
-        SELECT COUNT(*) FROM information_schema.columns
-        WHERE table_name = 'users' AND column_name = 'secondary_role'
-    """)
-    has_secondary_role = c.fetchone()[0] > 0
+    has_secondary_role = column_exists("users", "secondary_role", c)
 
     has_settings = 'price' in us_columns
     role_condition = "(u.role = 'employee' OR u.secondary_role = 'employee')" if has_secondary_role else "u.role = 'employee'"
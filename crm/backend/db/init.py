@@ -4,6 +4,7 @@
 """
 from core.config import APP_NAME, SALON_CURRENCY_DEFAULT
 from db.connection import get_db_connection
+from db.schema_catalog import load_schema_columns, invalidate_schema_catalog
 from utils.logger import log_info, log_error
 import os
 import re
@@ -22,8 +23,15 @@ def init_database():
         conn.close()
         return
 
+    # Снимок колонок на старте: на уже развёрнутой БД почти все add_column_if_not_exists
+    # заканчиваются без запросов. Промах проверяется по-старому (таблица могла
+    # появиться в этой же транзакции) и дописывается в снимок.
+    known_columns = {table: set(columns) for table, columns in load_schema_columns(c).items()}
+
     def add_column_if_not_exists(table, column, definition):
         """Add column if it doesn't exist - uses main cursor to see uncommitted tables"""
+        if column in known_columns.get(table, ()):
+            return
         try:
             # Use main cursor (c) to see tables created in current transaction
             # Check if column already exists
@@ -34,6 +42,7 @@ def init_database():
                 )
             """, (table, column))
             if c.fetchone()[0]:
+                known_columns.setdefault(table, set()).add(column)
                 return  # Column already exists, skip
 
             # Check if table exists
@@ -48,12 +57,16 @@ def init_database():
 
             # Add the column
             c.execute("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}".format(table, column, definition))
+            known_columns.setdefault(table, set()).add(column)
         except Exception as e:
             log_error(f"Ошибка при добавлении колонки {column} в {table}: {e}", "db")
 
     def set_column_default_if_exists(table, column, default_sql):
         """Set a column default when both table and column already exist."""
         try:
+            if column in known_columns.get(table, ()):
+                c.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT {default_sql}")
+                return
             c.execute("""
                 SELECT EXISTS (
                     SELECT FROM information_schema.columns
@@ -107,6 +120,312 @@ def init_database():
         except Exception as e:
             log_error(f"Ошибка настройки tenant policy для {table_name}: {e}", "db")
 
+    def _ensure_client_aggregates():
+        """
+        Счётчики клиента (входящие сообщения, активные записи, выручка) поддерживаются
+        триггерами, чтобы список клиентов не агрегировал chat_history/messenger_messages/bookings.
+        """
+        c.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'trg_bookings_client_aggregates'")
+        needs_backfill = c.fetchone() is None
+
+        c.execute("SAVEPOINT client_aggregates")
+        try:
+            c.execute("""
+                CREATE OR REPLACE FUNCTION clients_chat_history_aggregate() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP <> 'INSERT' AND OLD.sender = 'client' AND OLD.instagram_id IS NOT NULL THEN
+                        UPDATE clients
+                        SET inbound_messages_count = GREATEST(COALESCE(inbound_messages_count, 0) - 1, 0)
+                        WHERE instagram_id = OLD.instagram_id;
+                    END IF;
+                    IF TG_OP <> 'DELETE' AND NEW.sender = 'client' AND NEW.instagram_id IS NOT NULL THEN
+                        UPDATE clients
+                        SET inbound_messages_count = COALESCE(inbound_messages_count, 0) + 1
+                        WHERE instagram_id = NEW.instagram_id;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            c.execute("""
+                CREATE OR REPLACE FUNCTION clients_messenger_messages_aggregate() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP <> 'INSERT' AND OLD.sender_type = 'client' AND OLD.client_id IS NOT NULL THEN
+                        UPDATE clients
+                        SET inbound_messages_count = GREATEST(COALESCE(inbound_messages_count, 0) - 1, 0)
+                        WHERE instagram_id = OLD.client_id;
+                    END IF;
+                    IF TG_OP <> 'DELETE' AND NEW.sender_type = 'client' AND NEW.client_id IS NOT NULL THEN
+                        UPDATE clients
+                        SET inbound_messages_count = COALESCE(inbound_messages_count, 0) + 1
+                        WHERE instagram_id = NEW.client_id;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            c.execute("""
+                CREATE OR REPLACE FUNCTION clients_bookings_aggregate() RETURNS trigger AS $$
+                DECLARE
+                    old_active BOOLEAN := FALSE;
+                    new_active BOOLEAN := FALSE;
+                BEGIN
+                    IF TG_OP <> 'INSERT' THEN
+                        old_active := OLD.instagram_id IS NOT NULL
+                            AND COALESCE(OLD.status, '') <> 'cancelled'
+                            AND OLD.deleted_at IS NULL;
+                    END IF;
+                    IF TG_OP <> 'DELETE' THEN
+                        new_active := NEW.instagram_id IS NOT NULL
+                            AND COALESCE(NEW.status, '') <> 'cancelled'
+                            AND NEW.deleted_at IS NULL;
+                    END IF;
+                    IF TG_OP = 'UPDATE' AND old_active = new_active
+                       AND OLD.instagram_id IS NOT DISTINCT FROM NEW.instagram_id
+                       AND OLD.revenue IS NOT DISTINCT FROM NEW.revenue THEN
+                        RETURN NULL;
+                    END IF;
+                    IF old_active THEN
+                        UPDATE clients
+                        SET active_bookings_count = GREATEST(COALESCE(active_bookings_count, 0) - 1, 0),
+                            active_bookings_spend = COALESCE(active_bookings_spend, 0) - COALESCE(OLD.revenue, 0)
+                        WHERE instagram_id = OLD.instagram_id;
+                    END IF;
+                    IF new_active THEN
+                        UPDATE clients
+                        SET active_bookings_count = COALESCE(active_bookings_count, 0) + 1,
+                            active_bookings_spend = COALESCE(active_bookings_spend, 0) + COALESCE(NEW.revenue, 0)
+                        WHERE instagram_id = NEW.instagram_id;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            triggers = (
+                ('trg_chat_history_client_aggregates', 'chat_history', 'sender, instagram_id', 'clients_chat_history_aggregate'),
+                ('trg_messenger_messages_client_aggregates', 'messenger_messages', 'sender_type, client_id', 'clients_messenger_messages_aggregate'),
+                ('trg_bookings_client_aggregates', 'bookings', 'instagram_id, status, deleted_at, revenue', 'clients_bookings_aggregate'),
+            )
+            for trigger_name, table_name, watched_columns, function_name in triggers:
+                c.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table_name}")
+                c.execute(f"""
+                    CREATE TRIGGER {trigger_name}
+                    AFTER INSERT OR DELETE OR UPDATE OF {watched_columns} ON {table_name}
+                    FOR EACH ROW EXECUTE PROCEDURE {function_name}()
+                """)
+
+            if needs_backfill:
+                from db.clients import rebuild_client_aggregates
+                rebuild_client_aggregates(cursor=c)
+                log_info("✅ Client aggregates backfilled", "db")
+            c.execute("RELEASE SAVEPOINT client_aggregates")
+        except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT client_aggregates")
+            log_error(f"Ошибка настройки агрегатов клиентов: {e}", "db")
+
+    def _ensure_analytics_rollup_hooks():
+        """
+        Триггеры ставят затронутые дни в analytics_rollup_queue; роллапы
+        пересчитывает db.analytics_rollups.run_analytics_rollups_job.
+        DO UPDATE (а не DO NOTHING) держит блокировку строки дня до конца
+        транзакции записи: захват дня (SKIP LOCKED) её пропустит.
+        """
+        c.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'trg_bookings_analytics_rollups'")
+        needs_backfill = c.fetchone() is None
+
+        c.execute("SAVEPOINT analytics_rollup_hooks")
+        try:
+            c.execute("""
+                CREATE OR REPLACE FUNCTION analytics_rollups_mark_booking() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP <> 'INSERT' THEN
+                        INSERT INTO analytics_rollup_queue (day)
+                        SELECT DISTINCT day FROM (VALUES (OLD.created_at::date), (OLD.datetime::date)) AS v(day)
+                        WHERE day IS NOT NULL
+                        ON CONFLICT (day) DO UPDATE SET queued_at = NOW();
+                    END IF;
+                    IF TG_OP <> 'DELETE' THEN
+                        INSERT INTO analytics_rollup_queue (day)
+                        SELECT DISTINCT day FROM (VALUES (NEW.created_at::date), (NEW.datetime::date)) AS v(day)
+                        WHERE day IS NOT NULL
+                        ON CONFLICT (day) DO UPDATE SET queued_at = NOW();
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            c.execute("""
+                CREATE OR REPLACE FUNCTION analytics_rollups_mark_message() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP <> 'INSERT' AND OLD.timestamp IS NOT NULL THEN
+                        INSERT INTO analytics_rollup_queue (day) VALUES (OLD.timestamp::date)
+                        ON CONFLICT (day) DO UPDATE SET queued_at = NOW();
+                    END IF;
+                    IF TG_OP <> 'DELETE' AND NEW.timestamp IS NOT NULL THEN
+                        INSERT INTO analytics_rollup_queue (day) VALUES (NEW.timestamp::date)
+                        ON CONFLICT (day) DO UPDATE SET queued_at = NOW();
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            triggers = (
+                ('trg_bookings_analytics_rollups', 'bookings',
+                 'company_id, instagram_id, service_name, master, datetime, status, revenue, created_at',
+                 'analytics_rollups_mark_booking'),
+                ('trg_chat_history_analytics_rollups', 'chat_history',
+                 'company_id, instagram_id, sender, timestamp',
+                 'analytics_rollups_mark_message'),
+            )
+            for trigger_name, table_name, watched_columns, function_name in triggers:
+                c.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table_name}")
+                c.execute(f"""
+                    CREATE TRIGGER {trigger_name}
+                    AFTER INSERT OR DELETE OR UPDATE OF {watched_columns} ON {table_name}
+                    FOR EACH ROW EXECUTE PROCEDURE {function_name}()
+                """)
+
+            if needs_backfill:
+                # Все дни с данными читаются из сырых таблиц, пока задача их не пересчитает
+                from db.analytics_rollups import rebuild_analytics_rollups
+                rebuild_analytics_rollups(cursor=c)
+                log_info("✅ Analytics rollup backfill queued", "db")
+            c.execute("RELEASE SAVEPOINT analytics_rollup_hooks")
+        except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT analytics_rollup_hooks")
+            log_error(f"Ошибка настройки роллапов аналитики: {e}", "db")
+
+    def _ensure_bot_catalog_hooks():
+        """
+        Версия каталога (услуги, мастера, их услуги) для кэша секций промпта
+        бота (bot/prompt_cache.py): любая значимая запись увеличивает версию компании.
+        """
+        c.execute("SAVEPOINT bot_catalog_hooks")
+        try:
+            c.execute("""
+                CREATE OR REPLACE FUNCTION bot_catalog_bump_version() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP <> 'INSERT' AND OLD.company_id IS NOT NULL THEN
+                        INSERT INTO bot_catalog_versions (company_id, version, updated_at)
+                        VALUES (OLD.company_id, 1, NOW())
+                        ON CONFLICT (company_id) DO UPDATE
+                        SET version = bot_catalog_versions.version + 1, updated_at = NOW();
+                    END IF;
+                    IF TG_OP <> 'DELETE' AND NEW.company_id IS NOT NULL
+                       AND (TG_OP = 'INSERT' OR NEW.company_id IS DISTINCT FROM OLD.company_id) THEN
+                        INSERT INTO bot_catalog_versions (company_id, version, updated_at)
+                        VALUES (NEW.company_id, 1, NOW())
+                        ON CONFLICT (company_id) DO UPDATE
+                        SET version = bot_catalog_versions.version + 1, updated_at = NOW();
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            triggers = (
+                ('trg_services_bot_catalog', 'services',
+                 'company_id, name, category, price, min_price, max_price, currency, duration, is_active'),
+                ('trg_users_bot_catalog', 'users',
+                 'company_id, full_name, position, experience, years_of_experience, role, secondary_role, '
+                 'is_service_provider, is_active, deleted_at'),
+                ('trg_user_services_bot_catalog', 'user_services', None),
+            )
+            for trigger_name, table_name, watched_columns in triggers:
+                events = f"INSERT OR DELETE OR UPDATE OF {watched_columns}" if watched_columns else "INSERT OR DELETE OR UPDATE"
+                c.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table_name}")
+                c.execute(f"""
+                    CREATE TRIGGER {trigger_name}
+                    AFTER {events} ON {table_name}
+                    FOR EACH ROW EXECUTE PROCEDURE bot_catalog_bump_version()
+                """)
+            c.execute("RELEASE SAVEPOINT bot_catalog_hooks")
+        except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT bot_catalog_hooks")
+            log_error(f"Ошибка настройки версий каталога бота: {e}", "db")
+
+    def _ensure_search_indexes():
+        """
+        Полнотекстовый (tsvector, конфигурация 'simple') и нечёткий (pg_trgm) поиск
+        по клиентам, сообщениям и записям (db/search.py). Колонки заполняются
+        BEFORE-триггерами, поэтому индексы обновляются инкрементально при записи.
+        """
+        c.execute("SAVEPOINT search_trgm")
+        try:
+            c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            c.execute("RELEASE SAVEPOINT search_trgm")
+        except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT search_trgm")
+            log_error(f"pg_trgm недоступен, нечёткий поиск отключён: {e}", "db")
+        c.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        trgm_available = c.fetchone() is not None
+
+        c.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'trg_chat_history_search'")
+        needs_backfill = c.fetchone() is None
+
+        c.execute("SAVEPOINT search_indexes")
+        try:
+            c.execute("""
+                CREATE OR REPLACE FUNCTION clients_search_refresh() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_text := LOWER(CONCAT_WS(' ', NEW.name, NEW.username, NEW.instagram_id, NEW.email));
+                    NEW.search_vector := to_tsvector('simple', NEW.search_text);
+                    NEW.phone_digits := NULLIF(regexp_replace(COALESCE(NEW.phone, ''), '[^0-9]', '', 'g'), '');
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            c.execute("""
+                CREATE OR REPLACE FUNCTION chat_history_search_refresh() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector := to_tsvector('simple', COALESCE(NEW.message, ''));
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            c.execute("""
+                CREATE OR REPLACE FUNCTION bookings_search_refresh() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector := to_tsvector('simple', LOWER(CONCAT_WS(' ', NEW.service_name, NEW.name)));
+                    NEW.phone_digits := NULLIF(regexp_replace(COALESCE(NEW.phone, ''), '[^0-9]', '', 'g'), '');
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            triggers = (
+                ('trg_clients_search', 'clients', 'name, username, instagram_id, email, phone', 'clients_search_refresh'),
+                ('trg_chat_history_search', 'chat_history', 'message', 'chat_history_search_refresh'),
+                ('trg_bookings_search', 'bookings', 'service_name, name, phone', 'bookings_search_refresh'),
+            )
+            for trigger_name, table_name, watched_columns, function_name in triggers:
+                c.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table_name}")
+                c.execute(f"""
+                    CREATE TRIGGER {trigger_name}
+                    BEFORE INSERT OR UPDATE OF {watched_columns} ON {table_name}
+                    FOR EACH ROW EXECUTE PROCEDURE {function_name}()
+                """)
+
+            if needs_backfill:
+                # "Пустые" UPDATE прогоняют существующие строки через триггеры выше
+                c.execute("UPDATE clients SET name = name")
+                c.execute("UPDATE bookings SET name = name")
+                c.execute("UPDATE chat_history SET message = message")
+                log_info("✅ Search columns backfilled", "db")
+
+            c.execute("CREATE INDEX IF NOT EXISTS idx_clients_search_vector ON clients USING GIN (search_vector)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_search_vector ON chat_history USING GIN (search_vector)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_search_vector ON bookings USING GIN (search_vector)")
+            if trgm_available:
+                c.execute("CREATE INDEX IF NOT EXISTS idx_clients_search_text_trgm ON clients USING GIN (search_text gin_trgm_ops)")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_clients_phone_digits_trgm ON clients USING GIN (phone_digits gin_trgm_ops)")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_phone_digits_trgm ON bookings USING GIN (phone_digits gin_trgm_ops)")
+            else:
+                c.execute("CREATE INDEX IF NOT EXISTS idx_clients_phone_digits ON clients (phone_digits text_pattern_ops)")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_phone_digits ON bookings (phone_digits text_pattern_ops)")
+            c.execute("RELEASE SAVEPOINT search_indexes")
+        except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT search_indexes")
+            log_error(f"Ошибка настройки поисковых индексов: {e}", "db")
+
     def ensure_fk_cascade(table, column, ref_table, ref_column):
         """Гарантирует, что внешний ключ имеет ON DELETE CASCADE"""
         try:
@@ -354,6 +673,29 @@ def init_database():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )''')
 
+        # Очередь рассылок (services/broadcast_engine.py): аренда + чекпоинт для возобновления
+        c.execute('''CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id SERIAL PRIMARY KEY,
+            company_id INTEGER,
+            sender_id INTEGER,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total_targets INTEGER,
+            sent_count INTEGER DEFAULT 0,
+            failed_count INTEGER DEFAULT 0,
+            checkpoint JSONB,
+            attempts INTEGER DEFAULT 0,
+            locked_by TEXT,
+            heartbeat_at TIMESTAMP,
+            error TEXT,
+            history_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_active ON broadcast_jobs (id) WHERE status IN ('queued', 'running')")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_company ON broadcast_jobs (company_id, id DESC)")
+
         # Scheduled Notifications Queue
         c.execute('''CREATE TABLE IF NOT EXISTS notification_history (
             id SERIAL PRIMARY KEY,
@@ -935,6 +1277,14 @@ def init_database():
         add_column_if_not_exists('clients', 'telegram_id', 'TEXT')
         add_column_if_not_exists('clients', 'pipeline_stage_id', 'INTEGER')
         add_column_if_not_exists('clients', 'user_id', 'INTEGER')  # Связь с зарегистрированным пользователем
+        # Поддерживаются триггерами (_ensure_client_aggregates)
+        add_column_if_not_exists('clients', 'inbound_messages_count', 'INTEGER DEFAULT 0')
+        add_column_if_not_exists('clients', 'active_bookings_count', 'INTEGER DEFAULT 0')
+        add_column_if_not_exists('clients', 'active_bookings_spend', 'REAL DEFAULT 0')
+        # Поиск (_ensure_search_indexes, db/search.py)
+        add_column_if_not_exists('clients', 'search_text', 'TEXT')
+        add_column_if_not_exists('clients', 'search_vector', 'TSVECTOR')
+        add_column_if_not_exists('clients', 'phone_digits', 'TEXT')
 
         c.execute('''CREATE TABLE IF NOT EXISTS chat_history (
             id SERIAL PRIMARY KEY,
@@ -949,6 +1299,7 @@ def init_database():
         )''')
         add_column_if_not_exists('chat_history', 'company_id', 'INTEGER REFERENCES companies(id) ON DELETE CASCADE')
         add_column_if_not_exists('chat_history', 'language', 'TEXT')
+        add_column_if_not_exists('chat_history', 'search_vector', 'TSVECTOR')
         c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_instagram_id ON chat_history(instagram_id)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_company_id ON chat_history(company_id)")
 
@@ -991,6 +1342,8 @@ def init_database():
         add_column_if_not_exists('bookings', 'user_id', 'INTEGER')
         add_column_if_not_exists('bookings', 'master_user_id', 'INTEGER REFERENCES users(id)')
         add_column_if_not_exists('bookings', 'promo_code', 'TEXT')
+        add_column_if_not_exists('bookings', 'search_vector', 'TSVECTOR')
+        add_column_if_not_exists('bookings', 'phone_digits', 'TEXT')
         c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_master_user_id_datetime ON bookings (master_user_id, datetime)")
 
         c.execute('''CREATE TABLE IF NOT EXISTS ratings (
@@ -1016,6 +1369,8 @@ def init_database():
         c.execute("CREATE INDEX IF NOT EXISTS idx_clients_phone ON clients (phone)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_clients_name ON clients (name)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_clients_created_at ON clients (created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_instagram_id ON bookings (instagram_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_master ON bookings (master)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_ratings_created_at ON ratings (created_at)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_ratings_instagram_id ON ratings (instagram_id)")
 
@@ -2340,6 +2695,27 @@ def init_database():
               AND ch.company_id IS NOT NULL
         """)
 
+        # Keyset-пагинация списка клиентов (выражения совпадают с crm_api/clients.py)
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_clients_list_last_contact ON clients (
+                company_id,
+                COALESCE(is_pinned, FALSE) DESC,
+                COALESCE(last_contact, TIMESTAMP '1970-01-01') DESC,
+                instagram_id DESC
+            ) WHERE deleted_at IS NULL
+        """)
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_clients_list_created_at ON clients (
+                company_id,
+                COALESCE(is_pinned, FALSE) DESC,
+                COALESCE(created_at, TIMESTAMP '1970-01-01') DESC,
+                instagram_id DESC
+            ) WHERE deleted_at IS NULL
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_messenger_messages_client_type ON messenger_messages (client_id, messenger_type)")
+        _ensure_client_aggregates()
+        _ensure_search_indexes()
+
         # --- 7. DEFAULT DATA SYNC ---
 
         # Stages
@@ -3037,6 +3413,87 @@ def init_database():
         )''')
         c.execute("CREATE INDEX IF NOT EXISTS idx_webhook_logs_wh ON webhook_logs(webhook_id)")
 
+        # Outbox исходящих вебхуков: строка пишется в транзакции бизнес-изменения,
+        # доставляет services.webhook_dispatcher
+        c.execute('''CREATE TABLE IF NOT EXISTS webhook_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            company_id INTEGER REFERENCES companies(id) ON DELETE CASCADE,
+            webhook_id INTEGER REFERENCES webhooks(id) ON DELETE CASCADE,
+            event TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            locked_by TEXT,
+            locked_until TIMESTAMP,
+            last_status_code INTEGER,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            delivered_at TIMESTAMP
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due ON webhook_outbox (next_attempt_at, id) WHERE status = 'pending'")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_webhook_outbox_leased ON webhook_outbox (locked_until) WHERE status = 'delivering'")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_webhook_outbox_webhook ON webhook_outbox (webhook_id, status)")
+
+        # Очередь входящих событий Instagram (services.instagram_inbox): уникальный mid —
+        # дедупликация повторных доставок Meta между воркерами
+        c.execute('''CREATE TABLE IF NOT EXISTS instagram_inbox (
+            id BIGSERIAL PRIMARY KEY,
+            mid TEXT,
+            conversation_id TEXT NOT NULL,
+            event JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            locked_by TEXT,
+            locked_until TIMESTAMP,
+            last_error TEXT,
+            received_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            started_at TIMESTAMP,
+            processed_at TIMESTAMP
+        )''')
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_instagram_inbox_mid ON instagram_inbox (mid)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_instagram_inbox_open ON instagram_inbox (conversation_id, id) WHERE status IN ('pending', 'processing')")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_instagram_inbox_received ON instagram_inbox (received_at) WHERE status IN ('done', 'failed')")
+
+        # Дневные роллапы аналитики (db.analytics_rollups): дашборды читают их
+        # вместо сырых bookings/chat_history; дни из очереди считаются по сырым таблицам
+        c.execute('''CREATE TABLE IF NOT EXISTS analytics_booking_rollups (
+            company_id INTEGER REFERENCES companies(id) ON DELETE CASCADE,
+            basis TEXT NOT NULL,
+            day DATE NOT NULL,
+            master TEXT NOT NULL DEFAULT '',
+            service_name TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT '',
+            hour SMALLINT,
+            weekday SMALLINT,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            paid_bookings INTEGER NOT NULL DEFAULT 0,
+            revenue DOUBLE PRECISION NOT NULL DEFAULT 0
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_analytics_booking_rollups_day ON analytics_booking_rollups (company_id, basis, day)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_analytics_booking_rollups_refresh ON analytics_booking_rollups (day)")
+        c.execute('''CREATE TABLE IF NOT EXISTS analytics_client_rollups (
+            company_id INTEGER REFERENCES companies(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            new_clients INTEGER NOT NULL DEFAULT 0,
+            returning_clients INTEGER NOT NULL DEFAULT 0,
+            client_messages INTEGER NOT NULL DEFAULT 0,
+            bot_messages INTEGER NOT NULL DEFAULT 0,
+            responses INTEGER NOT NULL DEFAULT 0,
+            response_seconds DOUBLE PRECISION NOT NULL DEFAULT 0
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_analytics_client_rollups_day ON analytics_client_rollups (company_id, day)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_analytics_client_rollups_refresh ON analytics_client_rollups (day)")
+        c.execute('''CREATE TABLE IF NOT EXISTS analytics_rollup_queue (
+            day DATE PRIMARY KEY,
+            queued_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp ON chat_history (timestamp)")
+        _ensure_company_rls('analytics_booking_rollups')
+        _ensure_company_rls('analytics_client_rollups')
+        _ensure_analytics_rollup_hooks()
+
         # ─── Feature 6: Recurring Bookings ───────────────────────────────────────
         c.execute('''CREATE TABLE IF NOT EXISTS recurring_bookings (
             id SERIAL PRIMARY KEY,
@@ -3093,6 +3550,40 @@ def init_database():
             UNIQUE(company_id, client_instagram_id)
         )''')
         c.execute("CREATE INDEX IF NOT EXISTS idx_scores_company ON client_scores(company_id)")
+        # Последний прогон скоринга компании (services.client_scoring): отпечаток
+        # завершённых записей — пересчёт только при изменениях или смене дня
+        c.execute('''CREATE TABLE IF NOT EXISTS client_scoring_runs (
+            company_id INTEGER PRIMARY KEY REFERENCES companies(id) ON DELETE CASCADE,
+            fingerprint TEXT,
+            scored_on DATE,
+            clients INTEGER DEFAULT 0,
+            duration_ms INTEGER DEFAULT 0,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+        # Версия каталога компании для кэша секций промпта бота. Без FK на companies:
+        # триггер срабатывает и при каскадном удалении сотрудников/услуг компании
+        c.execute('''CREATE TABLE IF NOT EXISTS bot_catalog_versions (
+            company_id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        _ensure_bot_catalog_hooks()
+
+        # Дневные счётчики кэша ответов бота (пишет буфер db/bot_analytics.py)
+        c.execute('''CREATE TABLE IF NOT EXISTS bot_answer_cache_daily (
+            company_id INTEGER REFERENCES companies(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0,
+            bypassed INTEGER NOT NULL DEFAULT 0,
+            stored INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
+            saved_ms BIGINT NOT NULL DEFAULT 0,
+            upstream_ms BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (company_id, day)
+        )''')
+        _ensure_company_rls('bot_answer_cache_daily')
 
         # ─── Feature 9: Gift Cards ────────────────────────────────────────────────
         c.execute('''CREATE TABLE IF NOT EXISTS gift_cards (
@@ -3166,6 +3657,7 @@ def init_database():
         # Startup must not auto-fill reference catalogs.
 
         conn.commit()
+        invalidate_schema_catalog()
         log_info("✅ Unified schema initialized successfully", "db")
         
     except Exception as e:
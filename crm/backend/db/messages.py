@@ -70,6 +70,9 @@ def save_message(instagram_id: str, message: str, sender: str,
     conn.commit()
     conn.close()
 
+    from services.conversation_state import record_conversation_message
+    record_conversation_message(instagram_id, resolved_company_id, message, sender, message_type, now, message_id)
+
 def get_chat_history(instagram_id: str, limit: int = 10):
     """Получить историю чата"""
     conn = get_db_connection()
@@ -205,22 +208,29 @@ def save_reaction(message_id: int, emoji: str, user_id: int = None):
         conn.close()
 
 def search_messages(query: str, limit: int = 50):
-    """Поиск сообщений по тексту"""
+    """Ранжированный полнотекстовый поиск сообщений (префиксы слов, индекс chat_history.search_vector)"""
+    from db.search import SEARCH_CONFIG, build_prefix_tsquery, clamp_search_limit
+
+    tsquery = build_prefix_tsquery(query)
+    if not tsquery:
+        return []
+
     conn = get_db_connection()
     c = conn.cursor()
     current_company_id = _safe_int(get_current_company_id())
     
     try:
-        c.execute("""
+        c.execute(f"""
             SELECT m.id, m.instagram_id, c.username, c.name, m.message, 
                    m.sender, m.message_type, m.timestamp
             FROM chat_history m
             LEFT JOIN clients c ON m.instagram_id = c.instagram_id
-            WHERE m.message LIKE %s
-              AND (%s IS NULL OR m.company_id = %s)
-            ORDER BY m.timestamp DESC
+            CROSS JOIN to_tsquery('{SEARCH_CONFIG}', %s) AS query
+            WHERE m.search_vector @@ query
+              AND (%s::INTEGER IS NULL OR m.company_id = %s)
+            ORDER BY ts_rank(m.search_vector, query) DESC, m.timestamp DESC
             LIMIT %s
-        """, (query, current_company_id, current_company_id, limit))
+        """, (tsquery, current_company_id, current_company_id, clamp_search_limit(limit)))
         
         messages = c.fetchall()
         
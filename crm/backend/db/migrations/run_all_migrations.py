@@ -12,6 +12,7 @@ if BACKEND_ROOT not in sys.path:
 
 from db.init import init_database
 from db.connection import get_db_connection
+from db.schema_catalog import invalidate_schema_catalog
 from utils.logger import log_info, log_error
 
 def print_header(text):
@@ -105,6 +106,9 @@ def run_all_migrations():
         else:
             log_info("⏭️ Test staff seeding skipped (SEED_TEST_DATA=false)", "migrations")
 
+        # Схема могла измениться — воркеры перечитают каталог колонок
+        invalidate_schema_catalog()
+
         print_header("SYNC COMPLETED SUCCESSFULLY")
         # Release lock before returning (also in finally as backup)
         try:
@@ -2,6 +2,7 @@
 Утилиты для работы с промокодами
 """
 from db.connection import get_db_connection
+from db.schema_catalog import get_table_columns
 from datetime import datetime, timedelta
 from utils.logger import log_info, log_error
 import random
@@ -15,14 +16,6 @@ def _split_csv(value: Optional[str]) -> list[str]:
     return [item.strip() for item in value.split(",") if item.strip()]
 
 
-def _get_promo_columns(cursor) -> set[str]:
-    cursor.execute("""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = 'promo_codes'
-    """)
-    return {row[0] for row in cursor.fetchall()}
-
 def create_promo_code(
     code: str, 
     discount_type: str, 
@@ -92,7 +85,7 @@ def validate_promo_code(
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        promo_columns = _get_promo_columns(c)
+        promo_columns = get_table_columns("promo_codes", c)
         scope_sql = "COALESCE(target_scope, 'all')" if "target_scope" in promo_columns else "'all'"
         category_sql = "target_category_names" if "target_category_names" in promo_columns else "NULL"
         service_sql = "target_service_ids" if "target_service_ids" in promo_columns else "NULL"
@@ -4,18 +4,23 @@ DB-функции для рекламного модуля: реферальны
 from __future__ import annotations
 
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Any
 import hashlib
 import random
 import re
 import string
+import time
 
 from db.connection import get_db_connection
+from utils.event_buffer import EventBuffer
 from utils.logger import log_error
+from utils.tenant_context import platform_access
 
 
 # ─── Helpers ─────────────────────────────────────────────────────────────────
 
+@lru_cache(maxsize=2048)
 def _parse_ua(ua_string: str) -> tuple[str, str]:
     """Определяет тип устройства и браузер из User-Agent."""
     if not ua_string:
@@ -726,70 +731,91 @@ def delete_referral_link(link_id: int, company_id: int) -> bool:
 
 # ─── Event Tracking ──────────────────────────────────────────────────────────
 
-def track_referral_impression(
-    link_id: int,
-    company_id: int,
-    ip: str,
-    user_agent: str = "",
-    referrer: str | None = None,
-    placement: str | None = None,
-    city: str | None = None,
-    country: str | None = None,
-) -> int | None:
-    """Записывает показ. Возвращает impression_id."""
-    device, browser = _parse_ua(user_agent)
+def _referral_row(event: tuple) -> tuple:
+    link_id, company_id, ip, user_agent, referrer, placement, city, country, queued_at = event
+    device, browser = _parse_ua(user_agent or "")
     ip_hash = _hash_ip(ip) if ip else None
+    age_ms = max(0, int((time.monotonic() - queued_at) * 1000))
+    return (
+        link_id, company_id, ip, ip_hash, user_agent, device, browser,
+        referrer, placement, city, country, age_ms,
+    )
+
+
+def _flush_referral_events(table: str, time_column: str, events: list[tuple]) -> None:
+    """
+    Пишет пачку показов/кликов одним INSERT.
+
+    is_unique считается для всей пачки: один SELECT находит пары
+    (link_id, ip_hash), уже встречавшиеся за 24 часа, а внутри пачки
+    уникальным считается только первое событие пары.
+    """
+    rows = [_referral_row(event) for event in events]
+    if not rows:
+        return
+    link_ids = sorted({row[0] for row in rows})
+    ip_hashes = sorted({row[3] for row in rows if row[3]})
 
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        c.execute(
-            """
-            SELECT id
-            FROM referral_impressions
-            WHERE link_id = %s AND ip_hash = %s AND viewed_at > NOW() - INTERVAL '24 hours'
-            LIMIT 1
-            """,
-            (link_id, ip_hash),
-        )
-        is_unique = c.fetchone() is None
+        seen: set[tuple[Any, Any]] = set()
+        if ip_hashes:
+            c.execute(
+                f"""
+                SELECT DISTINCT link_id, ip_hash
+                FROM {table}
+                WHERE link_id = ANY(%s) AND ip_hash = ANY(%s)
+                  AND {time_column} > NOW() - INTERVAL '24 hours'
+                """,
+                (link_ids, ip_hashes),
+            )
+            seen = {(row[0], row[1]) for row in c.fetchall()}
+
+        values = []
+        params: list[Any] = []
+        for row in rows:
+            key = (row[0], row[3])
+            is_unique = key not in seen
+            seen.add(key)
+            values.append("(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP - %s * INTERVAL '1 millisecond')")
+            params.extend(row[:11])
+            params.append(is_unique)
+            params.append(row[11])
 
         c.execute(
-            """
-            INSERT INTO referral_impressions (
+            f"""
+            INSERT INTO {table} (
                 link_id, company_id, ip_address, ip_hash, user_agent,
-                device_type, browser, referrer, placement, city, country, is_unique
+                device_type, browser, referrer, placement, city, country, is_unique, {time_column}
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
+            VALUES {", ".join(values)}
             """,
-            (
-                link_id,
-                company_id,
-                ip,
-                ip_hash,
-                user_agent,
-                device,
-                browser,
-                referrer,
-                placement,
-                city,
-                country,
-                is_unique,
-            ),
+            params,
         )
-        impression_id = c.fetchone()[0]
         conn.commit()
-        return _safe_int(impression_id)
-    except Exception as error:
+    except Exception:
         conn.rollback()
-        log_error(f"track_referral_impression error: {error}", "db.referral_links")
-        return None
+        raise
     finally:
         conn.close()
 
 
-def track_referral_click(
+def flush_referral_impressions(events: list[tuple]) -> None:
+    with platform_access():
+        _flush_referral_events("referral_impressions", "viewed_at", events)
+
+
+def flush_referral_clicks(events: list[tuple]) -> None:
+    with platform_access():
+        _flush_referral_events("referral_clicks", "clicked_at", events)
+
+
+referral_impression_buffer = EventBuffer("referral_impressions", flush_referral_impressions)
+referral_click_buffer = EventBuffer("referral_clicks", flush_referral_clicks)
+
+
+def track_referral_impression(
     link_id: int,
     company_id: int,
     ip: str,
@@ -798,58 +824,27 @@ def track_referral_click(
     placement: str | None = None,
     city: str | None = None,
     country: str | None = None,
-) -> int | None:
-    """Записывает клик. Возвращает click_id."""
-    device, browser = _parse_ua(user_agent)
-    ip_hash = _hash_ip(ip) if ip else None
+) -> bool:
+    """Ставит показ в буфер пакетной записи. False — буфер переполнен."""
+    return referral_impression_buffer.add(
+        (link_id, company_id, ip, user_agent, referrer, placement, city, country, time.monotonic())
+    )
 
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
-        c.execute(
-            """
-            SELECT id
-            FROM referral_clicks
-            WHERE link_id = %s AND ip_hash = %s AND clicked_at > NOW() - INTERVAL '24 hours'
-            LIMIT 1
-            """,
-            (link_id, ip_hash),
-        )
-        is_unique = c.fetchone() is None
 
-        c.execute(
-            """
-            INSERT INTO referral_clicks (
-                link_id, company_id, ip_address, ip_hash, user_agent,
-                device_type, browser, referrer, placement, city, country, is_unique
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-            """,
-            (
-                link_id,
-                company_id,
-                ip,
-                ip_hash,
-                user_agent,
-                device,
-                browser,
-                referrer,
-                placement,
-                city,
-                country,
-                is_unique,
-            ),
-        )
-        click_id = c.fetchone()[0]
-        conn.commit()
-        return _safe_int(click_id)
-    except Exception as error:
-        conn.rollback()
-        log_error(f"track_referral_click error: {error}", "db.referral_links")
-        return None
-    finally:
-        conn.close()
+def track_referral_click(
+    link_id: int,
+    company_id: int,
+    ip: str,
+    user_agent: str = "",
+    referrer: str | None = None,
+    placement: str | None = None,
+    city: str | None = None,
+    country: str | None = None,
+) -> bool:
+    """Ставит клик в буфер пакетной записи. False — буфер переполнен."""
+    return referral_click_buffer.add(
+        (link_id, company_id, ip, user_agent, referrer, placement, city, country, time.monotonic())
+    )
 
 
 def record_conversion(
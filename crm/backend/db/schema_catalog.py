@@ -0,0 +1,143 @@
+"""
+Кэш схемы БД: таблицы и колонки текущей схемы, загружаемые один раз на процесс.
+
+Код, который поддерживает старые и новые версии схемы, проверяет наличие колонок
+(`column_exists`) — раньше каждый такой вызов был запросом к information_schema.
+Каталог загружается одним запросом и живёт до следующей миграции:
+run_all_migrations/init_database сбрасывают его локально и через Pub/Sub
+в остальных воркерах. TTL — страховка на случай недоступного Pub/Sub.
+"""
+import os
+import threading
+import time
+from typing import Dict, FrozenSet, Mapping, Optional
+
+from db.connection import get_db_connection
+from utils.logger import log_error, log_info
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+_SCHEMA_CATALOG_TTL_SECONDS = max(0, _read_int_env("SCHEMA_CATALOG_TTL_SECONDS", 600))
+_SCHEMA_PUBSUB_PREFIX = "crm:schema:"
+
+_catalog_lock = threading.Lock()
+# Отдельный лок для версии: сброс не должен ждать загрузку (и блокировать event loop)
+_version_lock = threading.Lock()
+_catalog: Optional[Dict[str, FrozenSet[str]]] = None
+_catalog_loaded_at = 0.0
+_catalog_version = 0
+
+
+def load_schema_columns(cursor) -> Dict[str, FrozenSet[str]]:
+    """Прочитать {таблица: колонки} через переданный курсор (видит его незакоммиченный DDL)."""
+    cursor.execute("""
+        SELECT table_name, column_name
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+    """)
+    columns: Dict[str, set] = {}
+    for row in cursor.fetchall():
+        # Вызывающий может передать RealDictCursor: распаковка dict дала бы имена колонок
+        if isinstance(row, Mapping):
+            table_name, column_name = row["table_name"], row["column_name"]
+        else:
+            table_name, column_name = row[0], row[1]
+        columns.setdefault(table_name, set()).add(column_name)
+    return {table_name: frozenset(names) for table_name, names in columns.items()}
+
+
+def get_schema_version() -> int:
+    """Локальная версия каталога (растёт при каждой инвалидации)."""
+    return _catalog_version
+
+
+def _catalog_is_fresh() -> bool:
+    if _catalog is None:
+        return False
+    if _SCHEMA_CATALOG_TTL_SECONDS == 0:
+        return True
+    return time.monotonic() - _catalog_loaded_at < _SCHEMA_CATALOG_TTL_SECONDS
+
+
+def get_schema_catalog(cursor=None) -> Dict[str, FrozenSet[str]]:
+    """
+    Каталог {таблица: frozenset(колонки)}. Курсор вызывающего используется
+    только для первой загрузки, чтобы не брать второе соединение из пула.
+    """
+    global _catalog, _catalog_loaded_at
+    if _catalog_is_fresh():
+        return _catalog
+
+    with _catalog_lock:
+        if _catalog_is_fresh():
+            return _catalog
+        version = _catalog_version
+        conn = None
+        c = cursor
+        if c is None:
+            conn = get_db_connection()
+            c = conn.cursor()
+        try:
+            loaded = load_schema_columns(c)
+        finally:
+            if conn is not None:
+                conn.close()
+        # Инвалидация во время загрузки: отдаём прочитанное, но не кэшируем
+        with _version_lock:
+            if version == _catalog_version:
+                _catalog = loaded
+                _catalog_loaded_at = time.monotonic()
+        return loaded
+
+
+def get_table_columns(table_name: str, cursor=None) -> FrozenSet[str]:
+    return get_schema_catalog(cursor).get(table_name, frozenset())
+
+
+def table_exists(table_name: str, cursor=None) -> bool:
+    return table_name in get_schema_catalog(cursor)
+
+
+def column_exists(table_name: str, column_name: str, cursor=None) -> bool:
+    return column_name in get_table_columns(table_name, cursor)
+
+
+def _drop_catalog() -> int:
+    global _catalog, _catalog_version
+    with _version_lock:
+        _catalog = None
+        _catalog_version += 1
+        return _catalog_version
+
+
+def invalidate_schema_catalog(broadcast: bool = True) -> None:
+    """Сбросить каталог в этом воркере и (через Pub/Sub) в остальных."""
+    version = _drop_catalog()
+    log_info(f"🗂️ Schema catalog invalidated (v{version})", "database")
+    if broadcast:
+        try:
+            from utils.redis_pubsub import redis_pubsub
+            redis_pubsub.publish_nowait(f"{_SCHEMA_PUBSUB_PREFIX}invalidate", {"version": version})
+        except Exception as e:
+            log_error(f"Schema catalog invalidation not broadcast: {e}", "database")
+
+
+async def _schema_pubsub_handler(channel: str, data: dict) -> None:
+    _drop_catalog()
+
+
+def _register_schema_pubsub_handler() -> None:
+    try:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.register_handler(_SCHEMA_PUBSUB_PREFIX, _schema_pubsub_handler)
+    except Exception as e:
+        log_error(f"Schema catalog Pub/Sub handler not registered: {e}", "database")
+
+
+_register_schema_pubsub_handler()
@@ -0,0 +1,193 @@
+"""
+Поиск по клиентам, сообщениям и записям.
+
+Индексы и колонки (search_vector, search_text, phone_digits) создаются в db/init.py
+и поддерживаются BEFORE-триггерами при каждой записи. Здесь — построение запросов:
+префиксный tsquery по словам, подстрока/нечёткое совпадение через pg_trgm
+(если расширение установлено) и поиск телефона по цифрам.
+"""
+import re
+from typing import List, Optional
+
+from db.connection import get_db_connection
+
+# Конфигурация 'simple': без стемминга, одинаково для ru/en/ar
+SEARCH_CONFIG = "simple"
+MAX_QUERY_TERMS = 8
+MIN_PHONE_DIGITS = 3
+MAX_SEARCH_LIMIT = 200
+
+_TERM_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_trgm_available: Optional[bool] = None
+
+
+def normalize_phone_digits(value: Optional[str]) -> str:
+    """Оставить в телефоне только цифры (так же, как триггеры заполняют phone_digits)."""
+    return re.sub(r"[^0-9]", "", str(value or ""))
+
+
+def build_prefix_tsquery(text: Optional[str]) -> Optional[str]:
+    """
+    'анна кол' -> 'анна:* & кол:*'. Берутся только буквенно-цифровые токены,
+    поэтому строку безопасно передавать в to_tsquery.
+    """
+    terms = _TERM_RE.findall(str(text or "").lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def clamp_search_limit(limit: object, default: int = 50) -> int:
+    try:
+        value = int(limit)
+    except (TypeError, ValueError):
+        value = default
+    return max(1, min(value, MAX_SEARCH_LIMIT))
+
+
+def is_trgm_available(cursor) -> bool:
+    """pg_trgm может быть не установлен (нет прав на CREATE EXTENSION)."""
+    global _trgm_available
+    if _trgm_available is None:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trgm_available = cursor.fetchone() is not None
+    return _trgm_available
+
+
+def _client_match_sql(cursor, query: str, alias: str = "c"):
+    """
+    Условие совпадения и выражение ранга для клиентов.
+    Возвращает (where_sql, where_params, rank_sql, rank_params) или None для пустого запроса.
+    """
+    tsquery = build_prefix_tsquery(query)
+    normalized = str(query or "").strip().lower()
+    digits = normalize_phone_digits(query)
+    trgm = is_trgm_available(cursor)
+
+    conditions, params = [], []
+    rank_parts, rank_params = [], []
+
+    if tsquery:
+        conditions.append(f"{alias}.search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s)")
+        params.append(tsquery)
+        rank_parts.append(f"ts_rank({alias}.search_vector, to_tsquery('{SEARCH_CONFIG}', %s))")
+        rank_params.append(tsquery)
+    if trgm and normalized:
+        conditions.append(f"{alias}.search_text LIKE %s")
+        params.append(f"%{escape_like(normalized)}%")
+        conditions.append(f"{alias}.search_text %% %s")
+        params.append(normalized)
+        rank_parts.append(f"similarity({alias}.search_text, %s)")
+        rank_params.append(normalized)
+    if len(digits) >= MIN_PHONE_DIGITS:
+        # С pg_trgm индекс поддерживает подстроку, без него — только префикс
+        pattern = f"%{digits}%" if trgm else f"{digits}%"
+        conditions.append(f"{alias}.phone_digits LIKE %s")
+        params.append(pattern)
+        rank_parts.append(f"CASE WHEN {alias}.phone_digits LIKE %s THEN 1.0 ELSE 0 END")
+        rank_params.append(pattern)
+
+    if not conditions:
+        return None
+    return "(" + " OR ".join(conditions) + ")", params, " + ".join(rank_parts), rank_params
+
+
+def search_clients(query: str, limit: int = 50) -> List[dict]:
+    """Ранжированный поиск клиентов по имени, username, instagram_id, email и телефону."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        match = _client_match_sql(c, query)
+        if match is None:
+            return []
+        where_sql, where_params, rank_sql, rank_params = match
+        c.execute(f"""
+            SELECT c.instagram_id, c.username, c.name, c.phone, c.status,
+                   COALESCE(c.inbound_messages_count, 0), c.lifetime_value, c.profile_pic,
+                   {rank_sql} AS rank
+            FROM clients c
+            WHERE c.deleted_at IS NULL
+              AND {where_sql}
+            ORDER BY rank DESC, c.last_contact DESC NULLS LAST
+            LIMIT %s
+        """, rank_params + where_params + [clamp_search_limit(limit)])
+        return [
+            {
+                "id": row[0],
+                "instagram_id": row[0],
+                "username": row[1],
+                "name": row[2],
+                "phone": row[3],
+                "display_name": row[2] or (f"@{row[1]}" if row[1] else row[0]),
+                "status": row[4] or "new",
+                "total_messages": row[5],
+                "lifetime_value": row[6] or 0,
+                "profile_pic": row[7],
+                "rank": float(row[8] or 0),
+            }
+            for row in c.fetchall()
+        ]
+    finally:
+        conn.close()
+
+
+def get_search_suggestions(query: str, limit: int = 10) -> List[dict]:
+    """Префиксные подсказки: клиенты (по словам имени/username и цифрам телефона) и услуги."""
+    tsquery = build_prefix_tsquery(query)
+    digits = normalize_phone_digits(query)
+    limit = clamp_search_limit(limit, 10)
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        suggestions = []
+        conditions, params = [], []
+        if tsquery:
+            conditions.append(f"c.search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s)")
+            params.append(tsquery)
+        if len(digits) >= MIN_PHONE_DIGITS:
+            conditions.append("c.phone_digits LIKE %s")
+            params.append(f"{digits}%")
+        if conditions:
+            c.execute(f"""
+                SELECT c.instagram_id, c.name, c.username
+                FROM clients c
+                WHERE c.deleted_at IS NULL
+                  AND ({" OR ".join(conditions)})
+                ORDER BY c.last_contact DESC NULLS LAST
+                LIMIT %s
+            """, params + [limit])
+            for instagram_id, name, username in c.fetchall():
+                suggestions.append({
+                    "type": "client",
+                    "text": name or username or instagram_id,
+                    "id": instagram_id,
+                    "subtitle": f"@{username}" if username else instagram_id,
+                })
+
+        normalized = str(query or "").strip().lower()
+        remaining = limit - len(suggestions)
+        if normalized and remaining > 0:
+            c.execute("""
+                SELECT id, name, price, currency
+                FROM services
+                WHERE is_active = TRUE
+                  AND LOWER(name) LIKE %s
+                ORDER BY name
+                LIMIT %s
+            """, (f"{escape_like(normalized)}%", remaining))
+            for service_id, name, price, currency in c.fetchall():
+                suggestions.append({
+                    "type": "service",
+                    "text": name,
+                    "id": service_id,
+                    "subtitle": f"{price} {currency or 'AED'}",
+                })
+
+        return suggestions
+    finally:
+        conn.close()
@@ -6,12 +6,16 @@ from datetime import datetime
 from copy import deepcopy
 import json
 import os
+import threading
+from typing import Any, Optional
 import psycopg2
 from psycopg2 import errors as pg_errors
 
 from db.connection import get_db_connection
-from db.companies import get_current_company, update_company
+from db.companies import get_company_by_id, get_current_company, update_company
+from utils.cache import TTLCache
 from utils.logger import log_error, log_warning, log_info
+from utils.tenant_context import get_current_company_id
 
 from core.config import (
     APP_NAME,
@@ -426,12 +430,122 @@ def _normalize_bool(raw_value):
 def _product_mode_to_flags(product_mode: str):
     return True, False
 
+# ===== КЭШ НАСТРОЕК (per company, versioned) =====
+
+def _read_int_env(name: str, default: int) -> int:
+    raw_value = os.getenv(name)
+    if raw_value is None:
+        return default
+    try:
+        return int(str(raw_value).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+# TTL — страховка на случай недоступного Pub/Sub; основная инвалидация событийная
+_SETTINGS_CACHE_TTL_SECONDS = max(1, _read_int_env("SETTINGS_CACHE_TTL_SECONDS", 60))
+_SETTINGS_PUBSUB_PREFIX = "crm:settings:"
+_settings_cache = TTLCache(maxsize=512, ttl=_SETTINGS_CACHE_TTL_SECONDS)
+_settings_versions: dict[int, int] = {}
+_settings_versions_lock = threading.Lock()
+
+
+def get_settings_version(company_id: Optional[int] = None) -> int:
+    """Локальная версия настроек компании (растёт при каждой инвалидации)."""
+    resolved_company_id = company_id if company_id is not None else get_current_company_id()
+    if resolved_company_id is None:
+        return 0
+    with _settings_versions_lock:
+        return _settings_versions.get(int(resolved_company_id), 0)
+
+
+def _bump_settings_version(company_id: int) -> int:
+    with _settings_versions_lock:
+        next_version = _settings_versions.get(company_id, 0) + 1
+        _settings_versions[company_id] = next_version
+    for kind in ("salon", "bot"):
+        _settings_cache.pop((company_id, kind))
+    return next_version
+
+
+def _resolve_company_id(company_id: Optional[int]) -> Optional[int]:
+    resolved_company_id = company_id if company_id is not None else get_current_company_id()
+    if resolved_company_id is None:
+        return None
+    try:
+        return int(resolved_company_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_cached_settings(company_id: int, kind: str) -> Optional[dict]:
+    entry = _settings_cache.get((company_id, kind))
+    if entry is None:
+        return None
+    version, value = entry
+    if version != get_settings_version(company_id):
+        return None
+    return deepcopy(value)
+
+
+def _store_cached_settings(company_id: int, kind: str, version: int, value: dict) -> None:
+    # Версия снимается ДО загрузки: если инвалидация пришла во время чтения,
+    # запись с устаревшей версией будет отброшена при следующем обращении.
+    _settings_cache.set((company_id, kind), (version, deepcopy(value)))
+
+
+def invalidate_settings_cache(company_id: Optional[int] = None, broadcast: bool = True) -> None:
+    """Сбросить кэш настроек компании в этом воркере и (через Pub/Sub) в остальных."""
+    resolved_company_id = _resolve_company_id(company_id)
+    if resolved_company_id is None:
+        return
+    _bump_settings_version(resolved_company_id)
+    if broadcast:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.publish_nowait(
+            f"{_SETTINGS_PUBSUB_PREFIX}invalidate",
+            {"company_id": resolved_company_id},
+        )
+
+
+async def _settings_pubsub_handler(channel: str, data: dict) -> None:
+    company_id = _resolve_company_id(data.get("company_id") if isinstance(data, dict) else None)
+    if company_id is not None:
+        _bump_settings_version(company_id)
+
+
+def _register_settings_pubsub_handler() -> None:
+    try:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.register_handler(_SETTINGS_PUBSUB_PREFIX, _settings_pubsub_handler)
+    except Exception as e:
+        log_error(f"Settings cache Pub/Sub handler not registered: {e}", "database")
+
+
+_register_settings_pubsub_handler()
+
 # ===== НАСТРОЙКИ САЛОНА =====
 
-def get_salon_settings() -> dict:
-    """Получить настройки текущей компании из БД (tenant-aware SSOT)."""
+def get_salon_settings(company_id: Optional[int] = None) -> dict:
+    """Получить настройки компании (по умолчанию текущей) — tenant-aware SSOT с кэшем."""
+    resolved_company_id = _resolve_company_id(company_id)
+    if resolved_company_id is None:
+        return _get_default_salon_settings()
+
+    cached = _get_cached_settings(resolved_company_id, "salon")
+    if cached is not None:
+        return cached
+
+    version = get_settings_version(resolved_company_id)
+    settings = _load_salon_settings(resolved_company_id)
+    if settings.get("company_id") == resolved_company_id:
+        _store_cached_settings(resolved_company_id, "salon", version, settings)
+    return settings
+
+
+def _load_salon_settings(company_id: int) -> dict:
     try:
-        row = get_current_company()
+        row = get_company_by_id(company_id)
         if not row:
             return _get_default_salon_settings()
 
@@ -629,22 +743,37 @@ def update_salon_settings(data: dict) -> bool:
 
 # ===== НАСТРОЙКИ БОТА =====
 
-def get_bot_settings() -> dict:
-    """Получить настройки бота текущей компании."""
+def get_bot_settings(company_id: Optional[int] = None) -> dict:
+    """Получить настройки бота компании (по умолчанию текущей)."""
+    resolved_company_id = _resolve_company_id(company_id)
+    if resolved_company_id is None:
+        return _get_default_bot_settings()
+
+    cached = _get_cached_settings(resolved_company_id, "bot")
+    if cached is not None:
+        return cached
+
+    version = get_settings_version(resolved_company_id)
+    settings = _load_bot_settings(resolved_company_id)
+    _store_cached_settings(resolved_company_id, "bot", version, settings)
+    return settings
+
+
+def _load_bot_settings(company_id: int) -> dict:
     try:
-        current_company = get_current_company()
+        current_company = get_company_by_id(company_id)
         bot_data = current_company.get("bot_config") if current_company else None
         if bot_data:
             if isinstance(bot_data, str):
                 bot_data = json.loads(bot_data)
 
             log_info("✅ Loaded bot settings from companies.bot_config", "database")
-            defaults = _get_default_bot_settings()
+            defaults = _get_default_bot_settings(company_id)
             result_dict = {**defaults, **bot_data}
-            salon_settings = get_salon_settings()
+            salon_settings = get_salon_settings(company_id)
             return _replace_bot_placeholders(result_dict, salon_settings)
 
-        return _get_default_bot_settings()
+        return _get_default_bot_settings(company_id)
 
     except Exception as e:
         log_error(f"❌ Ошибка в get_bot_settings: {e}", "database")
@@ -671,7 +800,7 @@ def _replace_bot_placeholders(bot_settings: dict, salon_settings: dict) -> dict:
 
     return bot_settings
 
-def _get_default_bot_settings() -> dict:
+def _get_default_bot_settings(company_id: Optional[int] = None) -> dict:
     """Дефолтные настройки бота"""
     from bot.constants import SERVICE_SYNONYMS, OBJECTION_KEYWORDS, PROMPT_HEADERS
     
@@ -679,7 +808,7 @@ def _get_default_bot_settings() -> dict:
     bot_name_env = os.getenv('BOT_NAME', 'Assistant')
     
     try:
-        salon = get_salon_settings()
+        salon = get_salon_settings(company_id)
         bot_name = salon.get('bot_name') or bot_name_env
         salon_name = salon.get('name') or salon_name_env
     except:
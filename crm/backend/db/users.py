@@ -5,16 +5,16 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict
 import hashlib
 import secrets
-import time
 
 from db.connection import get_db_connection
-from utils.cache import cache
+from utils.cache import cache, TTLCache
 from utils.logger import log_error
 import psycopg2
 
-# In-memory cache for session verification (fallback when Redis is unavailable)
-_session_cache = {}
+# In-process cache for session verification (bounded LRU + TTL, per worker)
 _session_cache_ttl = 300  # 5 minutes - cache session verification to reduce DB load
+_session_cache = TTLCache(maxsize=5000, ttl=_session_cache_ttl)
+_SESSION_PUBSUB_PREFIX = "crm:sessions:"
 
 def get_all_users():
     """Получить всех пользователей"""
@@ -227,23 +227,37 @@ def create_session(user_id: int, company_id: int | None = None) -> str:
     
     return session_token
 
+def _session_cache_key(session_token: str) -> str:
+    return f"session_user_{session_token}"
+
+
+def peek_cached_session_user(session_token: str) -> tuple[bool, Optional[Dict]]:
+    """Проверить только in-process кэш сессий (без Redis/БД, безопасно на event loop)"""
+    if not session_token:
+        return True, None
+    cached_user = _session_cache.get(_session_cache_key(session_token))
+    if cached_user is None:
+        return False, None
+    return True, cached_user
+
+
 def get_user_by_session(session_token: str) -> Optional[Dict]:
     """Получить пользователя по токену сессии (с кэшированием)"""
     if not session_token:
         return None
     
-    cache_key = f"session_user_{session_token}"
+    cache_key = _session_cache_key(session_token)
+    
+    # In-memory cache first (no network round trip)
+    cached_user = _session_cache.get(cache_key)
+    if cached_user is not None:
+        return cached_user
     
-    # Try Redis cache first (if available)
+    # Then shared Redis cache (if available)
     if cache.enabled:
         cached_user = cache.get(cache_key)
         if cached_user is not None:
-            return cached_user
-    
-    # Fallback to in-memory cache
-    if cache_key in _session_cache:
-        cached_user, cached_time = _session_cache[cache_key]
-        if time.time() - cached_time < _session_cache_ttl:
+            _session_cache.set(cache_key, cached_user)
             return cached_user
     
     # Query database
@@ -288,16 +302,10 @@ def get_user_by_session(session_token: str) -> Optional[Dict]:
             
             # Cache in Redis (if available)
             if cache.enabled:
-                cache.set(cache_key, user_dict, expire=300)  # 5 minutes
-            
-            # Cache in memory as fallback
-            _session_cache[cache_key] = (user_dict, time.time())
+                cache.set(cache_key, user_dict, expire=_session_cache_ttl)
             
-            # Clean old cache entries (keep only last 100)
-            if len(_session_cache) > 100:
-                sorted_items = sorted(_session_cache.items(), key=lambda x: x[1][1])
-                for key, _ in sorted_items[:len(_session_cache) - 100]:
-                    del _session_cache[key]
+            # Cache in memory (LRU-bounded, TTL-evicted)
+            _session_cache.set(cache_key, user_dict)
             
             return user_dict
         return None
@@ -307,14 +315,28 @@ def get_user_by_session(session_token: str) -> Optional[Dict]:
     finally:
         conn.close()
 
-def delete_session(session_token: str):
-    """Удалить сессию (выход)"""
-    # Invalidate cache
-    cache_key = f"session_user_{session_token}"
-    if cache_key in _session_cache:
-        del _session_cache[cache_key]
+def invalidate_session_cache(session_token: str, broadcast: bool = True) -> None:
+    """Сбросить кэш сессии в этом воркере, в Redis и (через Pub/Sub) в остальных воркерах"""
+    if not session_token:
+        return
+    cache_key = _session_cache_key(session_token)
+    _session_cache.pop(cache_key)
     if cache.enabled:
         cache.delete(cache_key)
+    if broadcast:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.publish_nowait(f"{_SESSION_PUBSUB_PREFIX}invalidate", {"session_token": session_token})
+
+
+async def _session_pubsub_handler(channel: str, data: dict) -> None:
+    session_token = data.get("session_token") if isinstance(data, dict) else None
+    if session_token:
+        _session_cache.pop(_session_cache_key(session_token))
+
+
+def delete_session(session_token: str):
+    """Удалить сессию (выход)"""
+    invalidate_session_cache(session_token)
     
     conn = get_db_connection()
     c = conn.cursor()
@@ -324,6 +346,17 @@ def delete_session(session_token: str):
     finally:
         conn.close()
 
+
+def _register_session_pubsub_handler() -> None:
+    try:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.register_handler(_SESSION_PUBSUB_PREFIX, _session_pubsub_handler)
+    except Exception as e:
+        log_error(f"Session cache Pub/Sub handler not registered: {e}", "users")
+
+
+_register_session_pubsub_handler()
+
 # ===== СБРОС ПАРОЛЯ =====
 
 def create_password_reset_token(user_id: int) -> str:
@@ -1,15 +1,20 @@
 """
 Enhanced database functions for visitor tracking with city and distance breakdowns
 """
+import time
+from functools import lru_cache
+
 from db.connection import get_db_connection
+from utils.cache import TTLCache
+from utils.event_buffer import EventBuffer
 from utils.geolocation import get_visitor_location_data
-from utils.logger import log_info, log_error
 from typing import Optional, List, Dict
 from datetime import datetime, timedelta
 
+@lru_cache(maxsize=2048)
 def parse_user_agent(ua_string):
-    """Simple heuristic to parse User-Agent string"""
-    ua = ua_string.lower()
+    """Simple heuristic to parse User-Agent string (memoised: a few hundred distinct UAs cover most traffic)"""
+    ua = (ua_string or '').lower()
     browser = 'Other'
     device_type = 'Desktop'
     
@@ -35,77 +40,79 @@ def parse_user_agent(ua_string):
         
     return device_type, browser
 
-def track_visitor(ip: str, user_agent: str, page_url: str, referrer: str = None) -> bool:
-    """
-    Track a visitor by IP address with geolocation
-    Deduplicates visits from the same IP within 10 seconds
-    Returns True if successfully tracked, False otherwise
-    """
+_EMPTY_LOCATION = {
+    'ip_hash': None,
+    'latitude': None,
+    'longitude': None,
+    'city': None,
+    'country': None,
+    'distance_km': None,
+    'is_local': None
+}
+
+# Повторный визит с того же IP на тот же URL в пределах окна не пишется
+VISIT_DEDUP_SECONDS = 10
+_recent_visits = TTLCache(maxsize=50000, ttl=VISIT_DEDUP_SECONDS)
+
+
+def _visitor_row(event: tuple) -> tuple:
+    """Геолокация и разбор UA — в потоке сброса, не в запросе."""
+    ip, user_agent, page_url, referrer, queued_at = event
+    location_data = get_visitor_location_data(ip) or _EMPTY_LOCATION
+    device_type, browser = parse_user_agent(user_agent)
+    age_ms = max(0, int((time.monotonic() - queued_at) * 1000))
+    return (
+        ip,
+        location_data['ip_hash'],
+        location_data['latitude'],
+        location_data['longitude'],
+        location_data['city'],
+        location_data['country'],
+        location_data['distance_km'],
+        location_data['is_local'],
+        user_agent,
+        page_url,
+        referrer,
+        device_type,
+        browser,
+        age_ms,
+    )
+
+
+def flush_visitor_events(events: List[tuple]) -> None:
+    """Записать пачку визитов одним INSERT; visited_at — момент визита, а не сброса."""
+    rows = [_visitor_row(event) for event in events]
+    conn = get_db_connection()
+    c = conn.cursor()
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        # Check if this IP was already tracked on THIS SAME URL in the last 10 seconds
-        c.execute("""
-            SELECT id FROM visitor_tracking 
-            WHERE ip_address = %s 
-            AND page_url = %s
-            AND visited_at > NOW() - INTERVAL '10 seconds'
-            LIMIT 1
-        """, (ip, page_url))
-        
-        recent_visit = c.fetchone()
-        
-        if recent_visit:
-            conn.close()
-            return False
-        
-        # Get location data
-        location_data = get_visitor_location_data(ip)
-        
-        # Helper for location
-        if not location_data:
-            location_data = {
-                'ip_hash': None,
-                'latitude': None,
-                'longitude': None,
-                'city': None,
-                'country': None,
-                'distance_km': None,
-                'is_local': None
-            }
-            
-        # Parse UA
-        device_type, browser = parse_user_agent(user_agent)
-        
-        c.execute("""
+        c.execute(f"""
             INSERT INTO visitor_tracking 
-            (ip_address, ip_hash, latitude, longitude, city, country, distance_km, is_local, user_agent, page_url, referrer, device_type, browser)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            ip,
-            location_data['ip_hash'],
-            location_data['latitude'],
-            location_data['longitude'],
-            location_data['city'],
-            location_data['country'],
-            location_data['distance_km'],
-            location_data['is_local'],
-            user_agent,
-            page_url,
-            referrer,
-            device_type,
-            browser
-        ))
-        
+            (ip_address, ip_hash, latitude, longitude, city, country, distance_km, is_local, user_agent, page_url, referrer, device_type, browser, visited_at)
+            VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP - %s * INTERVAL '1 millisecond')"] * len(rows))}
+        """, [value for row in rows for value in row])
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        log_info(f"Tracked new visitor from {ip} ({location_data.get('city', 'Unknown')}) on {device_type}/{browser}", "visitor_tracking")
-        return True
-        
-    except Exception as e:
-        log_error(f"Error tracking visitor: {e}", "visitor_tracking")
+
+
+visitor_buffer = EventBuffer("visitor_tracking", flush_visitor_events)
+
+
+def track_visitor(ip: str, user_agent: str, page_url: str, referrer: str = None) -> bool:
+    """
+    Track a visitor by IP address with geolocation.
+    Deduplicates visits from the same IP on the same URL within 10 seconds (in memory);
+    the row is written by visitor_buffer in the next batch.
+    Returns True if the visit was accepted, False for duplicates or a full buffer.
+    """
+    key = (ip, page_url)
+    if key in _recent_visits:
         return False
+    _recent_visits.set(key, True)
+    return visitor_buffer.add((ip, user_agent, page_url, referrer, time.monotonic()))
 
 def get_visitor_stats(start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Dict]:
     """
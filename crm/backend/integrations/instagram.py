@@ -3,6 +3,7 @@
 """
 import httpx
 from core.config import PAGE_ACCESS_TOKEN
+from utils.http_clients import get_http_client
 from utils.logger import log_error,log_info
 import os
 
@@ -29,12 +30,8 @@ async def send_message(recipient_id: str, message: str) -> dict:
     proxy_url = os.getenv("PROXY_URL") if os.getenv("ENVIRONMENT") == "production" else None
 
     try:
-        if proxy_url:
-            async with httpx.AsyncClient(timeout=30.0, proxy=proxy_url) as client:
-                response = await client.post(url, params=params, json=data)
-        else:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, params=params, json=data)
+        client = get_http_client(url, proxy=proxy_url)
+        response = await client.post(url, params=params, json=data, timeout=30.0)
         
         response.raise_for_status()
         return response.json()
@@ -109,12 +106,8 @@ async def send_file(recipient_id: str, file_url: str, file_type: str = "image")
         log_info(f"📤 Отправка файла ({file_type}): {file_url[:80]}...", "instagram")
         log_info(f"📦 Payload: {data}", "instagram")
         
-        if proxy_url:
-            async with httpx.AsyncClient(timeout=120.0, proxy=proxy_url) as client:
-                response = await client.post(url, params=params, json=data)
-        else:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(url, params=params, json=data)
+        client = get_http_client(url, proxy=proxy_url)
+        response = await client.post(url, params=params, json=data, timeout=120.0)
         
         if response.status_code != 200:
             error_text = response.text
@@ -154,12 +147,8 @@ async def send_typing_indicator(recipient_id: str) -> None:
     proxy_url = os.getenv("PROXY_URL") if os.getenv("ENVIRONMENT") == "production" else None
 
     try:
-        if proxy_url:
-            async with httpx.AsyncClient(timeout=30.0, proxy=proxy_url) as client:
-                await client.post(url, params=params, json=data)
-        else:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                await client.post(url, params=params, json=data)
+        client = get_http_client(url, proxy=proxy_url)
+        await client.post(url, params=params, json=data, timeout=30.0)
     except Exception as e:
         print(f"⚠️ Не удалось показать typing: {e}")
 
@@ -182,12 +171,8 @@ async def mark_as_seen(recipient_id: str) -> None:
     proxy_url = os.getenv("PROXY_URL") if os.getenv("ENVIRONMENT") == "production" else None
 
     try:
-        if proxy_url:
-            async with httpx.AsyncClient(timeout=30.0, proxy=proxy_url) as client:
-                await client.post(url, params=params, json=data)
-        else:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                await client.post(url, params=params, json=data)
+        client = get_http_client(url, proxy=proxy_url)
+        await client.post(url, params=params, json=data, timeout=30.0)
     except Exception as e:
         print(f"⚠️ Не удалось отметить как прочитанное: {e}")
 
@@ -222,12 +207,8 @@ async def send_reaction(recipient_id: str, message_id: str, reaction: str = "❤
     try:
         log_info(f"❤️ Отправка реакции {reaction} на сообщение {message_id}", "instagram")
         
-        if proxy_url:
-            async with httpx.AsyncClient(timeout=30.0, proxy=proxy_url) as client:
-                response = await client.post(url, params=params, json=data)
-        else:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, params=params, json=data)
+        client = get_http_client(url, proxy=proxy_url)
+        response = await client.post(url, params=params, json=data, timeout=30.0)
         
         response.raise_for_status()
         
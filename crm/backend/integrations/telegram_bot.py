@@ -3,14 +3,16 @@ Telegram Bot Integration
 Обработка сообщений от Telegram Bot API
 """
 from db.connection import get_db_connection
-import httpx
 import json
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Tuple
 import asyncio
 
 from core.config import TELEGRAM_BOT_TOKEN
+from utils.http_clients import get_http_client
+from utils.blocking import run_blocking
 from utils.logger import log_info, log_error
+from utils.tenant_context import reset_tenant_context, set_tenant_context
 from db.settings import get_salon_settings
 
 class TelegramBot:
@@ -67,8 +69,8 @@ class TelegramBot:
                 "url": webhook_url,
                 "allowed_updates": ["message", "callback_query"]
             }
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(url, json=data)
+            client = get_http_client(url)
+            response = await client.post(url, json=data, timeout=10.0)
             result = response.json()
 
             if result.get("ok"):
@@ -100,8 +102,8 @@ class TelegramBot:
                 "parse_mode": parse_mode
             }
 
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(url, json=data)
+            client = get_http_client(url)
+            response = await client.post(url, json=data, timeout=10.0)
             result = response.json()
 
             if result.get("ok"):
@@ -121,8 +123,8 @@ class TelegramBot:
 
         try:
             url = f"{self.base_url}/getWebhookInfo"
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url)
+            client = get_http_client(url)
+            response = await client.get(url, timeout=10.0)
             return response.json()
         except Exception as e:
             log_error(f"Error getting webhook info: {e}", "telegram")
@@ -130,12 +132,28 @@ class TelegramBot:
 
     async def process_update(self, update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
-        Обработать входящее обновление от Telegram
+        Обработать входящее обновление от Telegram в tenant-контексте компании клиента
         Args:
             update: JSON с обновлением от Telegram API
         Returns:
             Ответное сообщение или None
         """
+        chat_id = (update.get("message") or {}).get("chat", {}).get("id")
+        company_id = None
+        if chat_id is not None:
+            from db.clients import resolve_conversation_company_id
+            try:
+                company_id = await run_blocking(resolve_conversation_company_id, f"telegram_{chat_id}")
+            except Exception as e:
+                log_error(f"Company not resolved for Telegram chat {chat_id}: {e}", "telegram")
+
+        tenant_tokens = set_tenant_context(company_id=company_id, bypass=company_id is None)
+        try:
+            return await self._process_update(update)
+        finally:
+            reset_tenant_context(tenant_tokens)
+
+    async def _process_update(self, update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         try:
             # Обрабатываем текстовое сообщение
             if "message" in update:
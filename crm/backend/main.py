@@ -5,7 +5,6 @@ import os
 import sys
 import threading
 import types
-import time
 import concurrent.futures
 from typing import Optional
 from contextlib import asynccontextmanager
@@ -27,7 +26,7 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 # Основные утилиты
-from utils.logger import log_info, log_error
+from utils.logger import log_info, log_error, log_warning
 from core.config import APP_NAME, is_localhost
 from db.connection import init_connection_pool, get_db_connection
 from scripts.maintenance.recreate_database import drop_database, recreate_database  # Uncomment only for manual DB reset
@@ -35,6 +34,7 @@ from db.settings import get_salon_settings
 from utils.utils import ensure_upload_directories
 from middleware import TenantContextMiddleware, TimingMiddleware
 from middleware.user_activity import UserActivityMiddleware
+from middleware.tenant_context import resolve_scope_session
 
 # Архитектура роутеров (Единый источник истины - SSOT)
 from product_groups.shared import mount_shared_routers
@@ -47,16 +47,17 @@ from product_groups.crm import (
     RUNTIME_CRM_ONLY_PREFIXES,
 )
 from utils.redis_pubsub import redis_pubsub
+from services.broadcast_engine import broadcast_runner
+from services.webhook_dispatcher import webhook_dispatcher
+from services.instagram_inbox import instagram_inbox
+from utils.smtp_transport import smtp_transport
+from utils.http_clients import http_clients
+from utils.event_buffer import shutdown_event_buffers
+from utils.blocking import set_blocking_executor, audit_blocking_routes, run_blocking
 import asyncio
 
 # Глобальное состояние приложения
 salon_config = None
-_feature_gate_cache = {
-    "expires_at": 0.0,
-    "crm_modules": {},
-}
-_feature_gate_lock = threading.Lock()
-
 _CRM_MODULE_ROUTE_MATCHERS = CRM_MODULE_ROUTE_MATCHERS
 _RUNTIME_CRM_ONLY_PREFIXES = RUNTIME_CRM_ONLY_PREFIXES
 
@@ -98,16 +99,10 @@ def _resolve_crm_module_by_path(path: str) -> Optional[str]:
     return None
 
 
-def _get_feature_gates_cached() -> dict:
-    now = time.time()
-    with _feature_gate_lock:
-        if _feature_gate_cache["expires_at"] > now:
-            return {
-                "crm_modules": _feature_gate_cache["crm_modules"],
-            }
-
+def _get_feature_gates(company_id: Optional[int]) -> dict:
+    # get_salon_settings кэшируется per company и инвалидируется через Pub/Sub
     try:
-        settings = get_salon_settings()
+        settings = get_salon_settings(company_id)
         business_profile_config = settings.get("business_profile_config")
         crm_modules = {}
         if isinstance(business_profile_config, dict):
@@ -118,10 +113,6 @@ def _get_feature_gates_cached() -> dict:
         log_error(f"Feature-gate load failed: {error}", "feature-gates")
         crm_modules = {}
 
-    with _feature_gate_lock:
-        _feature_gate_cache["crm_modules"] = crm_modules
-        _feature_gate_cache["expires_at"] = now + 10
-
     return {
         "crm_modules": crm_modules,
     }
@@ -202,6 +193,7 @@ def _configure_runtime_threading(app: FastAPI, runtime_label: str) -> None:
     )
     loop.set_default_executor(executor)
     app.state.default_executor = executor
+    set_blocking_executor(executor)
 
     try:
         from anyio import to_thread
@@ -221,6 +213,7 @@ def _shutdown_runtime_threading(app: FastAPI) -> None:
     if executor is None:
         return
 
+    set_blocking_executor(None)
     try:
         executor.shutdown(wait=False, cancel_futures=True)
     except Exception as error:
@@ -229,6 +222,29 @@ def _shutdown_runtime_threading(app: FastAPI) -> None:
         app.state.default_executor = None
 
 
+def _audit_blocking_routes(app: FastAPI) -> None:
+    if not _env_flag("BLOCKING_ROUTE_AUDIT", default=True):
+        return
+
+    try:
+        findings = audit_blocking_routes(app)
+    except Exception as error:
+        log_error(f"Blocking route audit failed: {error}", "boot")
+        return
+
+    if not findings:
+        log_info("✅ Blocking route audit: no async routes touch get_db_connection on the event loop", "boot")
+        return
+
+    log_warning(
+        f"⚠️ Blocking route audit: {len(findings)} async routes call get_db_connection on the event loop",
+        "boot",
+    )
+    for finding in findings:
+        methods = ",".join(finding["methods"])
+        log_warning(f"   {methods} {finding['path']} -> {finding['endpoint']}", "boot")
+
+
 def _build_server_run_kwargs() -> dict:
     reload_enabled = _resolve_reload_mode()
     worker_count = _resolve_worker_count(reload_enabled)
@@ -270,6 +286,7 @@ async def lifespan(app: FastAPI):
 
     init_connection_pool()
     _configure_runtime_threading(app, "crm")
+    _audit_blocking_routes(app)
 
     # 3. Redis Pub/Sub (Sink for multi-worker synchronization)
     pubsub_ready = await redis_pubsub.connect()
@@ -345,6 +362,9 @@ async def lifespan(app: FastAPI):
 
     # 7. CRM сервисы
     start_crm_runtime_services()
+    broadcast_runner.start()
+    webhook_dispatcher.start()
+    instagram_inbox.start()
 
     # 8. Периодические задачи
     schedulers_started = start_crm_schedulers()
@@ -357,6 +377,14 @@ async def lifespan(app: FastAPI):
     log_info("🛑 Двигатель CRM безопасно останавливается...", "shutdown")
 
     stop_crm_schedulers()
+    await instagram_inbox.stop()
+    await broadcast_runner.stop()
+    await webhook_dispatcher.stop()
+    # После рассылок: их письма уходят через пул SMTP-сессий
+    await run_blocking(smtp_transport.shutdown)
+    await http_clients.aclose()
+    # Остаток визитов/показов/кликов из буферов пакетной записи
+    await run_blocking(shutdown_event_buffers)
 
     await redis_pubsub.stop()
     if hasattr(app.state, "redis_listener"):
@@ -409,7 +437,9 @@ async def feature_gate_middleware(request: Request, call_next):
             return await call_next(request)
 
         if matched_module_key is not None:
-            gates = _get_feature_gates_cached()
+            _, user = await resolve_scope_session(request.scope)
+            company_id = user.get("company_id") if isinstance(user, dict) else None
+            gates = await run_blocking(_get_feature_gates, company_id)
             crm_modules = gates.get("crm_modules")
             if isinstance(crm_modules, dict):
                 module_enabled = _normalize_feature_flag(crm_modules.get(matched_module_key), True)
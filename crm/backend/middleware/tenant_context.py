@@ -1,13 +1,65 @@
 from http.cookies import SimpleCookie
+from typing import Optional
 
-from db.users import get_user_by_session
-from utils.tenant_context import reset_tenant_context, set_tenant_context
+from db.users import get_user_by_session, peek_cached_session_user
+from utils.blocking import run_blocking
+from utils.tenant_context import (
+    reset_request_session,
+    reset_tenant_context,
+    set_request_session,
+    set_tenant_context,
+)
+
+# Ключ ASGI scope, под которым хранится (session_token, user) текущего запроса
+SCOPE_SESSION_KEY = "crm.session"
+
+
+def _extract_session_token(scope) -> Optional[str]:
+    cookie_header = b""
+    for header_name, header_value in scope.get("headers", []):
+        if header_name == b"cookie":
+            cookie_header = header_value
+            break
+
+    if not cookie_header:
+        return None
+
+    try:
+        cookies = SimpleCookie()
+        cookies.load(cookie_header.decode())
+        if "session_token" in cookies:
+            return cookies["session_token"].value
+    except Exception:
+        return None
+    return None
+
+
+async def resolve_scope_session(scope) -> tuple:
+    """
+    Resolve (session_token, user) once per request and memoize it on the scope.
+    Cache misses go to the worker thread pool, never block the event loop.
+    """
+    resolved = scope.get(SCOPE_SESSION_KEY)
+    if resolved is not None:
+        return resolved
+
+    session_token = _extract_session_token(scope)
+    user = None
+    if session_token:
+        is_cached, user = peek_cached_session_user(session_token)
+        if not is_cached:
+            user = await run_blocking(get_user_by_session, session_token)
+
+    resolved = (session_token, user)
+    scope[SCOPE_SESSION_KEY] = resolved
+    return resolved
 
 
 class TenantContextMiddleware:
     """
     Resolve current authenticated tenant once per request and expose it
-    through ContextVar so DB/session helpers can apply tenant-aware behavior.
+    through ContextVar so DB/session helpers and auth dependencies
+    (`require_auth`, `get_current_user`) reuse the same lookup.
     """
 
     def __init__(self, app):
@@ -18,27 +70,12 @@ class TenantContextMiddleware:
             await self.app(scope, receive, send)
             return
 
-        tokens = None
-        cookie_header = b""
-        for header_name, header_value in scope.get("headers", []):
-            if header_name == b"cookie":
-                cookie_header = header_value
-                break
-
-        session_token = None
-        if cookie_header:
-            try:
-                cookies = SimpleCookie()
-                cookies.load(cookie_header.decode())
-                if "session_token" in cookies:
-                    session_token = cookies["session_token"].value
-            except Exception:
-                session_token = None
-
-        user = get_user_by_session(session_token) if session_token else None
+        session_token, user = await resolve_scope_session(scope)
         tokens = set_tenant_context(user=user)
+        session_context_token = set_request_session(session_token, user)
 
         try:
             await self.app(scope, receive, send)
         finally:
+            reset_request_session(session_context_token)
             reset_tenant_context(tokens)
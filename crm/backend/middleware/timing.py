@@ -1,13 +1,19 @@
+import os
 import time
 from utils.logger import log_info, log_warning, log_error
+from utils.query_profiler import current_request_profile, finish_request_profile, start_request_profile
 
 class TimingMiddleware:
     """
     Native ASGI Middleware для логирования времени выполнения запросов.
     Избегает накладных расходов BaseHTTPMiddleware.
+
+    Также открывает профиль SQL-запросов (utils.query_profiler) на время запроса
+    и вне production добавляет заголовок Server-Timing (db / app).
     """
     def __init__(self, app):
         self.app = app
+        self.server_timing = os.getenv("ENVIRONMENT") != "production"
 
     async def __call__(self, scope, receive, send):
         if scope["type"] != "http":
@@ -19,10 +25,16 @@ class TimingMiddleware:
         method = scope.get("method", "")
         
         status_code = [None] # Use list to be mutable in closure
+        profile_token = start_request_profile()
 
         async def send_wrapper(message):
             if message["type"] == "http.response.start":
                 status_code[0] = message["status"]
+                profile = current_request_profile()
+                if self.server_timing and profile is not None:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
             await send(message)
 
         try:
@@ -33,6 +45,9 @@ class TimingMiddleware:
             raise
         finally:
             duration = (time.time() - start_time) * 1000
+            # Шаблон маршрута (/api/clients/{client_id}) вместо конкретного пути
+            route = getattr(scope.get("route"), "path", None) or path
+            finish_request_profile(profile_token, f"{method} {route}")
             
             # Логируем только медленные запросы или информационные
             if duration > 1000:
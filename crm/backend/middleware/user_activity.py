@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 from db.connection import get_db_connection
-from db.users import get_user_by_session
+from middleware.tenant_context import resolve_scope_session
 from utils.logger import log_error
 
 # Cache to avoid updating DB on every request
@@ -19,17 +19,6 @@ class UserActivityMiddleware:
             await self.app(scope, receive, send)
             return
 
-        # Extract session_token from cookies in scope
-        session_token = None
-        headers = dict(scope.get("headers", []))
-        cookie_header = headers.get(b"cookie", b"").decode()
-        if cookie_header:
-            import http.cookies
-            cookies = http.cookies.SimpleCookie()
-            cookies.load(cookie_header)
-            if "session_token" in cookies:
-                session_token = cookies["session_token"].value
-
         # Status code tracking
         status_code = [None]
 
@@ -41,10 +30,10 @@ class UserActivityMiddleware:
         await self.app(scope, receive, send_wrapper)
 
         # Post-request processing (non-blocking status update)
-        if session_token and status_code[0] and status_code[0] < 400:
+        if status_code[0] and status_code[0] < 400:
             try:
-                # Use a lightweight check
-                user = get_user_by_session(session_token)
+                # Session is already resolved by TenantContextMiddleware for this scope
+                _, user = await resolve_scope_session(scope)
                 if user and user.get('id'):
                     user_id = user['id']
                     now = datetime.now()
@@ -1,13 +1,13 @@
 """
 Email уведомления
 """
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import List, Optional
 from core.config import APP_NAME
 from modules import get_module_config
 from utils.logger import log_info, log_error
+from utils.smtp_transport import smtp_transport
 
 
 def _notification_brand_name(salon_data: dict) -> str:
@@ -68,11 +68,15 @@ async def send_email_notification(
             part2 = MIMEText(html, 'html', 'utf-8')
             msg.attach(part2)
 
-        # Подключение к SMTP серверу
-        with smtplib.SMTP(smtp_config['smtp_host'], smtp_config['smtp_port']) as server:
-            server.starttls()
-            server.login(smtp_config['smtp_user'], smtp_config['smtp_password'])
-            server.send_message(msg)
+        # Отправка через общий пул SMTP-сессий
+        sent = await smtp_transport.send_async(msg, {
+            'host': smtp_config['smtp_host'],
+            'port': smtp_config['smtp_port'],
+            'user': smtp_config['smtp_user'],
+            'password': smtp_config['smtp_password'],
+        })
+        if not sent:
+            return False
 
         log_info(f"✅ Email отправлен: {subject} → {', '.join(recipients)}", "notifications.email")
         return True
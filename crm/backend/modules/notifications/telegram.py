@@ -1,7 +1,7 @@
 """
 Telegram уведомления
 """
-import httpx
+from utils.http_clients import get_http_client
 from typing import List, Optional
 from core.config import APP_NAME
 from modules import get_module_config
@@ -56,24 +56,24 @@ async def send_telegram_notification(
             return False
 
     success = True
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        for chat_id in recipients:
-            try:
-                url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-                payload = {
-                    "chat_id": chat_id,
-                    "text": message,
-                    "parse_mode": parse_mode
-                }
-
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-
-                log_info(f"✅ Telegram отправлено → {chat_id}", "notifications.telegram")
-
-            except Exception as e:
-                log_error(f"Ошибка отправки в Telegram ({chat_id}): {e}", "notifications.telegram")
-                success = False
+    for chat_id in recipients:
+        try:
+            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+            payload = {
+                "chat_id": chat_id,
+                "text": message,
+                "parse_mode": parse_mode
+            }
+
+            client = get_http_client(url)
+            response = await client.post(url, json=payload, timeout=10.0)
+            response.raise_for_status()
+
+            log_info(f"✅ Telegram отправлено → {chat_id}", "notifications.telegram")
+
+        except Exception as e:
+            log_error(f"Ошибка отправки в Telegram ({chat_id}): {e}", "notifications.telegram")
+            success = False
 
     return success
 
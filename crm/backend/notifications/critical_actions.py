@@ -170,19 +170,17 @@ async def send_critical_action_notification(action_data: Dict[str, Any]):
 """
         
         # Отправляем email всем директорам
-        from utils.email_service import send_email
-        
-        for email, name in directors:
-            try:
-                await send_email(
-                    to_email=email,
-                    subject=subject,
-                    body=body,
-                    is_html=True
-                )
+        from utils.email_service import send_bulk_emails_async
+        
+        results = await send_bulk_emails_async([
+            {'to_email': email, 'subject': subject, 'html_body': body}
+            for email, _name in directors
+        ])
+        for (email, name), success in zip(directors, results):
+            if success:
                 log_info(f"✅ Critical action notification sent to {name} ({email})", "notifications")
-            except Exception as e:
-                log_error(f"❌ Failed to send notification to {email}: {e}", "notifications")
+            else:
+                log_error(f"❌ Failed to send notification to {email}", "notifications")
         
     except Exception as e:
         log_error(f"Error sending critical action notification: {e}", "notifications")
@@ -122,6 +122,19 @@ def start_crm_schedulers() -> bool:
     cron.add_job(check_database_backup, "cron", hour=4, minute=0, id="database_backup")
     log_info("📦 Database backup scheduler registered (runs at 04:00 daily)", "boot")
 
+    from utils.geoip import GEOIP_DB_URL, refresh_geoip_database
+
+    if GEOIP_DB_URL:
+        cron.add_job(refresh_geoip_database, "cron", day_of_week="mon", hour=4, minute=30, id="geoip_refresh")
+
+    from db.analytics_rollups import run_analytics_rollups_job
+
+    cron.add_job(run_analytics_rollups_job, "interval", minutes=5, id="analytics_rollups")
+
+    from services.client_scoring import run_client_scoring_job
+
+    cron.add_job(run_client_scoring_job, "interval", hours=1, id="client_scoring")
+
     from scheduler.trash_cleanup import start_trash_cleanup_scheduler
 
     start_trash_cleanup_scheduler(cron)
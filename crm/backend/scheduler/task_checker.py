@@ -1,6 +1,7 @@
 import asyncio
 from datetime import datetime, timedelta
 from db.connection import get_db_connection
+from db.schema_catalog import table_exists
 from crm_api.notifications import create_notification
 from utils.logger import log_info, log_error
 
@@ -10,21 +11,8 @@ async def check_tasks_due():
     c = conn.cursor()
     try:
         # Check if required tables exist
-        c.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables
-                WHERE table_name = 'workflow_stages'
-            )
-        """)
-        has_workflow_stages = c.fetchone()[0]
-
-        c.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables
-                WHERE table_name = 'unified_communication_log'
-            )
-        """)
-        has_unified_log = c.fetchone()[0]
+        has_workflow_stages = table_exists("workflow_stages", c)
+        has_unified_log = table_exists("unified_communication_log", c)
 
         now = datetime.now()
         tomorrow = now + timedelta(days=1)
@@ -106,13 +94,7 @@ async def check_client_reminders():
     c = conn.cursor()
     try:
         # Check if unified_communication_log table exists
-        c.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables
-                WHERE table_name = 'unified_communication_log'
-            )
-        """)
-        has_unified_log = c.fetchone()[0]
+        has_unified_log = table_exists("unified_communication_log", c)
 
         now = datetime.now()
 
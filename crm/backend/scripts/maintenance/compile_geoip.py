@@ -0,0 +1,20 @@
+"""
+Сборка офлайн-базы геолокации (utils.geoip) из CSV диапазонов.
+
+    python -m scripts.maintenance.compile_geoip ranges.csv [data/geoip.bin]
+
+CSV: network (CIDR) или start_ip,end_ip + country, city, latitude, longitude.
+Работающие воркеры подхватят новый файл сами (проверка mtime).
+"""
+import sys
+
+from utils.geoip import GEOIP_DB_PATH, compile_range_table
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    output_path = sys.argv[2] if len(sys.argv) > 2 else GEOIP_DB_PATH
+    summary = compile_range_table(sys.argv[1], output_path)
+    print(f"✅ {output_path}: {summary}")
@@ -0,0 +1,114 @@
+"""
+Бенчмарк записи трекинга: построчный путь против буфера пакетной записи.
+
+Построчный путь повторяет прежний track_visitor (SELECT дедупликации,
+INSERT и commit на каждое событие, своё соединение из пула). Буферный —
+EventBuffer + flush_visitor_events (один многострочный INSERT на пачку).
+Пишет в visitor_tracking строки с page_url `/__benchmark__/...` и удаляет
+их по завершении. Нужна рабочая БД (DATABASE_URL / настройки пула).
+
+Запуск (из crm/backend):
+    python scripts/monitoring/benchmark_event_ingestion.py --events 5000 --batch 500
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from db.connection import get_db_connection, init_connection_pool
+from db.visitor_tracking import flush_visitor_events, parse_user_agent
+from utils.event_buffer import EventBuffer
+
+BENCHMARK_URL = "/__benchmark__/"
+USER_AGENTS = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36",
+)
+
+
+def build_events(count: int):
+    # Частные адреса: геолокация не участвует в сравнении (get_visitor_location_data для них — None)
+    return [
+        (f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}", USER_AGENTS[i % len(USER_AGENTS)],
+         f"{BENCHMARK_URL}{i % 50}", None)
+        for i in range(count)
+    ]
+
+
+def legacy_track(ip, user_agent, page_url, referrer):
+    """Прежний путь: проверка дубликата за 10 секунд и INSERT на каждое событие."""
+    device_type, browser = parse_user_agent(user_agent)
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT id FROM visitor_tracking
+            WHERE ip_address = %s AND page_url = %s
+            AND visited_at > NOW() - INTERVAL '10 seconds'
+        """, (ip, page_url))
+        if c.fetchone():
+            return False
+        c.execute("""
+            INSERT INTO visitor_tracking
+            (ip_address, user_agent, page_url, referrer, device_type, browser)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (ip, user_agent, page_url, referrer, device_type, browser))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def cleanup():
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("DELETE FROM visitor_tracking WHERE page_url LIKE %s", (BENCHMARK_URL + "%",))
+        conn.commit()
+        return c.rowcount
+    finally:
+        conn.close()
+
+
+def report(label, events, elapsed):
+    print(f"{label:<10} {events / elapsed:>10.0f} events/s {elapsed * 1000 / events:>8.3f} ms/event")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=500, help="max_batch буфера")
+    parser.add_argument("--delay-ms", type=int, default=1000, help="max_delay_ms буфера")
+    args = parser.parse_args()
+
+    init_connection_pool()
+    events = build_events(args.events)
+
+    try:
+        started = time.perf_counter()
+        for event in events:
+            legacy_track(*event)
+        report("per-row", len(events), time.perf_counter() - started)
+
+        buffer = EventBuffer("benchmark", flush_visitor_events, max_batch=args.batch,
+                             max_delay_ms=args.delay_ms, max_pending=len(events) + 1)
+        started = time.perf_counter()
+        for ip, user_agent, page_url, referrer in events:
+            buffer.add((ip, user_agent, page_url, referrer, time.monotonic()))
+        enqueue_elapsed = time.perf_counter() - started
+        buffer.shutdown()
+        elapsed = time.perf_counter() - started
+        report("buffered", len(events), elapsed)
+
+        stats = buffer.stats()
+        print(f"request-path enqueue: {enqueue_elapsed * 1_000_000 / len(events):.2f} µs/event, "
+              f"batches={stats['batches']} avg_batch={stats['avg_batch']} dropped={stats['dropped']}")
+    finally:
+        print(f"cleanup: {cleanup()} rows removed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Нагрузочный тест диспетчера LLM против локального фейкового upstream.
+
+Фейковый upstream повторяет Gemini generateContent: задержка ответа,
+лимит запросов в минуту на ключ (429 с RetryInfo.retryDelay), ключи из
+--forbidden-keys всегда отвечают 403. Тест гоняет разговоры нескольких
+компаний через LLMDispatcher и печатает его метрики: ожидание в очереди,
+время ответа upstream, отказы, здоровье ключей. БД не нужна.
+
+Запуск (из crm/backend):
+    python scripts/monitoring/benchmark_llm_dispatch.py --tenants 5 --requests 40 --keys 3 --upstream-rpm 120
+Только фейковый upstream (для живого бэкенда с LLM_UPSTREAM_URL=http://127.0.0.1:8765):
+    python scripts/monitoring/benchmark_llm_dispatch.py --serve
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from services.llm_dispatcher import LLMDispatcher, LLMRejected, LLMUnavailable
+
+
+def build_fake_upstream(rpm: int, latency_ms: tuple, forbidden_keys: set) -> FastAPI:
+    app = FastAPI()
+    recent = defaultdict(deque)
+
+    @app.post("/v1beta/models/{target}")
+    async def generate_content(target: str, request: Request):
+        key = request.query_params.get("key", "")
+        if not target.endswith(":generateContent"):
+            return JSONResponse({"error": {"code": 404, "message": "Not found"}}, status_code=404)
+        if key in forbidden_keys:
+            return JSONResponse({"error": {"code": 403, "message": "User location is not supported"}}, status_code=403)
+
+        now = time.monotonic()
+        window = recent[key]
+        while window and now - window[0] > 60:
+            window.popleft()
+        if rpm and len(window) >= rpm:
+            retry_delay = max(1, int(60 - (now - window[0])) + 1)
+            return JSONResponse({"error": {
+                "code": 429, "message": "Resource has been exhausted",
+                "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay}s"}],
+            }}, status_code=429)
+        window.append(now)
+
+        await asyncio.sleep(random.uniform(*latency_ms) / 1000)
+        body = await request.json()
+        prompt = body["contents"][0]["parts"][0]["text"]
+        return {"candidates": [{
+            "finishReason": "STOP",
+            "content": {"parts": [{"text": f"fake answer ({len(prompt)} chars)"}]},
+        }]}
+
+    return app
+
+
+async def run_load(args, upstream_url: str) -> None:
+    keys = [f"fake-key-{i:06d}" for i in range(args.keys)]
+    dispatcher = LLMDispatcher(
+        keys,
+        [],
+        key_rpm=args.key_rpm,
+        concurrency=args.concurrency,
+        queue_timeout=args.queue_timeout,
+        upstream_url=upstream_url,
+        model="fake-model",
+    )
+    results = defaultdict(lambda: defaultdict(int))
+    latencies = defaultdict(list)
+
+    async def conversation(tenant: int, turn: int):
+        payload = {
+            "contents": [{"parts": [{"text": "system prompt " * random.randint(50, 500)}]}],
+            "generationConfig": {"maxOutputTokens": 1000},
+        }
+        # Первая компания — «шумная»: шлёт всё сразу, остальные — с паузами между ходами
+        if tenant:
+            await asyncio.sleep(turn * args.think_ms / 1000)
+        started = time.perf_counter()
+        try:
+            await dispatcher.generate(payload, company_id=tenant + 1)
+            results[tenant]["ok"] += 1
+        except LLMRejected:
+            results[tenant]["rejected"] += 1
+        except LLMUnavailable:
+            results[tenant]["failed"] += 1
+        latencies[tenant].append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        conversation(tenant, turn)
+        for tenant in range(args.tenants)
+        for turn in range(args.requests)
+    ))
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.tenants * args.requests} requests in {elapsed:.1f}s")
+    for tenant in range(args.tenants):
+        ordered = sorted(latencies[tenant])
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0
+        print(f"  tenant {tenant + 1}{' (burst)' if tenant == 0 else ''}: {dict(results[tenant])} p95 {p95:.0f} ms")
+    print(json.dumps(dispatcher.stats(), indent=2, ensure_ascii=False))
+
+
+async def main_async(args) -> None:
+    app = build_fake_upstream(args.upstream_rpm, (args.latency_min_ms, args.latency_max_ms),
+                              {f"fake-key-{i:06d}" for i in range(args.forbidden_keys)})
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    if args.serve:
+        await server.serve()
+        return
+
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    try:
+        await run_load(args, f"http://127.0.0.1:{args.port}")
+    finally:
+        server.should_exit = True
+        await server_task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help="только поднять фейковый upstream")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tenants", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=40, help="ходов на компанию")
+    parser.add_argument("--think-ms", type=int, default=200, help="пауза между ходами «тихих» компаний")
+    parser.add_argument("--keys", type=int, default=3)
+    parser.add_argument("--forbidden-keys", type=int, default=0, help="сколько первых ключей отвечают 403")
+    parser.add_argument("--key-rpm", type=int, default=120, help="RPM бакета ключа в диспетчере")
+    parser.add_argument("--upstream-rpm", type=int, default=100, help="реальный лимит фейкового upstream на ключ")
+    parser.add_argument("--latency-min-ms", type=int, default=200)
+    parser.add_argument("--latency-max-ms", type=int, default=800)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--queue-timeout", type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Бенчмарк поиска сообщений: LIKE '%q%' против tsvector-индекса (db/search.py).
+
+Заливает синтетические сообщения (по умолчанию 1M) на служебных клиентов
+bench_search_*, делает ANALYZE, замеряет задержку обоих вариантов и удаляет
+данные (каскадом через clients). Требует БД с применённой схемой (db/init.py).
+
+Запуск (из crm/backend):
+    python scripts/monitoring/benchmark_search.py --messages 1000000 --rounds 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from db.connection import get_db_connection
+from db.messages import search_messages
+from db.search import search_clients
+from utils.tenant_context import platform_access
+
+CLIENT_PREFIX = "bench_search"
+CLIENTS = 200
+WORDS = (
+    "manicure", "pedicure", "haircut", "coloring", "booking", "tomorrow", "evening",
+    "price", "discount", "master", "appointment", "gel", "polish", "brows", "lashes",
+    "маникюр", "педикюр", "стрижка", "запись", "завтра", "вечером", "цена", "скидка",
+)
+# Редкое, частое слово и префикс
+QUERIES = ("balayage", "manicure", "appoint", "стриж")
+
+
+def seed(total_messages: int):
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO clients (instagram_id, username, name, phone)
+            SELECT %s || '_' || g, 'bench_user_' || g, 'Bench Client ' || g, '+97150' || LPAD(g::TEXT, 7, '0')
+            FROM generate_series(1, %s) g
+            ON CONFLICT (instagram_id) DO NOTHING
+        """, (CLIENT_PREFIX, CLIENTS))
+        # sender='bot', чтобы не нагружать триггер агрегатов клиента
+        c.execute("""
+            INSERT INTO chat_history (instagram_id, message, sender, timestamp)
+            SELECT %s || '_' || (1 + g %% %s),
+                   array_to_string(ARRAY(
+                       SELECT (%s::TEXT[])[1 + ((g * 7919 + w * 104729) %% array_length(%s::TEXT[], 1))]
+                       FROM generate_series(1, 6) w
+                   ), ' ') || CASE WHEN g %% 5000 = 0 THEN ' balayage' ELSE '' END,
+                   'bot',
+                   NOW() - (g || ' seconds')::INTERVAL
+            FROM generate_series(1, %s) g
+        """, (CLIENT_PREFIX, CLIENTS, list(WORDS), list(WORDS), total_messages))
+        conn.commit()
+        c.execute("ANALYZE chat_history")
+        c.execute("ANALYZE clients")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def cleanup():
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("DELETE FROM clients WHERE instagram_id LIKE %s", (f"{CLIENT_PREFIX}\\_%",))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def legacy_search_messages(query: str, limit: int):
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT m.id, m.instagram_id, c.username, c.name, m.message,
+                   m.sender, m.message_type, m.timestamp
+            FROM chat_history m
+            LEFT JOIN clients c ON m.instagram_id = c.instagram_id
+            WHERE m.message LIKE %s
+            ORDER BY m.timestamp DESC
+            LIMIT %s
+        """, (f"%{query}%", limit))
+        return c.fetchall()
+    finally:
+        conn.close()
+
+
+def measure(label, func, rounds):
+    timings = []
+    found = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        found = len(func())
+        timings.append((time.perf_counter() - started) * 1000)
+    print(f"  {label:<10} p50={statistics.median(timings):8.1f}ms  max={max(timings):8.1f}ms  rows={found}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="не удалять синтетические данные")
+    args = parser.parse_args()
+
+    with platform_access():
+        started = time.perf_counter()
+        seed(args.messages)
+        print(f"seeded {args.messages} messages in {time.perf_counter() - started:.1f}s")
+        try:
+            for query in QUERIES:
+                print(f"q={query!r}")
+                measure("LIKE", lambda: legacy_search_messages(query, args.limit), args.rounds)
+                measure("tsvector", lambda: search_messages(query, args.limit), args.rounds)
+            print("clients q='bench client 1'")
+            measure("clients", lambda: search_clients("bench client 1", args.limit), args.rounds)
+        finally:
+            if not args.keep:
+                cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Микро-бенчмарк поиска слотов: линейный перебор с шагом против свободных окон.
+
+Строит синтетические дни с большим количеством записей и сравнивает
+прежний алгоритм (перебор сетки + `_validate_slot_with_context` + линейный
+`_is_optimal_slot`) с `MasterScheduleService._generate_slots`. БД не нужна.
+
+Запуск (из crm/backend):
+    python scripts/monitoring/benchmark_slot_search.py --bookings 60 --step 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from services.master_schedule import MasterScheduleService
+
+
+def build_context(service, bookings: int, seed: int):
+    timezone = ZoneInfo("UTC")
+    date_obj = datetime(2030, 1, 15).date()
+    work_start = datetime.combine(date_obj, datetime.min.time(), tzinfo=timezone) + timedelta(hours=8)
+    work_end = work_start + timedelta(hours=14)
+
+    rng = random.Random(seed)
+    blocked = []
+    for _ in range(bookings):
+        start = work_start + timedelta(minutes=rng.randrange(0, 14 * 60, 5))
+        blocked.append({
+            "start": start,
+            "end": start + timedelta(minutes=rng.choice((15, 30, 45, 60, 90))),
+            "source": "booking",
+        })
+    blocked.sort(key=lambda interval: interval["start"])
+
+    return {
+        "date": date_obj.strftime("%Y-%m-%d"),
+        "date_obj": date_obj,
+        "timezone": timezone,
+        "now": work_start - timedelta(days=1),
+        "user_id": 1,
+        "master_name": "Benchmark",
+        "work_start": work_start,
+        "work_end": work_end,
+        "blocked_intervals": blocked,
+        "is_working": True,
+        "day_off_reason": None,
+    }
+
+
+def legacy_slots(service, context, duration: int, step: int):
+    """Прежний алгоритм: шаг по сетке, валидация строкой и линейные проходы."""
+    slots = []
+    current_dt = context["work_start"]
+    while current_dt + timedelta(minutes=duration) <= context["work_end"]:
+        slot_end = current_dt + timedelta(minutes=duration)
+        validation = service._validate_slot_with_context(context, current_dt.strftime("%H:%M"), duration)
+        if validation.get("is_available"):
+            is_optimal = current_dt == context["work_start"] or slot_end == context["work_end"]
+            for interval in context["blocked_intervals"]:
+                if (service._minute_key(current_dt) == service._minute_key(interval["end"])
+                        or service._minute_key(slot_end) == service._minute_key(interval["start"])):
+                    is_optimal = True
+                    break
+            slots.append({"time": current_dt.strftime("%H:%M"), "is_optimal": is_optimal})
+        current_dt += timedelta(minutes=step)
+    return slots
+
+
+def run(label, func, contexts, rounds):
+    produced = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for context in contexts:
+            context.pop("free_intervals", None)
+            context.pop("boundary_keys", None)
+            produced += len(func(context))
+    elapsed = time.perf_counter() - started
+    days = rounds * len(contexts)
+    print(f"{label:<14} {days / elapsed:>10.0f} days/s {produced / elapsed:>12.0f} slots/s")
+    return produced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=40, help="записей на день")
+    parser.add_argument("--duration", type=int, default=60, help="длительность слота, мин")
+    parser.add_argument("--step", type=int, default=15, help="шаг сетки, мин")
+    parser.add_argument("--days", type=int, default=50, help="синтетических дней")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    service = MasterScheduleService()
+    contexts = [build_context(service, args.bookings, seed) for seed in range(args.days)]
+
+    for context in contexts:
+        expected = legacy_slots(service, context, args.duration, args.step)
+        actual = service._generate_slots(
+            context, args.duration, return_metadata=True, slot_step_minutes=args.step,
+        )
+        assert actual == expected, f"slot mismatch for {context['date']}"
+
+    print(f"bookings/day={args.bookings} duration={args.duration}m step={args.step}m days={args.days}")
+    run("linear scan", lambda ctx: legacy_slots(service, ctx, args.duration, args.step), contexts, args.rounds)
+    run("free intervals", lambda ctx: service._generate_slots(
+        ctx, args.duration, return_metadata=True, slot_step_minutes=args.step,
+    ), contexts, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,10 @@
 """
 
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from core.config import DATABASE_NAME
 from db.connection import get_db_connection
+from db.analytics_rollups import booking_facts_sql
 from utils.logger import log_info, log_error
 
 class AnalyticsService:
@@ -79,47 +80,36 @@ class AnalyticsService:
             log_error(f"Error getting dashboard KPI: {e}", "analytics")
             return {}
 
+    def _visit_facts(self, start_date: str, end_date: str, master: Optional[str] = None) -> Tuple[str, List[Any]]:
+        """Факты записей по дню визита из дневных роллапов (db/analytics_rollups.py)"""
+        facts_sql, params = booking_facts_sql("visit", start_date, end_date)
+        if master:
+            return f"(SELECT * FROM ({facts_sql}) master_facts WHERE master = %s) f", params + [master]
+        return f"({facts_sql}) f", params
+
     def _get_revenue_metrics(self, start_date: str, end_date: str, master: Optional[str] = None) -> Dict:
         """Метрики по выручке"""
-        params = [start_date, end_date]
-        master_clause = ""
-        if master:
-            master_clause = " AND master = %s"
-            params.append(master)
+        facts, params = self._visit_facts(start_date, end_date, master)
 
-        # Общая выручка за период
+        # Общая выручка за период и средний чек (по записям с ненулевой выручкой)
         self.c.execute(f"""
-            SELECT COALESCE(SUM(revenue), 0)
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            AND status != 'cancelled'
-            {master_clause}
-        """, tuple(params))
-        total_revenue = self.c.fetchone()[0]
+            SELECT COALESCE(SUM(f.revenue), 0), COALESCE(SUM(f.paid_bookings), 0)::INTEGER
+            FROM {facts}
+            WHERE NULLIF(f.status, '') <> 'cancelled'
+        """, params)
+        total_revenue, paid_bookings = self.c.fetchone()
+        avg_check = round(total_revenue / paid_bookings, 2) if paid_bookings else 0
 
         # Выручка по дням
         self.c.execute(f"""
-            SELECT DATE(datetime) as date, COALESCE(SUM(revenue), 0) as daily_revenue
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            AND status != 'cancelled'
-            {master_clause}
-            GROUP BY DATE(datetime)
+            SELECT f.day as date, COALESCE(SUM(f.revenue), 0) as daily_revenue
+            FROM {facts}
+            WHERE NULLIF(f.status, '') <> 'cancelled'
+            GROUP BY f.day
             ORDER BY date
-        """, tuple(params))
+        """, params)
         daily_revenue = [{"date": row[0], "revenue": row[1]} for row in self.c.fetchall()]
 
-        # Средний чек
-        self.c.execute(f"""
-            SELECT COALESCE(AVG(revenue), 0)
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            AND status != 'cancelled'
-            AND revenue > 0
-            {master_clause}
-        """, tuple(params))
-        avg_check = round(self.c.fetchone()[0] or 0, 2)
-
         # Прогноз на остаток периода (упрощенно)
         # Если прошло X дней из 30, то прогноз = (total / X) * 30
         days_passed = (datetime.fromisoformat(end_date.replace(' ', 'T')) - datetime.fromisoformat(start_date.replace(' ', 'T'))).days
@@ -135,30 +125,17 @@ class AnalyticsService:
 
     def _get_booking_metrics(self, start_date: str, end_date: str, master: Optional[str] = None) -> Dict:
         """Метрики по записям"""
-        params = [start_date, end_date]
-        master_clause = ""
-        if master:
-            master_clause = " AND master = %s"
-            params.append(master)
+        facts, params = self._visit_facts(start_date, end_date, master)
 
-        # Общее количество записей
+        # Статусы (общее количество — их сумма)
         self.c.execute(f"""
-            SELECT COUNT(*) FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            {master_clause}
-        """, tuple(params))
-        total_bookings = self.c.fetchone()[0]
-
-        # Статусы
-        self.c.execute(f"""
-            SELECT status, COUNT(*) 
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            {master_clause}
-            GROUP BY status
-        """, tuple(params))
+            SELECT f.status, SUM(f.bookings)::INTEGER
+            FROM {facts}
+            GROUP BY f.status
+        """, params)
         status_counts = dict(self.c.fetchall())
-        
+        total_bookings = sum(status_counts.values())
+
         completed = status_counts.get('completed', 0)
         cancelled = status_counts.get('cancelled', 0)
         no_show = status_counts.get('no_show', 0)
@@ -249,18 +226,18 @@ class AnalyticsService:
             # Для конкретного мастера аналитика по другим мастерам не нужна
             return {"top_masters": [], "active_masters": 1, "avg_bookings_per_master": 0}
 
+        facts, params = self._visit_facts(start_date, end_date)
+
         # Топ-5 мастеров по выручке
-        self.c.execute("""
-            SELECT master, COUNT(*) as bookings_count, COALESCE(SUM(revenue), 0) as revenue
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            AND status != 'cancelled'
-            AND master IS NOT NULL
-            AND master != ''
-            GROUP BY master
+        self.c.execute(f"""
+            SELECT f.master, SUM(f.bookings)::INTEGER as bookings_count, COALESCE(SUM(f.revenue), 0) as revenue
+            FROM {facts}
+            WHERE NULLIF(f.status, '') <> 'cancelled'
+            AND f.master != ''
+            GROUP BY f.master
             ORDER BY revenue DESC
             LIMIT 5
-        """, (start_date, end_date))
+        """, params)
 
         top_masters = [
             {
@@ -272,23 +249,12 @@ class AnalyticsService:
         ]
 
         # Средняя загрузка
-        self.c.execute("""
-            SELECT COUNT(DISTINCT master)
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            AND master IS NOT NULL
-            AND master != ''
-        """, (start_date, end_date))
-        active_masters = self.c.fetchone()[0] or 0
-
-        self.c.execute("""
-            SELECT COUNT(*)
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            AND master IS NOT NULL
-            AND master != ''
-        """, (start_date, end_date))
-        total_bookings = self.c.fetchone()[0] or 0
+        self.c.execute(f"""
+            SELECT COUNT(DISTINCT f.master), COALESCE(SUM(f.bookings), 0)::INTEGER
+            FROM {facts}
+            WHERE f.master != ''
+        """, params)
+        active_masters, total_bookings = self.c.fetchone()
 
         avg_bookings_per_master = round(total_bookings / active_masters if active_masters > 0 else 0, 2)
 
@@ -300,22 +266,16 @@ class AnalyticsService:
 
     def _get_service_metrics(self, start_date: str, end_date: str, master: Optional[str] = None) -> Dict:
         """Метрики по услугам"""
-        params = [start_date, end_date]
-        master_clause = ""
-        if master:
-            master_clause = " AND master = %s"
-            params.append(master)
+        facts, params = self._visit_facts(start_date, end_date, master)
 
         self.c.execute(f"""
-            SELECT service_name, COUNT(*) as bookings_count, COALESCE(SUM(revenue), 0) as revenue
-            FROM bookings
-            WHERE datetime BETWEEN %s AND %s
-            AND status != 'cancelled'
-            {master_clause}
-            GROUP BY service_name
+            SELECT NULLIF(f.service_name, ''), SUM(f.bookings)::INTEGER as bookings_count, COALESCE(SUM(f.revenue), 0) as revenue
+            FROM {facts}
+            WHERE NULLIF(f.status, '') <> 'cancelled'
+            GROUP BY 1
             ORDER BY bookings_count DESC
             LIMIT 5
-        """, tuple(params))
+        """, params)
 
         top_services = [
             {
@@ -332,25 +292,19 @@ class AnalyticsService:
 
     def _get_peak_hours(self, start_date: str, end_date: str, master: Optional[str] = None) -> List[Dict]:
         """Пиковые часы посещаемости"""
-        params = [start_date, end_date]
-        master_clause = ""
-        if master:
-            master_clause = " AND master = %s"
-            params.append(master)
+        facts, params = self._visit_facts(start_date, end_date, master)
 
         self.c.execute(f"""
-            SELECT EXTRACT(HOUR FROM datetime::timestamp) as hour, COUNT(*) as count 
-            FROM bookings 
-            WHERE datetime BETWEEN %s AND %s
-            AND status != 'cancelled'
-            {master_clause}
-            GROUP BY hour 
-            ORDER BY count DESC 
+            SELECT f.hour, SUM(f.bookings)::INTEGER as count
+            FROM {facts}
+            WHERE NULLIF(f.status, '') <> 'cancelled'
+            GROUP BY f.hour
+            ORDER BY count DESC
             LIMIT 5
-        """, tuple(params))
-        
+        """, params)
+
         return [
-            {"hour": f"{int(row[0])}:00", "count": row[1]} 
+            {"hour": f"{int(row[0])}:00", "count": row[1]}
             for row in self.c.fetchall()
         ]
 
@@ -363,26 +317,18 @@ class AnalyticsService:
         prev_end = start - timedelta(seconds=1)
         prev_start = prev_end - timedelta(days=period_length)
 
-        master_clause = " AND master = %s" if master else ""
-        
-        # Current revenue
-        params_curr = [start_date, end_date]
-        if master: params_curr.append(master)
-        self.c.execute(f"SELECT COALESCE(SUM(revenue), 0) FROM bookings WHERE datetime BETWEEN %s AND %s AND status != 'cancelled' {master_clause}", tuple(params_curr))
-        current_revenue = self.c.fetchone()[0] or 0
-
-        # Previous revenue
-        params_prev = [prev_start.isoformat(), prev_end.isoformat()]
-        if master: params_prev.append(master)
-        self.c.execute(f"SELECT COALESCE(SUM(revenue), 0) FROM bookings WHERE datetime BETWEEN %s AND %s AND status != 'cancelled' {master_clause}", tuple(params_prev))
-        prev_revenue = self.c.fetchone()[0] or 0
-
-        # Bookings
-        self.c.execute(f"SELECT COUNT(*) FROM bookings WHERE datetime BETWEEN %s AND %s {master_clause}", tuple(params_curr))
-        current_bookings = self.c.fetchone()[0] or 0
-
-        self.c.execute(f"SELECT COUNT(*) FROM bookings WHERE datetime BETWEEN %s AND %s {master_clause}", tuple(params_prev))
-        prev_bookings = self.c.fetchone()[0] or 0
+        # Оба периода одним проходом по роллапам
+        facts, params = self._visit_facts(prev_start.isoformat(), end_date, master)
+        start_day = start.date()
+        self.c.execute(f"""
+            SELECT
+                COALESCE(SUM(f.revenue) FILTER (WHERE f.day >= %s AND NULLIF(f.status, '') <> 'cancelled'), 0),
+                COALESCE(SUM(f.revenue) FILTER (WHERE f.day < %s AND NULLIF(f.status, '') <> 'cancelled'), 0),
+                COALESCE(SUM(f.bookings) FILTER (WHERE f.day >= %s), 0)::INTEGER,
+                COALESCE(SUM(f.bookings) FILTER (WHERE f.day < %s), 0)::INTEGER
+            FROM {facts}
+        """, [start_day, start_day, start_day, start_day] + params)
+        current_revenue, prev_revenue, current_bookings, prev_bookings = self.c.fetchone()
 
         revenue_change = round(((current_revenue - prev_revenue) / prev_revenue * 100) if prev_revenue > 0 else 0, 2)
         bookings_change = round(((current_bookings - prev_bookings) / prev_bookings * 100) if prev_bookings > 0 else 0, 2)
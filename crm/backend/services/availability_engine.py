@@ -0,0 +1,489 @@
+"""
+Диапазонный движок доступности мастеров.
+
+`MasterScheduleService._build_day_context` раньше открывал отдельное соединение
+и делал ~6 запросов на каждую пару (мастер, день): календарь месяца на M мастеров
+стоил 30×M×6 round trip'ов. `AvailabilityTimeline` загружает праздники,
+графики, отпуска, записи и черновики за весь диапазон несколькими set-based
+запросами, раскладывает их по мастерам и дням в памяти и отвечает на вопросы
+"слоты на день", "даты с окнами в месяце" и "любой мастер" без обращений к БД.
+
+Контекст дня имеет ту же форму, что и раньше, поэтому валидация и генерация
+слотов остаются в `MasterScheduleService` (SSOT).
+"""
+from datetime import datetime, timedelta, date as dt_date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from db.connection import get_db_connection
+from db.schema_catalog import column_exists
+from utils.datetime_utils import get_current_time, get_salon_timezone
+
+_EMPTY_HOLIDAY_STATE = {
+    "is_holiday": False,
+    "holiday_name": None,
+    "is_closed": False,
+    "has_override": False,
+    "is_day_off": False,
+}
+
+
+def _date_key(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (datetime, dt_date)):
+        return value.strftime("%Y-%m-%d")
+    raw = str(value).strip()
+    return raw[:10] if len(raw) >= 10 else None
+
+
+class AvailabilityTimeline:
+    """Предзагруженные интервалы занятости мастеров за диапазон дат."""
+
+    def __init__(
+        self,
+        service,
+        user_records: Iterable[Dict[str, Any]],
+        start_date: dt_date,
+        end_date: dt_date,
+    ):
+        self._service = service
+        self.start_date = start_date
+        self.end_date = end_date
+        self.timezone = ZoneInfo(get_salon_timezone())
+        self.now = get_current_time().astimezone(self.timezone)
+
+        self.masters: List[Dict[str, Any]] = []
+        self._masters_by_id: Dict[int, Dict[str, Any]] = {}
+        for record in user_records:
+            if not record or record.get("id") is None:
+                continue
+            user_id = int(record["id"])
+            if user_id in self._masters_by_id:
+                continue
+            self._masters_by_id[user_id] = record
+            self.masters.append(record)
+
+        self._salon_settings: Dict[str, Any] = {}
+        self._holidays: Dict[str, Tuple[Any, Any, List[int]]] = {}
+        self._schedules: Dict[Tuple[int, int], Tuple[Any, Any, Any]] = {}
+        self._time_off: Dict[int, List[Dict[str, Any]]] = {}
+        self._day_intervals: Dict[Tuple[int, str], List[Dict[str, Any]]] = {}
+        self._contexts: Dict[Tuple[int, str], Dict[str, Any]] = {}
+
+    # ---------------------------------------------------------------- loading
+
+    @classmethod
+    def load(
+        cls,
+        service,
+        user_records: Iterable[Dict[str, Any]],
+        start_date: dt_date,
+        end_date: dt_date,
+        cursor=None,
+    ) -> "AvailabilityTimeline":
+        """
+        `cursor` — курсор вызывающей транзакции (резервирование слота под
+        advisory lock); без него берётся отдельное соединение из пула.
+        """
+        timeline = cls(service, user_records, start_date, end_date)
+        timeline._load(cursor)
+        return timeline
+
+    def _load(self, cursor=None) -> None:
+        from db.settings import get_salon_settings
+        self._salon_settings = get_salon_settings() or {}
+
+        if not self.masters or self.end_date < self.start_date:
+            return
+
+        user_ids = [int(record["id"]) for record in self.masters]
+        range_start_key = f"{self.start_date.strftime('%Y-%m-%d')} 00:00:00"
+        range_end_key = f"{(self.end_date + timedelta(days=1)).strftime('%Y-%m-%d')} 00:00:00"
+
+        conn = None
+        if cursor is None:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+        try:
+            self._load_holidays(cursor)
+            self._load_schedules(cursor, user_ids)
+            self._load_time_off(cursor, user_ids, range_start_key, range_end_key)
+            duration_by_id, duration_by_name = self._service._load_service_duration_maps(cursor)
+            self._load_bookings(cursor, user_ids, range_start_key, range_end_key, duration_by_name)
+            self._load_drafts(cursor, user_ids, range_start_key, range_end_key, duration_by_id)
+        finally:
+            if conn is not None:
+                conn.close()
+
+        for intervals in self._day_intervals.values():
+            intervals.sort(key=lambda interval: interval["start"])
+
+    def _load_holidays(self, cursor) -> None:
+        cursor.execute(
+            """
+            SELECT date, name, is_closed, master_exceptions
+            FROM salon_holidays
+            WHERE date >= %s AND date <= %s
+            """,
+            (self.start_date.strftime("%Y-%m-%d"), self.end_date.strftime("%Y-%m-%d")),
+        )
+        for row in cursor.fetchall():
+            key = _date_key(row[0])
+            if not key or key in self._holidays:
+                continue
+            self._holidays[key] = (row[1], row[2], self._service._parse_master_exceptions(row[3]))
+
+    def _load_schedules(self, cursor, user_ids: List[int]) -> None:
+        cursor.execute(
+            """
+            SELECT user_id, day_of_week, start_time, end_time, is_active
+            FROM user_schedule
+            WHERE user_id = ANY(%s)
+            """,
+            (user_ids,),
+        )
+        for row in cursor.fetchall():
+            key = (int(row[0]), int(row[1]))
+            if key not in self._schedules:
+                self._schedules[key] = (row[2], row[3], row[4])
+
+    def _load_time_off(self, cursor, user_ids: List[int], range_start_key: str, range_end_key: str) -> None:
+        cursor.execute(
+            """
+            SELECT user_id, start_date, end_date
+            FROM user_time_off
+            WHERE user_id = ANY(%s)
+              AND start_date < %s
+              AND end_date > %s
+            """,
+            (user_ids, range_end_key, range_start_key),
+        )
+        for row in cursor.fetchall():
+            start_dt = self._service._to_tz_datetime(row[1], self.timezone)
+            end_dt = self._service._to_tz_datetime(row[2], self.timezone)
+            if not start_dt or not end_dt or end_dt <= start_dt:
+                continue
+            self._time_off.setdefault(int(row[0]), []).append({
+                "start": start_dt,
+                "end": end_dt,
+                "source": "time_off",
+            })
+
+    def _alias_index(self) -> Dict[str, List[int]]:
+        index: Dict[str, List[int]] = {}
+        for record in self.masters:
+            user_id = int(record["id"])
+            for alias in self._service._get_master_aliases(record):
+                owners = index.setdefault(alias.upper(), [])
+                if user_id not in owners:
+                    owners.append(user_id)
+        return index
+
+    def _fetch_master_rows(
+        self,
+        cursor,
+        table_name: str,
+        value_column: str,
+        extra_condition: str,
+        user_ids: List[int],
+        aliases_upper: List[str],
+        range_start_key: str,
+        range_end_key: str,
+    ) -> List[Tuple[Any, ...]]:
+        if column_exists(table_name, "master_user_id", cursor):
+            cursor.execute(
+                f"""
+                SELECT datetime, {value_column}, master_user_id, UPPER(COALESCE(master, ''))
+                FROM {table_name}
+                WHERE datetime >= %s
+                  AND datetime < %s
+                  AND {extra_condition}
+                  AND (
+                    master_user_id = ANY(%s)
+                    OR (master_user_id IS NULL AND UPPER(COALESCE(master, '')) = ANY(%s))
+                  )
+                """,
+                (range_start_key, range_end_key, user_ids, aliases_upper),
+            )
+        else:
+            cursor.execute(
+                f"""
+                SELECT datetime, {value_column}, NULL, UPPER(COALESCE(master, ''))
+                FROM {table_name}
+                WHERE datetime >= %s
+                  AND datetime < %s
+                  AND {extra_condition}
+                  AND UPPER(COALESCE(master, '')) = ANY(%s)
+                """,
+                (range_start_key, range_end_key, aliases_upper),
+            )
+        return cursor.fetchall()
+
+    def _row_owners(self, master_user_id: Any, master_upper: str, user_ids: set, alias_index: Dict[str, List[int]]) -> List[int]:
+        if master_user_id is not None:
+            try:
+                owner_id = int(master_user_id)
+            except Exception:
+                return []
+            return [owner_id] if owner_id in user_ids else []
+        return alias_index.get(master_upper or "", [])
+
+    def _add_interval(self, owners: List[int], start_dt: datetime, end_dt: datetime, source: str) -> None:
+        date_key = start_dt.strftime("%Y-%m-%d")
+        for user_id in owners:
+            self._day_intervals.setdefault((user_id, date_key), []).append({
+                "start": start_dt,
+                "end": end_dt,
+                "source": source,
+            })
+
+    def _load_bookings(
+        self,
+        cursor,
+        user_ids: List[int],
+        range_start_key: str,
+        range_end_key: str,
+        duration_by_name: Dict[str, int],
+    ) -> None:
+        alias_index = self._alias_index()
+        user_id_set = set(user_ids)
+        rows = self._fetch_master_rows(
+            cursor, "bookings", "service_name", "status != 'cancelled'",
+            user_ids, list(alias_index.keys()), range_start_key, range_end_key,
+        )
+        for row in rows:
+            owners = self._row_owners(row[2], row[3], user_id_set, alias_index)
+            if not owners:
+                continue
+            start_dt = self._service._to_tz_datetime(row[0], self.timezone)
+            if not start_dt:
+                continue
+            duration = self._service._estimate_duration_from_text(row[1], duration_by_name, fallback=60)
+            self._add_interval(owners, start_dt, start_dt + timedelta(minutes=duration), "booking")
+
+    def _load_drafts(
+        self,
+        cursor,
+        user_ids: List[int],
+        range_start_key: str,
+        range_end_key: str,
+        duration_by_id: Dict[int, int],
+    ) -> None:
+        alias_index = self._alias_index()
+        user_id_set = set(user_ids)
+        rows = self._fetch_master_rows(
+            cursor, "booking_drafts", "service_id", "expires_at > NOW()",
+            user_ids, list(alias_index.keys()), range_start_key, range_end_key,
+        )
+        for row in rows:
+            owners = self._row_owners(row[2], row[3], user_id_set, alias_index)
+            if not owners:
+                continue
+            start_dt = self._service._to_tz_datetime(row[0], self.timezone)
+            if not start_dt:
+                continue
+            service_id = row[1]
+            duration = duration_by_id.get(int(service_id), 60) if service_id is not None else 60
+            self._add_interval(owners, start_dt, start_dt + timedelta(minutes=duration), "draft")
+
+    # ---------------------------------------------------------------- queries
+
+    def iter_dates(self) -> List[str]:
+        dates: List[str] = []
+        current = self.start_date
+        while current <= self.end_date:
+            dates.append(current.strftime("%Y-%m-%d"))
+            current += timedelta(days=1)
+        return dates
+
+    def covers(self, date_obj: dt_date) -> bool:
+        return self.start_date <= date_obj <= self.end_date
+
+    def find_master(self, master_identifier: Any) -> Optional[Dict[str, Any]]:
+        """Найти загруженного мастера по id/full_name/username/nickname."""
+        identifier = str(master_identifier or "").strip()
+        if not identifier:
+            return None
+        if identifier.isdigit() and int(identifier) in self._masters_by_id:
+            return self._masters_by_id[int(identifier)]
+
+        lowered = identifier.lower()
+        for record in self.masters:
+            for key in ("username", "full_name", "nickname"):
+                if str(record.get(key) or "").strip().lower() == lowered:
+                    return record
+        return None
+
+    def _holiday_state(self, date_str: str, user_id: int) -> Dict[str, Any]:
+        holiday = self._holidays.get(date_str)
+        if not holiday:
+            return dict(_EMPTY_HOLIDAY_STATE)
+
+        holiday_name, is_closed, exceptions = holiday
+        has_override = user_id in exceptions
+        return {
+            "is_holiday": True,
+            "holiday_name": holiday_name,
+            "is_closed": bool(is_closed),
+            "has_override": has_override,
+            "is_day_off": bool(is_closed and not has_override),
+        }
+
+    def _schedule_state(self, user_id: int, date_obj: dt_date) -> Dict[str, Any]:
+        service = self._service
+        day_of_week = int(date_obj.weekday())
+        row = self._schedules.get((user_id, day_of_week))
+        if row:
+            start_time = service._normalize_time_string(row[0])
+            end_time = service._normalize_time_string(row[1])
+            is_working = bool(row[2] and start_time and end_time and start_time < end_time)
+            return {
+                "is_working": is_working,
+                "start_time": start_time,
+                "end_time": end_time,
+                "day_of_week": day_of_week,
+                "source": "user_schedule",
+            }
+
+        settings_key = "hours_weekends" if day_of_week >= 5 else "hours_weekdays"
+        configured_range = self._salon_settings.get(settings_key) or ""
+        start_time, end_time = service._parse_hours_range(configured_range, "", "")
+        return {
+            "is_working": bool(start_time and end_time and start_time < end_time),
+            "start_time": start_time,
+            "end_time": end_time,
+            "day_of_week": day_of_week,
+            "source": "salon_defaults",
+        }
+
+    def get_day_context(self, user_id: int, date_str: str) -> Optional[Dict[str, Any]]:
+        """Контекст дня мастера в формате `MasterScheduleService._build_day_context`."""
+        user_id = int(user_id)
+        cache_key = (user_id, date_str)
+        if cache_key in self._contexts:
+            return self._contexts[cache_key]
+
+        user_record = self._masters_by_id.get(user_id)
+        if not user_record:
+            return None
+        try:
+            date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+        except Exception:
+            return None
+        if date_obj < self.start_date or date_obj > self.end_date:
+            return None
+
+        service = self._service
+        holiday_state = self._holiday_state(date_str, user_id)
+        schedule_state = self._schedule_state(user_id, date_obj)
+        context: Dict[str, Any] = {
+            "date": date_str,
+            "date_obj": date_obj,
+            "timezone": self.timezone,
+            "now": self.now,
+            "user_id": user_id,
+            "master_name": user_record.get("full_name") or user_record.get("username") or str(user_id),
+            "holiday": holiday_state,
+            "schedule": schedule_state,
+            "work_start": None,
+            "work_end": None,
+            "blocked_intervals": [],
+            "is_working": False,
+            "day_off_reason": None,
+        }
+        self._contexts[cache_key] = context
+
+        if holiday_state.get("is_day_off"):
+            context["day_off_reason"] = "holiday"
+            return context
+        if not schedule_state.get("is_working"):
+            context["day_off_reason"] = "schedule_off"
+            return context
+
+        work_start = service._combine_date_time(date_obj, schedule_state.get("start_time"), self.timezone)
+        work_end = service._combine_date_time(date_obj, schedule_state.get("end_time"), self.timezone)
+        if not work_start or not work_end or work_end <= work_start:
+            context["day_off_reason"] = "schedule_off"
+            return context
+
+        day_start = datetime.combine(date_obj, datetime.min.time(), tzinfo=self.timezone)
+        day_end = day_start + timedelta(days=1)
+        blocked_intervals: List[Dict[str, Any]] = [
+            interval
+            for interval in self._time_off.get(user_id, [])
+            if interval["start"] < day_end and interval["end"] > day_start
+        ]
+        lunch_interval = service._fetch_lunch_interval(self._salon_settings, date_obj, self.timezone)
+        if lunch_interval:
+            blocked_intervals.append(lunch_interval)
+        blocked_intervals.extend(self._day_intervals.get(cache_key, []))
+        blocked_intervals.sort(key=lambda interval: interval["start"])
+
+        context["work_start"] = work_start
+        context["work_end"] = work_end
+        context["blocked_intervals"] = blocked_intervals
+        context["is_working"] = True
+        return context
+
+    def get_slots(
+        self,
+        user_id: int,
+        date_str: str,
+        duration_minutes: Any = 60,
+        return_metadata: bool = False,
+        slot_step_minutes: Optional[int] = None,
+    ) -> List[Any]:
+        context = self.get_day_context(user_id, date_str)
+        return self._service._generate_slots(
+            context,
+            duration_minutes,
+            return_metadata=return_metadata,
+            slot_step_minutes=slot_step_minutes,
+        )
+
+    def has_availability(
+        self,
+        user_id: int,
+        date_str: str,
+        duration_minutes: Any = 60,
+        slot_step_minutes: Optional[int] = None,
+    ) -> bool:
+        context = self.get_day_context(user_id, date_str)
+        slots = self._service._generate_slots(
+            context, duration_minutes, limit=1, slot_step_minutes=slot_step_minutes,
+        )
+        return bool(slots)
+
+    def get_masters_availability(
+        self,
+        date_str: str,
+        duration_minutes: Any = 60,
+        return_metadata: bool = False,
+        slot_step_minutes: Optional[int] = None,
+    ) -> Dict[str, List[Any]]:
+        """Слоты всех загруженных мастеров на день ({имя мастера: слоты})."""
+        availability: Dict[str, List[Any]] = {}
+        for record in self.masters:
+            slots = self.get_slots(
+                int(record["id"]), date_str, duration_minutes, return_metadata, slot_step_minutes,
+            )
+            if not slots:
+                continue
+            master_name = record.get("full_name") or record.get("username") or str(record["id"])
+            availability.setdefault(master_name, slots)
+        return availability
+
+    def get_available_dates(self, duration_minutes: Any = 60, slot_step_minutes: Optional[int] = None) -> List[str]:
+        """Даты диапазона (начиная с сегодня), в которые хотя бы у одного мастера есть окно."""
+        today = self.now.date()
+        available_dates: List[str] = []
+        for date_str in self.iter_dates():
+            if datetime.strptime(date_str, "%Y-%m-%d").date() < today:
+                continue
+            if any(
+                self.has_availability(int(record["id"]), date_str, duration_minutes, slot_step_minutes)
+                for record in self.masters
+            ):
+                available_dates.append(date_str)
+        return available_dates
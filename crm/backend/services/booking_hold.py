@@ -1,8 +1,156 @@
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from typing import Any, Optional, List, Dict
+from zoneinfo import ZoneInfo
 from db.connection import get_db_connection
+from utils.datetime_utils import get_salon_timezone
 from utils.logger import log_error, log_info
 
+# Namespace для pg_advisory_xact_lock(int, int): мастер + день.
+# 910001 занят лидерством планировщика (product_groups/crm/runtime_bootstrap.py).
+SLOT_LOCK_NAMESPACE = 910101
+
+
+class SlotConflictError(ValueError):
+    """
+    Слот занят. Сообщение сохраняет формат "slot_unavailable:<reason>",
+    который разбирают API-роуты; `conflict` описывает мешающий интервал.
+    """
+
+    def __init__(self, reason: str, conflict: Optional[Dict[str, Any]] = None):
+        self.reason = reason or "unavailable"
+        self.conflict = conflict or {}
+        super().__init__(f"slot_unavailable:{self.reason}")
+
+
+def master_lock_key(master_user_id: Optional[int], master_name: Optional[str]) -> str:
+    if master_user_id is not None:
+        return f"id:{int(master_user_id)}"
+    return f"name:{str(master_name or '').strip().upper()}"
+
+
+def lock_master_day(cursor, master_user_id: Optional[int], master_name: Optional[str], date_str: str) -> None:
+    """
+    Сериализовать запись к мастеру на день до конца текущей транзакции.
+    Все пути, создающие записи/холды на мастера, берут этот же lock.
+    """
+    cursor.execute(
+        "SELECT pg_advisory_xact_lock(%s, hashtext(%s))",
+        (SLOT_LOCK_NAMESPACE, f"{master_lock_key(master_user_id, master_name)}:{date_str}"),
+    )
+
+
+def _holds_table_exists(cursor) -> bool:
+    cursor.execute("SELECT to_regclass('booking_holds') IS NOT NULL")
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def find_conflicting_hold(
+    cursor,
+    schedule_service,
+    master_aliases: List[str],
+    start_dt: datetime,
+    end_dt: datetime,
+    client_id: Optional[str],
+) -> Optional[Dict[str, Any]]:
+    """Активный холд другого клиента, пересекающийся с [start_dt, end_dt)."""
+    if not master_aliases or not _holds_table_exists(cursor):
+        return None
+
+    cursor.execute(
+        """
+        SELECT time, service_id, client_id
+        FROM booking_holds
+        WHERE date = %s
+          AND expires_at > NOW()
+          AND UPPER(master) = ANY(%s)
+          AND client_id IS DISTINCT FROM %s
+        """,
+        (start_dt.strftime("%Y-%m-%d"), [alias.upper() for alias in master_aliases], client_id),
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+
+    duration_by_id, _ = schedule_service._load_service_duration_maps(cursor)
+    for hold_time, service_id, _holder in rows:
+        hold_start = schedule_service._combine_date_time(start_dt.date(), hold_time, start_dt.tzinfo)
+        if not hold_start:
+            continue
+        duration = duration_by_id.get(int(service_id), 60) if service_id is not None else 60
+        hold_end = hold_start + timedelta(minutes=duration)
+        if hold_start < end_dt and hold_end > start_dt:
+            return {
+                "source": "hold",
+                "start": hold_start.strftime("%H:%M"),
+                "end": hold_end.strftime("%H:%M"),
+            }
+    return None
+
+
+def reserve_slot(
+    cursor,
+    master_name: str,
+    master_user_id: Optional[int],
+    start_dt: datetime,
+    duration_minutes: int,
+    client_id: Optional[str] = None,
+    schedule_service=None,
+) -> Dict[str, Any]:
+    """
+    Проверить слот внутри транзакции вызывающего под advisory lock мастера/дня.
+
+    Lock держится до commit/rollback, поэтому проверка и INSERT записи атомарны
+    относительно других писателей. При конфликте — SlotConflictError с точной
+    причиной (booked/held/lunch_break/time_off/outside_working_hours/...).
+    """
+    if schedule_service is None:
+        from services.master_schedule import MasterScheduleService
+        schedule_service = MasterScheduleService()
+
+    date_str = start_dt.strftime("%Y-%m-%d")
+    time_str = start_dt.strftime("%H:%M")
+    lock_master_day(cursor, master_user_id, master_name, date_str)
+
+    result = schedule_service.validate_slot(
+        master_name=master_name,
+        date=date_str,
+        time_str=time_str,
+        duration_minutes=duration_minutes,
+        cursor=cursor,
+    )
+    if not result.get("is_available"):
+        raise SlotConflictError(result.get("reason", "unavailable"), result.get("conflict"))
+
+    user_record = schedule_service._get_user_record(master_user_id or master_name, cursor=cursor) or {}
+    aliases = schedule_service._get_master_aliases(user_record, master_name)
+    hold_conflict = find_conflicting_hold(
+        cursor,
+        schedule_service,
+        aliases,
+        start_dt,
+        start_dt + timedelta(minutes=max(1, int(duration_minutes))),
+        client_id,
+    )
+    if hold_conflict:
+        raise SlotConflictError("held", hold_conflict)
+
+    return result
+
+
+def release_client_hold(cursor, client_id: Optional[str], master_aliases: List[str], date_str: str, time_str: str) -> None:
+    """Снять холд клиента после того, как слот превращён в запись."""
+    if not client_id or not master_aliases or not _holds_table_exists(cursor):
+        return
+    cursor.execute(
+        """
+        DELETE FROM booking_holds
+        WHERE client_id = %s AND date = %s AND time = %s AND UPPER(master) = ANY(%s)
+        """,
+        (client_id, date_str, time_str, [alias.upper() for alias in master_aliases]),
+    )
+
+
 class BookingHoldService:
     """Service for managing temporary booking holds to prevent double booking."""
     
@@ -23,6 +171,13 @@ class BookingHoldService:
         try:
             # First, clean up expired holds
             self._cleanup_expired(c)
+
+            # Same master/day lock as save_booking: a hold can't be taken on a slot
+            # that is being booked concurrently.
+            from services.master_schedule import MasterScheduleService
+            schedule_service = MasterScheduleService()
+            master_record = schedule_service._get_user_record(master_name, cursor=c) or {}
+            lock_master_day(c, master_record.get("id"), master_name, date)
             
             # Check if already held by SOMEONE ELSE
             c.execute("""
@@ -34,6 +189,7 @@ class BookingHoldService:
             if existing:
                 holder_id, expires_at = existing
                 if holder_id != client_id and expires_at > datetime.now():
+                    conn.rollback()  # releases the master/day lock
                     return False # Slot is taken by someone else
                 
                 # If held by self, refresh it
@@ -47,6 +203,24 @@ class BookingHoldService:
                      conn.commit()
                      return True
 
+            duration_by_id, _ = schedule_service._load_service_duration_maps(c)
+            duration = duration_by_id.get(int(service_id), 60) if service_id else 60
+            slot_check = schedule_service.validate_slot(master_name, date, time, duration_minutes=duration, cursor=c)
+            hold_start = schedule_service._combine_date_time(
+                datetime.strptime(date, "%Y-%m-%d").date(), time, ZoneInfo(get_salon_timezone()),
+            )
+            overlapping_hold = hold_start and find_conflicting_hold(
+                c,
+                schedule_service,
+                schedule_service._get_master_aliases(master_record, master_name),
+                hold_start,
+                hold_start + timedelta(minutes=duration),
+                client_id,
+            )
+            if not slot_check.get("is_available") or overlapping_hold:
+                conn.rollback()
+                return False
+
             # Create new hold
             expires_at = datetime.now() + timedelta(minutes=self.HOLD_DURATION_MINUTES)
             c.execute("""
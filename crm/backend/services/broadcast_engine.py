@@ -0,0 +1,671 @@
+"""
+Движок массовых рассылок.
+
+Рассылка — строка broadcast_jobs (очередь в PostgreSQL). Раннер в каждом воркере
+забирает задачи через FOR UPDATE SKIP LOCKED и держит аренду (heartbeat_at);
+задача с протухшей арендой (воркер упал или перезапущен) подхватывается заново
+с последнего чекпоинта.
+
+Получатели читаются порциями по keyset (сотрудники → клиенты → ручные контакты),
+соединение с БД на время отправки не удерживается. Порция рассылается параллельно
+с ограничением конкурентности и частоты на канал (Telegram, Instagram, SMTP, in-app);
+после порции сохраняются чекпоинт и счётчики, а прогресс уходит отправителю через
+notifications WebSocket (`{"type": "broadcast_progress"}`).
+
+Доставка at-least-once: после падения порция, не успевшая сохранить чекпоинт,
+отправляется повторно (не больше BROADCAST_CHUNK_SIZE получателей).
+Лимиты частоты действуют в пределах воркера.
+"""
+import asyncio
+import json
+import os
+import socket
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from db.connection import get_db_connection
+from utils.blocking import run_blocking
+from utils.logger import log_error, log_info, log_warning
+from utils.tenant_context import platform_access, reset_tenant_context, set_tenant_context
+from utils.token_bucket import AsyncTokenBucket
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def _read_float_env(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+BROADCAST_CHUNK_SIZE = max(1, _read_int_env("BROADCAST_CHUNK_SIZE", 100))
+BROADCAST_CHANNEL_CONCURRENCY = max(1, _read_int_env("BROADCAST_CHANNEL_CONCURRENCY", 8))
+BROADCAST_LEASE_SECONDS = max(30, _read_int_env("BROADCAST_LEASE_SECONDS", 120))
+BROADCAST_POLL_SECONDS = max(1, _read_int_env("BROADCAST_POLL_SECONDS", 5))
+BROADCAST_MAX_ATTEMPTS = max(1, _read_int_env("BROADCAST_MAX_ATTEMPTS", 5))
+
+# Сообщений в секунду на провайдера (BROADCAST_RATE_TELEGRAM и т.д.), 0 — без лимита
+_PROVIDER_RATE_DEFAULTS = {"telegram": 25.0, "instagram": 5.0, "email": 5.0, "in_app": 50.0}
+
+PHASES = ("staff", "clients", "manual")
+
+_JOB_COLUMNS = """
+    id, company_id, sender_id, payload, status, total_targets, sent_count, failed_count,
+    checkpoint, attempts, error, history_id, created_at, started_at, finished_at
+"""
+
+
+def _job_from_row(row) -> Dict[str, Any]:
+    (job_id, company_id, sender_id, payload, status, total_targets, sent_count, failed_count,
+     checkpoint, attempts, error, history_id, created_at, started_at, finished_at) = row
+    return {
+        "id": job_id,
+        "company_id": company_id,
+        "sender_id": sender_id,
+        "payload": payload if isinstance(payload, dict) else json.loads(payload or "{}"),
+        "status": status,
+        "total_targets": total_targets,
+        "sent_count": sent_count or 0,
+        "failed_count": failed_count or 0,
+        "checkpoint": checkpoint if isinstance(checkpoint, dict) else json.loads(checkpoint or "null"),
+        "attempts": attempts or 0,
+        "error": error,
+        "history_id": history_id,
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+    }
+
+
+def serialize_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Представление задачи для API и WebSocket."""
+    payload = job.get("payload") or {}
+    total = job.get("total_targets")
+    processed = job["sent_count"] + job["failed_count"]
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "subject": payload.get("subject", ""),
+        "channels": payload.get("channels", []),
+        "total": total,
+        "sent": job["sent_count"],
+        "failed": job["failed_count"],
+        "progress": round(min(1.0, processed / total), 4) if total else (1.0 if job["status"] == "completed" else 0.0),
+        "error": job.get("error"),
+        "history_id": job.get("history_id"),
+        "created_at": job["created_at"].isoformat() if hasattr(job.get("created_at"), "isoformat") else job.get("created_at"),
+        "finished_at": job["finished_at"].isoformat() if hasattr(job.get("finished_at"), "isoformat") else job.get("finished_at"),
+    }
+
+
+# ===== ОЧЕРЕДЬ =====
+
+def enqueue_broadcast_job(payload: Dict[str, Any], sender_id: int, company_id: Optional[int] = None) -> int:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO broadcast_jobs (company_id, sender_id, payload, status)
+            VALUES (%s, %s, %s, 'queued')
+            RETURNING id
+        """, (company_id, sender_id, json.dumps(payload, ensure_ascii=False, default=str)))
+        job_id = c.fetchone()[0]
+        conn.commit()
+        log_info(f"📣 Broadcast job #{job_id} queued by user {sender_id}", "broadcasts")
+        return job_id
+    finally:
+        conn.close()
+
+
+def get_broadcast_job(job_id: int, company_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        query = f"SELECT {_JOB_COLUMNS} FROM broadcast_jobs WHERE id = %s"
+        params: List[Any] = [job_id]
+        if company_id:
+            query += " AND company_id = %s"
+            params.append(company_id)
+        c.execute(query, params)
+        row = c.fetchone()
+        return _job_from_row(row) if row else None
+    finally:
+        conn.close()
+
+
+def list_broadcast_jobs(company_id: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        query = f"SELECT {_JOB_COLUMNS} FROM broadcast_jobs"
+        params: List[Any] = []
+        if company_id:
+            query += " WHERE company_id = %s"
+            params.append(company_id)
+        query += " ORDER BY id DESC LIMIT %s"
+        params.append(max(1, min(int(limit), 100)))
+        c.execute(query, params)
+        return [_job_from_row(row) for row in c.fetchall()]
+    finally:
+        conn.close()
+
+
+def cancel_broadcast_job(job_id: int, company_id: Optional[int] = None) -> bool:
+    """Отменить ожидающую или идущую рассылку; раннер остановится после текущей порции."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        query = """
+            UPDATE broadcast_jobs
+            SET status = 'cancelled', finished_at = NOW()
+            WHERE id = %s AND status IN ('queued', 'running')
+        """
+        params: List[Any] = [job_id]
+        if company_id:
+            query += " AND company_id = %s"
+            params.append(company_id)
+        c.execute(query, params)
+        cancelled = c.rowcount > 0
+        conn.commit()
+        return cancelled
+    finally:
+        conn.close()
+
+
+def claim_broadcast_job(worker_id: str, job_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Взять задачу в работу: новую или с протухшей арендой (её воркер перестал
+    обновлять heartbeat_at). Конкурирующие воркеры пропускают заблокированные строки.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if job_id is not None:
+            candidate_sql = "SELECT id FROM broadcast_jobs WHERE id = %s AND status = 'queued' FOR UPDATE SKIP LOCKED"
+            candidate_params: Tuple[Any, ...] = (job_id,)
+        else:
+            candidate_sql = """
+                SELECT id FROM broadcast_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND heartbeat_at < NOW() - %s * INTERVAL '1 second')
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            """
+            candidate_params = (BROADCAST_LEASE_SECONDS,)
+        c.execute(f"""
+            UPDATE broadcast_jobs
+            SET status = 'running',
+                locked_by = %s,
+                heartbeat_at = NOW(),
+                started_at = COALESCE(started_at, NOW()),
+                attempts = COALESCE(attempts, 0) + 1
+            WHERE id = ({candidate_sql})
+            RETURNING {_JOB_COLUMNS}
+        """, (worker_id, *candidate_params))
+        row = c.fetchone()
+        conn.commit()
+        return _job_from_row(row) if row else None
+    finally:
+        conn.close()
+
+
+def _renew_lease(job_id: int, worker_id: str) -> bool:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE broadcast_jobs SET heartbeat_at = NOW()
+            WHERE id = %s AND locked_by = %s AND status = 'running'
+        """, (job_id, worker_id))
+        renewed = c.rowcount > 0
+        conn.commit()
+        return renewed
+    finally:
+        conn.close()
+
+
+def _release_lease(job_id: int, worker_id: str) -> None:
+    """Вернуть задачу в очередь (остановка воркера) — другой воркер продолжит с чекпоинта."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE broadcast_jobs SET status = 'queued', locked_by = NULL, heartbeat_at = NULL
+            WHERE id = %s AND locked_by = %s AND status = 'running'
+        """, (job_id, worker_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _save_progress(job_id: int, worker_id: str, checkpoint: Dict[str, Any],
+                   sent: int, failed: int, total_targets: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    """
+    Сохранить чекпоинт и счётчики порции. None — аренда потеряна или задача отменена:
+    раннер должен остановиться.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE broadcast_jobs
+            SET checkpoint = %s,
+                sent_count = COALESCE(sent_count, 0) + %s,
+                failed_count = COALESCE(failed_count, 0) + %s,
+                total_targets = COALESCE(%s, total_targets),
+                heartbeat_at = NOW()
+            WHERE id = %s AND locked_by = %s AND status = 'running'
+            RETURNING sent_count, failed_count
+        """, (json.dumps(checkpoint), sent, failed, total_targets, job_id, worker_id))
+        row = c.fetchone()
+        conn.commit()
+        return (row[0], row[1]) if row else None
+    finally:
+        conn.close()
+
+
+def _finish_job(job: Dict[str, Any], worker_id: str, status: str, error: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Завершить задачу; для completed — записать итог в broadcast_history."""
+    payload = job["payload"]
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        history_id = None
+        if status == "completed":
+            c.execute("""
+                INSERT INTO broadcast_history (sender_id, subscription_type, channels, subject, message, target_role, total_sent, results)
+                SELECT sender_id, %s, %s, %s, %s, %s, sent_count,
+                       json_build_object('success', sent_count, 'failed', failed_count, 'job_id', id)::TEXT
+                FROM broadcast_jobs
+                WHERE id = %s AND locked_by = %s AND status = 'running'
+                RETURNING id
+            """, (
+                payload.get("subscription_type"),
+                ",".join(payload.get("channels") or []),
+                payload.get("subject"),
+                payload.get("message"),
+                payload.get("target_role"),
+                job["id"],
+                worker_id,
+            ))
+            row = c.fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            history_id = row[0]
+        c.execute(f"""
+            UPDATE broadcast_jobs
+            SET status = %s, error = %s, history_id = %s, finished_at = NOW(), locked_by = NULL
+            WHERE id = %s AND locked_by = %s AND status = 'running'
+            RETURNING {_JOB_COLUMNS}
+        """, (status, error, history_id, job["id"], worker_id))
+        row = c.fetchone()
+        conn.commit()
+        return _job_from_row(row) if row else None
+    finally:
+        conn.close()
+
+
+# ===== ПОЛУЧАТЕЛИ =====
+
+def _staff_filter(payload: Dict[str, Any], company_id: Optional[int], sender_id: int) -> Tuple[str, List[Any]]:
+    if payload.get("is_test"):
+        return "u.id = %s", [sender_id]
+    if payload.get("target_role") == "client":
+        return "FALSE", []
+
+    conditions = [
+        "u.is_active = TRUE",
+        "NOT EXISTS (SELECT 1 FROM marketing_unsubscriptions s WHERE s.user_id = u.id AND s.mailing_type = %s)",
+    ]
+    params: List[Any] = [payload.get("subscription_type")]
+    if company_id:
+        conditions.append("u.company_id = %s")
+        params.append(company_id)
+
+    user_ids = payload.get("user_ids") or []
+    if user_ids:
+        from crm_api.broadcasts import _split_target_ids
+        staff_ids, _ = _split_target_ids(user_ids)
+        if staff_ids:
+            conditions.append("u.id = ANY(%s)")
+            params.append(staff_ids)
+        else:
+            conditions.append("FALSE")
+    elif payload.get("target_role") and payload.get("target_role") != "all":
+        conditions.append("u.role = %s")
+        params.append(payload["target_role"])
+    return " AND ".join(conditions), params
+
+
+def _clients_filter(payload: Dict[str, Any], company_id: Optional[int]) -> Tuple[str, List[Any]]:
+    if payload.get("is_test"):
+        return "FALSE", []
+    if payload.get("target_role") and payload["target_role"] not in ("all", "client"):
+        return "FALSE", []
+
+    conditions = ["""NOT EXISTS (
+        SELECT 1 FROM marketing_unsubscriptions s
+        WHERE s.mailing_type = %s
+          AND (c.instagram_id = s.client_id OR c.telegram_id = s.client_id
+               OR (c.email IS NOT NULL AND c.email = s.email))
+    )"""]
+    params: List[Any] = [payload.get("subscription_type")]
+    if company_id:
+        conditions.append("c.company_id = %s")
+        params.append(company_id)
+
+    user_ids = payload.get("user_ids") or []
+    if user_ids:
+        from crm_api.broadcasts import _split_target_ids
+        _, client_ids = _split_target_ids(user_ids)
+        if client_ids:
+            conditions.append("(c.instagram_id = ANY(%s) OR c.id::text = ANY(%s))")
+            params.extend([client_ids, client_ids])
+        else:
+            conditions.append("FALSE")
+    return " AND ".join(conditions), params
+
+
+def _manual_targets(payload: Dict[str, Any]) -> List[tuple]:
+    """Ручные адреса и контакты: (key, name, email, telegram, instagram, type)."""
+    if payload.get("is_test"):
+        return []
+    targets: List[tuple] = []
+    if "email" in (payload.get("channels") or []):
+        for email in payload.get("additional_emails") or []:
+            normalized_email = str(email or "").strip()
+            if normalized_email and "@" in normalized_email:
+                targets.append((0, "Anonymous", normalized_email, None, None, "manual"))
+    for contact in payload.get("manual_contacts") or []:
+        if not isinstance(contact, dict):
+            continue
+        email = contact.get("email")
+        telegram = contact.get("telegram")
+        instagram = contact.get("instagram")
+        # Добавляем контакт только если есть хотя бы один канал связи
+        if email or telegram or instagram or contact.get("whatsapp"):
+            targets.append((0, contact.get("name", "Manual Contact"), email, telegram, instagram, "manual"))
+    return [(index, *target[1:]) for index, target in enumerate(targets)]
+
+
+def count_broadcast_targets(payload: Dict[str, Any], company_id: Optional[int], sender_id: int) -> int:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        staff_sql, staff_params = _staff_filter(payload, company_id, sender_id)
+        clients_sql, clients_params = _clients_filter(payload, company_id)
+        c.execute(f"""
+            SELECT (SELECT COUNT(*) FROM users u WHERE {staff_sql})
+                 + (SELECT COUNT(*) FROM clients c WHERE {clients_sql})
+        """, staff_params + clients_params)
+        return int(c.fetchone()[0] or 0) + len(_manual_targets(payload))
+    finally:
+        conn.close()
+
+
+def fetch_target_chunk(payload: Dict[str, Any], company_id: Optional[int], sender_id: int,
+                       phase: str, after: Any, limit: int) -> List[tuple]:
+    """Следующая порция получателей фазы после ключа `after` (keyset)."""
+    if phase == "manual":
+        start = -1 if after is None else int(after)
+        return [target for target in _manual_targets(payload) if target[0] > start][:limit]
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if phase == "staff":
+            where_sql, params = _staff_filter(payload, company_id, sender_id)
+            if after is not None:
+                where_sql += " AND u.id > %s"
+                params.append(int(after))
+            c.execute(f"""
+                SELECT u.id, u.full_name, u.email, u.telegram_chat_id, u.instagram_username, 'staff'
+                FROM users u
+                WHERE {where_sql}
+                ORDER BY u.id
+                LIMIT %s
+            """, params + [limit])
+        else:
+            where_sql, params = _clients_filter(payload, company_id)
+            if after is not None:
+                where_sql += " AND c.instagram_id > %s"
+                params.append(str(after))
+            c.execute(f"""
+                SELECT c.instagram_id, c.name, c.email, c.telegram_id, c.instagram_id, 'client'
+                FROM clients c
+                WHERE {where_sql}
+                ORDER BY c.instagram_id
+                LIMIT %s
+            """, params + [limit])
+        return c.fetchall()
+    finally:
+        conn.close()
+
+
+def build_deliveries(payload: Dict[str, Any], target: tuple) -> List[Dict[str, Any]]:
+    """Сообщения для одного получателя по выбранным каналам."""
+    t_id, t_name, t_email, t_tg, t_ig, t_type = target
+    deliveries = []
+    for channel in payload.get("channels") or []:
+        context = {"name": t_name or "Client", "lang": "ru"}
+        user_id = None
+        if channel == "email" and t_email:
+            recipient, platform = t_email, "email"
+            context["unsubscribe_link"] = "/unsubscribe?email={}&type={}&channel=email".format(
+                t_email, payload.get("subscription_type")
+            )
+        elif channel == "telegram" and t_tg:
+            recipient, platform = str(t_tg), "telegram"
+        elif channel == "instagram" and t_ig:
+            recipient, platform = t_ig, "instagram"
+        elif channel == "notification" and t_type == "staff":
+            recipient, platform, user_id = str(t_id), "in_app", t_id
+        else:
+            continue
+        deliveries.append({"recipient": recipient, "platform": platform, "context": context, "user_id": user_id})
+    return deliveries
+
+
+# ===== ОТПРАВКА =====
+
+_channel_limits: Dict[str, Tuple[asyncio.Semaphore, AsyncTokenBucket]] = {}
+
+
+def _get_channel_limits(platform: str) -> Tuple[asyncio.Semaphore, AsyncTokenBucket]:
+    limits = _channel_limits.get(platform)
+    if limits is None:
+        rate = _read_float_env(f"BROADCAST_RATE_{platform.upper()}", _PROVIDER_RATE_DEFAULTS.get(platform, 10.0))
+        limits = (asyncio.Semaphore(BROADCAST_CHANNEL_CONCURRENCY), AsyncTokenBucket(rate))
+        _channel_limits[platform] = limits
+    return limits
+
+
+async def _deliver(payload: Dict[str, Any], delivery: Dict[str, Any]) -> bool:
+    from services.universal_messenger import send_universal_message
+
+    semaphore, bucket = _get_channel_limits(delivery["platform"])
+    async with semaphore:
+        await bucket.acquire()
+        try:
+            result = await send_universal_message(
+                recipient_id=delivery["recipient"],
+                text=payload.get("message"),
+                subject=payload.get("subject"),
+                context=delivery["context"],
+                platform=delivery["platform"],
+                template_name=payload.get("template_name"),
+                user_id=delivery["user_id"],
+            )
+        except Exception as e:
+            log_error(f"Broadcast delivery via {delivery['platform']} failed: {e}", "broadcasts")
+            return False
+    return bool(result.get("success"))
+
+
+async def _publish_progress(job: Dict[str, Any]) -> None:
+    sender_id = job.get("sender_id")
+    if not sender_id:
+        return
+    try:
+        from crm_api.notifications_ws import notifications_manager
+        await notifications_manager.send_to_user(int(sender_id), {
+            "type": "broadcast_progress",
+            "data": serialize_job(job),
+            "timestamp": datetime.now().isoformat(),
+        })
+    except Exception as e:
+        log_warning(f"Broadcast progress not delivered: {e}", "broadcasts")
+
+
+async def _keep_lease(job_id: int, worker_id: str) -> None:
+    while True:
+        await asyncio.sleep(BROADCAST_LEASE_SECONDS / 3)
+        try:
+            if not await run_blocking(_renew_lease, job_id, worker_id):
+                return
+        except Exception as e:
+            log_warning(f"Broadcast #{job_id} lease renewal failed: {e}", "broadcasts")
+
+
+async def run_broadcast_job(job: Dict[str, Any], worker_id: str) -> Optional[Dict[str, Any]]:
+    """Выполнить взятую задачу с её чекпоинта до конца, отмены или потери аренды."""
+    job_id = job["id"]
+    payload = job["payload"]
+    company_id = job.get("company_id")
+    sender_id = job.get("sender_id")
+    tenant_tokens = set_tenant_context(company_id=company_id, bypass=company_id is None)
+    lease_task = asyncio.create_task(_keep_lease(job_id, worker_id))
+    try:
+        if job["attempts"] > BROADCAST_MAX_ATTEMPTS:
+            return await run_blocking(_finish_job, job, worker_id, "failed", "max_attempts_exceeded")
+
+        checkpoint = job.get("checkpoint") or {"phase": PHASES[0], "after": None}
+        if job.get("total_targets") is None:
+            total_targets = await run_blocking(count_broadcast_targets, payload, company_id, sender_id)
+            job["total_targets"] = total_targets
+            # Квота проверяется один раз — при первом запуске, а не при возобновлении
+            if company_id and not payload.get("is_test"):
+                from db.companies import QuotaExceededError, ensure_company_quota
+                try:
+                    await run_blocking(ensure_company_quota, int(company_id), "messages", total_targets)
+                except QuotaExceededError as quota_err:
+                    log_error(f"Message quota exceeded for company {company_id}: {quota_err}", "broadcasts")
+                    finished = await run_blocking(_finish_job, job, worker_id, "failed", "quota_exceeded")
+                    if finished:
+                        await _publish_progress(finished)
+                    return finished
+            await run_blocking(_save_progress, job_id, worker_id, checkpoint, 0, 0, total_targets)
+            log_info(f"📣 Broadcast #{job_id}: {total_targets} recipients", "broadcasts")
+
+        phase_index = PHASES.index(checkpoint.get("phase", PHASES[0]))
+        after = checkpoint.get("after")
+
+        while phase_index < len(PHASES):
+            phase = PHASES[phase_index]
+            targets = await run_blocking(
+                fetch_target_chunk, payload, company_id, sender_id, phase, after, BROADCAST_CHUNK_SIZE
+            )
+            if not targets:
+                phase_index += 1
+                after = None
+                continue
+
+            deliveries = [delivery for target in targets for delivery in build_deliveries(payload, target)]
+            results = await asyncio.gather(*(_deliver(payload, delivery) for delivery in deliveries))
+            sent = sum(1 for ok in results if ok)
+            after = targets[-1][0]
+
+            counters = await run_blocking(
+                _save_progress, job_id, worker_id, {"phase": phase, "after": after}, sent, len(results) - sent
+            )
+            if counters is None:
+                log_warning(f"Broadcast #{job_id} stopped: cancelled or lease lost", "broadcasts")
+                current = await run_blocking(get_broadcast_job, job_id)
+                if current:
+                    await _publish_progress(current)
+                return current
+            job["sent_count"], job["failed_count"] = counters
+            await _publish_progress(job)
+
+        finished = await run_blocking(_finish_job, job, worker_id, "completed")
+        if finished:
+            log_info(
+                f"✅ Broadcast #{job_id} completed: sent={finished['sent_count']} failed={finished['failed_count']}",
+                "broadcasts",
+            )
+            await _publish_progress(finished)
+        return finished
+    except asyncio.CancelledError:
+        # Отмена (shutdown воркера): снимаем аренду в пуле потоков, а не на event loop
+        try:
+            await asyncio.shield(run_blocking(_release_lease, job_id, worker_id))
+        except Exception as e:
+            log_warning(f"Broadcast #{job_id} lease release failed: {e}", "broadcasts")
+        raise
+    except Exception as e:
+        log_error(f"Error in broadcast job #{job_id}: {e}", "broadcasts")
+        # Аренда не снимается: задача будет подхвачена заново после BROADCAST_LEASE_SECONDS
+        return None
+    finally:
+        lease_task.cancel()
+        reset_tenant_context(tenant_tokens)
+
+
+class BroadcastRunner:
+    """Фоновый цикл воркера: берёт задачи из broadcast_jobs по одной."""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        log_info(f"📣 Broadcast runner started ({self.worker_id})", "broadcasts")
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                with platform_access():
+                    job = await run_blocking(claim_broadcast_job, self.worker_id)
+                if job is not None:
+                    await run_broadcast_job(job, self.worker_id)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(f"Broadcast runner error: {e}", "broadcasts")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=BROADCAST_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+broadcast_runner = BroadcastRunner()
@@ -0,0 +1,222 @@
+"""
+RFM-скоринг клиентов (Recency / Frequency / Monetary) и сегментация.
+
+Квинтили считаются за один проход по компании: уникальные значения
+сортируются один раз, позиция каждого клиента находится `bisect`
+(O(n log n) вместо сортировки всего списка на каждого клиента). Шкала та
+же, что и раньше: позиция значения среди уникальных (dense rank) → 1..5,
+одинаковые значения всегда получают одинаковый балл (NTILE разнёс бы
+равные значения по разным корзинам).
+
+Результаты пишутся многострочным INSERT ... ON CONFLICT пачками. Фоновая
+задача `run_client_scoring_job` пересчитывает только компании, у которых
+изменились завершённые записи или сменился день (recency), — параллельно
+по компаниям.
+"""
+import os
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from db.connection import get_db_connection
+from utils.logger import log_error, log_info
+from utils.tenant_context import platform_access
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+CLIENT_SCORING_WORKERS = max(1, _read_int_env("CLIENT_SCORING_WORKERS", 4))
+CLIENT_SCORING_BATCH = max(1, _read_int_env("CLIENT_SCORING_BATCH", 1000))
+
+SEGMENTS = {
+    "champion":     {"label": "Чемпионы",          "color": "#22c55e", "r": (4,5), "f": (4,5), "m": (4,5)},
+    "loyal":        {"label": "Лояльные",           "color": "#3b82f6", "r": (3,5), "f": (3,5), "m": (3,5)},
+    "potential":    {"label": "Потенциальные",      "color": "#8b5cf6", "r": (3,5), "f": (1,3), "m": (1,3)},
+    "at_risk":      {"label": "Под угрозой",        "color": "#f59e0b", "r": (2,3), "f": (3,5), "m": (3,5)},
+    "hibernating":  {"label": "Спящие",             "color": "#94a3b8", "r": (1,2), "f": (1,3), "m": (1,3)},
+    "lost":         {"label": "Потерянные",         "color": "#ef4444", "r": (1,2), "f": (1,2), "m": (1,2)},
+    "new":          {"label": "Новые",              "color": "#06b6d4", "r": (4,5), "f": (1,1), "m": (1,3)},
+    "promising":    {"label": "Перспективные",      "color": "#10b981", "r": (3,4), "f": (1,1), "m": (1,3)},
+}
+
+
+def assign_segment(r: int, f: int, m: int) -> str:
+    if r >= 4 and f >= 4 and m >= 4:
+        return "champion"
+    if r >= 4 and f == 1:
+        return "new"
+    if r >= 3 and f == 1:
+        return "promising"
+    if r >= 3 and f >= 3 and m >= 3:
+        return "loyal"
+    if r >= 3 and f <= 2 and m <= 2:
+        return "potential"
+    if r <= 2 and f >= 3 and m >= 3:
+        return "at_risk"
+    if r <= 2 and f <= 2 and m <= 2:
+        return "lost"
+    return "hibernating"
+
+
+def quintile_scores(values: Sequence[float]) -> List[int]:
+    """Балл 1..5 для каждого значения по его позиции среди уникальных значений."""
+    if not values:
+        return []
+    distinct = sorted(set(values))
+    n = len(distinct)
+    if n == 1:
+        return [3] * len(values)
+    return [max(1, min(5, int(bisect_left(distinct, value) / n * 4) + 1)) for value in values]
+
+
+def score_clients(rows: Sequence[Tuple[str, Optional[date], int, float]], today: date) -> List[tuple]:
+    """
+    rows: (instagram_id, last_visit, frequency, monetary).
+    Возвращает (instagram_id, r, f, m, rfm, segment, churn_risk, ltv_predicted).
+    """
+    recencies = [(today - row[1]).days if row[1] else 999 for row in rows]
+    frequencies = [row[2] for row in rows]
+    monetary = [float(row[3]) for row in rows]
+
+    # Чем меньше recency — тем лучше, инвертируем
+    max_recency = max(recencies, default=0) or 1
+    r_scores = quintile_scores([max_recency - value for value in recencies])
+    f_scores = quintile_scores(frequencies)
+    m_scores = quintile_scores(monetary)
+
+    scored = []
+    for i, row in enumerate(rows):
+        r, f, m = r_scores[i], f_scores[i], m_scores[i]
+        churn = max(0.0, min(1.0, recencies[i] / 180))
+        ltv = monetary[i] / max(1, (today - row[1]).days / 30) * 12 if row[1] else 0
+        scored.append((row[0], r, f, m, r + f + m, assign_segment(r, f, m), churn, ltv))
+    return scored
+
+
+# Отпечаток завершённых записей компании: меняется при новой/отменённой записи или правке выручки
+_FINGERPRINT_SQL = "CONCAT_WS(':', COUNT(*), COALESCE(SUM(b.revenue), 0), MAX(b.id), MAX(b.datetime))"
+
+
+def _upsert_scores(cursor, company_id: int, scored: Sequence[tuple]) -> None:
+    for start in range(0, len(scored), CLIENT_SCORING_BATCH):
+        chunk = scored[start:start + CLIENT_SCORING_BATCH]
+        params: List[Any] = []
+        for row in chunk:
+            params.append(company_id)
+            params.extend(row)
+        cursor.execute(f"""
+            INSERT INTO client_scores
+              (company_id,client_instagram_id,rfm_recency,rfm_frequency,rfm_monetary,
+               rfm_score,segment,churn_risk,ltv_predicted,last_calculated_at)
+            VALUES {", ".join(["(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())"] * len(chunk))}
+            ON CONFLICT (company_id, client_instagram_id) DO UPDATE SET
+              rfm_recency=EXCLUDED.rfm_recency,rfm_frequency=EXCLUDED.rfm_frequency,
+              rfm_monetary=EXCLUDED.rfm_monetary,rfm_score=EXCLUDED.rfm_score,
+              segment=EXCLUDED.segment,churn_risk=EXCLUDED.churn_risk,
+              ltv_predicted=EXCLUDED.ltv_predicted,last_calculated_at=NOW()
+        """, params)
+
+
+def score_company(company_id: int, today: Optional[date] = None) -> int:
+    """Пересчитать RFM-скоры всех клиентов компании одной транзакцией; возвращает число клиентов."""
+    today = today or date.today()
+    started = time.perf_counter()
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        # Отпечаток читаем до выборки: запись, пришедшая между ними, лишь вызовет повторный пересчёт
+        c.execute(f"""
+            SELECT {_FINGERPRINT_SQL}
+            FROM bookings b
+            WHERE b.company_id=%s AND b.status='completed' AND b.instagram_id IS NOT NULL
+        """, (company_id,))
+        fingerprint = c.fetchone()[0]
+        c.execute("""
+            SELECT instagram_id,
+                   MAX(DATE(datetime)) AS last_visit,
+                   COUNT(*) AS freq,
+                   COALESCE(SUM(revenue),0) AS monetary
+            FROM bookings
+            WHERE company_id=%s AND status='completed' AND instagram_id IS NOT NULL
+            GROUP BY instagram_id
+        """, (company_id,))
+        scored = score_clients(c.fetchall(), today)
+        _upsert_scores(c, company_id, scored)
+        c.execute("""
+            INSERT INTO client_scoring_runs (company_id, fingerprint, scored_on, clients, duration_ms, finished_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (company_id) DO UPDATE SET
+              fingerprint=EXCLUDED.fingerprint, scored_on=EXCLUDED.scored_on, clients=EXCLUDED.clients,
+              duration_ms=EXCLUDED.duration_ms, finished_at=EXCLUDED.finished_at
+        """, (company_id, fingerprint, today, len(scored), int((time.perf_counter() - started) * 1000)))
+        conn.commit()
+        return len(scored)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def get_stale_companies(today: Optional[date] = None) -> List[int]:
+    """
+    Компании, которым нужен пересчёт: отпечаток завершённых записей
+    (количество, сумма, последний id/визит) изменился или скоринг был не сегодня.
+    """
+    today = today or date.today()
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(f"""
+            SELECT b.company_id, {_FINGERPRINT_SQL}, r.fingerprint, r.scored_on
+            FROM bookings b
+            LEFT JOIN client_scoring_runs r ON r.company_id = b.company_id
+            WHERE b.company_id IS NOT NULL AND b.status='completed' AND b.instagram_id IS NOT NULL
+            GROUP BY b.company_id, r.fingerprint, r.scored_on
+        """)
+        return [row[0] for row in c.fetchall() if row[1] != row[2] or row[3] != today]
+    finally:
+        conn.close()
+
+
+def _score_company_job(company_id: int, today: date) -> int:
+    with platform_access():
+        return score_company(company_id, today=today)
+
+
+def run_client_scoring_job(workers: int = CLIENT_SCORING_WORKERS) -> Dict[str, int]:
+    """Задача планировщика: пересчитать устаревшие компании, по одной на поток."""
+    today = date.today()
+    started = time.perf_counter()
+    with platform_access():
+        stale = get_stale_companies(today)
+    if not stale:
+        return {"companies": 0, "clients": 0, "failed": 0}
+
+    clients = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=min(workers, len(stale)), thread_name_prefix="client-scoring") as executor:
+        futures = {
+            executor.submit(_score_company_job, company_id, today): company_id
+            for company_id in stale
+        }
+        for future, company_id in futures.items():
+            try:
+                clients += future.result()
+            except Exception as e:
+                failed += 1
+                log_error(f"Client scoring failed for company {company_id}: {e}", "client_scoring")
+
+    log_info(
+        f"🎯 Client scoring: {len(stale) - failed} companies, {clients} clients "
+        f"in {int((time.perf_counter() - started) * 1000)} ms",
+        "client_scoring",
+    )
+    return {"companies": len(stale) - failed, "clients": clients, "failed": failed}
@@ -10,6 +10,7 @@ from typing import Optional, Dict, Any
 from core.config import DATABASE_NAME
 from db.connection import get_db_connection
 from utils.logger import log_info, log_error
+from services.conversation_state import invalidate_conversation_state
 
 class ConversationContext:
     """Управление контекстом диалога с клиентом"""
@@ -61,6 +62,7 @@ class ConversationContext:
             ))
 
             conn.commit()
+            invalidate_conversation_state(self.client_id)
             log_info(f"Context saved for {self.client_id}: {context_type}", "conversation_context")
             return True
 
@@ -178,6 +180,7 @@ class ConversationContext:
                 """, (self.client_id,))
 
             conn.commit()
+            invalidate_conversation_state(self.client_id)
             log_info(f"Context cleared for {self.client_id}: {context_type or 'all'}", "conversation_context")
             return True
 
@@ -0,0 +1,418 @@
+"""
+Горячее состояние диалога для хода бота.
+
+Раньше на каждое сообщение webhook отдельными соединениями читал историю
+(`get_chat_history`), прогресс записи (`get_booking_progress`, JSON туда и
+обратно), язык и режим бота клиента и контексты `ConversationContext`.
+`ConversationState` держит всё это для одного диалога:
+
+- последние CONVERSATION_STATE_HISTORY сообщений;
+- прогресс записи (booking_drafts.data);
+- язык и режим бота (clients.detected_language / bot_mode);
+- активные контексты (conversation_context).
+
+Состояние загружается одним запросом на одном соединении и живёт в LRU
+процесса (`conversation_states`) по ключу (company_id, client_id).
+Изменения хода (язык, прогресс записи) копятся в объекте и пишутся в
+Postgres одной транзакцией в `flush()` в конце хода; сообщения по-прежнему
+сохраняет `save_message`, а в закэшированное состояние они дописываются
+через `record_conversation_message`.
+
+Ход одного диалога в кластере идёт в одном воркере за раз (очередь
+instagram_inbox), но следующий ход может попасть в другой воркер, поэтому
+после `flush()` и при любых изменениях в обход состояния рассылается
+`crm:conversation:invalidate` — остальные воркеры выбрасывают свою копию.
+Сбрасывают состояние: ответ менеджера из CRM или из приложения Instagram,
+смена режима бота, `update_booking_progress` / `clear_booking_progress`,
+`detect_and_save_language` и запись контекстов `ConversationContext`.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from db.connection import get_db_connection
+from utils.cache import TTLCache
+from utils.logger import log_error
+from utils.tenant_context import get_current_company_id
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+CONVERSATION_STATE_CACHE_SIZE = max(1, _read_int_env("CONVERSATION_STATE_CACHE_SIZE", 5000))
+CONVERSATION_STATE_TTL_SECONDS = max(1, _read_int_env("CONVERSATION_STATE_TTL_SECONDS", 600))
+CONVERSATION_STATE_HISTORY = max(1, _read_int_env("CONVERSATION_STATE_HISTORY", 10))
+
+_CONVERSATION_PUBSUB_PREFIX = "crm:conversation:"
+# Своё же сообщение об инвалидации воркер пропускает: его копия актуальна
+_WORKER_ID = uuid.uuid4().hex
+
+
+@dataclass
+class ConversationState:
+    client_id: str
+    company_id: Optional[int]
+    history: List[Tuple] = field(default_factory=list)
+    booking_progress: Optional[Dict[str, Any]] = None
+    language: str = "ru"
+    bot_mode: str = "autopilot"
+    contexts: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    history_limit: int = CONVERSATION_STATE_HISTORY
+    loaded_at: float = field(default_factory=time.time)
+    language_dirty: bool = False
+    progress_dirty: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def history_tuples(self) -> List[Tuple]:
+        with self.lock:
+            return list(self.history)
+
+    def append_message(
+        self,
+        message: str,
+        sender: str,
+        message_type: str = "text",
+        timestamp: Optional[str] = None,
+        message_id: Optional[int] = None,
+    ) -> None:
+        with self.lock:
+            self.history.append((message, sender, timestamp or datetime.now().isoformat(), message_type, message_id))
+            del self.history[:-self.history_limit]
+
+    def set_language(self, language: str) -> None:
+        with self.lock:
+            if language and language != self.language:
+                self.language = language
+                self.language_dirty = True
+
+    def get_booking_progress(self) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return dict(self.booking_progress) if self.booking_progress else None
+
+    def update_booking_progress(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self.booking_progress = {**(self.booking_progress or {}), **data}
+            self.progress_dirty = True
+            return dict(self.booking_progress)
+
+    def clear_booking_progress(self) -> None:
+        with self.lock:
+            self.booking_progress = None
+            self.progress_dirty = True
+
+    def get_context(self, context_type: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            context = self.contexts.get(context_type)
+        if not context:
+            return None
+        expires_at = context.get("expires_at")
+        if expires_at and str(expires_at) <= datetime.now().isoformat():
+            return None
+        return context
+
+    def has_context(self, context_type: str) -> bool:
+        return self.get_context(context_type) is not None
+
+    @property
+    def has_pending_writes(self) -> bool:
+        return self.language_dirty or self.progress_dirty
+
+
+_LOAD_SQL = """
+    SELECT
+        cl.detected_language,
+        cl.bot_mode,
+        (
+            SELECT d.data
+            FROM booking_drafts d
+            WHERE d.instagram_id = %s
+            ORDER BY d.id DESC
+            LIMIT 1
+        ) AS booking_progress,
+        (
+            SELECT COALESCE(json_agg(json_build_array(h.message, h.sender, h.timestamp, h.message_type, h.id)
+                                     ORDER BY h.timestamp), '[]'::json)
+            FROM (
+                SELECT message, sender, timestamp, message_type, id
+                FROM chat_history
+                WHERE instagram_id = %s
+                  AND (COALESCE(%s, cl.company_id) IS NULL OR company_id = COALESCE(%s, cl.company_id))
+                ORDER BY timestamp DESC
+                LIMIT %s
+            ) h
+        ) AS history,
+        (
+            SELECT COALESCE(json_agg(json_build_array(x.context_type, x.context_data, x.expires_at, x.created_at)
+                                     ORDER BY x.created_at), '[]'::json)
+            FROM conversation_context x
+            WHERE x.client_id = %s AND x.expires_at > %s
+        ) AS contexts
+    FROM (SELECT 1) AS one
+    LEFT JOIN clients cl ON cl.instagram_id = %s
+"""
+
+
+def _load_json(value: Any, default: Any) -> Any:
+    if value is None:
+        return default
+    if isinstance(value, (str, bytes, bytearray)):
+        try:
+            return json.loads(value)
+        except (TypeError, ValueError):
+            return default
+    return value
+
+
+def load_conversation_state(
+    client_id: str,
+    company_id: Optional[int] = None,
+    history_limit: int = CONVERSATION_STATE_HISTORY,
+) -> ConversationState:
+    """Загрузить состояние диалога из БД одним запросом."""
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        c.execute(_LOAD_SQL, (
+            client_id,
+            client_id, company_id, company_id, history_limit,
+            client_id, datetime.now(),
+            client_id,
+        ))
+        row = c.fetchone() or (None,) * 5
+    finally:
+        conn.close()
+
+    language, bot_mode, progress, history, contexts = row
+    active_contexts: Dict[str, Dict[str, Any]] = {}
+    for context_type, context_data, expires_at, created_at in _load_json(contexts, []):
+        active_contexts[context_type] = {
+            "data": _load_json(context_data, context_data),
+            "expires_at": expires_at,
+            "created_at": created_at,
+        }
+    return ConversationState(
+        client_id=client_id,
+        company_id=company_id,
+        history=[tuple(item) for item in _load_json(history, [])],
+        booking_progress=_load_json(progress, None) or None,
+        language=language or "ru",
+        bot_mode=bot_mode or "autopilot",
+        contexts=active_contexts,
+        history_limit=history_limit,
+    )
+
+
+def write_conversation_state(state: ConversationState) -> bool:
+    """
+    Записать накопленные изменения хода одной транзакцией: UPDATE clients
+    и DELETE booking_drafts — одним statement'ом (data-modifying CTE),
+    новый черновик — отдельным INSERT'ом. False — писать было нечего.
+    """
+    from db.bookings import _booking_drafts_key_column, booking_draft_row
+
+    with state.lock:
+        language = state.language if state.language_dirty else None
+        progress_dirty = state.progress_dirty
+        progress = dict(state.booking_progress) if state.booking_progress else None
+        state.language_dirty = False
+        state.progress_dirty = False
+    if language is None and not progress_dirty:
+        return False
+
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        ctes: List[str] = []
+        params: List[Any] = []
+        insert_sql = None
+        insert_params: List[Any] = []
+        if language is not None:
+            ctes.append("lang AS (UPDATE clients SET detected_language = %s WHERE instagram_id = %s RETURNING 1)")
+            params.extend([language, state.client_id])
+        if progress_dirty:
+            key_column = _booking_drafts_key_column(c)
+            ctes.append(f"dropped AS (DELETE FROM booking_drafts WHERE {key_column} = %s RETURNING 1)")
+            params.append(state.client_id)
+            if progress:
+                # Не в том же statement'е, что DELETE: все его части видят один снимок,
+                # и INSERT упёрся бы в уникальный индекс по ещё не удалённой строке
+                _, columns, values = booking_draft_row(c, state.client_id, progress)
+                with state.lock:
+                    if state.booking_progress:
+                        # Мастер приведён к каноническому имени, как в update_booking_progress
+                        state.booking_progress["master"] = progress.get("master")
+                insert_sql = (
+                    f"INSERT INTO booking_drafts ({', '.join(columns)}) "
+                    f"VALUES ({', '.join(['%s'] * len(columns))})"
+                )
+                insert_params = values
+        c.execute(f"WITH {', '.join(ctes)} SELECT 1", params)
+        if insert_sql:
+            c.execute(insert_sql, insert_params)
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        with state.lock:
+            state.language_dirty = state.language_dirty or language is not None
+            state.progress_dirty = state.progress_dirty or progress_dirty
+        raise
+    finally:
+        conn.close()
+
+
+class ConversationStateStore:
+    """LRU состояний диалогов процесса с write-through в Postgres."""
+
+    def __init__(self, maxsize: int = CONVERSATION_STATE_CACHE_SIZE, ttl: float = CONVERSATION_STATE_TTL_SECONDS):
+        self._states = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.writes = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(client_id: str, company_id: Optional[int]) -> Tuple[Optional[int], str]:
+        return (int(company_id) if company_id is not None else None, str(client_id))
+
+    def get(self, client_id: str, company_id: Optional[int] = None) -> ConversationState:
+        if company_id is None:
+            company_id = get_current_company_id()
+        key = self._key(client_id, company_id)
+        state = self._states.get(key)
+        if state is not None:
+            return state
+        state = load_conversation_state(client_id, key[0])
+        with self._lock:
+            self.loads += 1
+        self._states.set(key, state)
+        return state
+
+    def flush(self, state: ConversationState, broadcast: bool = True) -> bool:
+        """Записать изменения хода и сбросить копии этого диалога в других воркерах."""
+        try:
+            written = write_conversation_state(state)
+        except Exception as e:
+            # Копия с незаписанными изменениями не должна пережить сбой записи
+            self.invalidate(state.client_id, state.company_id, broadcast=broadcast)
+            log_error(f"Conversation state write failed for {state.client_id}: {e}", "conversation_state")
+            return False
+        if written:
+            with self._lock:
+                self.writes += 1
+        if broadcast:
+            _publish_invalidation(state.client_id, state.company_id)
+        return written
+
+    def record_message(
+        self,
+        client_id: str,
+        company_id: Optional[int],
+        message: str,
+        sender: str,
+        message_type: str = "text",
+        timestamp: Optional[str] = None,
+        message_id: Optional[int] = None,
+    ) -> None:
+        """Дописать сохранённое сообщение в локальную копию; остальные воркеры сбрасывают свою."""
+        key = self._key(client_id, company_id)
+        for candidate in {key, (None, key[1])}:
+            state = self._states.get(candidate)
+            if state is not None:
+                state.append_message(message, sender, message_type, timestamp, message_id)
+        _publish_invalidation(client_id, key[0])
+
+    def invalidate(self, client_id: str, company_id: Optional[int] = None, broadcast: bool = True) -> bool:
+        if company_id is None:
+            company_id = get_current_company_id()
+        key = self._key(client_id, company_id)
+        dropped = self._states.pop(key) is not None
+        # Без tenant-контекста копия могла лечь под ключ с компанией (и наоборот)
+        if key[0] is not None:
+            dropped = self._states.pop((None, key[1])) is not None or dropped
+        with self._lock:
+            self.invalidations += 1
+        if broadcast:
+            _publish_invalidation(client_id, key[0])
+        return dropped
+
+    def clear(self) -> None:
+        self._states.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {"loads": self.loads, "writes": self.writes, "invalidations": self.invalidations}
+        return {**counters, "cache": self._states.stats()}
+
+
+conversation_states = ConversationStateStore()
+
+
+def get_conversation_state(client_id: str, company_id: Optional[int] = None) -> ConversationState:
+    return conversation_states.get(client_id, company_id)
+
+
+def invalidate_conversation_state(client_id: str, company_id: Optional[int] = None, broadcast: bool = True) -> bool:
+    try:
+        return conversation_states.invalidate(client_id, company_id, broadcast=broadcast)
+    except Exception as e:
+        log_error(f"Conversation state not invalidated for {client_id}: {e}", "conversation_state")
+        return False
+
+
+def record_conversation_message(
+    client_id: str,
+    company_id: Optional[int],
+    message: str,
+    sender: str,
+    message_type: str = "text",
+    timestamp: Optional[str] = None,
+    message_id: Optional[int] = None,
+) -> None:
+    try:
+        conversation_states.record_message(client_id, company_id, message, sender, message_type, timestamp, message_id)
+    except Exception as e:
+        log_error(f"Conversation state not updated for {client_id}: {e}", "conversation_state")
+
+
+def _publish_invalidation(client_id: str, company_id: Optional[int]) -> None:
+    try:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.publish_nowait(
+            f"{_CONVERSATION_PUBSUB_PREFIX}invalidate",
+            {"client_id": client_id, "company_id": company_id, "origin": _WORKER_ID},
+        )
+    except Exception as e:
+        log_error(f"Conversation state invalidation not published: {e}", "conversation_state")
+
+
+async def _conversation_pubsub_handler(channel: str, data: dict) -> None:
+    if not isinstance(data, dict) or data.get("origin") == _WORKER_ID or not data.get("client_id"):
+        return
+    company_id = data.get("company_id")
+    try:
+        company_id = int(company_id) if company_id is not None else None
+    except (TypeError, ValueError):
+        company_id = None
+    conversation_states._states.pop(ConversationStateStore._key(data["client_id"], company_id))
+    conversation_states._states.pop((None, str(data["client_id"])))
+
+
+def _register_conversation_pubsub_handler() -> None:
+    try:
+        from utils.redis_pubsub import redis_pubsub
+        redis_pubsub.register_handler(_CONVERSATION_PUBSUB_PREFIX, _conversation_pubsub_handler)
+    except Exception as e:
+        log_error(f"Conversation state Pub/Sub handler not registered: {e}", "conversation_state")
+
+
+_register_conversation_pubsub_handler()
@@ -2,13 +2,13 @@
 Сервис для отправки документов через различные каналы
 """
 import os
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 from typing import Optional, List
-import httpx
+from utils.http_clients import get_http_client
 from utils.logger import log_info, log_error
+from utils.smtp_transport import smtp_transport
 
 class DocumentSender:
     """Отправка документов через различные каналы"""
@@ -69,10 +69,14 @@ class DocumentSender:
                     msg.attach(attachment)
             
             # Отправляем
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_user, self.smtp_password)
-                server.send_message(msg)
+            sent = await smtp_transport.send_async(msg, {
+                'host': self.smtp_host,
+                'port': self.smtp_port,
+                'user': self.smtp_user,
+                'password': self.smtp_password,
+            })
+            if not sent:
+                return False
             
             log_info(f"Email sent to {recipient_email}", "email")
             return True
@@ -112,8 +116,8 @@ class DocumentSender:
                     'caption': caption
                 }
                 
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(url, files=files, data=data)
+                client = get_http_client(url)
+                response = await client.post(url, files=files, data=data)
                     
                 if response.status_code == 200:
                     log_info(f"Telegram document sent to {chat_id}", "telegram")
@@ -156,45 +160,45 @@ class DocumentSender:
             
             # Пример для WhatsApp Business API
             # Реальная реализация зависит от используемого API
-            async with httpx.AsyncClient() as client:
-                # Сначала загружаем медиа
-                with open(file_path, 'rb') as f:
-                    files = {'file': f}
-                    upload_response = await client.post(
-                        f"{self.whatsapp_api_url}/media",
-                        headers={'Authorization': f'Bearer {self.whatsapp_api_token}'},
-                        files=files
-                    )
-                
-                if upload_response.status_code != 200:
-                    log_error(f"WhatsApp media upload failed: {upload_response.text}", "whatsapp")
-                    return False
-                
-                media_id = upload_response.json().get('id')
-                
-                # Отправляем документ
-                payload = {
-                    'messaging_product': 'whatsapp',
-                    'to': phone,
-                    'type': 'document',
-                    'document': {
-                        'id': media_id,
-                        'caption': message
-                    }
-                }
-                
-                send_response = await client.post(
-                    f"{self.whatsapp_api_url}/messages",
-                    headers=headers,
-                    json=payload
+            client = get_http_client(self.whatsapp_api_url)
+            # Сначала загружаем медиа
+            with open(file_path, 'rb') as f:
+                files = {'file': f}
+                upload_response = await client.post(
+                    f"{self.whatsapp_api_url}/media",
+                    headers={'Authorization': f'Bearer {self.whatsapp_api_token}'},
+                    files=files
                 )
-                
-                if send_response.status_code == 200:
-                    log_info(f"WhatsApp document sent to {phone}", "whatsapp")
-                    return True
-                else:
-                    log_error(f"WhatsApp send failed: {send_response.text}", "whatsapp")
-                    return False
+            
+            if upload_response.status_code != 200:
+                log_error(f"WhatsApp media upload failed: {upload_response.text}", "whatsapp")
+                return False
+            
+            media_id = upload_response.json().get('id')
+            
+            # Отправляем документ
+            payload = {
+                'messaging_product': 'whatsapp',
+                'to': phone,
+                'type': 'document',
+                'document': {
+                    'id': media_id,
+                    'caption': message
+                }
+            }
+            
+            send_response = await client.post(
+                f"{self.whatsapp_api_url}/messages",
+                headers=headers,
+                json=payload
+            )
+            
+            if send_response.status_code == 200:
+                log_info(f"WhatsApp document sent to {phone}", "whatsapp")
+                return True
+            else:
+                log_error(f"WhatsApp send failed: {send_response.text}", "whatsapp")
+                return False
                     
         except Exception as e:
             log_error(f"Error sending WhatsApp document: {e}", "whatsapp")
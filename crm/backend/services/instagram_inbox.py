@@ -0,0 +1,437 @@
+"""
+Очередь входящих событий Instagram, общая для всех воркеров.
+
+POST /webhook только записывает события в instagram_inbox (один многострочный
+INSERT ... ON CONFLICT (mid) DO NOTHING) и сразу отвечает 200: повтор
+доставки от Meta, попавший на другой воркер, отсекается уникальным индексом
+по mid за O(1). Строки хранятся INSTAGRAM_INBOX_DEDUP_TTL_SECONDS — это и
+есть окно дедупликации.
+
+Обработчик в каждом воркере берёт строки через FOR UPDATE SKIP LOCKED с
+арендой (locked_until, продлевается пока ход идёт). Строка берётся, только
+если у диалога нет более ранних незавершённых событий, поэтому на один
+conversation_id в кластере одновременно идёт не больше одного хода AI,
+и сообщения обрабатываются в порядке поступления. Всего в воркере не больше
+INSTAGRAM_INBOX_CONCURRENCY ходов. Упавший воркер теряет аренду — его
+строки подхватывают другие.
+
+Индикатор набора текста (sender_action) в очередь не пишется: он
+эфемерный и не должен ждать ход AI.
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from db.connection import get_db_connection
+from utils.blocking import run_blocking
+from utils.logger import log_error, log_info, log_warning
+from utils.tenant_context import platform_access
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+INSTAGRAM_INBOX_CONCURRENCY = max(1, _read_int_env("INSTAGRAM_INBOX_CONCURRENCY", 8))
+INSTAGRAM_INBOX_LEASE_SECONDS = max(30, _read_int_env("INSTAGRAM_INBOX_LEASE_SECONDS", 180))
+INSTAGRAM_INBOX_POLL_SECONDS = max(1, _read_int_env("INSTAGRAM_INBOX_POLL_SECONDS", 1))
+INSTAGRAM_INBOX_MAX_ATTEMPTS = max(1, _read_int_env("INSTAGRAM_INBOX_MAX_ATTEMPTS", 3))
+INSTAGRAM_INBOX_DEDUP_TTL_SECONDS = max(300, _read_int_env("INSTAGRAM_INBOX_DEDUP_TTL_SECONDS", 86400))
+
+_CLEANUP_INTERVAL_SECONDS = 600
+
+
+# ===== ПРИЁМ =====
+
+def conversation_key(messaging_event: Dict[str, Any]) -> Optional[str]:
+    """Диалог события: клиент — отправитель, для эха (наш ответ) — получатель."""
+    message = messaging_event.get("message") or {}
+    party = "recipient" if message.get("is_echo") else "sender"
+    return (messaging_event.get(party) or {}).get("id")
+
+
+def split_webhook_events(data: Dict[str, Any]) -> Tuple[List[Tuple[Optional[str], str, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    Разложить тело вебхука: (mid, conversation_id, событие) для очереди
+    и эфемерные события (sender_action). Прочее без message (прочтения,
+    реакции) обработчик всё равно пропускает. Повторы mid внутри тела отбрасываются.
+    """
+    durable: List[Tuple[Optional[str], str, Dict[str, Any]]] = []
+    ephemeral: List[Dict[str, Any]] = []
+    seen = set()
+    for entry in data.get("entry", []):
+        for messaging in entry.get("messaging", []):
+            if "message" not in messaging:
+                if messaging.get("sender_action"):
+                    ephemeral.append(messaging)
+                continue
+            conversation_id = conversation_key(messaging)
+            if not conversation_id:
+                continue
+            mid = (messaging.get("message") or {}).get("mid")
+            if mid:
+                if mid in seen:
+                    continue
+                seen.add(mid)
+            durable.append((mid, conversation_id, messaging))
+    return durable, ephemeral
+
+
+def enqueue_instagram_events(events: List[Tuple[Optional[str], str, Dict[str, Any]]]) -> List[Optional[str]]:
+    """
+    Записать события в очередь одним INSERT; уже виденные mid пропускаются.
+    Возвращает mid'ы принятых строк (None — событие без mid).
+    """
+    if not events:
+        return []
+    params: List[Any] = []
+    for mid, conversation_id, messaging in events:
+        params.extend([mid, conversation_id, json.dumps(messaging, ensure_ascii=False)])
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(f"""
+            INSERT INTO instagram_inbox (mid, conversation_id, event)
+            VALUES {", ".join(["(%s, %s, %s::jsonb)"] * len(events))}
+            ON CONFLICT (mid) DO NOTHING
+            RETURNING mid
+        """, params)
+        accepted = [row[0] for row in c.fetchall()]
+        conn.commit()
+        return accepted
+    finally:
+        conn.close()
+
+
+# ===== ОБРАБОТКА =====
+
+def claim_instagram_events(worker_id: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Взять до limit событий, каждое — первое незавершённое в своём диалоге.
+    Протухшая аренда (воркер упал) снова делает строку доступной.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE instagram_inbox i
+            SET status = 'processing',
+                locked_by = %s,
+                locked_until = NOW() + %s * INTERVAL '1 second',
+                attempts = i.attempts + 1,
+                started_at = NOW()
+            WHERE i.id IN (
+                SELECT p.id FROM instagram_inbox p
+                WHERE (
+                    (p.status = 'pending' AND p.available_at <= NOW())
+                    OR (p.status = 'processing' AND p.locked_until < NOW())
+                )
+                AND NOT EXISTS (
+                    SELECT 1 FROM instagram_inbox q
+                    WHERE q.conversation_id = p.conversation_id
+                      AND q.id < p.id
+                      AND q.status IN ('pending', 'processing')
+                )
+                ORDER BY p.id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING i.id, i.mid, i.conversation_id, i.event, i.attempts,
+                      EXTRACT(EPOCH FROM NOW() - i.received_at)
+        """, (worker_id, INSTAGRAM_INBOX_LEASE_SECONDS, limit))
+        rows = c.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    return [
+        {
+            "id": row[0],
+            "mid": row[1],
+            "conversation_id": row[2],
+            "event": row[3] if isinstance(row[3], dict) else json.loads(row[3] or "{}"),
+            "attempts": row[4],
+            "queued_seconds": float(row[5] or 0),
+        }
+        for row in sorted(rows, key=lambda item: item[0])
+    ]
+
+
+def finish_instagram_event(event_id: int, worker_id: str, error: Optional[str] = None,
+                           attempts: int = 1) -> str:
+    """Итог хода: done; при ошибке — повтор с задержкой или failed после лимита попыток."""
+    if error is None:
+        status = "done"
+    elif attempts < INSTAGRAM_INBOX_MAX_ATTEMPTS:
+        status = "pending"
+    else:
+        status = "failed"
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE instagram_inbox
+            SET status = %s,
+                last_error = %s,
+                locked_by = NULL,
+                locked_until = NULL,
+                available_at = CASE WHEN %s = 'pending' THEN NOW() + %s * INTERVAL '1 second' ELSE available_at END,
+                processed_at = CASE WHEN %s = 'pending' THEN NULL ELSE NOW() END
+            WHERE id = %s AND locked_by = %s
+        """, (status, error, status, 5 * attempts, status, event_id, worker_id))
+        conn.commit()
+        return status
+    finally:
+        conn.close()
+
+
+def renew_instagram_leases(worker_id: str, event_ids: Iterable[int]) -> None:
+    ids = list(event_ids)
+    if not ids:
+        return
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE instagram_inbox SET locked_until = NOW() + %s * INTERVAL '1 second'
+            WHERE id = ANY(%s) AND locked_by = %s AND status = 'processing'
+        """, (INSTAGRAM_INBOX_LEASE_SECONDS, ids, worker_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def purge_instagram_inbox(ttl_seconds: int = INSTAGRAM_INBOX_DEDUP_TTL_SECONDS) -> int:
+    """Удалить обработанные строки старше окна дедупликации."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            DELETE FROM instagram_inbox
+            WHERE status IN ('done', 'failed')
+              AND received_at < NOW() - %s * INTERVAL '1 second'
+        """, (ttl_seconds,))
+        deleted = c.rowcount or 0
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+
+def get_inbox_backlog() -> Dict[str, Any]:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT COUNT(*) FILTER (WHERE status = 'pending'),
+                   COUNT(*) FILTER (WHERE status = 'processing'),
+                   COUNT(*) FILTER (WHERE status = 'failed'),
+                   COUNT(DISTINCT conversation_id) FILTER (WHERE status IN ('pending', 'processing')),
+                   COALESCE(EXTRACT(EPOCH FROM NOW() - MIN(received_at) FILTER (WHERE status = 'pending')), 0)
+            FROM instagram_inbox
+        """)
+        row = c.fetchone()
+        return {
+            "pending": row[0],
+            "processing": row[1],
+            "failed": row[2],
+            "active_conversations": row[3],
+            "oldest_pending_seconds": round(float(row[4] or 0), 1),
+        }
+    finally:
+        conn.close()
+
+
+# ===== МЕТРИКИ =====
+
+def _percentiles(values: Iterable[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[len(ordered) // 2], 2),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+class InboxMetrics:
+    """Счётчики приёма и обработки в пределах воркера."""
+
+    def __init__(self, window: int = 1024):
+        self.received = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.fallback = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.saturated_polls = 0
+        self._ack_ms = deque(maxlen=window)
+        self._queue_ms = deque(maxlen=window)
+        self._turn_ms = deque(maxlen=window)
+
+    def record_ack(self, duration_ms: float) -> None:
+        self._ack_ms.append(duration_ms)
+
+    def record_turn(self, queued_seconds: float, turn_ms: float, status: str) -> None:
+        self._queue_ms.append(queued_seconds * 1000)
+        self._turn_ms.append(turn_ms)
+        if status == "done":
+            self.processed += 1
+        elif status == "pending":
+            self.retried += 1
+        else:
+            self.failed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "fallback": self.fallback,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            # Опросы, когда все слоты заняты — признак нехватки INSTAGRAM_INBOX_CONCURRENCY
+            "saturated_polls": self.saturated_polls,
+            "ack_ms": _percentiles(self._ack_ms),
+            "queue_wait_ms": _percentiles(self._queue_ms),
+            "turn_ms": _percentiles(self._turn_ms),
+        }
+
+
+# ===== ВОРКЕР =====
+
+class InstagramInbox:
+    """Фоновый цикл воркера: ходы AI из instagram_inbox с ограничением параллельности."""
+
+    def __init__(self, handler: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                 concurrency: int = INSTAGRAM_INBOX_CONCURRENCY):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.metrics = InboxMetrics()
+        self._handler = handler
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lease_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_cleanup = 0.0
+
+    def _get_handler(self) -> Callable[[Dict[str, Any]], Awaitable[None]]:
+        if self._handler is None:
+            # Импорт бота и интеграций — только когда появилась работа
+            from webhooks import process_message_background
+            self._handler = process_message_background
+        return self._handler
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        self._lease_task = asyncio.create_task(self._keep_leases())
+        log_info(f"📥 Instagram inbox started ({self.worker_id}, concurrency {self.concurrency})", "webhook")
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        """Остановить цикл; незавершённые ходы отменяются, их аренды истекут и строки возьмут заново."""
+        for task in (self._task, self._lease_task, *self._inflight.values()):
+            if task is not None:
+                task.cancel()
+        for task in (self._task, self._lease_task, *self._inflight.values()):
+            if task is None:
+                continue
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = self._lease_task = None
+        self._inflight = {}
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                free = self.concurrency - len(self._inflight)
+                if free <= 0:
+                    self.metrics.saturated_polls += 1
+                else:
+                    with platform_access():
+                        events = await run_blocking(claim_instagram_events, self.worker_id, free)
+                    for event in events:
+                        self._inflight[event["id"]] = asyncio.create_task(self._process(event))
+                    if len(events) == free:
+                        continue
+                    await self._maybe_cleanup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(f"Instagram inbox error: {e}", "webhook")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=INSTAGRAM_INBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _process(self, event: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        error = None
+        try:
+            await self._get_handler()(event["event"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            log_error(f"Instagram event {event['mid'] or event['id']} failed: {error}", "webhook")
+        finally:
+            self._inflight.pop(event["id"], None)
+        try:
+            with platform_access():
+                status = await run_blocking(finish_instagram_event, event["id"], self.worker_id, error, event["attempts"])
+            self.metrics.record_turn(event["queued_seconds"], (time.perf_counter() - started) * 1000, status)
+        except Exception as e:
+            log_error(f"Instagram inbox finish #{event['id']} failed: {e}", "webhook")
+        # Освободился слот, а у диалога могло появиться следующее сообщение
+        self.wake()
+
+    async def _keep_leases(self) -> None:
+        while True:
+            await asyncio.sleep(INSTAGRAM_INBOX_LEASE_SECONDS / 3)
+            try:
+                with platform_access():
+                    await run_blocking(renew_instagram_leases, self.worker_id, list(self._inflight))
+            except Exception as e:
+                log_warning(f"Instagram inbox lease renewal failed: {e}", "webhook")
+
+    async def _maybe_cleanup(self) -> None:
+        now = time.monotonic()
+        if now - self._last_cleanup < _CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_cleanup = now
+        with platform_access():
+            deleted = await run_blocking(purge_instagram_inbox)
+        if deleted:
+            log_info(f"📥 Instagram inbox: purged {deleted} processed rows", "webhook")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._task is not None and not self._task.done(),
+            "concurrency": self.concurrency,
+            "in_flight": len(self._inflight),
+            **self.metrics.snapshot(),
+        }
+
+
+instagram_inbox = InstagramInbox()
@@ -0,0 +1,524 @@
+"""
+Общий диспетчер запросов к LLM (Gemini generateContent).
+
+Раньше каждый диалог сам перебирал ключи и прокси по `attempt % len(...)`
+и на 429 спал до 64 с в своей корутине, так что один исчерпанный ключ
+тормозил все разговоры. Диспетчер один на процесс:
+
+- у каждого API-ключа токен-бакеты RPM и TPM, у каждого прокси — RPM
+  (`utils.token_bucket.AsyncTokenBucket`; LLM_KEY_RPM / LLM_KEY_TPM / LLM_PROXY_RPM);
+- здоровье ключа и прокси (0..1) падает после 429/403/таймаутов, на время
+  cooldown пара не выдаётся, затем здоровье восстанавливается
+  экспоненциально (LLM_HEALTH_RECOVERY_SECONDS);
+- запросы ждут в очереди по компаниям, компании обслуживаются по кругу, и
+  каждый запрос получает самую здоровую свободную пару ключ/прокси;
+- повтор после 429/403/сбоя сети идёт сразу на другую пару, без sleep в
+  диалоге; ожидание в очереди ограничено LLM_QUEUE_TIMEOUT_SECONDS.
+
+Очередь не привязана к event loop'у: пары выдаются под threading.Lock, а
+ожидающий будится через call_soon_threadsafe, так что диспетчер работает и
+из asyncio.run в потоках. Метрики (ожидание в очереди, время ответа
+upstream, отказы, здоровье) — `llm_dispatcher.stats()`, /api/diagnostics/llm.
+LLM_UPSTREAM_URL переключает на локальный фейковый upstream для нагрузочных
+тестов (scripts/monitoring/benchmark_llm_dispatch.py).
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+
+from core.config import GEMINI_MODEL
+from utils.http_clients import get_http_client
+from utils.logger import log_warning
+from utils.tenant_context import get_current_company_id
+from utils.token_bucket import AsyncTokenBucket
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def load_numbered_env(name: str, count: int = 9) -> List[str]:
+    """NAME, NAME_1 … NAME_9 без пустых и повторов (ключи Gemini, прокси)."""
+    values: List[str] = []
+    for env_name in [name] + [f"{name}_{i}" for i in range(1, count + 1)]:
+        value = os.getenv(env_name)
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+LLM_KEY_RPM = max(0, _read_int_env("LLM_KEY_RPM", 60))
+LLM_KEY_TPM = max(0, _read_int_env("LLM_KEY_TPM", 1_000_000))
+LLM_PROXY_RPM = max(0, _read_int_env("LLM_PROXY_RPM", 0))
+LLM_CONCURRENCY = max(1, _read_int_env("LLM_CONCURRENCY", 32))
+LLM_MAX_QUEUE = max(1, _read_int_env("LLM_MAX_QUEUE", 500))
+LLM_QUEUE_TIMEOUT_SECONDS = max(1, _read_int_env("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+LLM_REQUEST_TIMEOUT_SECONDS = max(1, _read_int_env("LLM_REQUEST_TIMEOUT_SECONDS", 60))
+LLM_MAX_ATTEMPTS = max(1, _read_int_env("LLM_MAX_ATTEMPTS", 4))
+LLM_HEALTH_RECOVERY_SECONDS = max(1, _read_int_env("LLM_HEALTH_RECOVERY_SECONDS", 120))
+LLM_UPSTREAM_URL = os.getenv("LLM_UPSTREAM_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+
+# Исход запроса → (множитель здоровья, cooldown в секундах) для ключа и/или прокси
+_PENALTIES = {
+    "rate_limited": {"key": (0.5, 20.0)},
+    "forbidden": {"key": (0.3, 60.0), "proxy": (0.3, 60.0)},
+    "network": {"proxy": (0.5, 10.0)},
+    "server_error": {"key": (0.8, 0.0), "proxy": (0.8, 0.0)},
+}
+# Ожидающие сами перепроверяют очередь не реже раза в секунду (бакеты копятся без событий)
+_MAX_IDLE_WAIT_SECONDS = 1.0
+
+
+class LLMRejected(Exception):
+    """Запрос не получил пару ключ/прокси: очередь переполнена, ожидание истекло или все ключи в 429."""
+
+
+class LLMUnavailable(Exception):
+    """Upstream недоступен: нет ключей или все попытки закончились ошибкой."""
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    """Грубая оценка токенов запроса для TPM: ~4 символа на токен + лимит ответа."""
+    chars = 0
+    for content in payload.get("contents") or []:
+        for part in content.get("parts") or []:
+            chars += len(part.get("text") or "")
+    max_output = (payload.get("generationConfig") or {}).get("maxOutputTokens") or 0
+    return chars // 4 + int(max_output)
+
+
+def classify_response(status_code: int, data: Any) -> str:
+    error = data.get("error") if isinstance(data, dict) else None
+    code = error.get("code") if isinstance(error, dict) and error.get("code") else status_code
+    if code == 429:
+        return "rate_limited"
+    if code == 403:
+        return "forbidden"
+    # Любой 5xx, в том числе 520/522 от прокси или CDN, — повтор на другой паре
+    if (isinstance(code, int) and code >= 500) or status_code >= 500:
+        return "server_error"
+    if error or status_code >= 400:
+        return "error"
+    return "ok"
+
+
+def parse_retry_after(headers, data: Any) -> Optional[float]:
+    """Retry-After из заголовка или RetryInfo.retryDelay ("23s") из тела ошибки Gemini."""
+    try:
+        value = headers.get("retry-after") if headers is not None else None
+        if value:
+            return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    error = data.get("error") if isinstance(data, dict) else None
+    for detail in (error.get("details") or []) if isinstance(error, dict) else []:
+        delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return max(0.0, float(delay[:-1]))
+            except ValueError:
+                continue
+    return None
+
+
+def _summary(values: Iterable[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "count": len(ordered),
+        "avg": round(sum(ordered) / len(ordered), 2),
+        "p50": round(ordered[len(ordered) // 2], 2),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+class _Endpoint:
+    """API-ключ или прокси: бакеты, здоровье, cooldown, счётчики исходов."""
+
+    def __init__(self, kind: str, value: Optional[str], rpm: int, tpm: int = 0):
+        self.kind = kind
+        self.value = value
+        if kind == "key":
+            self.label = f"...{value[-6:]}"
+        elif value:
+            self.label = value.split("@", 1)[1] if "@" in value else value
+        else:
+            self.label = "direct"
+        # Бакет RPM допускает всплеск в 1/6 минутного лимита, TPM — весь минутный лимит
+        self.requests = AsyncTokenBucket(rpm / 60.0, burst=max(1.0, rpm / 6.0)) if rpm else AsyncTokenBucket(0)
+        self.tokens = AsyncTokenBucket(tpm / 60.0, burst=float(tpm)) if tpm else AsyncTokenBucket(0)
+        self._health = 1.0
+        self._health_at = time.monotonic()
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.outcomes: Dict[str, int] = {}
+
+    def health(self, now: float) -> float:
+        elapsed = max(0.0, now - self._health_at)
+        return 1.0 - (1.0 - self._health) * math.exp(-elapsed / LLM_HEALTH_RECOVERY_SECONDS)
+
+    def _set_health(self, value: float, now: float) -> None:
+        self._health = max(0.01, min(1.0, value))
+        self._health_at = now
+
+    def penalize(self, factor: float, cooldown: float, now: float) -> None:
+        self._set_health(self.health(now) * factor, now)
+        # Прямое подключение — единственный «прокси»: cooldown остановил бы все запросы
+        if cooldown and self.value is not None:
+            self.cooldown_until = max(self.cooldown_until, now + cooldown)
+
+    def reward(self, now: float) -> None:
+        health = self.health(now)
+        self._set_health(health + (1.0 - health) * 0.2, now)
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        return max(
+            self.cooldown_until - now,
+            self.requests.wait_time(1.0),
+            self.tokens.wait_time(min(tokens, self.tokens.capacity)),
+        )
+
+    def take(self, tokens: float, now: float) -> None:
+        self.requests.try_acquire(1.0)
+        self.tokens.try_acquire(min(tokens, self.tokens.capacity))
+        self.in_flight += 1
+        self.last_used = now
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "health": round(self.health(now), 3),
+            "cooldown_seconds": round(max(0.0, self.cooldown_until - now), 1),
+            "in_flight": self.in_flight,
+            "outcomes": dict(self.outcomes),
+        }
+
+
+class LLMGrant:
+    """Выданная пара ключ/прокси; вернуть через `LLMDispatcher.release`."""
+
+    __slots__ = ("key", "proxy", "tenant")
+
+    def __init__(self, key: _Endpoint, proxy: _Endpoint, tenant: Any):
+        self.key = key
+        self.proxy = proxy
+        self.tenant = tenant
+
+
+class _Waiter:
+    __slots__ = ("tenant", "tokens", "loop", "future", "enqueued_at", "grant")
+
+    def __init__(self, tenant: Any, tokens: float, loop: asyncio.AbstractEventLoop):
+        self.tenant = tenant
+        self.tokens = tokens
+        self.loop = loop
+        self.future = loop.create_future()
+        self.enqueued_at = time.monotonic()
+        self.grant: Optional[LLMGrant] = None
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMMetrics:
+    """Счётчики и задержки диспетчера в пределах воркера."""
+
+    def __init__(self, window: int = 1024):
+        self.requests = 0
+        self.outcomes: Dict[str, int] = {}
+        self.rejections: Dict[str, int] = {}
+        self._queue_wait_ms = deque(maxlen=window)
+        self._upstream_ms = deque(maxlen=window)
+
+    def record_queue_wait(self, wait_ms: float) -> None:
+        self._queue_wait_ms.append(wait_ms)
+
+    def record_outcome(self, outcome: str, latency_ms: Optional[float]) -> None:
+        self.requests += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        if latency_ms is not None:
+            self._upstream_ms.append(latency_ms)
+
+    def record_rejection(self, reason: str) -> None:
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "outcomes": dict(self.outcomes),
+            "rejections": dict(self.rejections),
+            # От постановки в очередь до выдачи пары ключ/прокси
+            "queue_wait_ms": _summary(self._queue_wait_ms),
+            # Время HTTP-запроса к upstream (включая прокси)
+            "upstream_ms": _summary(self._upstream_ms),
+        }
+
+
+class LLMDispatcher:
+    """Очередь запросов к LLM с честной очередью по компаниям и выбором пары по здоровью."""
+
+    def __init__(
+        self,
+        keys: Sequence[str] = (),
+        proxies: Sequence[str] = (),
+        key_rpm: int = LLM_KEY_RPM,
+        key_tpm: int = LLM_KEY_TPM,
+        proxy_rpm: int = LLM_PROXY_RPM,
+        concurrency: int = LLM_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        request_timeout: float = LLM_REQUEST_TIMEOUT_SECONDS,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        upstream_url: str = LLM_UPSTREAM_URL,
+        model: Optional[str] = None,
+    ):
+        self.key_rpm = key_rpm
+        self.key_tpm = key_tpm
+        self.proxy_rpm = proxy_rpm
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.max_attempts = max_attempts
+        self.upstream_url = upstream_url.rstrip("/")
+        self.model = model or GEMINI_MODEL
+        self.metrics = LLMMetrics()
+        self._lock = threading.Lock()
+        self._keys: List[_Endpoint] = []
+        self._proxies: List[_Endpoint] = []
+        self._queues: "OrderedDict[Any, deque]" = OrderedDict()
+        self._queued = 0
+        self._in_flight = 0
+        self.configure(keys, proxies)
+
+    def configure(self, keys: Sequence[str], proxies: Sequence[str]) -> None:
+        """Задать ключи и прокси; бакеты и здоровье уже известных сохраняются."""
+        with self._lock:
+            known = {(endpoint.kind, endpoint.value): endpoint for endpoint in self._keys + self._proxies}
+            self._keys = [
+                known.get(("key", key)) or _Endpoint("key", key, self.key_rpm, self.key_tpm)
+                for key in dict.fromkeys(key for key in keys if key)
+            ]
+            proxy_values = list(dict.fromkeys(proxy for proxy in proxies if proxy)) or [None]
+            self._proxies = [
+                known.get(("proxy", proxy)) or _Endpoint("proxy", proxy, self.proxy_rpm)
+                for proxy in proxy_values
+            ]
+
+    # ----- очередь -----
+
+    def _select_locked(self, tokens: float, now: float) -> Tuple[Optional[Tuple[_Endpoint, _Endpoint]], float]:
+        best = None
+        best_rank = None
+        wait = math.inf
+        for key in self._keys:
+            key_wait = key.wait_time(tokens, now)
+            for proxy in self._proxies:
+                pair_wait = max(key_wait, proxy.wait_time(0, now))
+                if pair_wait > 0:
+                    wait = min(wait, pair_wait)
+                    continue
+                # Здоровее → меньше запросов в полёте → дольше не использовалась
+                rank = (
+                    key.health(now) * proxy.health(now),
+                    -(key.in_flight + proxy.in_flight),
+                    -max(key.last_used, proxy.last_used),
+                )
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = (key, proxy), rank
+        return best, wait
+
+    def _pump_locked(self, now: float) -> float:
+        """Раздать свободные пары ожидающим (компании по кругу); вернуть, через сколько перепроверить."""
+        while self._queues and self._in_flight < self.concurrency:
+            # Если большой запрос компании не влезает в TPM ни одной пары, ход
+            # переходит к следующей компании, а не блокирует всю очередь
+            granted = None
+            retry_in = math.inf
+            for tenant, queue in self._queues.items():
+                pair, wait = self._select_locked(queue[0].tokens, now)
+                if pair is not None:
+                    granted = (tenant, queue, pair)
+                    break
+                retry_in = min(retry_in, wait)
+            if granted is None:
+                return min(retry_in, _MAX_IDLE_WAIT_SECONDS)
+            tenant, queue, pair = granted
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+            key, proxy = pair
+            key.take(waiter.tokens, now)
+            proxy.take(0, now)
+            self._in_flight += 1
+            waiter.grant = LLMGrant(key, proxy, tenant)
+            try:
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            except RuntimeError:
+                # loop ожидающего уже закрыт — пару никто не заберёт
+                self._release_locked(waiter.grant, "cancelled", None, None, now)
+        return _MAX_IDLE_WAIT_SECONDS
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Убрать ожидающего из очереди; False — пара ему уже выдана."""
+        with self._lock:
+            if waiter.grant is not None:
+                return False
+            queue = self._queues.get(waiter.tenant)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[waiter.tenant]
+            return True
+
+    async def acquire(self, tenant: Any = 0, tokens: float = 1.0) -> LLMGrant:
+        """Дождаться пары ключ/прокси в очереди своей компании."""
+        waiter = _Waiter(tenant, tokens, asyncio.get_running_loop())
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self.metrics.record_rejection("queue_full")
+                raise LLMRejected("Rate limit: LLM queue is full")
+            self._queues.setdefault(tenant, deque()).append(waiter)
+            self._queued += 1
+            retry_in = self._pump_locked(waiter.enqueued_at)
+
+        deadline = waiter.enqueued_at + self.queue_timeout
+        try:
+            while waiter.grant is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.wait({waiter.future}, timeout=min(retry_in, remaining))
+                if waiter.grant is None:
+                    with self._lock:
+                        retry_in = self._pump_locked(time.monotonic())
+        except asyncio.CancelledError:
+            if not self._withdraw(waiter):
+                self.release(waiter.grant, "cancelled")
+            raise
+
+        if waiter.grant is None and self._withdraw(waiter):
+            self.metrics.record_rejection("queue_timeout")
+            raise LLMRejected(f"Rate limit: no LLM key available within {self.queue_timeout:g}s")
+        self.metrics.record_queue_wait((time.monotonic() - waiter.enqueued_at) * 1000)
+        return waiter.grant
+
+    def _release_locked(self, grant: LLMGrant, outcome: str, latency_ms: Optional[float],
+                        retry_after: Optional[float], now: float) -> None:
+        self._in_flight -= 1
+        for kind, endpoint in (("key", grant.key), ("proxy", grant.proxy)):
+            endpoint.in_flight -= 1
+            endpoint.outcomes[outcome] = endpoint.outcomes.get(outcome, 0) + 1
+            penalty = _PENALTIES.get(outcome, {}).get(kind)
+            if penalty is not None:
+                factor, cooldown = penalty
+                if outcome == "rate_limited" and retry_after is not None:
+                    cooldown = retry_after
+                endpoint.penalize(factor, cooldown, now)
+            elif outcome == "ok":
+                endpoint.reward(now)
+        if outcome != "cancelled":
+            self.metrics.record_outcome(outcome, latency_ms)
+
+    def release(self, grant: LLMGrant, outcome: str, latency_ms: Optional[float] = None,
+                retry_after: Optional[float] = None) -> None:
+        """Вернуть пару с исходом запроса (ok / error / rate_limited / forbidden / network / server_error)."""
+        now = time.monotonic()
+        with self._lock:
+            self._release_locked(grant, outcome, latency_ms, retry_after, now)
+            self._pump_locked(now)
+
+    # ----- запрос -----
+
+    async def generate(self, payload: Dict[str, Any], company_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        POST generateContent через лучшую свободную пару. 429/403/сбой сети/5xx —
+        повтор на другой паре; остальные ответы (в том числе ошибки) возвращаются как есть.
+        """
+        if not self._keys:
+            raise LLMUnavailable("No LLM API keys configured")
+        tenant = company_id if company_id is not None else get_current_company_id()
+        tokens = estimate_tokens(payload)
+        last_outcome = None
+        last_error: Optional[str] = None
+
+        for attempt in range(self.max_attempts):
+            grant = await self.acquire(tenant or 0, tokens)
+            url = f"{self.upstream_url}/v1beta/models/{self.model}:generateContent?key={grant.key.value}"
+            data: Any = None
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                # Общий keep-alive клиент на пару (хост, прокси): ротация не открывает TLS заново
+                client = get_http_client(url, proxy=grant.proxy.value)
+                response = await client.post(url, json=payload, timeout=self.request_timeout, follow_redirects=True)
+            except asyncio.CancelledError:
+                self.release(grant, "cancelled")
+                raise
+            except httpx.HTTPError as e:
+                outcome, last_error = "network", f"{type(e).__name__}: {e}"
+            else:
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = None
+                if data is None and response.status_code < 500:
+                    # Не-JSON без 5xx — страница прокси, а не ответ Gemini
+                    outcome, last_error = "network", f"non-JSON response {response.status_code}"
+                else:
+                    outcome = classify_response(response.status_code, data)
+                    last_error = f"HTTP {response.status_code}"
+                    if outcome == "rate_limited":
+                        retry_after = parse_retry_after(response.headers, data)
+            self.release(grant, outcome, (time.perf_counter() - started) * 1000, retry_after)
+
+            if outcome in ("ok", "error"):
+                if not isinstance(data, dict):
+                    # Вызывающие проверяют `"error" in data` — не отдаём None и не-объекты
+                    data = {"error": {"code": response.status_code, "message": f"Unexpected LLM response: {last_error}"}}
+                return data
+            last_outcome = outcome
+            log_warning(
+                f"LLM {outcome} via key {grant.key.label} / {grant.proxy.label} "
+                f"(attempt {attempt + 1}/{self.max_attempts}): {last_error}",
+                "llm",
+            )
+
+        if last_outcome == "rate_limited":
+            raise LLMRejected(f"Rate limit exceeded after {self.max_attempts} attempts")
+        raise LLMUnavailable(f"LLM upstream failed after {self.max_attempts} attempts ({last_outcome}: {last_error})")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "upstream": self.upstream_url,
+                "concurrency": self.concurrency,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "tenants_waiting": len(self._queues),
+                "keys": [endpoint.snapshot(now) for endpoint in self._keys],
+                "proxies": [endpoint.snapshot(now) for endpoint in self._proxies],
+                **self.metrics.snapshot(),
+            }
+
+
+llm_dispatcher = LLMDispatcher(load_numbered_env("GEMINI_API_KEY"), load_numbered_env("PROXY_URL"))
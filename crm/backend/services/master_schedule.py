@@ -3,41 +3,33 @@
 """
 from datetime import datetime, timedelta, date as dt_date, time as dt_time
 from zoneinfo import ZoneInfo
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Sequence, Tuple, Union
 import json
+import os
 import re
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.logger import log_info, log_error
-from utils.datetime_utils import get_current_time, get_salon_timezone
+from utils.datetime_utils import get_current_time
+from services.availability_engine import AvailabilityTimeline
 
-class MasterScheduleService:
-    """Сервис управления расписанием мастеров"""
 
-    def __init__(self):
-        self._column_cache: Dict[Tuple[str, str], bool] = {}
+def _read_slot_step_minutes() -> int:
+    try:
+        return max(5, int(os.getenv("SCHEDULE_SLOT_STEP_MINUTES", "30")))
+    except ValueError:
+        return 30
 
-    def _has_table_column(self, table_name: str, column_name: str) -> bool:
-        cache_key = (table_name, column_name)
-        if cache_key in self._column_cache:
-            return self._column_cache[cache_key]
 
-        conn = get_db_connection()
-        c = conn.cursor()
-        try:
-            c.execute(
-                """
-                SELECT 1
-                FROM information_schema.columns
-                WHERE table_name = %s AND column_name = %s
-                LIMIT 1
-                """,
-                (table_name, column_name),
-            )
-            exists = bool(c.fetchone())
-            self._column_cache[cache_key] = exists
-            return exists
-        finally:
-            conn.close()
+DEFAULT_SLOT_STEP_MINUTES = _read_slot_step_minutes()
+# Минимальный запас до начала слота на сегодня (см. reason "past_or_too_soon")
+MIN_LEAD_MINUTES = 30
+
+DurationSpec = Union[int, Sequence[int]]
+
+
+class MasterScheduleService:
+    """Сервис управления расписанием мастеров"""
 
     def _get_master_aliases(self, user_record: Dict[str, Any], raw_identifier: Optional[str] = None) -> List[str]:
         aliases: List[str] = []
@@ -56,7 +48,7 @@ class MasterScheduleService:
             aliases.append(normalized)
         return aliases
 
-    def _get_user_record(self, master_identifier: Any) -> Optional[Dict[str, Any]]:
+    def _get_user_record(self, master_identifier: Any, cursor=None) -> Optional[Dict[str, Any]]:
         """Получить пользователя мастера по id/username/full_name/nickname."""
         if master_identifier is None:
             return None
@@ -65,8 +57,11 @@ class MasterScheduleService:
         if not identifier:
             return None
 
-        conn = get_db_connection()
-        c = conn.cursor()
+        conn = None
+        c = cursor
+        if c is None:
+            conn = get_db_connection()
+            c = conn.cursor()
         try:
             if identifier.isdigit():
                 c.execute(
@@ -122,7 +117,8 @@ class MasterScheduleService:
                 "nickname": row[3],
             }
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
 
     def _get_user_id(self, master_name: str) -> Optional[int]:
         """Получить ID пользователя по идентификатору мастера."""
@@ -241,7 +237,7 @@ class MasterScheduleService:
             start_dt = f"{start_date} 00:00:00"
             end_dt = f"{end_date} 23:59:59"
 
-            has_type_column = self._has_table_column("user_time_off", "type")
+            has_type_column = column_exists("user_time_off", "type", c)
             if has_type_column:
                 c.execute("""
                     INSERT INTO user_time_off
@@ -278,7 +274,7 @@ class MasterScheduleService:
         c = conn.cursor()
 
         try:
-            has_type_column = self._has_table_column("user_time_off", "type")
+            has_type_column = column_exists("user_time_off", "type", c)
             type_select = "COALESCE(type, 'vacation') as type," if has_type_column else "'vacation' as type,"
             query = """
                 SELECT id, start_date, end_date, {type_select} reason
@@ -456,18 +452,23 @@ class MasterScheduleService:
 
         return fallback_duration
 
-    def estimate_duration_minutes(self, service_label: Any, fallback: int = 60) -> int:
+    def estimate_duration_minutes(self, service_label: Any, fallback: int = 60, cursor=None) -> int:
         """Оценить длительность услуги (или набора услуг) из SSOT таблицы services."""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        conn = None
+        if cursor is None:
+            conn = get_db_connection()
+            cursor = conn.cursor()
         try:
             _, duration_by_name = self._load_service_duration_maps(cursor)
             return self._estimate_duration_from_text(service_label, duration_by_name, fallback=fallback)
         except Exception as e:
+            if conn is None:
+                raise
             log_error(f"Error estimating duration: {e}", "schedule")
             return max(1, int(fallback))
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
 
     def _parse_master_exceptions(self, raw_value: Any) -> List[int]:
         if raw_value is None:
@@ -553,118 +554,6 @@ class MasterScheduleService:
     def _minute_key(self, dt_value: datetime) -> int:
         return (dt_value.hour * 60) + dt_value.minute
 
-    def _get_holiday_state(self, cursor, date_str: str, user_id: int) -> Dict[str, Any]:
-        cursor.execute(
-            """
-            SELECT name, is_closed, master_exceptions
-            FROM salon_holidays
-            WHERE date = %s
-            LIMIT 1
-            """,
-            (date_str,),
-        )
-        row = cursor.fetchone()
-        if not row:
-            return {
-                "is_holiday": False,
-                "holiday_name": None,
-                "is_closed": False,
-                "has_override": False,
-                "is_day_off": False,
-            }
-
-        holiday_name, is_closed, raw_exceptions = row
-        exceptions = self._parse_master_exceptions(raw_exceptions)
-        has_override = user_id in exceptions
-        is_day_off = bool(is_closed and not has_override)
-
-        return {
-            "is_holiday": True,
-            "holiday_name": holiday_name,
-            "is_closed": bool(is_closed),
-            "has_override": has_override,
-            "is_day_off": is_day_off,
-        }
-
-    def _get_day_schedule_state(
-        self,
-        cursor,
-        user_id: int,
-        date_obj: dt_date,
-        salon_settings: Dict[str, Any],
-    ) -> Dict[str, Any]:
-        day_of_week = int(date_obj.weekday())
-        cursor.execute(
-            """
-            SELECT start_time, end_time, is_active
-            FROM user_schedule
-            WHERE user_id = %s AND day_of_week = %s
-            LIMIT 1
-            """,
-            (user_id, day_of_week),
-        )
-        row = cursor.fetchone()
-        if row:
-            start_time = self._normalize_time_string(row[0])
-            end_time = self._normalize_time_string(row[1])
-            is_active = bool(row[2])
-            is_working = bool(is_active and start_time and end_time and start_time < end_time)
-            return {
-                "is_working": is_working,
-                "start_time": start_time,
-                "end_time": end_time,
-                "day_of_week": day_of_week,
-                "source": "user_schedule",
-            }
-
-        settings_key = "hours_weekends" if day_of_week >= 5 else "hours_weekdays"
-        configured_range = salon_settings.get(settings_key) or ""
-        start_time, end_time = self._parse_hours_range(configured_range, "", "")
-        is_working = bool(start_time and end_time and start_time < end_time)
-
-        return {
-            "is_working": is_working,
-            "start_time": start_time,
-            "end_time": end_time,
-            "day_of_week": day_of_week,
-            "source": "salon_defaults",
-        }
-
-    def _fetch_time_off_intervals(
-        self,
-        cursor,
-        user_id: int,
-        date_obj: dt_date,
-        timezone: ZoneInfo,
-    ) -> List[Dict[str, Any]]:
-        day_start_key = f"{date_obj.strftime('%Y-%m-%d')} 00:00:00"
-        day_end_key = f"{(date_obj + timedelta(days=1)).strftime('%Y-%m-%d')} 00:00:00"
-
-        cursor.execute(
-            """
-            SELECT start_date, end_date
-            FROM user_time_off
-            WHERE user_id = %s
-              AND start_date < %s
-              AND end_date > %s
-            """,
-            (user_id, day_end_key, day_start_key),
-        )
-
-        intervals: List[Dict[str, Any]] = []
-        for row in cursor.fetchall():
-            start_dt = self._to_tz_datetime(row[0], timezone)
-            end_dt = self._to_tz_datetime(row[1], timezone)
-            if not start_dt or not end_dt or end_dt <= start_dt:
-                continue
-            intervals.append({
-                "start": start_dt,
-                "end": end_dt,
-                "source": "time_off",
-            })
-
-        return intervals
-
     def _fetch_lunch_interval(
         self,
         salon_settings: Dict[str, Any],
@@ -687,119 +576,6 @@ class MasterScheduleService:
             "source": "lunch",
         }
 
-    def _fetch_booking_intervals(
-        self,
-        cursor,
-        user_record: Dict[str, Any],
-        date_obj: dt_date,
-        timezone: ZoneInfo,
-        duration_by_name: Dict[str, int],
-    ) -> List[Dict[str, Any]]:
-        day_start_key = f"{date_obj.strftime('%Y-%m-%d')} 00:00:00"
-        day_end_key = f"{(date_obj + timedelta(days=1)).strftime('%Y-%m-%d')} 00:00:00"
-        aliases_upper = [alias.upper() for alias in self._get_master_aliases(user_record)]
-        user_id = int(user_record["id"])
-
-        if self._has_table_column("bookings", "master_user_id"):
-            cursor.execute(
-                """
-                SELECT datetime, service_name
-                FROM bookings
-                WHERE datetime >= %s
-                  AND datetime < %s
-                  AND status != 'cancelled'
-                  AND (
-                    master_user_id = %s
-                    OR (master_user_id IS NULL AND UPPER(COALESCE(master, '')) = ANY(%s))
-                  )
-                """,
-                (day_start_key, day_end_key, user_id, aliases_upper),
-            )
-        else:
-            cursor.execute(
-                """
-                SELECT datetime, service_name
-                FROM bookings
-                WHERE datetime >= %s
-                  AND datetime < %s
-                  AND status != 'cancelled'
-                  AND UPPER(COALESCE(master, '')) = ANY(%s)
-                """,
-                (day_start_key, day_end_key, aliases_upper),
-            )
-
-        intervals: List[Dict[str, Any]] = []
-        for row in cursor.fetchall():
-            start_dt = self._to_tz_datetime(row[0], timezone)
-            if not start_dt:
-                continue
-            duration = self._estimate_duration_from_text(row[1], duration_by_name, fallback=60)
-            end_dt = start_dt + timedelta(minutes=duration)
-            intervals.append({
-                "start": start_dt,
-                "end": end_dt,
-                "source": "booking",
-            })
-
-        return intervals
-
-    def _fetch_booking_draft_intervals(
-        self,
-        cursor,
-        user_record: Dict[str, Any],
-        date_obj: dt_date,
-        timezone: ZoneInfo,
-        duration_by_id: Dict[int, int],
-    ) -> List[Dict[str, Any]]:
-        day_start_key = f"{date_obj.strftime('%Y-%m-%d')} 00:00:00"
-        day_end_key = f"{(date_obj + timedelta(days=1)).strftime('%Y-%m-%d')} 00:00:00"
-        aliases_upper = [alias.upper() for alias in self._get_master_aliases(user_record)]
-        user_id = int(user_record["id"])
-
-        if self._has_table_column("booking_drafts", "master_user_id"):
-            cursor.execute(
-                """
-                SELECT datetime, service_id
-                FROM booking_drafts
-                WHERE datetime >= %s
-                  AND datetime < %s
-                  AND expires_at > NOW()
-                  AND (
-                    master_user_id = %s
-                    OR (master_user_id IS NULL AND UPPER(COALESCE(master, '')) = ANY(%s))
-                  )
-                """,
-                (day_start_key, day_end_key, user_id, aliases_upper),
-            )
-        else:
-            cursor.execute(
-                """
-                SELECT datetime, service_id
-                FROM booking_drafts
-                WHERE datetime >= %s
-                  AND datetime < %s
-                  AND expires_at > NOW()
-                  AND UPPER(COALESCE(master, '')) = ANY(%s)
-                """,
-                (day_start_key, day_end_key, aliases_upper),
-            )
-
-        intervals: List[Dict[str, Any]] = []
-        for row in cursor.fetchall():
-            start_dt = self._to_tz_datetime(row[0], timezone)
-            if not start_dt:
-                continue
-            service_id = row[1]
-            duration = duration_by_id.get(int(service_id), 60) if service_id is not None else 60
-            end_dt = start_dt + timedelta(minutes=duration)
-            intervals.append({
-                "start": start_dt,
-                "end": end_dt,
-                "source": "draft",
-            })
-
-        return intervals
-
     def _intervals_overlap(self, start_a: datetime, end_a: datetime, start_b: datetime, end_b: datetime) -> bool:
         return start_a < end_b and end_a > start_b
 
@@ -809,81 +585,24 @@ class MasterScheduleService:
                 return interval
         return None
 
-    def _build_day_context(self, user_record: Dict[str, Any], date_str: str) -> Optional[Dict[str, Any]]:
+    def load_availability(
+        self,
+        user_records: List[Dict[str, Any]],
+        start_date: dt_date,
+        end_date: dt_date,
+        cursor=None,
+    ) -> AvailabilityTimeline:
+        """Загрузить занятость мастеров за диапазон дат несколькими set-based запросами."""
+        return AvailabilityTimeline.load(self, user_records, start_date, end_date, cursor=cursor)
+
+    def _build_day_context(self, user_record: Dict[str, Any], date_str: str, cursor=None) -> Optional[Dict[str, Any]]:
         try:
             date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
         except Exception:
             return None
 
-        timezone = ZoneInfo(get_salon_timezone())
-        now = get_current_time().astimezone(timezone)
-
-        from db.settings import get_salon_settings
-        salon_settings = get_salon_settings() or {}
-
-        user_id = int(user_record["id"])
-        master_name = user_record.get("full_name") or user_record.get("username") or str(user_id)
-
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            holiday_state = self._get_holiday_state(cursor, date_str, user_id)
-            schedule_state = self._get_day_schedule_state(cursor, user_id, date_obj, salon_settings)
-
-            context: Dict[str, Any] = {
-                "date": date_str,
-                "date_obj": date_obj,
-                "timezone": timezone,
-                "now": now,
-                "user_id": user_id,
-                "master_name": master_name,
-                "holiday": holiday_state,
-                "schedule": schedule_state,
-                "work_start": None,
-                "work_end": None,
-                "blocked_intervals": [],
-                "is_working": False,
-                "day_off_reason": None,
-            }
-
-            if holiday_state.get("is_day_off"):
-                context["day_off_reason"] = "holiday"
-                return context
-
-            if not schedule_state.get("is_working"):
-                context["day_off_reason"] = "schedule_off"
-                return context
-
-            work_start = self._combine_date_time(date_obj, schedule_state.get("start_time"), timezone)
-            work_end = self._combine_date_time(date_obj, schedule_state.get("end_time"), timezone)
-            if not work_start or not work_end or work_end <= work_start:
-                context["day_off_reason"] = "schedule_off"
-                return context
-
-            blocked_intervals: List[Dict[str, Any]] = []
-            blocked_intervals.extend(self._fetch_time_off_intervals(cursor, user_id, date_obj, timezone))
-
-            lunch_interval = self._fetch_lunch_interval(salon_settings, date_obj, timezone)
-            if lunch_interval:
-                blocked_intervals.append(lunch_interval)
-
-            duration_by_id, duration_by_name = self._load_service_duration_maps(cursor)
-            blocked_intervals.extend(
-                self._fetch_booking_intervals(cursor, user_record, date_obj, timezone, duration_by_name)
-            )
-            blocked_intervals.extend(
-                self._fetch_booking_draft_intervals(cursor, user_record, date_obj, timezone, duration_by_id)
-            )
-
-            blocked_intervals.sort(key=lambda interval: interval["start"])
-
-            context["work_start"] = work_start
-            context["work_end"] = work_end
-            context["blocked_intervals"] = blocked_intervals
-            context["is_working"] = True
-            return context
-        finally:
-            conn.close()
+        timeline = self.load_availability([user_record], date_obj, date_obj, cursor=cursor)
+        return timeline.get_day_context(int(user_record["id"]), date_str)
 
     def _validate_slot_with_context(
         self,
@@ -928,6 +647,11 @@ class MasterScheduleService:
             return {
                 "is_available": False,
                 "reason": reason_map.get(source, "blocked"),
+                "conflict": {
+                    "source": source,
+                    "start": overlap["start"].strftime("%H:%M"),
+                    "end": overlap["end"].strftime("%H:%M"),
+                },
             }
 
         return {"is_available": True, "reason": "available"}
@@ -937,14 +661,19 @@ class MasterScheduleService:
         master_name: str,
         date: str,
         time_str: str,
-        duration_minutes: int = 60,
+        duration_minutes: DurationSpec = 60,
+        cursor=None,
     ) -> Dict[str, Any]:
-        user_record = self._get_user_record(master_name)
+        """
+        Проверить слот мастера. С `cursor` занятость читается в транзакции
+        вызывающего (см. services.booking_hold.reserve_slot).
+        """
+        user_record = self._get_user_record(master_name, cursor=cursor)
         if not user_record:
             return {"is_available": False, "reason": "master_not_found"}
 
-        context = self._build_day_context(user_record, date)
-        result = self._validate_slot_with_context(context, time_str, duration_minutes)
+        context = self._build_day_context(user_record, date, cursor=cursor)
+        result = self._validate_slot_with_context(context, time_str, self._total_duration_minutes(duration_minutes))
         result["master"] = user_record.get("full_name") or master_name
         result["date"] = date
         result["time"] = time_str
@@ -955,63 +684,141 @@ class MasterScheduleService:
         result = self.validate_slot(master_name, date, time_str, duration_minutes=60)
         return bool(result.get("is_available"))
 
-    def _is_optimal_slot(self, context: Dict[str, Any], slot_start: datetime, slot_end: datetime) -> bool:
-        if slot_start == context["work_start"] or slot_end == context["work_end"]:
-            return True
+    def _total_duration_minutes(self, duration_minutes: DurationSpec) -> int:
+        """Длительность слота: число минут или список длительностей услуг подряд."""
+        if isinstance(duration_minutes, (list, tuple)):
+            total = sum(self._safe_duration_minutes(item, fallback=60) for item in duration_minutes)
+            return max(1, total)
+        return max(1, int(duration_minutes))
+
+    def _resolve_slot_step(self, slot_step_minutes: Optional[int]) -> int:
+        if slot_step_minutes is None:
+            return DEFAULT_SLOT_STEP_MINUTES
+        return max(1, int(slot_step_minutes))
+
+    def _get_free_intervals(self, context: Dict[str, Any]) -> List[Tuple[datetime, datetime]]:
+        """
+        Свободные окна дня: рабочее время минус занятые интервалы (один проход
+        по отсортированному blocked_intervals). Результат кэшируется в контексте.
+        """
+        cached = context.get("free_intervals")
+        if cached is not None:
+            return cached
 
-        slot_start_key = self._minute_key(slot_start)
-        slot_end_key = self._minute_key(slot_end)
+        work_start = context["work_start"]
+        work_end = context["work_end"]
+        cursor_dt = work_start
+        now = context["now"]
+        if context["date_obj"] == now.date():
+            cursor_dt = max(cursor_dt, now + timedelta(minutes=MIN_LEAD_MINUTES))
 
+        free_intervals: List[Tuple[datetime, datetime]] = []
         for interval in context["blocked_intervals"]:
-            start_key = self._minute_key(interval["start"])
-            end_key = self._minute_key(interval["end"])
-            if slot_start_key == end_key or slot_end_key == start_key:
-                return True
+            if cursor_dt >= work_end:
+                break
+            start_dt = interval["start"]
+            end_dt = interval["end"]
+            if start_dt >= work_end:
+                break
+            if end_dt <= cursor_dt:
+                continue
+            if start_dt > cursor_dt:
+                free_intervals.append((cursor_dt, start_dt))
+            cursor_dt = end_dt
 
-        return False
+        if cursor_dt < work_end:
+            free_intervals.append((cursor_dt, work_end))
 
-    def _get_available_slots_for_user(
+        context["free_intervals"] = free_intervals
+        return free_intervals
+
+    def _get_boundary_keys(self, context: Dict[str, Any]) -> Tuple[set, set]:
+        cached = context.get("boundary_keys")
+        if cached is not None:
+            return cached
+
+        start_keys = {self._minute_key(interval["start"]) for interval in context["blocked_intervals"]}
+        end_keys = {self._minute_key(interval["end"]) for interval in context["blocked_intervals"]}
+        context["boundary_keys"] = (start_keys, end_keys)
+        return start_keys, end_keys
+
+    def _is_optimal_slot(self, context: Dict[str, Any], slot_start: datetime, slot_end: datetime) -> bool:
+        """Слот примыкает к границе рабочего дня или к занятому интервалу (без "дырок")."""
+        if slot_start == context["work_start"] or slot_end == context["work_end"]:
+            return True
+
+        start_keys, end_keys = self._get_boundary_keys(context)
+        return self._minute_key(slot_start) in end_keys or self._minute_key(slot_end) in start_keys
+
+    def _generate_slots(
         self,
-        user_record: Dict[str, Any],
-        date: str,
-        duration_minutes: int = 60,
+        context: Optional[Dict[str, Any]],
+        duration_minutes: DurationSpec = 60,
         return_metadata: bool = False,
+        limit: Optional[int] = None,
+        slot_step_minutes: Optional[int] = None,
     ) -> List[Any]:
-        context = self._build_day_context(user_record, date)
+        """
+        Слоты дня из свободных окон: старты идут по сетке от начала рабочего дня
+        с шагом slot_step_minutes, слот помещается в окно целиком.
+        """
         if not context or not context.get("is_working"):
             return []
 
-        duration = max(1, int(duration_minutes))
-        current_dt = context["work_start"]
-        end_working_dt = context["work_end"]
+        duration_delta = timedelta(minutes=self._total_duration_minutes(duration_minutes))
+        step_delta = timedelta(minutes=self._resolve_slot_step(slot_step_minutes))
+        work_start = context["work_start"]
 
         slots: List[Any] = []
-        while current_dt + timedelta(minutes=duration) <= end_working_dt:
-            slot_end = current_dt + timedelta(minutes=duration)
-            validation = self._validate_slot_with_context(context, current_dt.strftime("%H:%M"), duration)
-            if validation.get("is_available"):
-                time_str = current_dt.strftime("%H:%M")
+        for gap_start, gap_end in self._get_free_intervals(context):
+            if gap_end - gap_start < duration_delta:
+                continue
+
+            # Первая точка сетки, не раньше начала окна
+            steps = -((work_start - gap_start) // step_delta)
+            slot_start = work_start + steps * step_delta
+            while slot_start + duration_delta <= gap_end:
+                time_str = slot_start.strftime("%H:%M")
                 if return_metadata:
                     slots.append({
                         "time": time_str,
-                        "is_optimal": self._is_optimal_slot(context, current_dt, slot_end),
+                        "is_optimal": self._is_optimal_slot(context, slot_start, slot_start + duration_delta),
                     })
                 else:
                     slots.append(time_str)
-
-            current_dt += timedelta(minutes=30)
+                if limit is not None and len(slots) >= limit:
+                    return slots
+                slot_start += step_delta
 
         return slots
 
+    def _get_available_slots_for_user(
+        self,
+        user_record: Dict[str, Any],
+        date: str,
+        duration_minutes: DurationSpec = 60,
+        return_metadata: bool = False,
+        slot_step_minutes: Optional[int] = None,
+    ) -> List[Any]:
+        context = self._build_day_context(user_record, date)
+        return self._generate_slots(
+            context,
+            duration_minutes,
+            return_metadata=return_metadata,
+            slot_step_minutes=slot_step_minutes,
+        )
+
     def get_available_slots(
         self,
         master_name: str,
         date: str,
-        duration_minutes: int = 60,
-        return_metadata: bool = False
+        duration_minutes: DurationSpec = 60,
+        return_metadata: bool = False,
+        slot_step_minutes: Optional[int] = None,
     ) -> List[Any]:
         """
-        Получить все доступные слоты на день
+        Получить все доступные слоты на день.
+        duration_minutes — минуты или список длительностей услуг, выполняемых подряд.
         """
         user_record = self._get_user_record(master_name)
         if not user_record:
@@ -1021,144 +828,123 @@ class MasterScheduleService:
             date=date,
             duration_minutes=duration_minutes,
             return_metadata=return_metadata,
+            slot_step_minutes=slot_step_minutes,
         )
 
-    def get_all_masters_availability(self, date: str, duration_minutes: int = 60, return_metadata: bool = False) -> Dict[str, List[Any]]:
-        """Получить доступность всех мастеров на день"""
+    def get_master_records(self, user_ids: List[int]) -> List[Dict[str, Any]]:
+        """Записи мастеров по списку id одним запросом (для AvailabilityTimeline)."""
+        normalized_ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+        if not normalized_ids:
+            return []
+
         conn = get_db_connection()
-        c = conn.cursor()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                SELECT id, full_name, username, nickname
+                FROM users
+                WHERE id = ANY(%s)
+                  AND is_service_provider = TRUE
+                  AND deleted_at IS NULL
+                ORDER BY id ASC
+                """,
+                (normalized_ids,),
+            )
+            return [
+                {"id": row[0], "full_name": row[1], "username": row[2], "nickname": row[3]}
+                for row in cursor.fetchall()
+            ]
+        finally:
+            conn.close()
 
+    def get_bookable_masters(self) -> List[Dict[str, Any]]:
+        """
+        Мастера для бронирования:
+        - is_service_provider = TRUE, is_active = TRUE
+        - role='employee' ИЛИ secondary_role='employee' (если колонка существует)
+        """
+        conn = get_db_connection()
+        cursor = conn.cursor()
         try:
-            # Получаем мастеров для бронирования:
-            # - is_service_provider = TRUE
-            # - role='employee' ИЛИ secondary_role='employee' (если колонка существует)
-            # Check if secondary_role column exists
-            c.execute("""
-                SELECT COUNT(*) FROM information_schema.columns
-                WHERE table_name = 'users' AND column_name = 'secondary_role'
-            """)
-            has_secondary_role = c.fetchone()[0] > 0
+            has_secondary_role = column_exists("users", "secondary_role", cursor)
 
-            if has_secondary_role:
-                c.execute("""
-                    SELECT DISTINCT u.full_name
-                    FROM users u
-                    WHERE u.is_active = TRUE
-                      AND u.is_service_provider = TRUE
-                      AND (u.role = 'employee' OR u.secondary_role = 'employee')
-                """)
-            else:
-                c.execute("""
-                    SELECT DISTINCT u.full_name
-                    FROM users u
-                    WHERE u.is_active = TRUE
-                      AND u.is_service_provider = TRUE
-                      AND u.role = 'employee'
-                """)
-
-            active_masters = [row[0] for row in c.fetchall()]
-            
-            # Для каждого активного мастера получаем слоты
-            availability = {}
-            for master_name in active_masters:
-                slots = self.get_available_slots(master_name, date, duration_minutes=duration_minutes, return_metadata=return_metadata)
-                if slots:
-                    availability[master_name] = slots
-            return availability
+            role_condition = "(role = 'employee' OR secondary_role = 'employee')" if has_secondary_role else "role = 'employee'"
+            cursor.execute(
+                f"""
+                SELECT id, full_name, username, nickname
+                FROM users
+                WHERE is_service_provider = TRUE
+                  AND is_active = TRUE
+                  AND {role_condition}
+                ORDER BY id ASC
+                """
+            )
+            return [
+                {"id": row[0], "full_name": row[1], "username": row[2], "nickname": row[3]}
+                for row in cursor.fetchall()
+            ]
+        finally:
+            conn.close()
 
+    def get_all_masters_availability(
+        self,
+        date: str,
+        duration_minutes: DurationSpec = 60,
+        return_metadata: bool = False,
+        slot_step_minutes: Optional[int] = None,
+    ) -> Dict[str, List[Any]]:
+        """Получить доступность всех мастеров на день"""
+        try:
+            date_obj = datetime.strptime(date, "%Y-%m-%d").date()
+            masters = self.get_bookable_masters()
+            if not masters:
+                return {}
+
+            timeline = self.load_availability(masters, date_obj, date_obj)
+            return timeline.get_masters_availability(
+                date,
+                duration_minutes,
+                return_metadata=return_metadata,
+                slot_step_minutes=slot_step_minutes,
+            )
         except Exception as e:
             log_error(f"Error getting all masters availability: {e}", "schedule")
             return {}
-        finally:
-            conn.close()
 
     def get_available_dates(
         self,
         master_name: Optional[str],
         year: int,
         month: int,
-        duration_minutes: int = 60
+        duration_minutes: DurationSpec = 60,
+        master_records: Optional[List[Dict[str, Any]]] = None,
+        slot_step_minutes: Optional[int] = None,
     ) -> List[str]:
         """
         Получить список дат с доступными слотами в указанном месяце.
-        SSOT: использует get_available_slots как единый источник вычисления.
+        Весь месяц загружается одним AvailabilityTimeline; слоты считаются
+        тем же `_generate_slots`, что и для одного дня (SSOT).
         """
         import calendar
-        available_dates: List[str] = []
-
-        num_days = calendar.monthrange(year, month)[1]
-        today = get_current_time().date()
-        duration = max(1, int(duration_minutes))
 
-        masters_to_check: List[Dict[str, Any]] = []
-        if master_name and str(master_name).strip().lower() not in {"any", "global"}:
+        if master_records is not None:
+            masters_to_check = list(master_records)
+        elif master_name and str(master_name).strip().lower() not in {"any", "global"}:
             master_record = self._get_user_record(master_name)
-            if master_record:
-                masters_to_check = [master_record]
+            masters_to_check = [master_record] if master_record else []
         else:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            try:
-                cursor.execute(
-                    """
-                    SELECT COUNT(*)
-                    FROM information_schema.columns
-                    WHERE table_name = 'users' AND column_name = 'secondary_role'
-                    """
-                )
-                has_secondary_role = cursor.fetchone()[0] > 0
-
-                if has_secondary_role:
-                    cursor.execute(
-                        """
-                        SELECT id, full_name, username
-                        FROM users
-                        WHERE is_service_provider = TRUE
-                          AND is_active = TRUE
-                          AND (role = 'employee' OR secondary_role = 'employee')
-                        """
-                    )
-                else:
-                    cursor.execute(
-                        """
-                        SELECT id, full_name, username
-                        FROM users
-                        WHERE is_service_provider = TRUE
-                          AND is_active = TRUE
-                          AND role = 'employee'
-                        """
-                    )
-
-                masters_to_check = [
-                    {"id": row[0], "full_name": row[1], "username": row[2]}
-                    for row in cursor.fetchall()
-                ]
-            finally:
-                conn.close()
+            masters_to_check = self.get_bookable_masters()
 
         if not masters_to_check:
             return []
 
-        for day in range(1, num_days + 1):
-            date_obj = datetime(year, month, day).date()
-            if date_obj < today:
-                continue
-
-            date_str = date_obj.strftime("%Y-%m-%d")
-            day_has_availability = False
-
-            for master_record in masters_to_check:
-                slots = self._get_available_slots_for_user(
-                    user_record=master_record,
-                    date=date_str,
-                    duration_minutes=duration,
-                    return_metadata=False,
-                )
-                if slots:
-                    day_has_availability = True
-                    break
-
-            if day_has_availability:
-                available_dates.append(date_str)
+        num_days = calendar.monthrange(year, month)[1]
+        month_start = dt_date(year, month, 1)
+        month_end = dt_date(year, month, num_days)
+        today = get_current_time().date()
+        if month_end < today:
+            return []
 
-        return available_dates
+        timeline = self.load_availability(masters_to_check, max(month_start, today), month_end)
+        return timeline.get_available_dates(duration_minutes, slot_step_minutes=slot_step_minutes)
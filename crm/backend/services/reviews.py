@@ -1,5 +1,5 @@
 import logging
-import httpx
+from utils.http_clients import get_http_client
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 
@@ -80,11 +80,11 @@ class GoogleReviewsService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(url, params=params, timeout=10.0)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return "".join([x[0] for x in data[0]])
+            client = get_http_client(url)
+            resp = await client.get(url, params=params, timeout=10.0)
+            if resp.status_code == 200:
+                data = resp.json()
+                return "".join([x[0] for x in data[0]])
         except Exception as e:
             logger.error(f"Translation error: {e}")
             
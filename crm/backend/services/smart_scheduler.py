@@ -23,6 +23,28 @@ class SmartScheduler:
         self.schedule_service = MasterScheduleService()
         self.DEFAULT_BUFFER_HOURS = 3  # Minimum hours advance for 'today'
         self.SEARCH_WINDOW_DAYS = 2    # Look ahead/behind X days
+        self._timeline = None
+
+    def _resolve_target_date(self, target_date_str: Optional[str]):
+        now = get_current_time()
+        if not target_date_str:
+            return now.date()
+        try:
+            return datetime.strptime(target_date_str, "%Y-%m-%d").date()
+        except ValueError:
+            return now.date()
+
+    def preload(self, master_ids: List[int], target_date_str: Optional[str] = None) -> None:
+        """
+        Load the whole suggestion window (previous/target/next day) for several
+        masters at once, so subsequent get_smart_suggestions calls are served
+        from memory instead of per-master, per-day queries.
+        """
+        target_date = self._resolve_target_date(target_date_str)
+        start_date = max(target_date - timedelta(days=1), get_current_time().date())
+        end_date = target_date + timedelta(days=1)
+        records = self.schedule_service.get_master_records(master_ids)
+        self._timeline = self.schedule_service.load_availability(records, start_date, end_date)
 
     def get_smart_suggestions(
         self, 
@@ -47,13 +69,7 @@ class SmartScheduler:
         now = get_current_time()
         
         # 1. Determine Target Date
-        if not target_date_str:
-            target_date = now.date()
-        else:
-            try:
-                target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
-            except ValueError:
-                target_date = now.date()
+        target_date = self._resolve_target_date(target_date_str)
         
         # 2. Check Primary Date Availability
         primary_slots, status = self._get_filtered_slots(master_name, target_date, duration_minutes)
@@ -69,7 +85,7 @@ class SmartScheduler:
         if len(primary_slots) < 3:
             # Check Next Day
             next_day = target_date + timedelta(days=1)
-            next_slots = self._get_filtered_slots(master_name, next_day, duration_minutes)
+            next_slots, _ = self._get_filtered_slots(master_name, next_day, duration_minutes)
             if next_slots:
                 result["alternatives"].append({
                     "date": next_day.strftime("%Y-%m-%d"),
@@ -93,20 +109,27 @@ class SmartScheduler:
         date_str = date_obj.strftime("%Y-%m-%d")
 
         # SSOT: существование/график/выходные/праздники/брони валидируются в MasterScheduleService
-        user_record = self.schedule_service._get_user_record(master_name)
+        timeline = self._timeline if self._timeline and self._timeline.covers(date_obj) else None
+        user_record = timeline.find_master(master_name) if timeline else None
+        if not user_record:
+            timeline = None
+            user_record = self.schedule_service._get_user_record(master_name)
         if not user_record:
             logger.error(f"Master '{master_name}' not found")
             return [], "not_found"
 
         master_identifier = str(user_record.get("id") or master_name)
 
-        # 1. Get Raw Slots from SSOT schedule service
+        # 1. Get Raw Slots from SSOT schedule service (preloaded timeline when available)
         try:
-            raw_slots = self.schedule_service.get_available_slots(
-                master_name=master_identifier,
-                date=date_str,
-                duration_minutes=duration_minutes 
-            )
+            if timeline:
+                raw_slots = timeline.get_slots(int(user_record["id"]), date_str, duration_minutes)
+            else:
+                raw_slots = self.schedule_service.get_available_slots(
+                    master_name=master_identifier,
+                    date=date_str,
+                    duration_minutes=duration_minutes 
+                )
         except Exception as e:
             logger.error(f"Error in get_available_slots for {master_name}: {e}", exc_info=True)
             return [], "error"
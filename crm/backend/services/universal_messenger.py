@@ -7,46 +7,25 @@ import asyncio
 import json
 import os
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List, Literal, Set
+from typing import Optional, Dict, Any, List, Literal
 
 from db.companies import QuotaExceededError, ensure_company_quota
 from utils.logger import log_info, log_error, log_warning
 from db.connection import get_db_connection
+from db.schema_catalog import column_exists
 from utils.datetime_utils import get_current_time
 from utils.tenant_context import get_current_company_id
 
 Platform = Literal['instagram', 'telegram', 'whatsapp', 'email', 'in_app', 'auto']
-_clients_columns_cache: Optional[Set[str]] = None
 
 
-def _load_clients_columns() -> Set[str]:
-    """Кэшированная загрузка колонок таблицы clients для безопасных запросов."""
-    global _clients_columns_cache
-    if _clients_columns_cache is not None:
-        return _clients_columns_cache
-
-    conn = get_db_connection()
-    c = conn.cursor()
+def _has_clients_column(column_name: str) -> bool:
+    """Проверка колонки clients по кэшу схемы (db/schema_catalog.py)."""
     try:
-        c.execute(
-            """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = 'clients'
-            """
-        )
-        _clients_columns_cache = {row[0] for row in c.fetchall()}
+        return column_exists("clients", column_name)
     except Exception as e:
         log_warning(f"Failed to inspect clients columns: {e}", "messenger")
-        _clients_columns_cache = set()
-    finally:
-        conn.close()
-
-    return _clients_columns_cache
-
-
-def _has_clients_column(column_name: str) -> bool:
-    return column_name in _load_clients_columns()
+        return False
 
 
 def _is_valid_instagram_recipient_id(recipient_id: str) -> bool:
@@ -232,9 +211,9 @@ async def send_universal_message(
                 success = False
             
         elif platform == 'email':
-            from utils.email_service import send_email
+            from utils.email_service import send_email_async
             unsubscribe_link = context.get("unsubscribe_link") if context else None
-            success = send_email(
+            success = await send_email_async(
                 recipient_id, 
                 final_subject or "Notification", 
                 final_text,
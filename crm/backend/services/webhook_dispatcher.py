@@ -0,0 +1,553 @@
+"""
+Доставка исходящих вебхуков через outbox.
+
+Событие пишется в webhook_outbox (по строке на подписанный вебхук) той же
+транзакцией, что и бизнес-изменение: `enqueue_webhook_event(cursor, ...)`
+перед `conn.commit()` вызывающего. Откат транзакции — нет события, commit —
+событие будет доставлено, даже если воркер упадёт сразу после него.
+
+Диспетчер в каждом воркере забирает пачку готовых строк через
+FOR UPDATE SKIP LOCKED с арендой (locked_until), рассылает их параллельно
+(не больше WEBHOOK_CONCURRENCY запросов) через общие keep-alive клиенты и
+одной транзакцией сохраняет итог: многострочный INSERT в webhook_logs,
+статусы outbox и счётчики webhooks.
+
+Ошибка сети, 408/429/5xx — повтор с экспоненциальной задержкой и джиттером,
+после WEBHOOK_MAX_ATTEMPTS строка помечается dead; прочие 4xx — сразу dead.
+Вебхук, набравший WEBHOOK_DISABLE_AFTER_FAILURES неудач подряд (fail_count),
+выключается, его ожидающие события помечаются skipped.
+
+Доставка at-least-once: получатель может дедуплицировать по X-CRM-Delivery.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import socket
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from db.connection import get_db_connection
+from utils.blocking import run_blocking
+from utils.http_clients import get_http_client
+from utils.logger import log_error, log_info, log_warning
+from utils.tenant_context import get_current_company_id, platform_access
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+WEBHOOK_CONCURRENCY = max(1, _read_int_env("WEBHOOK_CONCURRENCY", 16))
+WEBHOOK_BATCH_SIZE = max(1, _read_int_env("WEBHOOK_BATCH_SIZE", 50))
+WEBHOOK_TIMEOUT_SECONDS = max(1, _read_int_env("WEBHOOK_TIMEOUT_SECONDS", 10))
+WEBHOOK_LEASE_SECONDS = max(30, _read_int_env("WEBHOOK_LEASE_SECONDS", 120))
+WEBHOOK_POLL_SECONDS = max(1, _read_int_env("WEBHOOK_POLL_SECONDS", 2))
+WEBHOOK_MAX_ATTEMPTS = max(1, _read_int_env("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_BACKOFF_BASE_SECONDS = max(1, _read_int_env("WEBHOOK_BACKOFF_BASE_SECONDS", 10))
+WEBHOOK_BACKOFF_MAX_SECONDS = max(1, _read_int_env("WEBHOOK_BACKOFF_MAX_SECONDS", 3600))
+WEBHOOK_DISABLE_AFTER_FAILURES = max(1, _read_int_env("WEBHOOK_DISABLE_AFTER_FAILURES", 50))
+WEBHOOK_RETENTION_DAYS = max(1, _read_int_env("WEBHOOK_RETENTION_DAYS", 7))
+
+_RETRYABLE_STATUS_CODES = {408, 425, 429}
+_RESPONSE_LOG_LIMIT = 500
+_CLEANUP_INTERVAL_SECONDS = 3600
+
+
+# ===== OUTBOX =====
+
+def build_webhook_payload(event: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"event": event, "timestamp": datetime.now().isoformat(), "data": data}
+
+
+def enqueue_webhook_event(cursor, event: str, data: Dict[str, Any], company_id: Optional[int] = None) -> int:
+    """
+    Поставить событие в outbox для всех активных вебхуков компании, подписанных
+    на event. Выполняется курсором вызывающего, до его commit. Возвращает число строк.
+
+    Ошибка outbox откатывается до savepoint'а и не ломает бизнес-транзакцию.
+    """
+    company_id = company_id or get_current_company_id()
+    if not company_id:
+        return 0
+    payload = json.dumps(build_webhook_payload(event, data), ensure_ascii=False, default=str)
+    try:
+        cursor.execute("SAVEPOINT webhook_outbox")
+        cursor.execute("""
+            INSERT INTO webhook_outbox (company_id, webhook_id, event, payload)
+            SELECT company_id, id, %s, %s::jsonb
+            FROM webhooks
+            WHERE company_id = %s AND is_active = TRUE AND %s = ANY(events)
+        """, (event, payload, company_id, event))
+        queued = cursor.rowcount or 0
+        cursor.execute("RELEASE SAVEPOINT webhook_outbox")
+        return queued
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT webhook_outbox")
+        log_error(f"Webhook outbox enqueue failed for {event}: {e}", "webhooks")
+        return 0
+
+
+def publish_webhook_event(company_id: int, event: str, data: Dict[str, Any]) -> int:
+    """Событие вне бизнес-транзакции: отдельное соединение и commit."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        queued = enqueue_webhook_event(c, event, data, company_id=company_id)
+        conn.commit()
+    finally:
+        conn.close()
+    if queued:
+        webhook_dispatcher.wake()
+    return queued
+
+
+def claim_webhook_deliveries(worker_id: str, limit: int = WEBHOOK_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """
+    Взять готовые к отправке строки: pending с наступившим next_attempt_at
+    и delivering с протухшей арендой (воркер упал посреди пачки).
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            WITH due AS (
+                SELECT id FROM webhook_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                   OR (status = 'delivering' AND locked_until < NOW())
+                ORDER BY next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE webhook_outbox o
+            SET status = 'delivering',
+                locked_by = %s,
+                locked_until = NOW() + %s * INTERVAL '1 second',
+                attempts = o.attempts + 1
+            FROM due, webhooks w
+            WHERE o.id = due.id AND w.id = o.webhook_id
+            RETURNING o.id, o.webhook_id, o.company_id, o.event, o.payload, o.attempts,
+                      EXTRACT(EPOCH FROM NOW() - o.created_at), w.url, w.secret, w.is_active
+        """, (limit, worker_id, WEBHOOK_LEASE_SECONDS))
+        rows = c.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    claimed_at = time.monotonic()
+    return [
+        {
+            "id": row[0],
+            "webhook_id": row[1],
+            "company_id": row[2],
+            "event": row[3],
+            "payload": row[4] if isinstance(row[4], dict) else json.loads(row[4] or "{}"),
+            "attempts": row[5],
+            # Возраст события на момент захвата — для сквозной задержки доставки
+            "age_seconds": float(row[6] or 0),
+            "claimed_at": claimed_at,
+            "url": row[7],
+            "secret": row[8],
+            "is_active": bool(row[9]),
+        }
+        for row in sorted(rows, key=lambda item: item[0])
+    ]
+
+
+# ===== ПОЛИТИКА ПОВТОРОВ =====
+
+def is_retryable_status(status_code: int) -> bool:
+    """0 — сетевая ошибка/таймаут; 5xx и 408/425/429 — временные отказы получателя."""
+    return status_code == 0 or status_code >= 500 or status_code in _RETRYABLE_STATUS_CODES
+
+
+def backoff_seconds(attempts: int, retry_after: Optional[float] = None) -> float:
+    """base·2^(n-1), не больше потолка, с джиттером ±25%; Retry-After получателя — нижняя граница."""
+    delay = min(WEBHOOK_BACKOFF_MAX_SECONDS, WEBHOOK_BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    delay *= random.uniform(0.75, 1.25)
+    if retry_after:
+        delay = max(delay, min(float(retry_after), WEBHOOK_BACKOFF_MAX_SECONDS))
+    return round(delay, 3)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def resolve_outcome(delivery: Dict[str, Any], status_code: int, retry_after: Optional[float] = None) -> Dict[str, Any]:
+    """Итоговый статус строки outbox после попытки."""
+    if 200 <= status_code < 300:
+        return {"status": "delivered", "delay": None}
+    if is_retryable_status(status_code) and delivery["attempts"] < WEBHOOK_MAX_ATTEMPTS:
+        return {"status": "pending", "delay": backoff_seconds(delivery["attempts"], retry_after)}
+    return {"status": "dead", "delay": None}
+
+
+def sign_payload(secret: str, body: str) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+
+
+# ===== МЕТРИКИ =====
+
+class DispatcherMetrics:
+    """Счётчики и задержки диспетчера в пределах воркера."""
+
+    def __init__(self, window: int = 1024):
+        self.attempts = 0
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self.skipped = 0
+        self.disabled_webhooks = 0
+        self.batches = 0
+        self._request_ms = deque(maxlen=window)
+        self._lag_ms = deque(maxlen=window)
+
+    def record_attempt(self, duration_ms: int) -> None:
+        self.attempts += 1
+        self._request_ms.append(duration_ms)
+
+    def record_outcome(self, status: str, lag_ms: Optional[float] = None) -> None:
+        if status == "delivered":
+            self.delivered += 1
+            if lag_ms is not None:
+                self._lag_ms.append(lag_ms)
+        elif status == "pending":
+            self.retried += 1
+        elif status == "dead":
+            self.dead += 1
+        elif status == "skipped":
+            self.skipped += 1
+
+    @staticmethod
+    def _summary(values: Iterable[float]) -> Dict[str, float]:
+        ordered = sorted(values)
+        if not ordered:
+            return {"count": 0, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": len(ordered),
+            "avg": round(sum(ordered) / len(ordered), 2),
+            "p50": round(ordered[len(ordered) // 2], 2),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            "max": round(ordered[-1], 2),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+            "skipped": self.skipped,
+            "disabled_webhooks": self.disabled_webhooks,
+            "batches": self.batches,
+            # Время HTTP-запроса к получателю
+            "request_ms": self._summary(self._request_ms),
+            # От записи в outbox до успешной доставки (включая повторы)
+            "end_to_end_ms": self._summary(self._lag_ms),
+        }
+
+
+# ===== СОХРАНЕНИЕ РЕЗУЛЬТАТОВ =====
+
+def _values_sql(row_template: str, count: int) -> str:
+    return ", ".join([row_template] * count)
+
+
+def webhook_counter_updates(results: Sequence[Dict[str, Any]]) -> List[tuple]:
+    """
+    Итог пачки по вебхукам: (webhook_id, последний код, сбросить fail_count, неудач).
+    Успех обнуляет серию, поэтому считаются только неудачи после последнего успеха.
+    """
+    summary: Dict[int, Dict[str, Any]] = {}
+    for result in results:
+        if result["status"] == "skipped":
+            continue
+        entry = summary.setdefault(result["webhook_id"], {"code": None, "reset": False, "failures": 0})
+        entry["code"] = result["status_code"]
+        if result["status"] == "delivered":
+            entry["reset"] = True
+            entry["failures"] = 0
+        else:
+            entry["failures"] += 1
+    return [(webhook_id, item["code"], item["reset"], item["failures"]) for webhook_id, item in summary.items()]
+
+
+def save_delivery_results(worker_id: str, results: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Одна транзакция на пачку: журнал, статусы outbox, счётчики вебхуков и
+    выключение вебхуков с длинной серией неудач. Возвращает выключенные вебхуки.
+    """
+    if not results:
+        return []
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        attempted = [result for result in results if result["status"] != "skipped"]
+        if attempted:
+            params: List[Any] = []
+            for result in attempted:
+                params.extend([
+                    result["webhook_id"], result["event"],
+                    json.dumps(result["payload"], ensure_ascii=False, default=str),
+                    result["status_code"], result["response"], result["duration_ms"],
+                ])
+            c.execute(f"""
+                INSERT INTO webhook_logs (webhook_id, event, payload, status_code, response, duration_ms)
+                VALUES {_values_sql("(%s, %s, %s::jsonb, %s, %s, %s)", len(attempted))}
+            """, params)
+
+        params = []
+        for result in results:
+            params.extend([result["id"], result["status"], result["delay"], result["status_code"], result.get("error")])
+        c.execute(f"""
+            UPDATE webhook_outbox o
+            SET status = v.status,
+                next_attempt_at = CASE WHEN v.delay IS NULL THEN o.next_attempt_at
+                                       ELSE NOW() + v.delay * INTERVAL '1 second' END,
+                delivered_at = CASE WHEN v.status = 'delivered' THEN NOW() ELSE o.delivered_at END,
+                last_status_code = v.status_code,
+                last_error = v.error,
+                locked_by = NULL,
+                locked_until = NULL
+            FROM (VALUES {_values_sql("(%s::BIGINT, %s::TEXT, %s::DOUBLE PRECISION, %s::INTEGER, %s::TEXT)", len(results))})
+                AS v(id, status, delay, status_code, error)
+            WHERE o.id = v.id AND o.locked_by = %s
+        """, params + [worker_id])
+
+        counters = webhook_counter_updates(results)
+        disabled: List[Dict[str, Any]] = []
+        if counters:
+            params = [value for row in counters for value in row]
+            c.execute(f"""
+                UPDATE webhooks w
+                SET last_triggered_at = NOW(),
+                    last_status_code = v.status_code,
+                    fail_count = CASE WHEN v.reset THEN v.failures
+                                      ELSE COALESCE(w.fail_count, 0) + v.failures END
+                FROM (VALUES {_values_sql("(%s::INTEGER, %s::INTEGER, %s::BOOLEAN, %s::INTEGER)", len(counters))})
+                    AS v(id, status_code, reset, failures)
+                WHERE w.id = v.id
+            """, params)
+
+            c.execute("""
+                UPDATE webhooks SET is_active = FALSE
+                WHERE id = ANY(%s) AND is_active = TRUE AND fail_count >= %s
+                RETURNING id, company_id, name, url, fail_count
+            """, ([row[0] for row in counters], WEBHOOK_DISABLE_AFTER_FAILURES))
+            disabled = [
+                {"id": row[0], "company_id": row[1], "name": row[2], "url": row[3], "fail_count": row[4]}
+                for row in c.fetchall()
+            ]
+            if disabled:
+                c.execute("""
+                    UPDATE webhook_outbox SET status = 'skipped', last_error = 'webhook disabled'
+                    WHERE webhook_id = ANY(%s) AND status = 'pending'
+                """, ([item["id"] for item in disabled],))
+        conn.commit()
+        return disabled
+    finally:
+        conn.close()
+
+
+def purge_webhook_outbox(days: int = WEBHOOK_RETENTION_DAYS) -> int:
+    """Удалить завершённые строки outbox старше days (журнал остаётся в webhook_logs)."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            DELETE FROM webhook_outbox
+            WHERE status IN ('delivered', 'dead', 'skipped')
+              AND created_at < NOW() - %s * INTERVAL '1 day'
+        """, (days,))
+        deleted = c.rowcount or 0
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+
+def get_outbox_stats() -> Dict[str, int]:
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT status, COUNT(*) FROM webhook_outbox GROUP BY status")
+        counts = {row[0]: row[1] for row in c.fetchall()}
+        c.execute("""
+            SELECT COALESCE(EXTRACT(EPOCH FROM NOW() - MIN(next_attempt_at)), 0)
+            FROM webhook_outbox WHERE status = 'pending' AND next_attempt_at <= NOW()
+        """)
+        counts["oldest_due_seconds"] = int(c.fetchone()[0] or 0)
+        return counts
+    finally:
+        conn.close()
+
+
+# ===== ДОСТАВКА =====
+
+async def deliver_webhook(delivery: Dict[str, Any], semaphore: asyncio.Semaphore,
+                          metrics: Optional[DispatcherMetrics] = None) -> Dict[str, Any]:
+    """Одна попытка доставки; возвращает результат для save_delivery_results."""
+    result = {
+        "id": delivery["id"],
+        "webhook_id": delivery["webhook_id"],
+        "event": delivery["event"],
+        "payload": delivery["payload"],
+        "status_code": None,
+        "response": None,
+        "duration_ms": 0,
+        "error": None,
+    }
+    if not delivery["is_active"]:
+        result.update(status="skipped", delay=None, error="webhook disabled")
+        return result
+
+    body = json.dumps(delivery["payload"], ensure_ascii=False, default=str)
+    headers = {
+        "Content-Type": "application/json",
+        "X-CRM-Event": delivery["event"],
+        "X-CRM-Delivery": str(delivery["id"]),
+    }
+    if delivery.get("secret"):
+        headers["X-CRM-Signature"] = sign_payload(delivery["secret"], body)
+
+    retry_after = None
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            client = get_http_client(delivery["url"])
+            response = await client.post(
+                delivery["url"], content=body.encode("utf-8"), headers=headers, timeout=WEBHOOK_TIMEOUT_SECONDS
+            )
+            status_code = response.status_code
+            response_text = response.text[:_RESPONSE_LOG_LIMIT]
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+        except Exception as e:
+            status_code = 0
+            response_text = f"{type(e).__name__}: {e}"[:_RESPONSE_LOG_LIMIT]
+        duration_ms = int((time.perf_counter() - started) * 1000)
+
+    result.update(status_code=status_code, response=response_text, duration_ms=duration_ms)
+    result.update(resolve_outcome(delivery, status_code, retry_after))
+    if result["status"] != "delivered":
+        result["error"] = response_text if status_code == 0 else f"HTTP {status_code}"
+    if metrics is not None:
+        metrics.record_attempt(duration_ms)
+        lag_ms = None
+        if result["status"] == "delivered":
+            lag_ms = (delivery["age_seconds"] + time.monotonic() - delivery["claimed_at"]) * 1000
+        metrics.record_outcome(result["status"], lag_ms)
+    return result
+
+
+class WebhookDispatcher:
+    """Фоновый цикл воркера: пачки из webhook_outbox, параллельная доставка."""
+
+    def __init__(self, concurrency: int = WEBHOOK_CONCURRENCY):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.metrics = DispatcherMetrics()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_cleanup = 0.0
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        log_info(f"🪝 Webhook dispatcher started ({self.worker_id}, concurrency {self.concurrency})", "webhooks")
+
+    def wake(self) -> None:
+        """Разбудить цикл после commit'а с новыми событиями; можно звать из любого потока."""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is None or wakeup is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            wakeup.set()
+        else:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def dispatch_batch(self, deliveries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(deliver_webhook(item, semaphore, self.metrics) for item in deliveries))
+        for result in results:
+            if result["status"] == "skipped":
+                self.metrics.record_outcome("skipped")
+        self.metrics.batches += 1
+        return list(results)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                with platform_access():
+                    deliveries = await run_blocking(claim_webhook_deliveries, self.worker_id)
+                if deliveries:
+                    results = await self.dispatch_batch(deliveries)
+                    with platform_access():
+                        disabled = await run_blocking(save_delivery_results, self.worker_id, results)
+                    for webhook in disabled:
+                        self.metrics.disabled_webhooks += 1
+                        log_warning(
+                            f"Webhook #{webhook['id']} ({webhook['url']}) disabled after "
+                            f"{webhook['fail_count']} consecutive failures",
+                            "webhooks",
+                        )
+                    continue
+                await self._maybe_cleanup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(f"Webhook dispatcher error: {e}", "webhooks")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=WEBHOOK_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _maybe_cleanup(self) -> None:
+        now = time.monotonic()
+        if now - self._last_cleanup < _CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_cleanup = now
+        with platform_access():
+            deleted = await run_blocking(purge_webhook_outbox)
+        if deleted:
+            log_info(f"🪝 Webhook outbox: purged {deleted} finished rows", "webhooks")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._task is not None and not self._task.done(),
+            "concurrency": self.concurrency,
+            **self.metrics.snapshot(),
+        }
+
+
+webhook_dispatcher = WebhookDispatcher()
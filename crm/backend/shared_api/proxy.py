@@ -1,7 +1,7 @@
 
 from fastapi import APIRouter, Query
 from fastapi.responses import Response
-import httpx
+from utils.http_clients import get_http_client
 from utils.logger import log_error, log_info
 
 router = APIRouter(tags=["Proxy"])
@@ -49,30 +49,30 @@ async def proxy_image(url: str = Query(...)):
             'Upgrade-Insecure-Requests': '1',
         }
         
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            
-            # Проверяем, что получили изображение, а не HTML
-            content_type = response.headers.get('content-type', '').lower()
-            if 'text/html' in content_type:
-                log_error(f"❌ Получен HTML вместо изображения: {content_type}", "proxy")
-                return Response(
-                    content=b'',
-                    status_code=404,
-                    media_type='image/png'
-                )
-            
-            log_info(f"✅ Изображение загружено: {len(response.content)} bytes, тип: {content_type}", "proxy")
-            
+        client = get_http_client(url)
+        response = await client.get(url, headers=headers, timeout=30.0, follow_redirects=True)
+        response.raise_for_status()
+
+        # Проверяем, что получили изображение, а не HTML
+        content_type = response.headers.get('content-type', '').lower()
+        if 'text/html' in content_type:
+            log_error(f"❌ Получен HTML вместо изображения: {content_type}", "proxy")
             return Response(
-                content=response.content,
-                media_type=response.headers.get('content-type', 'image/jpeg'),
-                headers={
-                    'Cache-Control': 'public, max-age=31536000',
-                    'Access-Control-Allow-Origin': '*'
-                }
+                content=b'',
+                status_code=404,
+                media_type='image/png'
             )
+
+        log_info(f"✅ Изображение загружено: {len(response.content)} bytes, тип: {content_type}", "proxy")
+
+        return Response(
+            content=response.content,
+            media_type=response.headers.get('content-type', 'image/jpeg'),
+            headers={
+                'Cache-Control': 'public, max-age=31536000',
+                'Access-Control-Allow-Origin': '*'
+            }
+        )
             
     except Exception as e:
         log_error(f"❌ Ошибка прокси: {e}", "proxy")
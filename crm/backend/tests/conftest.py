@@ -11,6 +11,114 @@ from datetime import datetime
 # Добавляем путь к backend
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+
+class FakeCursor:
+    """
+    Курсор без БД для unit-тестов.
+
+    Запросы (SQL со схлопнутыми пробелами, params) пишутся в `executed`;
+    общий список можно передать снаружи, чтобы собрать запросы нескольких
+    соединений. Результат fetchall/fetchone — строки первого правила
+    `(фрагмент SQL, rows)`, найденного в последнем запросе, иначе `rows`.
+    rows правила может быть функцией `(sql, params) -> rows`: так тест
+    моделирует состояние таблицы или бросает ошибку БД.
+    `on_execute()` вызывается после каждого execute.
+    """
+
+    def __init__(self, rows=None, rules=None, executed=None, on_execute=None, connection=None):
+        self.rows = list(rows or [])
+        self.rules = list(rules or [])
+        self.executed = executed if executed is not None else []
+        self.on_execute = on_execute
+        self.connection = connection
+        self._result = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.executed.append((sql, params))
+        rows = next((rows for fragment, rows in self.rules if fragment in sql), self.rows)
+        self._result = list(rows(sql, params) if callable(rows) else rows)
+        if self.on_execute:
+            self.on_execute()
+
+    def fetchall(self):
+        return list(self._result)
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Соединение для FakeCursor: отдаёт переданный курсор или новый с теми же настройками."""
+
+    def __init__(self, cursor=None, **cursor_kwargs):
+        self._cursor = cursor
+        self._cursor_kwargs = cursor_kwargs
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self, cursor_factory=None):
+        if self._cursor is not None:
+            return self._cursor
+        return FakeCursor(connection=self, **self._cursor_kwargs)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDatabase:
+    """
+    Подмена get_db_connection: `patch.object(module, "get_db_connection", db.connect)`.
+
+    Каждое соединение — FakeConnection; запросы всех соединений собираются
+    в общий `executed`. Аргументы — как у FakeCursor (или готовый cursor).
+    """
+
+    def __init__(self, cursor=None, **cursor_kwargs):
+        self._cursor = cursor
+        self.executed = cursor.executed if cursor is not None else cursor_kwargs.pop("executed", [])
+        self._cursor_kwargs = cursor_kwargs
+        self.connections = []
+
+    def connect(self):
+        if self._cursor is not None:
+            conn = FakeConnection(self._cursor)
+        else:
+            conn = FakeConnection(executed=self.executed, **self._cursor_kwargs)
+        self.connections.append(conn)
+        return conn
+
+    @property
+    def commits(self):
+        return sum(conn.commits for conn in self.connections)
+
+    @property
+    def rollbacks(self):
+        return sum(conn.rollbacks for conn in self.connections)
+
+
+@pytest.fixture
+def fake_cursor():
+    """Фабрика FakeCursor — для кода, которому курсор передаётся напрямую."""
+    return FakeCursor
+
+
+@pytest.fixture
+def fake_db():
+    """Фабрика FakeDatabase: `db = fake_db(rules=[...])`."""
+    return FakeDatabase
+
+
 @pytest.fixture(scope="function")
 def clean_database():
     """Очищает базу данных для каждого теста"""
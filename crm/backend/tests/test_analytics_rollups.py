@@ -0,0 +1,127 @@
+"""
+Тесты дневных роллапов аналитики (db/analytics_rollups.py)
+"""
+import sys
+import os
+from datetime import date
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db import analytics_rollups
+from db.analytics_rollups import as_day, booking_facts_sql, client_facts_sql
+
+
+def test_as_day_accepts_dashboard_formats():
+    assert as_day("2026-03-01 23:59:59") == date(2026, 3, 1)
+    assert as_day("2026-03-01T10:00:00+04:00") == date(2026, 3, 1)
+    assert as_day(date(2026, 3, 1)) == date(2026, 3, 1)
+    assert as_day(None) is None and as_day("") is None
+
+
+def test_facts_combine_rollups_with_queued_days():
+    sql, params = booking_facts_sql("visit", "2026-03-01 00:00:00", "2026-03-31 23:59:59")
+    normalized = " ".join(sql.split())
+    assert "FROM analytics_booking_rollups r" in normalized and "UNION ALL" in normalized
+    # Роллап — только дни вне очереди, сырые bookings — только дни из очереди
+    assert "NOT EXISTS (SELECT 1 FROM analytics_rollup_queue q WHERE q.day = r.day)" in normalized
+    assert "b.datetime::date IN (SELECT day FROM analytics_rollup_queue)" in normalized
+    assert params == ["visit", date(2026, 3, 1), date(2026, 3, 31), date(2026, 3, 1), date(2026, 4, 1)]
+    assert normalized.count("%s") == len(params)
+
+    sql, params = booking_facts_sql("created")
+    assert params == ["created"] and "b.created_at::date" in sql
+
+    sql, params = client_facts_sql("2026-03-01", "2026-03-07")
+    assert params == [date(2026, 3, 1), date(2026, 3, 7)] * 2
+    assert " ".join(sql.split()).count("%s") == len(params)
+
+    try:
+        booking_facts_sql("updated")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown basis must be rejected")
+
+
+def test_refresh_claims_one_day_per_transaction(fake_db):
+    queue = [date(2026, 3, 1), date(2026, 3, 2)]
+    db = fake_db(rules=[("DELETE FROM analytics_rollup_queue", lambda sql, params: [(queue.pop(0),)] if queue else [])])
+    executed = db.executed
+
+    with patch.object(analytics_rollups, "get_db_connection", db.connect):
+        assert analytics_rollups.refresh_analytics_rollups(max_days=10) == 2
+
+    # На каждый день: DELETE роллапа записей, INSERT по двум базисам, DELETE + INSERT клиентских
+    day_statements = [sql for sql, _ in executed if not sql.startswith("DELETE FROM analytics_rollup_queue")]
+    assert len(day_statements) == 2 * 5
+    inserts = [params for sql, params in executed if sql.startswith("INSERT INTO analytics_booking_rollups")]
+    assert inserts[0] == ("created", date(2026, 3, 1), date(2026, 3, 2))
+    assert inserts[1] == ("visit", date(2026, 3, 1), date(2026, 3, 2))
+    assert db.commits == 3 and db.rollbacks == 0  # два дня + пустой захват
+
+
+class RollupQueue:
+    """
+    analytics_rollup_queue с блокировками строк: ON CONFLICT DO NOTHING
+    блокировку не берёт, DO UPDATE держит её до конца транзакции писателя,
+    захват дня (FOR UPDATE SKIP LOCKED) пропускает заблокированные строки.
+    """
+
+    def __init__(self, *days):
+        self.days = set(days)
+        self.locks = {}
+
+    def writer(self, txn):
+        def handle(sql, params):
+            for day in params:
+                if day not in self.days or "DO UPDATE" in sql:
+                    self.locks[day] = txn
+                self.days.add(day)
+            return []
+        return handle
+
+    def claim(self, sql, params):
+        free = sorted(day for day in self.days if day not in self.locks)
+        if not free:
+            return []
+        self.days.discard(free[0])
+        return [(free[0],)]
+
+    def commit(self, txn):
+        self.locks = {day: owner for day, owner in self.locks.items() if owner != txn}
+
+
+def test_pending_writer_keeps_its_day_queued(fake_db, fake_cursor):
+    day = date(2026, 3, 5)
+    queue = RollupQueue(day)  # день уже в очереди: запись на будущий визит, правка статуса
+    writer = fake_cursor(rules=[("INSERT INTO analytics_rollup_queue", queue.writer("booking"))])
+    job = fake_db(rules=[("DELETE FROM analytics_rollup_queue", queue.claim)])
+
+    with patch.object(analytics_rollups, "get_db_connection", job.connect):
+        # Транзакция записи поставила день и ещё не закоммичена
+        analytics_rollups.enqueue_analytics_rollup_days([day], cursor=writer)
+        assert analytics_rollups.refresh_analytics_rollups(max_days=10) == 0
+        assert day in queue.days
+
+        # После коммита писателя день пересчитывается уже с его изменениями
+        queue.commit("booking")
+        assert analytics_rollups.refresh_analytics_rollups(max_days=10) == 1
+        assert not queue.days
+
+    # Триггеры bookings / chat_history ставят дни тем же upsert'ом
+    with open(os.path.join(os.path.dirname(__file__), "..", "db", "init.py"), encoding="utf-8") as f:
+        init_source = f.read()
+    assert "ON CONFLICT (day) DO NOTHING" not in init_source
+    assert init_source.count("ON CONFLICT (day) DO UPDATE SET queued_at = NOW();") == 4
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeCursor, FakeDatabase
+
+    test_as_day_accepts_dashboard_formats()
+    test_facts_combine_rollups_with_queued_days()
+    test_refresh_claims_one_day_per_transaction(FakeDatabase)
+    test_pending_writer_keeps_its_day_queued(FakeDatabase, FakeCursor)
+    print("✅ Analytics rollup tests passed")
@@ -0,0 +1,151 @@
+"""
+Тесты кэша ответов бота (bot/answer_cache.py) и его счётчиков в db/bot_analytics.py
+"""
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot import answer_cache
+from bot import prompt_cache
+from db import bot_analytics
+from db.settings import invalidate_settings_cache
+
+
+def test_normalization_and_bypass_rules():
+    assert answer_cache.normalize_question("  Сколько стоит МАНИКЮР?? 💅 ") == "сколько стоит маникюр"
+    assert answer_cache.normalize_question("Ваш адрес,   подскажите!") == answer_cache.normalize_question("ваш адрес подскажите")
+    assert answer_cache.normalize_question("Ёлка") == "елка"
+
+    assert answer_cache.bypass_reason("price for manicure?") is None
+    assert answer_cache.bypass_reason("адрес?", booking_progress={"service": "Маникюр"}) == "booking_progress"
+    assert answer_cache.bypass_reason("адрес?", booking_progress={"phone": None}) is None
+    assert answer_cache.bypass_reason("адрес?", context_flags={"is_urgent": True}) == "context_flags"
+    assert answer_cache.bypass_reason("адрес?", context_flags={"is_urgent": False, "incomplete_booking": None}) is None
+    for question in ["Можно завтра?", "Есть окно в 15:30?", "на 12.03", "at 5pm", "в субботу работаете?",
+                     "Friday?", "мой номер +7 999 123 45 67", "2 марта свободно?"]:
+        assert answer_cache.bypass_reason(question) == "date_time", question
+    assert answer_cache.bypass_reason("a" * (answer_cache.ANSWER_CACHE_MAX_QUESTION_CHARS + 1)) == "too_long"
+    assert answer_cache.bypass_reason("?!") == "empty"
+
+    assert answer_cache.is_cacheable_answer("Маникюр стоит 150 AED 💅")
+    assert not answer_cache.is_cacheable_answer("[BOOKING_CONFIRMED]\nservice: manicure\n[/BOOKING_CONFIRMED]")
+    assert not answer_cache.is_cacheable_answer("Менеджер скоро ответит!")
+
+
+def test_hits_keyed_by_company_language_and_versions():
+    answer_cache.clear_answer_cache()
+    events = []
+    catalog_version = {"value": 1}
+
+    def record(company_id, event, upstream_ms=0.0):
+        events.append((company_id, event, upstream_ms))
+
+    with patch.object(prompt_cache, "get_catalog_version", lambda company_id: catalog_version["value"]), \
+            patch.object(bot_analytics, "record_answer_cache_event", record):
+        key = answer_cache.answer_cache_key(7, "Сколько стоит маникюр?", "ru")
+        assert answer_cache.get_cached_answer(key) is None
+        assert answer_cache.store_answer(key, "150 AED", upstream_ms=1800)
+
+        # Тот же вопрос другими словами регистра/пунктуации — попадание
+        same = answer_cache.answer_cache_key(7, "сколько стоит маникюр", "ru")
+        assert answer_cache.get_cached_answer(same) == "150 AED"
+        # Другой язык и другая компания — свои записи
+        assert answer_cache.get_cached_answer(answer_cache.answer_cache_key(7, "Сколько стоит маникюр?", "en")) is None
+        assert answer_cache.get_cached_answer(answer_cache.answer_cache_key(8, "Сколько стоит маникюр?", "ru")) is None
+
+        # Поменялся каталог или настройки — старый ответ не используется
+        catalog_version["value"] = 2
+        assert answer_cache.get_cached_answer(answer_cache.answer_cache_key(7, "Сколько стоит маникюр?", "ru")) is None
+        catalog_version["value"] = 1
+        invalidate_settings_cache(7, broadcast=False)
+        assert answer_cache.get_cached_answer(answer_cache.answer_cache_key(7, "Сколько стоит маникюр?", "ru")) is None
+
+        assert answer_cache.answer_cache_key(7, "Можно завтра в 10?", "ru") is None
+
+    assert (7, "hit", 1800.0) in events
+    assert [event for _, event, _ in events].count("miss") == 5
+    assert (7, "bypass:date_time", 0.0) in events
+
+
+def test_only_session_opening_turns_use_cache():
+    now = datetime(2026, 10, 17, 12, 0)
+    recent = (now - timedelta(minutes=5)).isoformat()
+    old = now - timedelta(days=2)
+
+    assert answer_cache.is_session_opening([("Привет", "client", recent, "text", 1)], now=now)
+    assert answer_cache.is_session_opening([("Добрый день!", "bot", old, "text", 1)], now=now)
+    assert not answer_cache.is_session_opening([("Какую услугу?", "bot", recent, "text", 1)], now=now)
+    assert not answer_cache.is_session_opening([("Секунду", "manager", None, "text", 1)], now=now)
+
+    # «маникюр» в ответ на вопрос бота — продолжение диалога, а не справочный вопрос
+    in_dialog = [("Какую услугу хотите?", "bot", datetime.now().isoformat(), "text", 1), ("маникюр", "client", "", "text", 2)]
+    assert answer_cache.bypass_reason("маникюр", history=in_dialog) == "in_conversation"
+    assert answer_cache.bypass_reason("маникюр", history=[("маникюр", "client", "", "text", 2)]) is None
+
+    with patch.object(prompt_cache, "get_catalog_version", lambda company_id: 1), \
+            patch.object(bot_analytics, "record_answer_cache_event", lambda *args: None):
+        new_client = answer_cache.answer_cache_key(7, "адрес?", "ru", history=[], prompt_context="- Новый клиент\n")
+        same_context = answer_cache.answer_cache_key(7, "Адрес", "ru", history=[], prompt_context="- Новый клиент\n")
+        vip = answer_cache.answer_cache_key(7, "адрес?", "ru", history=[], prompt_context="- ⭐ VIP КЛИЕНТ\n")
+        assert new_client == same_context and new_client != vip
+        assert answer_cache.answer_cache_key(7, "маникюр", "ru", history=in_dialog) is None
+
+
+def test_flush_aggregates_events_into_one_upsert(fake_db):
+    db = fake_db()
+
+    events = [
+        (1, "miss", 0.0), (1, "stored", 2000.0), (1, "hit", 2000.0), (1, "hit", 2000.0),
+        (2, "bypass:date_time", 0.0), (2, "bypass:booking_progress", 0.0), (2, "rejected", 0.0),
+    ]
+    with patch.object(bot_analytics, "get_db_connection", db.connect):
+        bot_analytics.flush_answer_cache_events(events)
+
+    assert len(db.executed) == 1 and db.commits == 1
+    sql, params = db.executed[0]
+    assert "ON CONFLICT (company_id, day) DO UPDATE SET hits = bot_answer_cache_daily.hits + EXCLUDED.hits" in sql
+    # company_id, hits, misses, bypassed, stored, rejected, saved_ms, upstream_ms
+    assert params == [1, 2, 1, 0, 1, 0, 4000, 2000, 2, 0, 0, 2, 0, 1, 0, 0]
+
+    summary = bot_analytics._answer_cache_summary((3, 1, 5, 1, 5400, 1800))
+    assert summary["hit_rate"] == 75.0 and summary["saved_upstream_seconds"] == 5.4
+    assert summary["avg_upstream_ms"] == 1800 and summary["bypassed"] == 5
+    assert bot_analytics._answer_cache_summary(None)["hit_rate"] == 0
+
+
+def test_turn_with_bot_action_is_not_cached():
+    from bot import core
+
+    reply = 'Записала вас! [ACTION]{"action": "save_booking", "service": "Маникюр"}[/ACTION]'
+    gemini = {"candidates": [{"finishReason": "STOP", "content": {"parts": [{"text": reply}]}}]}
+    bot = core.SalonBot.__new__(core.SalonBot)
+    bot.proxies = []
+    executed_actions = []
+
+    with patch.object(core.SalonBot, "context", SimpleNamespace(company_id=7, bot_settings={})), \
+            patch.object(core.llm_dispatcher, "generate", AsyncMock(return_value=gemini)), \
+            patch.object(core.SalonBot, "_handle_bot_action", AsyncMock()) as handle_action:
+        text = asyncio.run(bot._generate_via_proxy("prompt", instagram_id="client_1", executed_actions=executed_actions))
+
+    handle_action.assert_awaited_once()
+    # Блок вырезан из ответа, поэтому is_cacheable_answer его уже не видит —
+    # generate_response пропускает store_answer по executed_actions
+    assert text == "Записала вас!" and answer_cache.is_cacheable_answer(text)
+    assert executed_actions == ['{"action": "save_booking", "service": "Маникюр"}']
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_normalization_and_bypass_rules()
+    test_hits_keyed_by_company_language_and_versions()
+    test_only_session_opening_turns_use_cache()
+    test_flush_aggregates_events_into_one_upsert(FakeDatabase)
+    test_turn_with_bot_action_is_not_cached()
+    print("✅ Answer cache tests passed")
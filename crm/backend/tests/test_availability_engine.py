@@ -0,0 +1,177 @@
+"""
+Тесты диапазонного движка доступности (services/availability_engine.py)
+"""
+import sys
+import os
+import asyncio
+from contextlib import ExitStack
+from datetime import datetime, date
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import db.companies as companies_db
+import db.settings as settings_db
+import services.availability_engine as engine_module
+from crm_api import schedule as schedule_api
+from services.master_schedule import MasterScheduleService
+from utils.tenant_context import get_current_company_id
+
+MASTERS = [
+    {"id": 1, "full_name": "Anna", "username": "anna", "nickname": None},
+    {"id": 2, "full_name": "Maria", "username": "maria", "nickname": None},
+]
+
+
+SCHEDULE_RULES = [
+    ("FROM salon_holidays", [("2030-01-03", "Holiday", True, "[2]")]),
+    ("FROM user_schedule", [
+        (user_id, dow, "10:00", "14:00", True)
+        for user_id in (1, 2)
+        for dow in range(7)
+    ]),
+    ("FROM user_time_off", [(1, "2030-01-02 00:00:00", "2030-01-03 00:00:00")]),
+    ("FROM services", [(10, "Manicure", "120")]),
+    ("FROM bookings", [
+        ("2030-01-01 10:00:00", "Manicure", 1, "ANNA"),
+        ("2030-01-01 12:00:00", "Manicure", None, "MARIA"),
+    ]),
+    ("FROM booking_drafts", [("2030-01-01 12:00:00", 10, 1, "")]),
+]
+
+
+def _load_timeline(fake_db, start, end):
+    db = fake_db(rules=SCHEDULE_RULES)
+    service = MasterScheduleService()
+    with ExitStack() as stack:
+        stack.enter_context(patch.object(engine_module, "get_db_connection", db.connect))
+        stack.enter_context(patch.object(engine_module, "get_salon_timezone", return_value="UTC"))
+        stack.enter_context(patch.object(
+            engine_module, "get_current_time",
+            return_value=datetime(2029, 12, 31, 9, 0, tzinfo=ZoneInfo("UTC")),
+        ))
+        stack.enter_context(patch.object(settings_db, "get_salon_settings", return_value={}))
+        stack.enter_context(patch.object(engine_module, "column_exists", return_value=True))
+        timeline = service.load_availability(MASTERS, start, end)
+    return timeline, db.executed
+
+
+def test_month_is_loaded_with_constant_number_of_queries(fake_db):
+    timeline, log = _load_timeline(fake_db, date(2030, 1, 1), date(2030, 1, 31))
+    assert len(log) == 6
+
+    timeline.get_available_dates(60)
+    assert len(log) == 6
+
+
+def test_bookings_and_drafts_are_assigned_to_masters(fake_db):
+    timeline, _ = _load_timeline(fake_db, date(2030, 1, 1), date(2030, 1, 3))
+
+    # Anna: booking 10-12 and draft 12-14 fill the whole day
+    assert timeline.get_slots(1, "2030-01-01", 60) == []
+    # Maria: legacy booking matched by name blocks 12-14
+    assert timeline.get_slots(2, "2030-01-01", 60) == ["10:00", "10:30", "11:00"]
+
+    availability = timeline.get_masters_availability("2030-01-01", 60)
+    assert list(availability.keys()) == ["Maria"]
+
+
+def test_time_off_and_holiday_overrides(fake_db):
+    timeline, _ = _load_timeline(fake_db, date(2030, 1, 1), date(2030, 1, 3))
+
+    assert timeline.get_slots(1, "2030-01-02", 60) == []
+    assert timeline.get_day_context(1, "2030-01-03")["day_off_reason"] == "holiday"
+    # Maria is listed in master_exceptions and works on the holiday
+    assert timeline.get_slots(2, "2030-01-03", 240) == ["10:00"]
+
+    assert timeline.get_available_dates(60) == ["2030-01-01", "2030-01-02", "2030-01-03"]
+
+
+def _day_context(blocked, now=None):
+    tz = ZoneInfo("UTC")
+    work_start = datetime(2030, 1, 1, 10, 0, tzinfo=tz)
+    return {
+        "date": "2030-01-01",
+        "date_obj": work_start.date(),
+        "timezone": tz,
+        "now": now or datetime(2029, 12, 31, 9, 0, tzinfo=tz),
+        "work_start": work_start,
+        "work_end": datetime(2030, 1, 1, 14, 0, tzinfo=tz),
+        "blocked_intervals": [
+            {"start": datetime(2030, 1, 1, sh, sm, tzinfo=tz), "end": datetime(2030, 1, 1, eh, em, tzinfo=tz), "source": "booking"}
+            for sh, sm, eh, em in blocked
+        ],
+        "is_working": True,
+    }
+
+
+def test_slots_are_generated_from_free_gaps():
+    service = MasterScheduleService()
+    context = _day_context([(10, 0, 11, 0), (10, 30, 11, 15), (13, 0, 13, 30)])
+
+    # 11:15-13:00 and 13:30-14:00 are free; starts stay on the 30-minute grid
+    assert service._generate_slots(context, 60) == ["11:30", "12:00"]
+    assert service._generate_slots(context, 30, slot_step_minutes=15) == [
+        "11:15", "11:30", "11:45", "12:00", "12:15", "12:30", "13:30",
+    ]
+    assert service._generate_slots(context, [15, 15], slot_step_minutes=15)[-1] == "13:30"
+
+    metadata = service._generate_slots(context, 30, return_metadata=True)
+    assert metadata[0] == {"time": "11:30", "is_optimal": False}
+    assert {"time": "12:30", "is_optimal": True} in metadata
+
+
+def test_today_respects_minimum_lead_time():
+    service = MasterScheduleService()
+    context = _day_context([], now=datetime(2030, 1, 1, 11, 10, tzinfo=ZoneInfo("UTC")))
+
+    assert service._generate_slots(context, 60) == ["12:00", "12:30", "13:00"]
+
+
+def test_public_slots_are_scoped_to_requested_company(fake_db):
+    queries = []
+    seen_company_ids = []
+
+    db = fake_db(
+        rows=[{"id": 10, "duration": "90"}],
+        rules=[("FROM users", [{"id": 1}])],
+        executed=queries,
+        on_execute=lambda: seen_company_ids.append(get_current_company_id()),
+    )
+
+    companies = {"salon-a": {"id": 5, "status": "active"}}
+    with ExitStack() as stack:
+        stack.enter_context(patch.object(companies_db, "get_company_by_slug", side_effect=companies.get))
+        stack.enter_context(patch.object(schedule_api, "get_db_connection", db.connect))
+        stack.enter_context(patch.object(MasterScheduleService, "get_master_records", return_value=MASTERS[:1]))
+        stack.enter_context(patch.object(MasterScheduleService, "get_available_dates", return_value=["2030-01-01"]))
+
+        missing = asyncio.run(schedule_api.get_available_dates_api(
+            company="unknown", year=2030, month=1, master_id=None, service_id=None,
+            service_ids=None, duration=None, step=None,
+        ))
+        assert missing.status_code == 404 and queries == []
+
+        result = asyncio.run(schedule_api.get_available_dates_api(
+            company="salon-a", year=2030, month=1, master_id=None, service_id=10,
+            service_ids=None, duration=None, step=None,
+        ))
+
+    assert result["available_dates"] == ["2030-01-01"] and result["duration"] == 90
+    assert all("company_id = %s" in sql and params[0] == 5 for sql, params in queries)
+    # Запросы идут под контекстом компании, после запроса контекст сброшен
+    assert seen_company_ids == [5, 5] and get_current_company_id() is None
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_month_is_loaded_with_constant_number_of_queries(FakeDatabase)
+    test_bookings_and_drafts_are_assigned_to_masters(FakeDatabase)
+    test_time_off_and_holiday_overrides(FakeDatabase)
+    test_slots_are_generated_from_free_gaps()
+    test_today_respects_minimum_lead_time()
+    test_public_slots_are_scoped_to_requested_company(FakeDatabase)
+    print("✅ Availability engine tests passed")
@@ -0,0 +1,102 @@
+"""
+Тесты выноса блокирующих роутов с event loop (utils/blocking.py)
+"""
+import sys
+import os
+import asyncio
+import threading
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from db import bookings
+from db.bookings import get_all_bookings
+from utils.blocking import OffloadedRoute, audit_blocking_routes, offload_blocking, run_blocking
+from utils.tenant_context import get_current_company_id, reset_tenant_context, set_tenant_context
+
+
+def get_db_connection():
+    raise AssertionError("audit must not call the endpoint")
+
+
+def _load_rows():
+    conn = get_db_connection()
+    return conn
+
+
+def test_run_blocking_copies_tenant_context():
+    async def scenario():
+        tokens = set_tenant_context(company_id=42)
+        try:
+            return await run_blocking(lambda: (get_current_company_id(), threading.current_thread().name))
+        finally:
+            reset_tenant_context(tokens)
+
+    company_id, thread_name = asyncio.run(scenario())
+    assert company_id == 42
+    assert thread_name != threading.main_thread().name
+
+
+def test_offloaded_routes_keep_signature():
+    router = APIRouter(route_class=OffloadedRoute)
+
+    @router.get("/sync/{item_id}")
+    def sync_item(item_id: int, q: str = "x"):
+        return {"item_id": item_id, "q": q, "thread": threading.current_thread().name}
+
+    app = FastAPI()
+    app.include_router(router)
+
+    @app.get("/decorated")
+    @offload_blocking
+    def decorated(limit: int = 5):
+        return {"limit": limit}
+
+    client = TestClient(app)
+    response = client.get("/sync/7", params={"q": "hello"})
+    assert response.status_code == 200
+    assert response.json()["item_id"] == 7
+    assert response.json()["q"] == "hello"
+    assert client.get("/decorated", params={"limit": 3}).json() == {"limit": 3}
+
+
+def test_audit_reports_async_routes_touching_db():
+    app = FastAPI()
+
+    @app.get("/direct")
+    async def direct():
+        return get_db_connection()
+
+    @app.get("/via-helper")
+    async def via_helper():
+        return _load_rows()
+
+    @app.get("/db-helper")
+    async def db_helper():
+        return get_all_bookings(limit=10)
+
+    @app.get("/db-module")
+    async def db_module():
+        return bookings.get_bookings_by_master("Anna")
+
+    @app.get("/clean")
+    async def clean():
+        return {"ok": True}
+
+    @app.get("/offloaded")
+    @offload_blocking
+    def offloaded():
+        return get_db_connection()
+
+    paths = [finding["path"] for finding in audit_blocking_routes(app)]
+    assert paths == ["/db-helper", "/db-module", "/direct", "/via-helper"]
+
+
+if __name__ == "__main__":
+    test_run_blocking_copies_tenant_context()
+    test_offloaded_routes_keep_signature()
+    test_audit_reports_async_routes_touching_db()
+    print("✅ Blocking route tests passed")
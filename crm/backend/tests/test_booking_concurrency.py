@@ -0,0 +1,112 @@
+"""
+Стресс-тест резервирования слотов: N параллельных писателей на одного мастера
+(db.bookings.save_booking + services.booking_hold.reserve_slot).
+Требует тестовую БД, как и остальные интеграционные тесты.
+"""
+import sys
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.connection import get_db_connection
+from db.bookings import save_booking
+from services.booking_hold import SlotConflictError
+from tests.test_utils import create_test_user, cleanup_test_users
+
+# Каждый ожидающий писатель держит соединение пула, поэтому N не больше DB_POOL_MAX
+WRITERS = int(os.getenv("BOOKING_STRESS_WRITERS", "8"))
+USER_PREFIX = "test_concurrency_master"
+CLIENT_PREFIX = "test_concurrency_client"
+
+
+def _prepare_master():
+    user_id = create_test_user(USER_PREFIX, "Concurrency Master")
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        for day in range(7):
+            c.execute("""
+                INSERT INTO user_schedule (user_id, day_of_week, start_time, end_time, is_active)
+                VALUES (%s, %s, '09:00', '21:00', TRUE)
+                ON CONFLICT (user_id, day_of_week) DO UPDATE
+                SET start_time = EXCLUDED.start_time, end_time = EXCLUDED.end_time, is_active = TRUE
+            """, (user_id, day))
+        conn.commit()
+    finally:
+        conn.close()
+    return user_id
+
+
+def _cleanup(user_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("DELETE FROM bookings WHERE master_user_id = %s OR instagram_id LIKE %s", (user_id, f"{CLIENT_PREFIX}_%"))
+        c.execute("DELETE FROM clients WHERE instagram_id LIKE %s", (f"{CLIENT_PREFIX}_%",))
+        conn.commit()
+    finally:
+        conn.close()
+    cleanup_test_users(USER_PREFIX)
+
+
+def test_parallel_writers_never_overlap():
+    user_id = _prepare_master()
+    target_day = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+    # Все писатели целятся в пересекающиеся 60-минутные окна 10:00-12:00
+    start_times = ["10:00", "10:30", "11:00"]
+
+    barrier = threading.Barrier(WRITERS)
+    created, conflicts, errors = [], [], []
+    lock = threading.Lock()
+
+    def writer(index):
+        time_str = start_times[index % len(start_times)]
+        barrier.wait()
+        try:
+            booking_id = save_booking(
+                f"{CLIENT_PREFIX}_{index}",
+                "Concurrency test",
+                f"{target_day}T{time_str}",
+                f"+000000{index:04d}",
+                f"Client {index}",
+                master=str(user_id),
+                source="test",
+                duration_minutes=60,
+            )
+            with lock:
+                created.append((booking_id, time_str))
+        except SlotConflictError as e:
+            with lock:
+                conflicts.append(e.reason)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors, errors
+        assert created, "at least one writer must win"
+        assert len(created) + len(conflicts) == WRITERS
+        assert set(conflicts) <= {"booked"}
+
+        intervals = sorted(
+            datetime.strptime(f"{target_day} {time_str}", "%Y-%m-%d %H:%M")
+            for _, time_str in created
+        )
+        for previous, current in zip(intervals, intervals[1:]):
+            assert current >= previous + timedelta(minutes=60), f"overlap: {previous} / {current}"
+    finally:
+        _cleanup(user_id)
+
+
+if __name__ == "__main__":
+    test_parallel_writers_never_overlap()
+    print("✅ Booking concurrency test passed")
@@ -0,0 +1,130 @@
+"""
+Тесты реестра контекстов бота по компаниям (bot/contexts.py)
+"""
+import sys
+import os
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot import contexts
+from bot.contexts import BotContext, BotContextRegistry
+from db.settings import get_settings_version, invalidate_settings_cache
+from utils.tenant_context import get_current_company_id
+
+
+def fake_builder(builds, delay=0.0):
+    def build(company_id):
+        version = get_settings_version(company_id)
+        time.sleep(delay)
+        builds.append(company_id)
+        return BotContext(
+            company_id=company_id,
+            salon={"name": f"Salon {company_id}"},
+            bot_settings={"bot_name": f"Bot {company_id}", "build": len(builds)},
+            prompt_builder=None,
+            settings_version=version,
+        )
+    return build
+
+
+def test_contexts_are_per_company_and_lru_bounded():
+    builds = []
+    registry = BotContextRegistry(maxsize=2)
+    with patch.object(contexts, "build_bot_context", fake_builder(builds)):
+        assert registry.get(1).salon["name"] == "Salon 1"
+        assert registry.get(2).salon["name"] == "Salon 2"
+        assert registry.get(1) is registry.get(1)
+        assert builds == [1, 2]
+
+        # Третья компания вытесняет давно не использованную (2), а не 1
+        registry.get(3)
+        registry.get(1)
+        registry.get(2)
+        assert builds == [1, 2, 3, 2]
+
+    stats = registry.stats()
+    assert stats["size"] == 2 and stats["evictions"] == 2
+    assert stats["hits"] == 3 and stats["misses"] == 4
+
+
+def test_settings_invalidation_rebuilds_only_that_company():
+    builds = []
+    registry = BotContextRegistry()
+    with patch.object(contexts, "build_bot_context", fake_builder(builds)):
+        first = registry.get(101)
+        other = registry.get(102)
+
+        # update_bot_settings -> update_company -> invalidate_settings_cache (в других воркерах — Pub/Sub)
+        invalidate_settings_cache(101, broadcast=False)
+        rebuilt = registry.get(101)
+        assert rebuilt is not first and rebuilt.bot_settings["build"] == 3
+        assert registry.get(102) is other
+    assert registry.stats()["stale"] == 1
+
+
+def test_pubsub_invalidation_drops_context_in_global_registry():
+    builds = []
+    contexts.bot_contexts.clear()
+    with patch.object(contexts, "build_bot_context", fake_builder(builds)):
+        first = contexts.get_bot_context(201)
+        asyncio.run(contexts._bot_pubsub_handler("crm:bot:invalidate", {"company_id": "201"}))
+        assert contexts.get_bot_context(201) is not first
+    assert builds == [201, 201]
+    contexts.bot_contexts.clear()
+
+
+def test_concurrent_first_access_builds_once():
+    builds = []
+    registry = BotContextRegistry()
+    results = []
+
+    def worker():
+        results.append(registry.get(301))
+
+    with patch.object(contexts, "build_bot_context", fake_builder(builds, delay=0.05)):
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert builds == [301]
+    assert len({id(context) for context in results}) == 1
+
+
+def test_webhook_turn_runs_in_client_company_context():
+    import webhooks
+
+    builds = []
+    seen = []
+
+    async def turn(messaging_event):
+        context = contexts.get_bot_context()
+        seen.append((messaging_event["sender"]["id"], get_current_company_id(), context.company_id))
+
+    companies = {"ig_a": 11, "ig_b": 12}
+    contexts.bot_contexts.clear()
+    with patch.object(contexts, "build_bot_context", fake_builder(builds)), \
+            patch.object(webhooks, "resolve_conversation_company_id", companies.get), \
+            patch.object(webhooks, "_process_message_event", turn):
+        for sender in ["ig_a", "ig_b", "ig_a"]:
+            asyncio.run(webhooks.process_message_background({"sender": {"id": sender}, "message": {"text": "hi"}}))
+
+    # Каждый ход — в контексте компании клиента, а не в общем контексте None
+    assert seen == [("ig_a", 11, 11), ("ig_b", 12, 12), ("ig_a", 11, 11)]
+    assert builds == [11, 12] and get_current_company_id() is None
+    contexts.bot_contexts.clear()
+
+
+if __name__ == "__main__":
+    test_contexts_are_per_company_and_lru_bounded()
+    test_settings_invalidation_rebuilds_only_that_company()
+    test_pubsub_invalidation_drops_context_in_global_registry()
+    test_concurrent_first_access_builds_once()
+    test_webhook_turn_runs_in_client_company_context()
+    print("✅ Bot context registry tests passed")
@@ -0,0 +1,169 @@
+"""
+Тесты движка рассылок (services/broadcast_engine.py)
+"""
+import sys
+import os
+import asyncio
+import threading
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import broadcast_engine
+from utils.token_bucket import AsyncTokenBucket
+
+
+PAYLOAD = {
+    "subscription_type": "promotions",
+    "channels": ["email", "telegram", "notification"],
+    "subject": "Акция",
+    "message": "Скидка 20%",
+    "user_ids": [7, "client_a"],
+    "additional_emails": ["extra@example.com", "broken"],
+}
+
+
+def test_build_deliveries_per_channel():
+    staff = broadcast_engine.build_deliveries(PAYLOAD, (7, "Анна", "anna@example.com", 555, None, "staff"))
+    assert [d["platform"] for d in staff] == ["email", "telegram", "in_app"]
+    assert staff[2]["user_id"] == 7
+    assert "type=promotions" in staff[0]["context"]["unsubscribe_link"]
+
+    # Клиентам in-app не отправляется, без telegram — только email
+    client = broadcast_engine.build_deliveries(PAYLOAD, ("client_a", None, "c@example.com", None, "client_a", "client"))
+    assert [d["platform"] for d in client] == ["email"]
+    assert client[0]["context"]["name"] == "Client"
+
+
+def test_recipient_filters():
+    staff_sql, staff_params = broadcast_engine._staff_filter(PAYLOAD, 3, sender_id=1)
+    assert "u.id = ANY(%s)" in staff_sql and staff_params == ["promotions", 3, [7]]
+
+    clients_sql, clients_params = broadcast_engine._clients_filter(PAYLOAD, 3)
+    assert clients_params == ["promotions", 3, ["client_a"], ["client_a"]]
+
+    test_payload = dict(PAYLOAD, is_test=True)
+    assert broadcast_engine._staff_filter(test_payload, 3, sender_id=1) == ("u.id = %s", [1])
+    assert broadcast_engine._clients_filter(test_payload, 3)[0] == "FALSE"
+    assert broadcast_engine._manual_targets(test_payload) == []
+
+    manual = broadcast_engine._manual_targets(PAYLOAD)
+    assert manual == [(0, "Anonymous", "extra@example.com", None, None, "manual")]
+
+
+def _job(checkpoint=None, total=None):
+    return {
+        "id": 11, "company_id": None, "sender_id": 1, "payload": PAYLOAD, "status": "running",
+        "total_targets": total, "sent_count": 0, "failed_count": 0, "checkpoint": checkpoint,
+        "attempts": 1, "error": None, "history_id": None, "created_at": None, "finished_at": None,
+    }
+
+
+def test_job_resumes_from_checkpoint_and_saves_progress():
+    chunks = {
+        ("clients", "client_a"): [("client_b", "Bob", "b@example.com", None, None, "client")],
+        ("manual", None): broadcast_engine._manual_targets(PAYLOAD),
+    }
+    fetched, saved, published = [], [], []
+
+    def fake_fetch(payload, company_id, sender_id, phase, after, limit):
+        fetched.append((phase, after))
+        return chunks.get((phase, after), [])
+
+    def fake_save(job_id, worker_id, checkpoint, sent, failed, total_targets=None):
+        saved.append((checkpoint, sent, failed))
+        return (sum(s for _, s, _ in saved), sum(f for _, _, f in saved))
+
+    def fake_finish(job, worker_id, status, error=None):
+        return dict(job, status=status)
+
+    async def fake_deliver(payload, delivery):
+        return delivery["recipient"] != "extra@example.com"
+
+    async def fake_publish(job):
+        published.append((job["status"], job["sent_count"], job["failed_count"]))
+
+    with patch.object(broadcast_engine, "fetch_target_chunk", fake_fetch), \
+         patch.object(broadcast_engine, "_save_progress", fake_save), \
+         patch.object(broadcast_engine, "_finish_job", fake_finish), \
+         patch.object(broadcast_engine, "_deliver", fake_deliver), \
+         patch.object(broadcast_engine, "_publish_progress", fake_publish), \
+         patch.object(broadcast_engine, "_keep_lease", lambda *args: asyncio.sleep(0)):
+        result = asyncio.run(broadcast_engine.run_broadcast_job(
+            _job(checkpoint={"phase": "clients", "after": "client_a"}, total=3), "worker-1",
+        ))
+
+    # Сотрудники уже были отправлены до падения — фаза staff не перечитывается
+    assert fetched == [("clients", "client_a"), ("clients", "client_b"), ("manual", None), ("manual", 0)]
+    assert saved == [({"phase": "clients", "after": "client_b"}, 1, 0), ({"phase": "manual", "after": 0}, 0, 1)]
+    assert published == [("running", 1, 0), ("running", 1, 1), ("completed", 1, 1)]
+    assert result["status"] == "completed"
+
+
+def test_job_stops_when_cancelled():
+    calls = []
+
+    async def fake_deliver(payload, delivery):
+        calls.append(delivery["recipient"])
+        return True
+
+    with patch.object(broadcast_engine, "fetch_target_chunk",
+                      lambda *args: [(1, "A", "a@example.com", None, None, "staff")]), \
+         patch.object(broadcast_engine, "_save_progress", lambda *args: None), \
+         patch.object(broadcast_engine, "get_broadcast_job", lambda job_id: dict(_job(), status="cancelled")), \
+         patch.object(broadcast_engine, "_deliver", fake_deliver), \
+         patch.object(broadcast_engine, "_publish_progress", lambda job: asyncio.sleep(0)), \
+         patch.object(broadcast_engine, "_keep_lease", lambda *args: asyncio.sleep(0)):
+        result = asyncio.run(broadcast_engine.run_broadcast_job(_job(total=5), "worker-1"))
+
+    assert result["status"] == "cancelled"
+    assert len(calls) == 2  # одна порция (email + in_app), дальше раннер не пошёл
+
+
+def test_shutdown_releases_lease_off_the_event_loop():
+    released = []
+
+    async def stuck_deliver(payload, delivery):
+        await asyncio.Event().wait()
+
+    def fake_release(job_id, worker_id):
+        released.append((job_id, worker_id, threading.current_thread() is threading.main_thread()))
+
+    async def scenario():
+        task = asyncio.create_task(broadcast_engine.run_broadcast_job(_job(total=5), "worker-1"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    with patch.object(broadcast_engine, "fetch_target_chunk",
+                      lambda *args: [(1, "A", "a@example.com", None, None, "staff")]), \
+         patch.object(broadcast_engine, "_save_progress", lambda *args: None), \
+         patch.object(broadcast_engine, "_deliver", stuck_deliver), \
+         patch.object(broadcast_engine, "_release_lease", fake_release), \
+         patch.object(broadcast_engine, "_keep_lease", lambda *args: asyncio.sleep(0)):
+        assert asyncio.run(scenario())
+
+    # Аренда снята в пуле потоков, а не синхронным вызовом на event loop
+    assert released == [(11, "worker-1", False)]
+
+
+def test_token_bucket_limits_burst():
+    bucket = AsyncTokenBucket(rate=1, burst=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert AsyncTokenBucket(rate=0).try_acquire()
+
+
+if __name__ == "__main__":
+    test_build_deliveries_per_channel()
+    test_recipient_filters()
+    test_job_resumes_from_checkpoint_and_saves_progress()
+    test_job_stops_when_cancelled()
+    test_shutdown_releases_lease_off_the_event_loop()
+    test_token_bucket_limits_burst()
+    print("✅ Broadcast engine tests passed")
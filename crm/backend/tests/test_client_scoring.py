@@ -0,0 +1,96 @@
+"""
+Тесты RFM-скоринга клиентов (services/client_scoring.py)
+"""
+import sys
+import os
+from datetime import date, timedelta
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import client_scoring
+from services.client_scoring import assign_segment, quintile_scores, score_clients
+
+
+def _legacy_quintile(values, value):
+    """Прежний алгоритм из crm_api/client_scoring.py — эталон шкалы."""
+    sorted_vals = sorted(set(values))
+    n = len(sorted_vals)
+    if n == 1:
+        return 3
+    idx = sorted_vals.index(value)
+    return max(1, min(5, int(idx / n * 4) + 1))
+
+
+def test_quintiles_match_legacy_scale_and_keep_ties_together():
+    values = [5, 1, 1, 9, 3, 3, 3, 7, 12, 0, 5, 40]
+    assert quintile_scores(values) == [_legacy_quintile(values, v) for v in values]
+
+    # Равные значения — равные баллы (NTILE разнёс бы их по разным корзинам)
+    tied = quintile_scores([10, 10, 10, 10, 20])
+    assert len(set(tied[:4])) == 1 and tied[4] > tied[0]
+    assert quintile_scores([3, 3, 3]) == [3, 3, 3]
+    assert quintile_scores([]) == []
+
+
+def test_score_clients_assigns_segments():
+    today = date(2026, 3, 31)
+    rows = [
+        ("vip", today - timedelta(days=2), 12, 9000),
+        ("regular", today - timedelta(days=20), 5, 3000),
+        ("newbie", today - timedelta(days=1), 1, 500),
+        ("gone", today - timedelta(days=300), 1, 100),
+        ("no_date", None, 1, 0),
+    ]
+    scored = {row[0]: row for row in score_clients(rows, today)}
+
+    assert scored["vip"][5] == "loyal" and scored["vip"][4] == sum(scored["vip"][1:4])
+    assert scored["vip"][3] == max(row[3] for row in scored.values())
+    assert scored["newbie"][5] == "new"
+    assert scored["gone"][5] == "lost" and scored["gone"][6] == 1.0
+    assert all(row[5] == assign_segment(*row[1:4]) for row in scored.values())
+    assert scored["no_date"][7] == 0 and scored["no_date"][6] == 1.0
+
+
+def test_score_company_upserts_in_chunks(fake_db):
+    today = date(2026, 3, 31)
+    rows = [(f"client_{i}", today - timedelta(days=i), i % 4 + 1, 100 * i) for i in range(5)]
+    # Первый запрос — отпечаток, выборка клиентов сгруппирована по instagram_id
+    db = fake_db(rows=[("5:1000:42:2026-03-31",)], rules=[("GROUP BY instagram_id", rows)])
+    executed = db.executed
+
+    with patch.object(client_scoring, "get_db_connection", db.connect), \
+         patch.object(client_scoring, "CLIENT_SCORING_BATCH", 2):
+        assert client_scoring.score_company(7, today=today) == 5
+    assert db.commits == 1 and db.rollbacks == 0
+
+    upserts = [params for sql, params in executed if sql.startswith("INSERT INTO client_scores")]
+    assert [len(params) for params in upserts] == [2 * 9, 2 * 9, 1 * 9]
+    assert upserts[0][:2] == [7, "client_0"]
+
+    runs = [params for sql, params in executed if sql.startswith("INSERT INTO client_scoring_runs")]
+    assert runs[0][:4] == (7, "5:1000:42:2026-03-31", today, 5)
+
+
+def test_stale_companies_by_fingerprint_or_day(fake_db):
+    today = date(2026, 3, 31)
+    db = fake_db(rows=[
+        (1, "3:300:10:x", "3:300:10:x", today),        # без изменений
+        (2, "4:400:11:x", "3:300:10:x", today),        # новые записи
+        (3, "2:200:5:x", "2:200:5:x", today - timedelta(days=1)),  # сменился день
+        (4, "1:100:1:x", None, None),                  # ещё не считали
+    ])
+
+    with patch.object(client_scoring, "get_db_connection", db.connect):
+        assert client_scoring.get_stale_companies(today) == [2, 3, 4]
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_quintiles_match_legacy_scale_and_keep_ties_together()
+    test_score_clients_assigns_segments()
+    test_score_company_upserts_in_chunks(FakeDatabase)
+    test_stale_companies_by_fingerprint_or_day(FakeDatabase)
+    print("✅ Client scoring tests passed")
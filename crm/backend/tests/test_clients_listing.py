@@ -0,0 +1,73 @@
+"""
+Тесты keyset-пагинации списка клиентов (crm_api/clients.py)
+"""
+import sys
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import crm_api.clients as clients_api
+
+
+def _run_page(fake_db, **kwargs):
+    db = fake_db()
+    with patch.object(clients_api, "get_db_connection", db.connect):
+        clients_api.get_clients_page(**kwargs)
+    return db.executed[0]
+
+
+def test_cursor_roundtrip_and_sort_mismatch():
+    row = {"pin_key": True, "sort_key": datetime(2030, 1, 2, 10, 30), "instagram_id": "client_1"}
+    cursor = clients_api.encode_clients_cursor("last_contact", "desc", row)
+
+    assert clients_api.decode_clients_cursor(cursor, "last_contact", "desc") == [
+        True, "2030-01-02T10:30:00", "client_1",
+    ]
+    for sort, order in (("created_at", "desc"), ("last_contact", "asc")):
+        try:
+            clients_api.decode_clients_cursor(cursor, sort, order)
+            assert False, "cursor must be bound to its sort"
+        except clients_api.InvalidClientsCursor:
+            pass
+    try:
+        clients_api.decode_clients_cursor("not-a-cursor", "last_contact", "desc")
+        assert False, "garbage cursor must be rejected"
+    except clients_api.InvalidClientsCursor:
+        pass
+
+
+def test_page_query_uses_aggregates_and_binds_every_parameter(fake_db):
+    sql, params = _run_page(
+        fake_db,
+        scope="master", master_name="Anna", messenger="telegram",
+        statuses=["new"], temperatures=["hot"], pinned=False,
+        sort="name", order="asc", after=[False, "b", "id_b"], limit=50,
+    )
+
+    assert "GROUP BY" not in sql
+    assert "inbound_messages_count" in sql
+    assert sql.count("%s") == len(params)
+    assert params[:3] == ["Anna", "Anna", "telegram"]
+    assert params[-1] == 51
+
+
+def test_restricted_scope_hides_contacts_and_finances(fake_db):
+    sql, params = _run_page(fake_db, scope="limited")
+
+    assert "c.phone" not in sql
+    assert "c.email" not in sql
+    assert "0 AS total_spend" in sql
+    assert "LIMIT" not in sql
+    assert params == []
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_cursor_roundtrip_and_sort_mismatch()
+    test_page_query_uses_aggregates_and_binds_every_parameter(FakeDatabase)
+    test_restricted_scope_hides_contacts_and_finances(FakeDatabase)
+    print("✅ Clients listing tests passed")
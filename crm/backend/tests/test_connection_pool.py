@@ -0,0 +1,167 @@
+"""
+Тесты справедливого пула соединений (db/connection.py::FairConnectionPool)
+"""
+import sys
+import os
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import db.connection as connection_module
+from psycopg2 import pool as pg_pool
+
+
+class FakeRawConnection:
+    def __init__(self, pid):
+        self.pid = pid
+        self.closed = 0
+
+    def get_backend_pid(self):
+        return self.pid
+
+
+class FakeInnerPool:
+    def __init__(self, minconn, maxconn, **kwargs):
+        self._pool = []
+        self._created = 0
+
+    def getconn(self):
+        if self._pool:
+            return self._pool.pop()
+        self._created += 1
+        return FakeRawConnection(self._created)
+
+    def putconn(self, conn, close=False):
+        if not close:
+            self._pool.append(conn)
+
+    def closeall(self):
+        self._pool.clear()
+
+
+def _make_pool(maxconn):
+    with patch.object(connection_module.pool, "ThreadedConnectionPool", FakeInnerPool):
+        return connection_module.FairConnectionPool(1, maxconn)
+
+
+def test_waiters_are_served_in_fifo_order():
+    fair_pool = _make_pool(1)
+    held = fair_pool.getconn(0.1)
+    order = []
+
+    def waiter(name):
+        conn = fair_pool.getconn(2.0)
+        order.append(name)
+        time.sleep(0.01)
+        fair_pool.putconn(conn)
+
+    threads = []
+    for name in ("first", "second", "third"):
+        thread = threading.Thread(target=waiter, args=(name,))
+        thread.start()
+        threads.append(thread)
+        # Дожидаемся, пока поток встанет в очередь
+        while fair_pool.snapshot()["waiters"] < len(threads):
+            time.sleep(0.001)
+
+    fair_pool.putconn(held)
+    for thread in threads:
+        thread.join()
+
+    assert order == ["first", "second", "third"]
+    snapshot = fair_pool.snapshot()
+    assert snapshot["in_use"] == 0
+    assert snapshot["waiters"] == 0
+    assert snapshot["counters"]["checkouts"] == 4
+    assert snapshot["wait_ms"]["count"] == 4
+
+
+def test_timeout_raises_pool_error_and_leaves_queue():
+    fair_pool = _make_pool(1)
+    held = fair_pool.getconn(0.1)
+    try:
+        fair_pool.getconn(0.05)
+        assert False, "exhausted pool must raise"
+    except pg_pool.PoolError:
+        pass
+
+    snapshot = fair_pool.snapshot()
+    assert snapshot["waiters"] == 0
+    assert snapshot["counters"]["timeouts"] == 1
+    fair_pool.putconn(held)
+    assert fair_pool.snapshot()["in_use"] == 0
+
+
+def test_async_waiter_does_not_block_event_loop():
+    fair_pool = _make_pool(1)
+    held = fair_pool.getconn(0.1)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker_task = asyncio.ensure_future(ticker())
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, fair_pool.putconn, held)
+        conn = await fair_pool.getconn_async(1.0)
+        ticker_task.cancel()
+        fair_pool.putconn(conn)
+        return ticks
+
+    ticks = asyncio.run(scenario())
+    assert ticks >= 5
+    assert fair_pool.snapshot()["in_use"] == 0
+
+
+def test_tenant_settings_are_skipped_when_unchanged():
+    fair_pool = _make_pool(2)
+    conn = fair_pool.getconn(0.1)
+    settings = ("7", "1", "admin", "off", "off")
+
+    assert not fair_pool.session_settings_current(conn, settings)
+    fair_pool.remember_session_settings(conn, settings)
+    assert fair_pool.session_settings_current(conn, settings)
+    assert not fair_pool.session_settings_current(conn, ("8", "1", "admin", "off", "off"))
+
+    # Переподключение (другой backend pid) сбрасывает кэш
+    conn.pid = 999
+    assert not fair_pool.session_settings_current(conn, settings)
+    counters = fair_pool.snapshot()["counters"]
+    assert counters["session_context_skipped"] == 1
+    assert counters["session_context_applied"] == 3
+
+
+def test_event_loop_wait_is_shortened_and_logged():
+    fair_pool = _make_pool(2)
+    warnings = []
+
+    async def on_loop():
+        return [connection_module._pool_wait_timeout() for _ in range(3)]
+
+    with patch.object(connection_module, "_connection_pool", fair_pool), \
+         patch.object(connection_module, "log_warning", lambda message, *args: warnings.append(message)), \
+         patch.dict(os.environ, {"DB_POOL_WAIT_MS": "750", "DB_POOL_LOOP_WAIT_MS": "100"}):
+        assert connection_module._pool_wait_timeout() == 0.75
+        assert asyncio.run(on_loop()) == [0.1, 0.1, 0.1]
+
+    # Лог — только на первое сокращённое ожидание, дальше счётчик в snapshot()
+    assert len(warnings) == 1 and "DB_POOL_LOOP_WAIT_MS" in warnings[0]
+    assert fair_pool.snapshot()["counters"]["event_loop_checkouts"] == 3
+
+
+if __name__ == "__main__":
+    test_waiters_are_served_in_fifo_order()
+    test_timeout_raises_pool_error_and_leaves_queue()
+    test_async_waiter_does_not_block_event_loop()
+    test_tenant_settings_are_skipped_when_unchanged()
+    test_event_loop_wait_is_shortened_and_logged()
+    print("✅ Connection pool tests passed")
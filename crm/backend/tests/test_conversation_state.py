@@ -0,0 +1,214 @@
+"""
+Тесты горячего состояния диалога (services/conversation_state.py)
+"""
+import sys
+import os
+import asyncio
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import psycopg2
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db import bookings
+from services import conversation_state
+from services.conversation_state import ConversationState, ConversationStateStore
+
+
+def loaded_row():
+    future = (datetime.now() + timedelta(minutes=10)).isoformat()
+    past = (datetime.now() - timedelta(minutes=1)).isoformat()
+    history = [
+        ["Здравствуйте", "client", "2026-10-17T10:00:00", "text", 1],
+        ["Добрый день!", "bot", "2026-10-17T10:00:05", "text", 2],
+    ]
+    contexts = [
+        ["awaiting_feedback", json.dumps({"booking_id": 5}), future, "2026-10-17T09:00:00"],
+        ["stale", "{}", past, "2026-10-17T08:00:00"],
+    ]
+    return ("en", "assistant", {"service": "Маникюр"}, json.dumps(history), contexts)
+
+
+def test_load_is_one_query_on_one_connection(fake_db):
+    db = fake_db(rows=[loaded_row()])
+    with patch.object(conversation_state, "get_db_connection", db.connect):
+        state = conversation_state.load_conversation_state("ig_1", 7, history_limit=10)
+
+    assert len(db.connections) == 1 and len(db.executed) == 1
+    sql, params = db.executed[0]
+    assert "FROM booking_drafts" in sql and "FROM chat_history" in sql and "FROM conversation_context" in sql
+    assert params[:5] == ("ig_1", "ig_1", 7, 7, 10)
+
+    assert state.language == "en" and state.bot_mode == "assistant"
+    assert state.get_booking_progress() == {"service": "Маникюр"}
+    assert state.history_tuples()[-1] == ("Добрый день!", "bot", "2026-10-17T10:00:05", "text", 2)
+    assert state.get_context("awaiting_feedback")["data"] == {"booking_id": 5}
+    # Контекст истёк между загрузкой и ходом — считается неактивным
+    assert not state.has_context("stale")
+
+    db = fake_db()
+    with patch.object(conversation_state, "get_db_connection", db.connect):
+        empty = conversation_state.load_conversation_state("ig_new")
+    assert empty.language == "ru" and empty.bot_mode == "autopilot"
+    assert empty.history == [] and empty.booking_progress is None
+
+
+class DraftsTable:
+    """
+    booking_drafts с уникальным индексом по instagram_id.
+
+    Как в Postgres, все части одного statement'а (CTE и основной запрос)
+    видят снимок до него: DELETE из CTE ещё не виден INSERT'у.
+    """
+
+    def __init__(self, *keys):
+        self.keys = set(keys)
+
+    def __call__(self, sql, params):
+        params = list(params or [])
+        snapshot = set(self.keys)
+        after = set(snapshot)
+        if "DELETE FROM booking_drafts WHERE instagram_id = %s" in sql:
+            after.discard(params[sql.split("DELETE FROM booking_drafts")[0].count("%s")])
+        if "INSERT INTO booking_drafts" in sql:
+            key = params[sql.split("INSERT INTO booking_drafts")[0].count("%s")]
+            if key in snapshot:
+                raise psycopg2.IntegrityError(
+                    'duplicate key value violates unique constraint "idx_booking_drafts_instagram_id_unique"'
+                )
+            after.add(key)
+        self.keys = after
+        return [(1,)]
+
+
+def test_turn_changes_are_written_in_one_transaction(fake_db):
+    drafts = DraftsTable("ig_1")
+    db = fake_db(rules=[("booking_drafts", drafts)])
+    store = ConversationStateStore(maxsize=10, ttl=60)
+    state = ConversationState(client_id="ig_1", company_id=7, booking_progress={"service": "Маникюр"})
+
+    def draft_row(c, instagram_id, progress):
+        progress["master"] = "Anna"
+        return "instagram_id", ["instagram_id", "data"], [instagram_id, json.dumps(progress)]
+
+    # Модель ловит прежнюю форму записи: DELETE в CTE + INSERT одним statement'ом
+    try:
+        drafts("WITH dropped AS (DELETE FROM booking_drafts WHERE instagram_id = %s RETURNING 1) "
+               "INSERT INTO booking_drafts (instagram_id, data) VALUES (%s, %s)", ["ig_1", "ig_1", "{}"])
+        raise AssertionError("single-statement rewrite must hit the unique index")
+    except psycopg2.IntegrityError:
+        pass
+
+    with patch.object(conversation_state, "get_db_connection", db.connect), \
+            patch.object(bookings, "_booking_drafts_key_column", lambda c: "instagram_id"), \
+            patch.object(bookings, "booking_draft_row", draft_row):
+        # Ничего не менялось — в БД не ходим
+        assert not conversation_state.write_conversation_state(state)
+        assert not db.connections
+
+        state.set_language("ru")
+        assert not state.has_pending_writes
+        state.set_language("ar")
+        # Второй шаг записи: черновик клиента уже есть в таблице
+        state.update_booking_progress({"master": "anna", "phone": "+971500000000"})
+        assert store.flush(state, broadcast=False)
+
+        assert len(db.connections) == 1 and db.commits == 1 and db.rollbacks == 0
+        assert len(db.executed) == 2
+        sql, params = db.executed[0]
+        assert sql.startswith("WITH lang AS (UPDATE clients SET detected_language = %s")
+        assert sql.endswith("dropped AS (DELETE FROM booking_drafts WHERE instagram_id = %s RETURNING 1) SELECT 1")
+        assert params == ["ar", "ig_1", "ig_1"]
+        sql, params = db.executed[1]
+        assert sql == "INSERT INTO booking_drafts (instagram_id, data) VALUES (%s, %s)"
+        assert json.loads(params[1])["phone"] == "+971500000000"
+        assert drafts.keys == {"ig_1"}
+        assert state.booking_progress["master"] == "Anna" and not state.has_pending_writes
+
+        # Следующий шаг снова перезаписывает существующий черновик
+        state.update_booking_progress({"date": "2026-10-20"})
+        assert store.flush(state, broadcast=False)
+        assert db.rollbacks == 0 and drafts.keys == {"ig_1"}
+
+        # Очистка прогресса — только DELETE
+        state.clear_booking_progress()
+        assert conversation_state.write_conversation_state(state)
+        sql, params = db.executed[-1]
+        assert sql == "WITH dropped AS (DELETE FROM booking_drafts WHERE instagram_id = %s RETURNING 1) SELECT 1"
+        assert params == ["ig_1"]
+        assert drafts.keys == set()
+
+
+def test_store_caches_appends_and_invalidates():
+    loads = []
+    published = []
+
+    def load(client_id, company_id=None, history_limit=10):
+        loads.append((client_id, company_id))
+        return ConversationState(client_id=client_id, company_id=company_id, history_limit=2)
+
+    store = ConversationStateStore(maxsize=10, ttl=60)
+    with patch.object(conversation_state, "load_conversation_state", load), \
+            patch.object(conversation_state, "_publish_invalidation", lambda *args: published.append(args)):
+        state = store.get("ig_1", 7)
+        assert store.get("ig_1", 7) is state
+        assert store.get("ig_1", 8) is not state
+        assert loads == [("ig_1", 7), ("ig_1", 8)]
+
+        # save_message дописывает сообщения в копию, история ограничена лимитом
+        for text in ["a", "b", "c"]:
+            store.record_message("ig_1", 7, text, "client", "text", "2026-10-17T10:00:00", 1)
+        assert [m[0] for m in state.history_tuples()] == ["b", "c"]
+        assert published[-1] == ("ig_1", 7)
+
+        # Ответ менеджера из CRM — следующий ход перечитает состояние
+        assert store.invalidate("ig_1", 7)
+        assert store.get("ig_1", 7) is not state
+        assert len(loads) == 3
+
+        # Запись хода рассылает инвалидацию, даже если писать было нечего
+        published.clear()
+        with patch.object(conversation_state, "write_conversation_state", lambda s: False):
+            assert not store.flush(store.get("ig_1", 7))
+        assert published == [("ig_1", 7)]
+
+        # Сбой записи — копия с незаписанными изменениями выбрасывается
+        def failing_write(s):
+            raise RuntimeError("db down")
+
+        with patch.object(conversation_state, "write_conversation_state", failing_write):
+            assert not store.flush(store.get("ig_1", 7))
+        store.get("ig_1", 7)
+        assert len(loads) == 4
+
+    stats = store.stats()
+    assert stats["loads"] == 4 and stats["invalidations"] == 2
+
+
+def test_pubsub_invalidation_skips_own_worker():
+    conversation_state.conversation_states.clear()
+    with patch.object(conversation_state, "load_conversation_state",
+                      lambda client_id, company_id=None, history_limit=10: ConversationState(client_id, company_id)):
+        state = conversation_state.get_conversation_state("ig_9", 3)
+        handler = conversation_state._conversation_pubsub_handler
+
+        asyncio.run(handler("crm:conversation:invalidate",
+                            {"client_id": "ig_9", "company_id": 3, "origin": conversation_state._WORKER_ID}))
+        assert conversation_state.get_conversation_state("ig_9", 3) is state
+
+        asyncio.run(handler("crm:conversation:invalidate", {"client_id": "ig_9", "company_id": "3", "origin": "other"}))
+        assert conversation_state.get_conversation_state("ig_9", 3) is not state
+    conversation_state.conversation_states.clear()
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_load_is_one_query_on_one_connection(FakeDatabase)
+    test_turn_changes_are_written_in_one_transaction(FakeDatabase)
+    test_store_caches_appends_and_invalidates()
+    test_pubsub_invalidation_skips_own_worker()
+    print("✅ Conversation state tests passed")
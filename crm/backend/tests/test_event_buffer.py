@@ -0,0 +1,114 @@
+"""
+Тесты буфера пакетной записи трекинга (utils/event_buffer.py)
+"""
+import sys
+import os
+import time
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.event_buffer import EventBuffer
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_flushes_by_size_and_by_time():
+    batches = []
+    buffer = EventBuffer("test_size", batches.append, max_batch=3, max_delay_ms=5000)
+    try:
+        for i in range(7):
+            assert buffer.add(i)
+        # Полная пачка будит поток сразу, не дожидаясь 5-секундного таймера
+        assert _wait_for(lambda: sum(len(batch) for batch in batches) == 7)
+        assert all(len(batch) <= 3 for batch in batches)
+        assert [event for batch in batches for event in batch] == list(range(7))
+    finally:
+        buffer.shutdown()
+
+    timed = []
+    buffer = EventBuffer("test_time", timed.append, max_batch=100, max_delay_ms=50)
+    try:
+        buffer.add("a")
+        buffer.add("b")
+        assert _wait_for(lambda: timed == [["a", "b"]])
+    finally:
+        buffer.shutdown()
+
+
+def test_shutdown_flushes_pending_and_bounds_queue():
+    batches = []
+    buffer = EventBuffer("test_shutdown", batches.append, max_batch=10, max_pending=4, autostart=False)
+    assert all(buffer.add(i) for i in range(4))
+    assert buffer.add(4) is False  # переполнение: событие отброшено, не блокирует запрос
+    assert batches == []
+
+    buffer.shutdown()
+    assert batches == [[0, 1, 2, 3]]
+    stats = buffer.stats()
+    assert stats["written"] == 4 and stats["dropped"] == 1 and stats["pending"] == 0
+
+
+def test_failed_batch_is_retried_once_then_dropped():
+    calls = []
+
+    def flaky(events):
+        calls.append(list(events))
+        if len(calls) <= 1:
+            raise RuntimeError("connection reset")
+
+    buffer = EventBuffer("test_retry", flaky, max_batch=10, autostart=False)
+    buffer.add("x")
+    assert buffer.flush() == 0
+    assert buffer.flush() == 1
+    assert calls == [["x"], ["x"]]
+
+    def broken(events):
+        raise RuntimeError("database is down")
+
+    buffer = EventBuffer("test_drop", broken, max_batch=10, autostart=False)
+    buffer.add("y")
+    buffer.shutdown()
+    stats = buffer.stats()
+    assert stats["dropped"] == 1 and stats["failed_batches"] == 2 and stats["written"] == 0
+
+
+def test_track_visitor_dedups_in_memory_and_batches_insert(fake_db):
+    from db import visitor_tracking
+
+    db = fake_db()
+
+    buffer = EventBuffer("test_visitors", visitor_tracking.flush_visitor_events, max_batch=100, autostart=False)
+    with patch.object(visitor_tracking, "visitor_buffer", buffer), \
+         patch.object(visitor_tracking, "get_visitor_location_data", lambda ip: None), \
+         patch.object(visitor_tracking, "get_db_connection", db.connect):
+        visitor_tracking._recent_visits.clear()
+        assert visitor_tracking.track_visitor("10.0.0.1", "Mozilla/5.0 (iPhone) Mobile Safari", "/")
+        assert not visitor_tracking.track_visitor("10.0.0.1", "Mozilla/5.0 (iPhone) Mobile Safari", "/")
+        assert visitor_tracking.track_visitor("10.0.0.1", "Mozilla/5.0 (iPhone) Mobile Safari", "/prices")
+        assert visitor_tracking.track_visitor("10.0.0.2", "Mozilla/5.0 Chrome/120", "/")
+        buffer.shutdown()
+
+    assert len(db.executed) == 1 and db.commits == 1
+    sql, params = db.executed[0]
+    assert sql.startswith("INSERT INTO visitor_tracking") and sql.count("INTERVAL '1 millisecond'") == 3
+    assert len(params) == 3 * 14
+    assert params[11:13] == ["Mobile", "Safari"]
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_flushes_by_size_and_by_time()
+    test_shutdown_flushes_pending_and_bounds_queue()
+    test_failed_batch_is_retried_once_then_dropped()
+    test_track_visitor_dedups_in_memory_and_batches_insert(FakeDatabase)
+    print("✅ Event buffer tests passed")
@@ -0,0 +1,144 @@
+"""
+Тесты офлайн-геолокации (utils/geoip.py)
+"""
+import sys
+import os
+import asyncio
+import tempfile
+import time
+from unittest.mock import patch
+
+import httpx
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.geoip as geoip
+import utils.http_clients as http_clients
+from utils.geoip import GeoLocator, RangeTableBackend, compile_range_table, open_backend
+
+
+CSV_ROWS = """network,start_ip,end_ip,country,city,latitude,longitude
+5.30.0.0/15,,,United Arab Emirates,Dubai,25.2048,55.2708
+,8.8.8.0,8.8.8.255,United States,Mountain View,37.386,-122.0838
+2a00:1450::/32,,,Ireland,Dublin,53.3498,-6.2603
+"""
+
+
+def _build_table(directory):
+    csv_path = os.path.join(directory, "ranges.csv")
+    with open(csv_path, "w", encoding="utf-8") as handle:
+        handle.write(CSV_ROWS)
+    table_path = os.path.join(directory, "geoip.bin")
+    summary = compile_range_table(csv_path, table_path)
+    return table_path, summary
+
+
+def test_range_table_lookup():
+    import ipaddress
+
+    with tempfile.TemporaryDirectory() as directory:
+        table_path, summary = _build_table(directory)
+        assert summary == {"ipv4_ranges": 2, "ipv6_ranges": 1, "locations": 3}
+
+        backend = RangeTableBackend(table_path)
+        try:
+            assert backend.lookup(ipaddress.ip_address("5.31.200.1"))["city"] == "Dubai"
+            assert backend.lookup(ipaddress.ip_address("8.8.8.8"))["country"] == "United States"
+            assert backend.lookup(ipaddress.ip_address("2a00:1450:4001::1"))["city"] == "Dublin"
+            assert backend.lookup(ipaddress.ip_address("8.8.9.1")) is None
+            assert backend.lookup(ipaddress.ip_address("1.1.1.1")) is None
+        finally:
+            backend.close()
+
+
+def test_locator_caches_and_reloads_replaced_file():
+    with tempfile.TemporaryDirectory() as directory:
+        table_path, _ = _build_table(directory)
+        locator = GeoLocator(path=table_path, cache_size=100, cache_ttl=3600)
+
+        assert locator.lookup("5.30.1.1")["city"] == "Dubai"
+        assert locator.lookup("5.30.1.1")["city"] == "Dubai"
+        assert locator.lookup("1.1.1.1") == {}  # промах базы — пустой dict, не None
+        assert locator.lookup("1.1.1.1") == {}
+        assert locator.backend_lookups == 2  # повторы обслужены из LRU
+
+        # Новая база на месте старой: воркер замечает смену mtime
+        with open(os.path.join(directory, "ranges.csv"), "a", encoding="utf-8") as handle:
+            handle.write("1.1.1.0/24,,,Australia,Sydney,-33.8688,151.2093\n")
+        compile_range_table(os.path.join(directory, "ranges.csv"), table_path)
+        os.utime(table_path, (time.time() + 5, time.time() + 5))
+        locator.reload()
+        assert locator.lookup("1.1.1.1")["city"] == "Sydney"
+        assert locator.stats()["backend"] == "range_table"
+
+
+def test_locator_without_database():
+    locator = GeoLocator(path=os.path.join(tempfile.gettempdir(), "missing-geoip.bin"))
+    assert locator.lookup("8.8.8.8") is None
+    assert not locator.available
+
+
+def test_backend_is_picked_by_content_not_extension():
+    with tempfile.TemporaryDirectory() as directory:
+        table_path, _ = _build_table(directory)
+        renamed = os.path.join(directory, "geoip.mmdb")
+        os.rename(table_path, renamed)
+        backend = open_backend(renamed)
+        assert backend.name == "range_table"
+        backend.close()
+
+        garbage = os.path.join(directory, "geoip.bin")
+        with open(garbage, "wb") as handle:
+            handle.write(b"<html>rate limited</html>")
+        try:
+            open_backend(garbage)
+            assert False, "unknown format must be rejected"
+        except ValueError:
+            pass
+
+
+def _refresh(url, body, path):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body)))
+
+    async def run():
+        try:
+            return await geoip.refresh_geoip_database(url, path)
+        finally:
+            await client.aclose()
+
+    with patch.object(http_clients, "get_http_client", lambda url: client), \
+            patch.object(geoip.geo_locator, "reload"):
+        return asyncio.run(run())
+
+
+def test_refresh_validates_download_before_replacing_database():
+    with tempfile.TemporaryDirectory() as directory:
+        table_path, _ = _build_table(directory)
+        with open(table_path, "rb") as handle:
+            working = handle.read()
+
+        # Битая загрузка (не база) не затирает рабочий файл
+        assert not _refresh("https://geo.example.com/db.mmdb", b"<html>oops</html>", table_path)
+        with open(table_path, "rb") as handle:
+            assert handle.read() == working
+
+        # CSV компилируется рядом, проверяется и только потом подменяет базу
+        csv_body = (CSV_ROWS + "1.1.1.0/24,,,Australia,Sydney,-33.8688,151.2093\n").encode()
+        assert _refresh("https://geo.example.com/ranges.csv?v=2", csv_body, table_path)
+        backend = open_backend(table_path)
+        try:
+            import ipaddress
+            assert backend.lookup(ipaddress.ip_address("1.1.1.1"))["city"] == "Sydney"
+        finally:
+            backend.close()
+        assert sorted(os.listdir(directory)) == ["geoip.bin", "ranges.csv"]
+
+
+if __name__ == "__main__":
+    test_range_table_lookup()
+    test_locator_caches_and_reloads_replaced_file()
+    test_locator_without_database()
+    test_backend_is_picked_by_content_not_extension()
+    test_refresh_validates_download_before_replacing_database()
+    print("✅ GeoIP tests passed")
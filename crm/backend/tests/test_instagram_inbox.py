@@ -0,0 +1,107 @@
+"""
+Тесты очереди входящих Instagram (services/instagram_inbox.py)
+"""
+import sys
+import os
+import asyncio
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import instagram_inbox as inbox_module
+from services.instagram_inbox import InstagramInbox
+
+
+def _message(sender, mid, text="hi", is_echo=False):
+    event = {"sender": {"id": sender}, "recipient": {"id": "page"}, "message": {"mid": mid, "text": text}}
+    if is_echo:
+        event = {"sender": {"id": "page"}, "recipient": {"id": sender}, "message": {"mid": mid, "text": text, "is_echo": True}}
+    return event
+
+
+def test_split_webhook_events():
+    data = {"object": "instagram", "entry": [{"messaging": [
+        _message("client_a", "m1"),
+        _message("client_a", "m1"),  # повтор внутри одного тела
+        _message("client_b", "m2", is_echo=True),
+        {"sender": {"id": "client_a"}, "recipient": {"id": "page"}, "sender_action": "typing_on"},
+        {"sender": {"id": "client_a"}, "recipient": {"id": "page"}, "read": {"mid": "m0"}},
+    ]}]}
+    durable, ephemeral = inbox_module.split_webhook_events(data)
+    assert [(mid, conversation) for mid, conversation, _ in durable] == [("m1", "client_a"), ("m2", "client_b")]
+    assert len(ephemeral) == 1 and ephemeral[0]["sender_action"] == "typing_on"
+
+
+def test_enqueue_uses_single_insert_with_mid_conflict(fake_db):
+    db = fake_db(rows=[("m1",)])
+
+    events = [("m1", "client_a", _message("client_a", "m1")), ("m2", "client_a", _message("client_a", "m2"))]
+    with patch.object(inbox_module, "get_db_connection", db.connect):
+        accepted = inbox_module.enqueue_instagram_events(events)
+
+    assert accepted == ["m1"]
+    assert len(db.executed) == 1 and db.commits == 1
+    sql, params = db.executed[0]
+    assert "ON CONFLICT (mid) DO NOTHING" in sql and sql.count("::jsonb") == 2
+    assert params[0] == "m1" and params[1] == "client_a"
+
+
+def test_worker_respects_concurrency_and_finishes_events():
+    queue = [
+        {"id": i, "mid": f"m{i}", "conversation_id": f"c{i}", "event": {"n": i}, "attempts": 1, "queued_seconds": 0.01}
+        for i in range(1, 8)
+    ]
+    finished = {}
+    claims = []
+    running = {"now": 0, "max": 0}
+
+    def fake_claim(worker_id, limit):
+        claims.append(limit)
+        batch = queue[:limit]
+        del queue[:limit]
+        return batch
+
+    def fake_finish(event_id, worker_id, error=None, attempts=1):
+        status = "done" if error is None else "pending"
+        finished[event_id] = status
+        return status
+
+    async def handler(event):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        if event["n"] == 3:
+            raise RuntimeError("LLM timeout")
+
+    async def run():
+        inbox = InstagramInbox(handler=handler, concurrency=3)
+        with patch.object(inbox_module, "claim_instagram_events", fake_claim), \
+             patch.object(inbox_module, "finish_instagram_event", fake_finish), \
+             patch.object(inbox_module, "purge_instagram_inbox", lambda: 0):
+            inbox.start()
+            for _ in range(100):
+                if len(finished) == 7:
+                    break
+                await asyncio.sleep(0.01)
+            await inbox.stop()
+        return inbox
+
+    inbox = asyncio.run(run())
+
+    assert running["max"] <= 3
+    assert all(limit <= 3 for limit in claims)
+    assert finished == {1: "done", 2: "done", 3: "pending", 4: "done", 5: "done", 6: "done", 7: "done"}
+    stats = inbox.stats()
+    assert stats["processed"] == 6 and stats["retried"] == 1
+    assert stats["queue_wait_ms"]["count"] == 7
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_split_webhook_events()
+    test_enqueue_uses_single_insert_with_mid_conflict(FakeDatabase)
+    test_worker_respects_concurrency_and_finishes_events()
+    print("✅ Instagram inbox tests passed")
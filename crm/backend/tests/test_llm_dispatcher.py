@@ -0,0 +1,182 @@
+"""
+Тесты диспетчера запросов к LLM (services/llm_dispatcher.py)
+"""
+import sys
+import os
+import asyncio
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import llm_dispatcher as dispatcher_module
+from services.llm_dispatcher import LLMDispatcher, LLMRejected, classify_response, parse_retry_after
+
+PAYLOAD = {"contents": [{"parts": [{"text": "hello"}]}], "generationConfig": {"maxOutputTokens": 100}}
+
+
+class FakeResponse:
+    def __init__(self, status_code, data, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self._data
+
+
+class FakeClient:
+    """Ответ зависит от ключа в URL: keys_to_status = {"key-a": 429, ...}."""
+
+    def __init__(self, keys_to_status):
+        self.keys_to_status = keys_to_status
+        self.calls = []
+
+    async def post(self, url, json=None, timeout=None, follow_redirects=False):
+        key = url.rsplit("key=", 1)[1]
+        self.calls.append(key)
+        status = self.keys_to_status.get(key, 200)
+        if status == 200:
+            return FakeResponse(200, {"candidates": [{"content": {"parts": [{"text": key}]}}]})
+        return FakeResponse(status, {"error": {"code": status, "message": "nope"}}, {"retry-after": "30"})
+
+
+def test_tenants_are_served_round_robin():
+    async def scenario():
+        dispatcher = LLMDispatcher(["key-000001"], [], key_rpm=0, key_tpm=0, concurrency=1)
+        first = await dispatcher.acquire("busy")
+        order = []
+
+        async def request(tenant, label):
+            grant = await dispatcher.acquire(tenant)
+            order.append(label)
+            await asyncio.sleep(0)
+            dispatcher.release(grant, "ok")
+
+        tasks = [asyncio.create_task(request("busy", f"busy-{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("quiet", "quiet-0")))
+        await asyncio.sleep(0)
+        dispatcher.release(first, "ok")
+        await asyncio.gather(*tasks)
+        return order
+
+    # «Тихая» компания не ждёт, пока «шумная» выберет всю свою очередь
+    assert asyncio.run(scenario()) == ["busy-0", "quiet-0", "busy-1", "busy-2"]
+
+
+def test_oversized_request_does_not_block_other_tenants():
+    async def scenario():
+        dispatcher = LLMDispatcher(["key-000001"], [], key_rpm=0, key_tpm=600, queue_timeout=0.3)
+        order = []
+
+        async def request(tenant, tokens, label):
+            try:
+                grant = await dispatcher.acquire(tenant, tokens)
+            except LLMRejected:
+                order.append(f"{label}-rejected")
+                return
+            order.append(label)
+            dispatcher.release(grant, "ok")
+
+        # Первый запрос выбирает почти весь TPM, следующий большой запрос ждёт пополнения
+        first = await dispatcher.acquire("big", 550)
+        dispatcher.release(first, "ok")
+        await asyncio.gather(request("big", 500, "big"), request("small", 10, "small"))
+        return order
+
+    # Маленький запрос другой компании не стоит за большим в голове очереди
+    assert asyncio.run(scenario()) == ["small", "big-rejected"]
+
+
+def test_non_json_5xx_is_retried_and_never_returns_none():
+    class ProxyPageResponse(FakeResponse):
+        def json(self):
+            raise ValueError("not json")
+
+    class ProxyClient:
+        def __init__(self):
+            self.calls = []
+
+        async def post(self, url, json=None, timeout=None, follow_redirects=False):
+            key = url.rsplit("key=", 1)[1]
+            self.calls.append(key)
+            if key == "key-aaaaaa":
+                return ProxyPageResponse(522, None)
+            return FakeResponse(200, ["unexpected"])
+
+    async def scenario():
+        dispatcher = LLMDispatcher(["key-aaaaaa", "key-bbbbbb"], [], key_rpm=0, key_tpm=0)
+        client = ProxyClient()
+        with patch.object(dispatcher_module, "get_http_client", lambda url, proxy=None: client):
+            return client, await dispatcher.generate(PAYLOAD, company_id=1)
+
+    client, data = asyncio.run(scenario())
+    assert client.calls == ["key-aaaaaa", "key-bbbbbb"]
+    assert isinstance(data, dict) and "error" in data
+
+
+def test_rate_limited_key_is_skipped_without_sleeping():
+    async def scenario():
+        dispatcher = LLMDispatcher(["key-aaaaaa", "key-bbbbbb"], [], key_rpm=0, key_tpm=0)
+        client = FakeClient({"key-aaaaaa": 429})
+        with patch.object(dispatcher_module, "get_http_client", lambda url, proxy=None: client):
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            first = await dispatcher.generate(PAYLOAD, company_id=1)
+            second = await dispatcher.generate(PAYLOAD, company_id=1)
+            elapsed = loop.time() - started
+        return dispatcher, client, first, second, elapsed
+
+    dispatcher, client, first, second, elapsed = asyncio.run(scenario())
+    assert first["candidates"][0]["content"]["parts"][0]["text"] == "key-bbbbbb"
+    assert second["candidates"][0]["content"]["parts"][0]["text"] == "key-bbbbbb"
+    # 429 отправил ключ в cooldown (Retry-After 30 c): второй запрос сразу на здоровый ключ
+    assert client.calls == ["key-aaaaaa", "key-bbbbbb", "key-bbbbbb"]
+    assert elapsed < 1
+
+    stats = dispatcher.stats()
+    limited = next(key for key in stats["keys"] if key["label"] == "...aaaaaa")
+    assert limited["health"] < 1 and limited["cooldown_seconds"] > 25
+    assert stats["outcomes"] == {"rate_limited": 1, "ok": 2}
+    assert stats["queue_wait_ms"]["count"] == 3 and stats["upstream_ms"]["count"] == 3
+
+
+def test_exhausted_bucket_rejects_after_queue_timeout():
+    async def scenario():
+        dispatcher = LLMDispatcher(["key-000001"], [], key_rpm=6, key_tpm=0, queue_timeout=0.2)
+        grant = await dispatcher.acquire(1)
+        dispatcher.release(grant, "ok")
+        try:
+            await dispatcher.acquire(2)
+        except LLMRejected as e:
+            return dispatcher, str(e)
+        return dispatcher, None
+
+    dispatcher, error = asyncio.run(scenario())
+    assert error and "Rate limit" in error
+    stats = dispatcher.stats()
+    assert stats["rejections"] == {"queue_timeout": 1} and stats["queued"] == 0 and stats["in_flight"] == 0
+
+
+def test_response_classification():
+    assert classify_response(200, {"candidates": []}) == "ok"
+    assert classify_response(200, {"error": {"code": 429}}) == "rate_limited"
+    assert classify_response(403, {"error": {"code": 403}}) == "forbidden"
+    assert classify_response(503, None) == "server_error"
+    assert classify_response(522, None) == "server_error"
+    assert classify_response(200, {"error": {"code": 520}}) == "server_error"
+    assert classify_response(400, {"error": {"code": 400}}) == "error"
+    details = {"error": {"details": [{"retryDelay": "17s"}]}}
+    assert parse_retry_after({}, details) == 17.0
+    assert parse_retry_after({"retry-after": "5"}, details) == 5.0
+
+
+if __name__ == "__main__":
+    test_tenants_are_served_round_robin()
+    test_oversized_request_does_not_block_other_tenants()
+    test_non_json_5xx_is_retried_and_never_returns_none()
+    test_rate_limited_key_is_skipped_without_sleeping()
+    test_exhausted_bucket_rejects_after_queue_timeout()
+    test_response_classification()
+    print("✅ LLM dispatcher tests passed")
@@ -0,0 +1,90 @@
+"""
+Тесты кэша секций промпта бота (bot/prompt_cache.py, PromptBuilder)
+"""
+import sys
+import os
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot import prompt_cache
+from bot import prompts
+from bot.prompts import PromptBuilder
+
+
+def test_sections_cached_per_company_language_and_versions():
+    prompt_cache.clear_prompt_sections()
+    builds = []
+    catalog_version = {"value": 1}
+
+    def build():
+        builds.append(1)
+        return {"services_list": f"build #{len(builds)}"}
+
+    with patch.object(prompt_cache, "get_catalog_version", lambda company_id: catalog_version["value"]):
+        assert prompt_cache.get_prompt_sections(1, "ru", build) == {"services_list": "build #1"}
+        assert prompt_cache.get_prompt_sections(1, "ru", build) == {"services_list": "build #1"}
+        # Другой язык и другая компания — свои записи
+        prompt_cache.get_prompt_sections(1, "en", build)
+        prompt_cache.get_prompt_sections(2, "ru", build)
+        assert len(builds) == 3
+
+        # Изменился каталог (триггер поднял версию) — пересборка
+        catalog_version["value"] = 2
+        assert prompt_cache.get_prompt_sections(1, "ru", build) == {"services_list": "build #4"}
+
+        # Изменились настройки компании — тоже пересборка
+        from db.settings import invalidate_settings_cache
+        invalidate_settings_cache(1, broadcast=False)
+        assert prompt_cache.get_prompt_sections(1, "ru", build) == {"services_list": "build #5"}
+
+    # Без tenant-контекста кэш не используется
+    prompt_cache.get_prompt_sections(None, "ru", build)
+    prompt_cache.get_prompt_sections(None, "ru", build)
+    assert len(builds) == 7
+
+
+def test_masters_list_uses_two_queries_on_one_connection(fake_db):
+    masters = [
+        (1, "Anna", "Nail master", "5 years", None),
+        (2, "Bella", "Stylist", None, 3),
+        (3, "Cora", "Admin", None, None),
+    ]
+    services = [
+        (1, "Manicure", "Nails", 100, None, None, 60, True),
+        (1, "Pedicure", "Nails", None, 120, 150, None, False),
+        (2, "Haircut", "Hair", 200, None, None, None, True),
+    ]
+    db = fake_db(rows=services, rules=[("SELECT id, full_name", masters)])
+    executed = db.executed
+
+    builder = PromptBuilder(salon={"currency": "AED"}, bot_settings={})
+    with patch.object(prompts, "get_db_connection", db.connect), \
+         patch.object(prompts, "column_exists", lambda table, column, cursor=None: True):
+        text = builder._build_masters_list("ru")
+
+    assert len(executed) == 2 and len(db.connections) == 1 and db.connections[0].closed
+    assert executed[1][1] == ([1, 2, 3],)
+    assert "👤 Anna" in text and "👤 Bella" in text and "Cora" not in text
+    assert "  - Manicure (Nails) - 100 AED, 60 min\n" in text
+    assert "  - Pedicure (Nails) - 120-150 AED (только по телефону)\n" in text
+    assert text.index("Manicure") < text.index("Bella") < text.index("Haircut")
+
+
+def test_prompt_build_is_measured():
+    before = prompt_cache.prompt_build_stats()["builds"]["builds"]
+    with prompt_cache.measure_prompt_build():
+        pass
+    stats = prompt_cache.prompt_build_stats()
+    assert stats["builds"]["builds"] == before + 1
+    assert "hit_rate" in stats["sections_cache"]
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_sections_cached_per_company_language_and_versions()
+    test_masters_list_uses_two_queries_on_one_connection(FakeDatabase)
+    test_prompt_build_is_measured()
+    print("✅ Prompt cache tests passed")
@@ -0,0 +1,65 @@
+"""
+Тесты профилировщика SQL (utils/query_profiler.py)
+"""
+import sys
+import os
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import query_profiler
+
+
+def test_fingerprint_normalizes_literals_and_lists():
+    first = query_profiler.fingerprint_sql("""
+        SELECT * FROM bookings  -- comment
+        WHERE id = 15 AND status = 'done' AND master_user_id IN (1, 2, 3)
+    """)
+    second = query_profiler.fingerprint_sql(
+        "select * from bookings where id = %s and status = %s and master_user_id in (%s, %s)"
+    )
+    assert first == second == (
+        "select * from bookings where id = ? and status = ? and master_user_id in (?, ...)"
+    )
+
+    values = query_profiler.fingerprint_sql("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)")
+    assert values == "insert into t (a, b) values (?, ...), ..."
+    # Цифры в идентификаторах не трогаем
+    assert "idx_t2" in query_profiler.fingerprint_sql("CREATE INDEX idx_t2 ON t (a)")
+
+
+def test_request_profile_detects_n_plus_one_per_route():
+    profiler = query_profiler.QueryProfiler(n_plus_one_threshold=3)
+    query_profiler.register_query_observer(profiler)
+    try:
+        token = query_profiler.start_request_profile()
+        for client_id in range(5):
+            query_profiler.record_query(f"SELECT name FROM clients WHERE instagram_id = '{client_id}'", 2.0, 1)
+        query_profiler.record_query("SELECT COUNT(*) FROM bookings", 10.0, 1)
+
+        profile = query_profiler.current_request_profile()
+        assert profile.query_count == 6
+        assert 'db;dur=20.0;desc="6 queries"' in profile.server_timing()
+
+        offenders = profiler.finish_request(profile, "GET /api/clients")
+        query_profiler.finish_request_profile(token, "GET /api/other")
+    finally:
+        query_profiler.unregister_query_observer(profiler)
+
+    assert len(offenders) == 1 and offenders[0]["calls"] == 5
+
+    report = profiler.report(sort="calls")
+    top = report["fingerprints"][0]
+    assert top["fingerprint"] == "select name from clients where instagram_id = ?"
+    assert top["calls"] == 5
+    assert top["p95_ms"] == 2.0
+    assert report["n_plus_one"][0]["route"] == "GET /api/clients"
+    route = report["routes"][0]
+    assert route["route"] == "GET /api/clients"
+    assert route["queries_per_request"] == 6
+
+
+if __name__ == "__main__":
+    test_fingerprint_normalizes_literals_and_lists()
+    test_request_profile_detects_n_plus_one_per_route()
+    print("✅ Query profiler tests passed")
@@ -0,0 +1,73 @@
+"""
+Тесты кэша схемы БД (db/schema_catalog.py)
+"""
+import sys
+import os
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db import schema_catalog
+
+
+ROWS = [
+    ("bookings", "id"),
+    ("bookings", "master_user_id"),
+    ("users", "secondary_role"),
+]
+
+
+def test_catalog_loads_once_until_invalidated(fake_cursor):
+    schema_catalog.invalidate_schema_catalog(broadcast=False)
+    cursor = fake_cursor(rows=ROWS)
+
+    assert schema_catalog.column_exists("bookings", "master_user_id", cursor)
+    assert not schema_catalog.column_exists("bookings", "promo_code", cursor)
+    assert schema_catalog.table_exists("users", cursor)
+    assert not schema_catalog.table_exists("booking_drafts", cursor)
+    assert schema_catalog.get_table_columns("missing", cursor) == frozenset()
+    assert len(cursor.executed) == 1
+
+    cursor.rows = ROWS + [("bookings", "promo_code")]
+    schema_catalog.invalidate_schema_catalog(broadcast=False)
+    assert schema_catalog.column_exists("bookings", "promo_code", cursor)
+    assert len(cursor.executed) == 2
+
+
+def test_invalidation_during_load_is_not_cached(fake_cursor):
+    schema_catalog.invalidate_schema_catalog(broadcast=False)
+    cursor = fake_cursor(rows=ROWS)
+    cursor.on_execute = lambda: schema_catalog.invalidate_schema_catalog(broadcast=False)
+
+    # Прочитанный снимок отдаётся вызывающему, но следующий вызов перечитает схему
+    assert schema_catalog.column_exists("users", "secondary_role", cursor)
+    cursor.on_execute = None
+    assert schema_catalog.column_exists("users", "secondary_role", cursor)
+    assert len(cursor.executed) == 2
+
+
+def test_dict_cursor_rows_are_read_by_column_name(fake_cursor):
+    from psycopg2.extras import RealDictRow
+
+    schema_catalog.invalidate_schema_catalog(broadcast=False)
+    rows = []
+    for table_name, column_name in ROWS:
+        row = RealDictRow()
+        row["table_name"], row["column_name"] = table_name, column_name
+        rows.append(row)
+    # schedule.py передаёт курсор с cursor_factory=RealDictCursor
+    cursor = fake_cursor(rows=rows)
+
+    assert schema_catalog.column_exists("bookings", "master_user_id", cursor)
+    assert schema_catalog.column_exists("users", "secondary_role")
+    assert not schema_catalog.table_exists("table_name")
+    schema_catalog.invalidate_schema_catalog(broadcast=False)
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeCursor
+
+    test_catalog_loads_once_until_invalidated(FakeCursor)
+    test_invalidation_during_load_is_not_cached(FakeCursor)
+    test_dict_cursor_rows_are_read_by_column_name(FakeCursor)
+    print("✅ Schema catalog tests passed")
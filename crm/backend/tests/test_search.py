@@ -0,0 +1,61 @@
+"""
+Тесты построения поисковых запросов (db/search.py)
+"""
+import sys
+import os
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import db.search as search_db
+
+
+# Проверка pg_trgm читает fetchone(), остальные запросы возвращают пустой список
+TRGM_RULES = [("pg_extension", [(1,)])]
+
+
+def test_prefix_tsquery_is_sanitized():
+    assert search_db.build_prefix_tsquery("Анна  Kol") == "анна:* & kol:*"
+    assert search_db.build_prefix_tsquery("o'neil & (x | y):*") == "o:* & neil:* & x:* & y:*"
+    assert search_db.build_prefix_tsquery("!!! ---") is None
+    assert search_db.normalize_phone_digits("+971 (50) 123-45-67") == "971501234567"
+    assert search_db.escape_like("50%_off\\") == "50\\%\\_off\\\\"
+    assert search_db.clamp_search_limit(10_000) == search_db.MAX_SEARCH_LIMIT
+    assert search_db.clamp_search_limit("bad") == 50
+
+
+def test_client_search_binds_every_parameter(fake_db):
+    db = fake_db(rules=TRGM_RULES)
+    log = db.executed
+    with patch.object(search_db, "get_db_connection", db.connect), \
+            patch.object(search_db, "_trgm_available", True):
+        assert search_db.search_clients("Anna 050", limit=20) == []
+
+    sql, params = log[-1]
+    assert "LIKE '%" not in sql
+    assert "search_vector @@ to_tsquery" in sql
+    assert "phone_digits LIKE %s" in sql
+    assert sql.replace("%%", "").count("%s") == len(params)
+    assert params[-1] == 20
+
+
+def test_suggestions_use_prefix_only(fake_db):
+    db = fake_db(rules=TRGM_RULES)
+    log = db.executed
+    with patch.object(search_db, "get_db_connection", db.connect):
+        search_db.get_search_suggestions("ann", limit=5)
+
+    client_sql, client_params = log[0]
+    service_sql, service_params = log[1]
+    assert list(client_params) == ["ann:*", 5]
+    assert list(service_params) == ["ann%", 5]
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeDatabase
+
+    test_prefix_tsquery_is_sanitized()
+    test_client_search_binds_every_parameter(FakeDatabase)
+    test_suggestions_use_prefix_only(FakeDatabase)
+    print("✅ Search tests passed")
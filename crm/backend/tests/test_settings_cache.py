@@ -0,0 +1,70 @@
+"""
+Тесты per-company кэша настроек (db/settings.py)
+"""
+import sys
+import os
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db import settings as settings_db
+
+
+def _company_row(company_id, name):
+    return {
+        "id": company_id,
+        "name": name,
+        "business_type": "beauty",
+        "custom_settings": {},
+        "currency": "AED",
+    }
+
+
+def test_salon_settings_are_cached_per_company():
+    rows = {101: _company_row(101, "Alpha"), 102: _company_row(102, "Beta")}
+    with patch.object(settings_db, "get_company_by_id", side_effect=lambda cid: rows.get(cid)) as loader, \
+            patch("utils.redis_pubsub.redis_pubsub.publish_nowait", return_value=False):
+        settings_db.invalidate_settings_cache(101)
+        settings_db.invalidate_settings_cache(102)
+
+        assert settings_db.get_salon_settings(101)["name"] == "Alpha"
+        assert settings_db.get_salon_settings(101)["name"] == "Alpha"
+        assert settings_db.get_salon_settings(102)["name"] == "Beta"
+        assert loader.call_count == 2
+
+
+def test_invalidation_bumps_version_and_reloads():
+    rows = {103: _company_row(103, "Old name")}
+    with patch.object(settings_db, "get_company_by_id", side_effect=lambda cid: rows.get(cid)) as loader, \
+            patch("utils.redis_pubsub.redis_pubsub.publish_nowait", return_value=True) as publish:
+        version_before = settings_db.get_settings_version(103)
+        assert settings_db.get_salon_settings(103)["name"] == "Old name"
+
+        rows[103] = _company_row(103, "New name")
+        settings_db.invalidate_settings_cache(103)
+
+        assert settings_db.get_settings_version(103) == version_before + 1
+        assert settings_db.get_salon_settings(103)["name"] == "New name"
+        assert loader.call_count == 2
+        publish.assert_called_once()
+
+
+def test_cached_settings_are_isolated_from_caller_mutations():
+    rows = {104: _company_row(104, "Gamma")}
+    with patch.object(settings_db, "get_company_by_id", side_effect=lambda cid: rows.get(cid)), \
+            patch("utils.redis_pubsub.redis_pubsub.publish_nowait", return_value=False):
+        settings_db.invalidate_settings_cache(104)
+        first = settings_db.get_salon_settings(104)
+        first["name"] = "mutated"
+        first["business_profile_config"]["modules"] = {}
+        second = settings_db.get_salon_settings(104)
+        assert second["name"] == "Gamma"
+        assert second["business_profile_config"]["modules"] != {}
+
+
+if __name__ == "__main__":
+    test_salon_settings_are_cached_per_company()
+    test_invalidation_bumps_version_and_reloads()
+    test_cached_settings_are_isolated_from_caller_mutations()
+    print("✅ Settings cache tests passed")
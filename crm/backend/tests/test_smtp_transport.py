@@ -0,0 +1,148 @@
+"""
+Тесты пула SMTP-сессий (utils/smtp_transport.py) и кэша лейаута писем
+"""
+import sys
+import os
+import asyncio
+from email.mime.text import MIMEText
+from unittest.mock import patch
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import aiosmtplib
+
+from utils.smtp_transport import SmtpTransport
+
+CONFIG = {'host': 'smtp.test', 'port': 587, 'user': 'robot@test.io', 'password': 'secret'}
+
+
+class FakeSMTP:
+    """Минимальный aiosmtplib.SMTP: считает соединения и письма"""
+    instances = []
+
+    def __init__(self, config, fail_first_send=None, refuse=()):
+        self.config = config
+        self.is_connected = False
+        self.logins = 0
+        self.sent = []
+        self.fail_first_send = fail_first_send
+        self.refuse = set(refuse)
+        FakeSMTP.instances.append(self)
+
+    async def connect(self):
+        await asyncio.sleep(0)
+        self.is_connected = True
+
+    async def login(self, user, password):
+        assert (user, password) == (CONFIG['user'], CONFIG['password'])
+        self.logins += 1
+
+    async def send_message(self, message):
+        await asyncio.sleep(0)
+        if self.fail_first_send is not None:
+            error, self.fail_first_send = self.fail_first_send, None
+            self.is_connected = False
+            raise error
+        if message['To'] in self.refuse:
+            raise aiosmtplib.SMTPRecipientsRefused([])
+        self.sent.append(message['To'])
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+def _message(to_email):
+    msg = MIMEText('hello', 'plain', 'utf-8')
+    msg['To'] = to_email
+    return msg
+
+
+def _transport(pool_size=2, **client_kwargs):
+    FakeSMTP.instances = []
+    return SmtpTransport(pool_size=pool_size, client_factory=lambda config: FakeSMTP(config, **client_kwargs))
+
+
+def test_batch_reuses_sessions():
+    transport = _transport(pool_size=2)
+    try:
+        results = transport.send_many([_message(f"user{i}@mail.io") for i in range(10)], CONFIG)
+        assert results == [True] * 10
+        # 10 писем — два соединения и два логина, а не десять
+        assert len(FakeSMTP.instances) == 2
+        assert sum(client.logins for client in FakeSMTP.instances) == 2
+        assert sum(len(client.sent) for client in FakeSMTP.instances) == 10
+
+        # Следующее письмо берёт сессию из пула
+        assert transport.send(_message("late@mail.io"), CONFIG) is True
+        assert transport.stats()["connects"] == 2
+    finally:
+        transport.shutdown()
+
+
+def test_reconnects_after_dropped_session():
+    FakeSMTP.instances = []
+    # Первое соединение обрывается на отправке, второе — рабочее
+    transport = SmtpTransport(pool_size=1, client_factory=lambda config: FakeSMTP(
+        config, fail_first_send=None if FakeSMTP.instances else aiosmtplib.SMTPServerDisconnected("bye"),
+    ))
+    try:
+        assert transport.send(_message("user@mail.io"), CONFIG) is True
+        assert len(FakeSMTP.instances) == 2
+        assert FakeSMTP.instances[1].sent == ["user@mail.io"]
+    finally:
+        transport.shutdown()
+
+
+def test_refused_recipient_keeps_session():
+    transport = _transport(pool_size=1, refuse={"bad@mail.io"})
+    try:
+        results = transport.send_many([_message("bad@mail.io"), _message("good@mail.io")], CONFIG)
+        assert results == [False, True]
+        assert len(FakeSMTP.instances) == 1
+    finally:
+        transport.shutdown()
+
+
+def test_async_api_from_running_loop():
+    transport = _transport(pool_size=3)
+
+    async def scenario():
+        single = await transport.send_async(_message("a@mail.io"), CONFIG)
+        batch = await transport.send_many_async([_message(f"b{i}@mail.io") for i in range(4)], CONFIG)
+        return single, batch
+
+    try:
+        single, batch = asyncio.run(scenario())
+        assert single is True and batch == [True] * 4
+        assert len(FakeSMTP.instances) <= 3
+    finally:
+        transport.shutdown()
+
+
+def test_email_layout_cached_per_template_and_language():
+    from utils import email_service
+
+    email_service._EMAIL_LAYOUT_CACHE.clear()
+    with patch.object(email_service, "get_salon_name", return_value="Studio"), \
+         patch.object(email_service, "get_logo_url", return_value=""), \
+         patch.object(email_service, "_render_email_layout", wraps=email_service._render_email_layout) as render:
+        first = email_service.wrap_email_html("Акция", "Скидка 20%", unsubscribe_link="https://x/u?email=a")
+        second = email_service.wrap_email_html("Акция", "Скидка 20%", unsubscribe_link="https://x/u?email=b")
+        english = email_service.wrap_email_html("Акция", "Скидка 20%", language="en")
+
+    assert render.call_count == 2  # ru один раз на оба письма + en
+    assert "email=a" in first and "email=b" in second and "email=a" not in second
+    assert "Отписаться от рассылки" in first and "Unsubscribe" in english
+
+
+if __name__ == "__main__":
+    test_batch_reuses_sessions()
+    test_reconnects_after_dropped_session()
+    test_refused_recipient_keeps_session()
+    test_async_api_from_running_loop()
+    test_email_layout_cached_per_template_and_language()
+    print("✅ SMTP transport tests passed")
@@ -0,0 +1,51 @@
+"""
+Тесты ограниченного in-process кэша TTLCache (utils/cache.py)
+"""
+import sys
+import os
+import time
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.cache import TTLCache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    local_cache = TTLCache(maxsize=2, ttl=60)
+    local_cache.set("a", 1)
+    local_cache.set("b", 2)
+    assert local_cache.get("a") == 1  # "a" становится самым свежим
+    local_cache.set("c", 3)
+
+    assert local_cache.get("b") is None
+    assert local_cache.get("a") == 1
+    assert local_cache.get("c") == 3
+    assert len(local_cache) == 2
+
+
+def test_ttl_cache_expires_entries():
+    local_cache = TTLCache(maxsize=10, ttl=0.05)
+    local_cache.set("session", {"id": 1})
+    assert "session" in local_cache
+    time.sleep(0.06)
+    assert local_cache.get("session") is None
+    assert "session" not in local_cache
+
+
+def test_ttl_cache_pop_and_stats():
+    local_cache = TTLCache(maxsize=10, ttl=60)
+    local_cache.set("k", "v")
+    assert local_cache.pop("k") == "v"
+    assert local_cache.pop("k") is None
+    assert local_cache.get("k") is None
+    stats = local_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["size"] == 0
+
+
+if __name__ == "__main__":
+    test_ttl_cache_evicts_least_recently_used()
+    test_ttl_cache_expires_entries()
+    test_ttl_cache_pop_and_stats()
+    print("✅ TTLCache tests passed")
@@ -0,0 +1,145 @@
+"""
+Тесты диспетчера исходящих вебхуков (services/webhook_dispatcher.py)
+"""
+import sys
+import os
+import asyncio
+from unittest.mock import patch
+
+import httpx
+
+# Добавляем путь к backend
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import webhook_dispatcher
+from services.webhook_dispatcher import WebhookDispatcher
+
+
+def _delivery(delivery_id, webhook_id=1, attempts=1, url="https://hooks.example.com/crm", is_active=True, secret="s3cret"):
+    return {
+        "id": delivery_id, "webhook_id": webhook_id, "company_id": 3, "event": "booking.created",
+        "payload": {"event": "booking.created", "data": {"booking_id": delivery_id}},
+        "attempts": attempts, "age_seconds": 0.5, "claimed_at": 0.0,
+        "url": url, "secret": secret, "is_active": is_active,
+    }
+
+
+def _result(delivery_id, webhook_id, status, status_code):
+    return {
+        "id": delivery_id, "webhook_id": webhook_id, "event": "booking.created", "payload": {},
+        "status": status, "status_code": status_code, "delay": 10.0 if status == "pending" else None,
+        "response": "", "duration_ms": 5, "error": None,
+    }
+
+
+def test_retry_policy():
+    assert webhook_dispatcher.resolve_outcome(_delivery(1), 204)["status"] == "delivered"
+    assert webhook_dispatcher.resolve_outcome(_delivery(1), 404)["status"] == "dead"
+
+    retry = webhook_dispatcher.resolve_outcome(_delivery(1, attempts=2), 503)
+    assert retry["status"] == "pending" and retry["delay"] > 0
+
+    network_error = webhook_dispatcher.resolve_outcome(_delivery(1), 0)
+    assert network_error["status"] == "pending"
+
+    last_attempt = _delivery(1, attempts=webhook_dispatcher.WEBHOOK_MAX_ATTEMPTS)
+    assert webhook_dispatcher.resolve_outcome(last_attempt, 503)["status"] == "dead"
+
+
+def test_backoff_grows_and_is_capped():
+    base = webhook_dispatcher.WEBHOOK_BACKOFF_BASE_SECONDS
+    first = webhook_dispatcher.backoff_seconds(1)
+    third = webhook_dispatcher.backoff_seconds(3)
+    assert base * 0.75 <= first <= base * 1.25
+    assert base * 4 * 0.75 <= third <= base * 4 * 1.25
+    assert webhook_dispatcher.backoff_seconds(60) <= webhook_dispatcher.WEBHOOK_BACKOFF_MAX_SECONDS * 1.25
+    # Retry-After получателя не даёт повторить раньше
+    assert webhook_dispatcher.backoff_seconds(1, retry_after=base * 3) >= base * 3
+
+
+def test_counter_updates_reset_on_success():
+    results = [
+        _result(1, 1, "pending", 500),
+        _result(2, 1, "delivered", 200),
+        _result(3, 1, "pending", 502),
+        _result(4, 2, "dead", 410),
+        _result(5, 3, "skipped", None),
+    ]
+    counters = {row[0]: row[1:] for row in webhook_dispatcher.webhook_counter_updates(results)}
+    assert counters == {1: (502, True, 1), 2: (410, False, 1)}
+
+
+def test_results_saved_in_one_transaction_and_failing_webhook_disabled(fake_db):
+    db = fake_db(rules=[("RETURNING id, company_id, name", [(2, 3, "ERP", "https://erp.example.com", 50)])])
+    results = [_result(1, 1, "delivered", 200), _result(2, 2, "pending", 500), _result(3, 2, "skipped", None)]
+
+    with patch.object(webhook_dispatcher, "get_db_connection", db.connect):
+        disabled = webhook_dispatcher.save_delivery_results("worker-1", results)
+
+    assert len(db.connections) == 1 and db.commits == 1
+    assert [item["id"] for item in disabled] == [2]
+    statements = [sql for sql, _ in db.executed]
+    log_inserts = [sql for sql in statements if sql.startswith("INSERT INTO webhook_logs")]
+    assert len(log_inserts) == 1
+    assert log_inserts[0].count("::jsonb") == 2  # пропущенная строка в журнал не попадает
+    assert sum(sql.startswith("UPDATE webhook_outbox o") for sql in statements) == 1
+    assert statements[-1].startswith("UPDATE webhook_outbox SET status = 'skipped'")
+    assert db.executed[-1][1] == ([2],)
+
+
+def test_dispatch_batch_is_bounded_and_signed():
+    in_flight = {"now": 0, "max": 0}
+    seen_headers = []
+
+    async def handler(request):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        seen_headers.append(request.headers)
+        await asyncio.sleep(0.01)
+        in_flight["now"] -= 1
+        return httpx.Response(500 if request.url.path == "/down" else 200)
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        deliveries = [_delivery(i) for i in range(1, 9)]
+        deliveries.append(_delivery(9, webhook_id=2, url="https://hooks.example.com/down"))
+        deliveries.append(_delivery(10, webhook_id=3, is_active=False))
+        dispatcher = WebhookDispatcher(concurrency=3)
+        with patch.object(webhook_dispatcher, "get_http_client", lambda url: client):
+            results = await dispatcher.dispatch_batch(deliveries)
+        await client.aclose()
+        return dispatcher, results
+
+    dispatcher, results = asyncio.run(run())
+
+    assert in_flight["max"] <= 3
+    assert len(seen_headers) == 9  # выключенный вебхук не вызывается
+    assert all(h["x-crm-signature"].startswith("sha256=") for h in seen_headers)
+    statuses = {result["id"]: result["status"] for result in results}
+    assert statuses[9] == "pending" and statuses[10] == "skipped"
+    stats = dispatcher.stats()
+    assert stats["delivered"] == 8 and stats["retried"] == 1 and stats["skipped"] == 1
+    assert stats["end_to_end_ms"]["count"] == 8 and stats["end_to_end_ms"]["p50"] >= 500
+
+
+def test_enqueue_failure_does_not_break_transaction(fake_cursor):
+    def missing_outbox(sql, params):
+        raise RuntimeError("relation webhook_outbox does not exist")
+
+    cursor = fake_cursor(rules=[("INSERT INTO webhook_outbox", missing_outbox)])
+    assert webhook_dispatcher.enqueue_webhook_event(cursor, "booking.created", {"id": 1}, company_id=3) == 0
+    assert cursor.executed[-1][0] == "ROLLBACK TO SAVEPOINT webhook_outbox"
+    # Без компании событие не ставится
+    assert webhook_dispatcher.enqueue_webhook_event(fake_cursor(), "booking.created", {"id": 1}) == 0
+
+
+if __name__ == "__main__":
+    from tests.conftest import FakeCursor, FakeDatabase
+
+    test_retry_policy()
+    test_backoff_grows_and_is_capped()
+    test_counter_updates_reset_on_success()
+    test_results_saved_in_one_transaction_and_failing_webhook_disabled(FakeDatabase)
+    test_dispatch_batch_is_bounded_and_signed()
+    test_enqueue_failure_does_not_break_transaction(FakeCursor)
+    print("✅ Webhook dispatcher tests passed")
@@ -0,0 +1,169 @@
+"""
+Выполнение блокирующего (psycopg2) кода вне event loop.
+
+Роуты объявлены как `async def`, но большинство db-хелперов синхронные:
+один медленный запрос останавливает все запросы и WebSocket'ы воркера.
+Модуль даёт три инструмента:
+
+- `run_blocking()` — await-обёртка, отправляющая sync-вызов в executor,
+  настроенный в `main._configure_runtime_threading`;
+- `@offload_blocking` / `OffloadedRoute` — перевод sync-тела роута на этот
+  executor (точечно или для всего роутера);
+- `audit_blocking_routes()` — стартовый аудит `async def` роутов, которые
+  всё ещё обращаются к `get_db_connection` или db-хелперам прямо на event loop.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import types
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+_blocking_executor: Optional[concurrent.futures.Executor] = None
+
+_DB_ENTRYPOINTS = frozenset({"get_db_connection"})
+_DB_PACKAGE = "db"
+_AUDIT_MAX_DEPTH = 2
+
+
+def set_blocking_executor(executor: Optional[concurrent.futures.Executor]) -> None:
+    """Зарегистрировать executor воркера (None — использовать executor loop'а по умолчанию)."""
+    global _blocking_executor
+    _blocking_executor = executor
+
+
+def get_blocking_executor() -> Optional[concurrent.futures.Executor]:
+    return _blocking_executor
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Выполнить синхронную функцию в пуле потоков воркера.
+
+    ContextVar'ы (tenant context, request-scoped auth) копируются в поток,
+    поэтому `get_db_connection()` внутри видит ту же компанию, что и запрос.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(_blocking_executor, call)
+
+
+def offload_blocking(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Декоратор для sync-тела роута: FastAPI видит async endpoint
+    с исходной сигнатурой, а тело выполняется в пуле потоков.
+
+    Usage:
+        @router.get("/clients")
+        @offload_blocking
+        def list_clients(...):
+            ...
+    """
+    if inspect.iscoroutinefunction(func):
+        raise TypeError(f"offload_blocking expects a sync function, got coroutine {func.__qualname__}")
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(func, *args, **kwargs)
+
+    wrapper.__offloaded__ = True
+    return wrapper
+
+
+class OffloadedRoute(APIRoute):
+    """
+    Router-level режим: все sync (`def`) endpoint'ы роутера выполняются
+    в executor воркера. `async def` endpoint'ы остаются как есть.
+
+    Usage:
+        router = APIRouter(route_class=OffloadedRoute)
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs):
+        if not inspect.iscoroutinefunction(endpoint) and not getattr(endpoint, "__offloaded__", False):
+            endpoint = offload_blocking(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _collect_code_names(code: types.CodeType) -> set:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _collect_code_names(const)
+    return names
+
+
+def _is_db_layer(module_name: Optional[str]) -> bool:
+    return bool(module_name) and (module_name == _DB_PACKAGE or module_name.startswith(_DB_PACKAGE + "."))
+
+
+def _is_sync_function(target: Any) -> bool:
+    return (
+        inspect.isfunction(target)
+        and not inspect.iscoroutinefunction(target)
+        and not getattr(target, "__offloaded__", False)
+    )
+
+
+def _touches_db(func: Callable[..., Any], depth: int, seen: set) -> bool:
+    func = inspect.unwrap(func)
+    code = getattr(func, "__code__", None)
+    if code is None or code in seen:
+        return False
+    seen.add(code)
+
+    names = _collect_code_names(code)
+    if names & _DB_ENTRYPOINTS:
+        return True
+
+    module_globals = getattr(func, "__globals__", {})
+    for name in names:
+        target = module_globals.get(name)
+        # `from db import clients` + `clients.get_client(...)`
+        if inspect.ismodule(target):
+            if _is_db_layer(target.__name__) and any(
+                _is_sync_function(getattr(target, attr, None)) for attr in names
+            ):
+                return True
+            continue
+        if not _is_sync_function(target):
+            continue
+        # db-слой целиком синхронный: любой его хелпер — поход в БД
+        if _is_db_layer(target.__module__):
+            return True
+        # В остальные модули не спускаемся — их роуты проверяются отдельно
+        if depth <= 0 or target.__module__ != func.__module__:
+            continue
+        if _touches_db(target, depth - 1, seen):
+            return True
+    return False
+
+
+def audit_blocking_routes(app) -> List[Dict[str, Any]]:
+    """
+    Найти `async def` HTTP-роуты, которые вызывают `get_db_connection`
+    или sync-функции пакета `db` (напрямую или через sync-хелперы своего
+    модуля) прямо на event loop.
+    """
+    findings: List[Dict[str, Any]] = []
+    for route in getattr(app, "routes", []):
+        if not isinstance(route, APIRoute):
+            continue
+        endpoint = route.endpoint
+        if getattr(endpoint, "__offloaded__", False):
+            continue
+        if not inspect.iscoroutinefunction(endpoint):
+            continue
+        if not _touches_db(endpoint, _AUDIT_MAX_DEPTH, set()):
+            continue
+        findings.append({
+            "path": route.path,
+            "methods": sorted(route.methods or []),
+            "endpoint": f"{endpoint.__module__}.{endpoint.__qualname__}",
+        })
+    findings.sort(key=lambda item: item["path"])
+    return findings
@@ -7,6 +7,9 @@ except ImportError:
 
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from utils.logger import log_info, log_error
 
@@ -140,5 +143,76 @@ class Cache:
             log_error(f"Redis clear pattern error ({pattern}): {e}", "cache")
             return False
 
+class TTLCache:
+    """
+    Bounded in-process cache with per-entry TTL and LRU eviction.
+
+    Thread-safe: routes run both on the event loop and in the worker
+    thread pool, so every access goes through one lock.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else float(ttl))
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, self._MISSING)
+        if entry is self._MISSING:
+            return default
+        return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
 # Singleton
 cache = Cache()
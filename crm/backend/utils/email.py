@@ -1,13 +1,20 @@
 """
 Утилиты для отправки email
 """
-import smtplib
 import secrets
 import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
-from utils.logger import log_info, log_error
+from utils.logger import log_info, log_error, log_warning
+from utils.smtp_transport import smtp_transport
+
+
+def _send_pooled(msg, smtp_host: str, smtp_port: int, smtp_user: str, smtp_password: str) -> None:
+    """Отправить через общий пул SMTP-сессий (utils/smtp_transport.py)"""
+    config = {'host': smtp_host, 'port': smtp_port, 'user': smtp_user, 'password': smtp_password}
+    if not smtp_transport.send(msg, config):
+        raise RuntimeError("SMTP delivery failed")
 
 
 def _get_salon_name() -> str:
@@ -164,10 +171,7 @@ def send_verification_email(to_email: str, code: str, full_name: str) -> bool:
         msg.attach(part2)
 
         # Отправляем
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+        _send_pooled(msg, smtp_host, smtp_port, smtp_user, smtp_password)
 
         log_info(f"Verification email sent to {to_email}", "email")
         return True
@@ -264,10 +268,7 @@ def send_verification_link_email(to_email: str, verification_token: str, full_na
         msg.attach(part2)
 
         # Отправляем
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+        _send_pooled(msg, smtp_host, smtp_port, smtp_user, smtp_password)
 
         log_info(f"Verification link email sent to {to_email}", "email")
         return True
@@ -390,10 +391,7 @@ def send_password_reset_email(to_email: str, reset_token: str, full_name: str) -
         msg.attach(part2)
 
         # Отправляем
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+        _send_pooled(msg, smtp_host, smtp_port, smtp_user, smtp_password)
 
         log_info(f"Password reset email sent to {to_email}", "email")
         return True
@@ -402,18 +400,13 @@ def send_password_reset_email(to_email: str, reset_token: str, full_name: str) -
         log_error(f"Failed to send password reset email: {e}", "email")
         return False
 
-def send_email_sync(recipients: list, subject: str, message: str, html: str = None) -> bool:
+def _prepare_notification_email(recipients: list, subject: str, message: str, html: str = None):
     """
-    Синхронная функция отправки email (для использования в background tasks)
-
-    Args:
-        recipients: Список email адресов получателей
-        subject: Тема письма
-        message: Текст письма (plain text)
-        html: HTML версия письма (опционально)
+    Собрать письмо для send_email_sync/send_email_async.
 
     Returns:
-        bool: True если отправлено успешно
+        (msg, smtp_config) для отправки или bool — итог без отправки
+        (все адреса тестовые, SKIP_REAL_MAIL, SMTP не настроен)
     """
     # Фильтруем тестовые email адреса
     valid_recipients = [r for r in recipients if not _is_fake_email(r)]
@@ -427,45 +420,63 @@ def send_email_sync(recipients: list, subject: str, message: str, html: str = No
 
     recipients = valid_recipients
 
-    try:
-        # Быстрый выход для тестов (если установлено SKIP_REAL_MAIL=true)
-        if os.getenv('SKIP_REAL_MAIL', '').lower() == 'true':
-            log_info(f"MOCK EMAIL (Skipped sending to {', '.join(recipients)}): {subject}", "email")
-            return True
+    # Быстрый выход для тестов (если установлено SKIP_REAL_MAIL=true)
+    if os.getenv('SKIP_REAL_MAIL', '').lower() == 'true':
+        log_info(f"MOCK EMAIL (Skipped sending to {', '.join(recipients)}): {subject}", "email")
+        return True
 
-        # SMTP настройки из переменных окружения
-        smtp_host = os.getenv('SMTP_SERVER') or os.getenv('SMTP_HOST', 'smtp.gmail.com')
-        smtp_port = int(os.getenv('SMTP_PORT', '587'))
-        smtp_user = os.getenv('SMTP_USERNAME') or os.getenv('SMTP_USER')
-        smtp_password = os.getenv('SMTP_PASSWORD')
-        smtp_from = os.getenv('FROM_EMAIL') or os.getenv('SMTP_FROM', smtp_user)
+    # SMTP настройки из переменных окружения
+    smtp_host = os.getenv('SMTP_SERVER') or os.getenv('SMTP_HOST', 'smtp.gmail.com')
+    smtp_port = int(os.getenv('SMTP_PORT', '587'))
+    smtp_user = os.getenv('SMTP_USERNAME') or os.getenv('SMTP_USER')
+    smtp_password = os.getenv('SMTP_PASSWORD')
+    smtp_from = os.getenv('FROM_EMAIL') or os.getenv('SMTP_FROM', smtp_user)
 
-        if not smtp_user or not smtp_password:
-            log_error("SMTP credentials not configured in .env", "email")
-            return False
+    if not smtp_user or not smtp_password:
+        log_error("SMTP credentials not configured in .env", "email")
+        return False
 
-        # Создаем сообщение
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = smtp_from
-        msg['To'] = ', '.join(recipients)
+    # Создаем сообщение
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = smtp_from
+    msg['To'] = ', '.join(recipients)
 
-        # Добавляем текстовую часть
-        part1 = MIMEText(message, 'plain')
-        msg.attach(part1)
+    # Добавляем текстовую часть
+    part1 = MIMEText(message, 'plain')
+    msg.attach(part1)
 
-        # Добавляем HTML часть (если есть)
-        if html:
-            part2 = MIMEText(html, 'html')
-            msg.attach(part2)
+    # Добавляем HTML часть (если есть)
+    if html:
+        part2 = MIMEText(html, 'html')
+        msg.attach(part2)
 
-        # Отправляем
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+    config = {'host': smtp_host, 'port': smtp_port, 'user': smtp_user, 'password': smtp_password}
+    return msg, config
+
+
+def send_email_sync(recipients: list, subject: str, message: str, html: str = None) -> bool:
+    """
+    Синхронная функция отправки email (для использования в background tasks)
+
+    Args:
+        recipients: Список email адресов получателей
+        subject: Тема письма
+        message: Текст письма (plain text)
+        html: HTML версия письма (опционально)
+
+    Returns:
+        bool: True если отправлено успешно
+    """
+    try:
+        prepared = _prepare_notification_email(recipients, subject, message, html)
+        if isinstance(prepared, bool):
+            return prepared
+        msg, config = prepared
+        if not smtp_transport.send(msg, config):
+            return False
 
-        log_info(f"Email sent to {', '.join(recipients)}: {subject}", "email")
+        log_info(f"Email sent to {msg['To']}: {subject}", "email")
         return True
 
     except Exception as e:
@@ -485,10 +496,21 @@ async def send_email_async(recipients: list, subject: str, message: str, html: s
     Returns:
         bool: True если отправлено успешно
     """
-    import asyncio
+    try:
+        prepared = _prepare_notification_email(recipients, subject, message, html)
+        if isinstance(prepared, bool):
+            return prepared
+        msg, config = prepared
+        # Отправка идёт через пул SMTP-сессий без блокирующего потока
+        if not await smtp_transport.send_async(msg, config):
+            return False
+
+        log_info(f"Email sent to {msg['To']}: {subject}", "email")
+        return True
 
-    # Запускаем синхронную функцию в отдельном потоке
-    return await asyncio.to_thread(send_email_sync, recipients, subject, message, html)
+    except Exception as e:
+        log_error(f"Failed to send email: {e}", "email")
+        return False
 
 def send_broadcast_email(to_email: str, subject: str, message: str, full_name: str, unsubscribe_link: str, salon_settings: dict = None, attachment_urls: list = None) -> bool:
     """
@@ -739,10 +761,7 @@ def send_broadcast_email(to_email: str, subject: str, message: str, full_name: s
                      log_error(f"Failed to attach file {url}: {e}", "email")
 
         # Отправляем
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+        _send_pooled(msg, smtp_host, smtp_port, smtp_user, smtp_password)
 
         log_info(f"Broadcast email sent to {to_email}: {subject}", "email")
         return True
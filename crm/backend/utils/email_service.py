@@ -4,15 +4,16 @@
 Поддерживает verification codes, admin notifications, password resets
 """
 import os
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Optional
+from typing import List, Optional, Tuple
 import random
 import string
 from datetime import datetime, timedelta
 
+from utils.cache import TTLCache
 from utils.logger import log_info, log_error, log_warning
+from utils.smtp_transport import smtp_transport
 
 # Email translations for multi-language support
 EMAIL_TRANSLATIONS = {
@@ -30,6 +31,9 @@ EMAIL_TRANSLATIONS = {
         'registration_rejected_body': 'К сожалению, ваша регистрация в {salon_name} была отклонена администратором.',
         'registration_rejected_reason': 'Причина',
         'registration_rejected_contact': 'Если у вас есть вопросы, пожалуйста, свяжитесь с администратором.',
+        'email_footer_unsubscribe': 'Отписаться от рассылки',
+        'email_footer_auto_notice': 'Это автоматическое уведомление. Пожалуйста, не отвечайте на него.',
+        'email_footer_rights': 'Все права защищены.',
     },
     'en': {
         'registration_approved_subject': 'Registration Approved',
@@ -45,6 +49,9 @@ EMAIL_TRANSLATIONS = {
         'registration_rejected_body': 'Unfortunately, your registration at {salon_name} has been rejected by the administrator.',
         'registration_rejected_reason': 'Reason',
         'registration_rejected_contact': 'If you have any questions, please contact the administrator.',
+        'email_footer_unsubscribe': 'Unsubscribe',
+        'email_footer_auto_notice': 'This is an automated notification. Please do not reply to it.',
+        'email_footer_rights': 'All rights reserved.',
     },
     'ar': {
         'registration_approved_subject': 'تمت الموافقة على التسجيل',
@@ -60,6 +67,9 @@ EMAIL_TRANSLATIONS = {
         'registration_rejected_body': 'للأسف، تم رفض تسجيلك في {salon_name} من قبل المسؤول.',
         'registration_rejected_reason': 'السبب',
         'registration_rejected_contact': 'إذا كانت لديك أي أسئلة، يرجى الاتصال بالمسؤول.',
+        'email_footer_unsubscribe': 'إلغاء الاشتراك',
+        'email_footer_auto_notice': 'هذا إشعار تلقائي. يرجى عدم الرد عليه.',
+        'email_footer_rights': 'جميع الحقوق محفوظة.',
     },
     'es': {
         'registration_approved_subject': 'Registro aprobado',
@@ -75,6 +85,9 @@ EMAIL_TRANSLATIONS = {
         'registration_rejected_body': 'Lamentablemente, tu registro en {salon_name} ha sido rechazado por el administrador.',
         'registration_rejected_reason': 'Razón',
         'registration_rejected_contact': 'Si tienes alguna pregunta, por favor contacta al administrador.',
+        'email_footer_unsubscribe': 'Darse de baja',
+        'email_footer_auto_notice': 'Esta es una notificación automática. Por favor, no responda a ella.',
+        'email_footer_rights': 'Todos los derechos reservados.',
     },
     'de': {
         'registration_approved_subject': 'Registrierung genehmigt',
@@ -90,6 +103,9 @@ EMAIL_TRANSLATIONS = {
         'registration_rejected_body': 'Leider wurde Ihre Registrierung bei {salon_name} vom Administrator abgelehnt.',
         'registration_rejected_reason': 'Grund',
         'registration_rejected_contact': 'Bei Fragen wenden Sie sich bitte an den Administrator.',
+        'email_footer_unsubscribe': 'Abmelden',
+        'email_footer_auto_notice': 'Dies ist eine automatische Benachrichtigung. Bitte antworten Sie nicht darauf.',
+        'email_footer_rights': 'Alle Rechte vorbehalten.',
     },
     'fr': {
         'registration_approved_subject': 'Inscription approuvée',
@@ -105,6 +121,9 @@ EMAIL_TRANSLATIONS = {
         'registration_rejected_body': 'Malheureusement, votre inscription chez {salon_name} a été refusée par l\'administrateur.',
         'registration_rejected_reason': 'Raison',
         'registration_rejected_contact': 'Si vous avez des questions, veuillez contacter l\'administrateur.',
+        'email_footer_unsubscribe': 'Se désabonner',
+        'email_footer_auto_notice': 'Ceci est une notification automatique. Merci de ne pas y répondre.',
+        'email_footer_rights': 'Tous droits réservés.',
     },
     'pt': {
         'registration_approved_subject': 'Registro aprovado',
@@ -120,6 +139,9 @@ EMAIL_TRANSLATIONS = {
         'registration_rejected_body': 'Infelizmente, seu registro em {salon_name} foi rejeitado pelo administrador.',
         'registration_rejected_reason': 'Motivo',
         'registration_rejected_contact': 'Se você tiver alguma dúvida, entre em contato com o administrador.',
+        'email_footer_unsubscribe': 'Cancelar inscrição',
+        'email_footer_auto_notice': 'Esta é uma notificação automática. Por favor, não responda.',
+        'email_footer_rights': 'Todos os direitos reservados.',
     },
 }
 
@@ -232,15 +254,113 @@ def is_fake_email(email: str) -> bool:
     return False
 
 
+def build_email_message(
+    to_email: str,
+    subject: str,
+    html_body: str,
+    smtp_config: dict,
+    text_body: Optional[str] = None,
+    unsubscribe_link: Optional[str] = None,
+    language: str = 'ru'
+) -> MIMEMultipart:
+    """Собрать письмо (HTML без <html> оборачивается в стандартный лейаут)"""
+    # Если html_body не содержит тегов <html> или <!DOCTYPE, оборачиваем его в стандартный лейаут
+    if not (html_body.lower().startswith('<!doctype') or '<html' in html_body.lower()):
+        html_body = wrap_email_html(subject, html_body, unsubscribe_link=unsubscribe_link, language=language)
+
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = f"{smtp_config['from_name']} <{smtp_config['from_email']}>"
+    msg['To'] = to_email
+
+    # Добавляем текстовую версию
+    if text_body:
+        msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
+
+    # Добавляем HTML версию
+    msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+    return msg
+
+
+def _prepare_emails(emails: List[dict]) -> Tuple[Optional[dict], List[Optional[MIMEMultipart]]]:
+    """
+    Подготовить пакет писем: (smtp_config, сообщения). None вместо сообщения —
+    письмо пропущено (тестовый адрес или ошибка сборки).
+    """
+    smtp_config = configure_smtp()
+    messages: List[Optional[MIMEMultipart]] = []
+    for email in emails:
+        to_email = email.get('to_email')
+        # Проверка на тестовые/фейковые email
+        if is_fake_email(to_email):
+            log_warning(f"Skipping email to fake/test address: {to_email}", "email")
+            messages.append(None)
+            continue
+        if not smtp_config:
+            log_warning(f"Cannot send email to {to_email}: SMTP not configured", "email")
+            messages.append(None)
+            continue
+        try:
+            messages.append(build_email_message(
+                to_email,
+                email.get('subject') or '',
+                email.get('html_body') or '',
+                smtp_config,
+                text_body=email.get('text_body'),
+                unsubscribe_link=email.get('unsubscribe_link'),
+                language=email.get('language') or 'ru',
+            ))
+        except Exception as e:
+            log_error(f"Failed to build email to {to_email}: {e}", "email")
+            messages.append(None)
+    return smtp_config, messages
+
+
+def _merge_results(emails: List[dict], messages: List[Optional[MIMEMultipart]], sent: List[bool]) -> List[bool]:
+    results = []
+    sent_iter = iter(sent)
+    for email, message in zip(emails, messages):
+        ok = message is not None and next(sent_iter)
+        if ok:
+            log_info(f"Email sent successfully to {email.get('to_email')}", "email")
+        results.append(ok)
+    return results
+
+
+def send_bulk_emails(emails: List[dict]) -> List[bool]:
+    """
+    Отправить пакет писем через пул SMTP-сессий (sync-вызов для пула потоков).
+
+    Args:
+        emails: Список dict с ключами to_email, subject, html_body,
+                text_body, unsubscribe_link, language (опционально)
+
+    Returns: Список флагов успеха в порядке emails
+    """
+    smtp_config, messages = _prepare_emails(emails)
+    ready = [message for message in messages if message is not None]
+    sent = smtp_transport.send_many(ready, smtp_config) if ready else []
+    return _merge_results(emails, messages, sent)
+
+
+async def send_bulk_emails_async(emails: List[dict]) -> List[bool]:
+    """Асинхронный вариант send_bulk_emails"""
+    smtp_config, messages = _prepare_emails(emails)
+    ready = [message for message in messages if message is not None]
+    sent = await smtp_transport.send_many_async(ready, smtp_config) if ready else []
+    return _merge_results(emails, messages, sent)
+
+
 def send_email(
     to_email: str,
     subject: str,
     html_body: str,
     text_body: Optional[str] = None,
-    unsubscribe_link: Optional[str] = None
+    unsubscribe_link: Optional[str] = None,
+    language: str = 'ru'
 ) -> bool:
     """
-    Универсальная функция отправки email
+    Универсальная функция отправки email (sync; из корутин — send_email_async)
 
     Args:
         to_email: Email получателя
@@ -248,52 +368,38 @@ def send_email(
         html_body: HTML содержимое письма
         text_body: Текстовое содержимое (fallback)
         unsubscribe_link: Ссылка для отписки (для футера)
+        language: Язык футера стандартного лейаута
 
     Returns: True если отправлено успешно
     """
-    # Проверка на тестовые/фейковые email
-    if is_fake_email(to_email):
-        log_warning(f"Skipping email to fake/test address: {to_email}", "email")
-        return False
+    return send_bulk_emails([{
+        'to_email': to_email,
+        'subject': subject,
+        'html_body': html_body,
+        'text_body': text_body,
+        'unsubscribe_link': unsubscribe_link,
+        'language': language,
+    }])[0]
 
-    smtp_config = configure_smtp()
 
-    if not smtp_config:
-        log_warning(f"Cannot send email to {to_email}: SMTP not configured", "email")
-        return False
-    
-    # Если html_body не содержит тегов <html> или <!DOCTYPE, оборачиваем его в стандартный лейаут
-    if not (html_body.lower().startswith('<!doctype') or '<html' in html_body.lower()):
-        html_body = wrap_email_html(subject, html_body, unsubscribe_link=unsubscribe_link)
-    
-    try:
-        # Создаем сообщение
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = f"{smtp_config['from_name']} <{smtp_config['from_email']}>"
-        msg['To'] = to_email
-        
-        # Добавляем текстовую версию
-        if text_body:
-            part1 = MIMEText(text_body, 'plain', 'utf-8')
-            msg.attach(part1)
-        
-        # Добавляем HTML версию
-        part2 = MIMEText(html_body, 'html', 'utf-8')
-        msg.attach(part2)
-        
-        # Отправляем
-        with smtplib.SMTP(smtp_config['host'], smtp_config['port']) as server:
-            server.starttls()
-            server.login(smtp_config['user'], smtp_config['password'])
-            server.send_message(msg)
-        
-        log_info(f"Email sent successfully to {to_email}", "email")
-        return True
-        
-    except Exception as e:
-        log_error(f"Failed to send email to {to_email}: {e}", "email")
-        return False
+async def send_email_async(
+    to_email: str,
+    subject: str,
+    html_body: str,
+    text_body: Optional[str] = None,
+    unsubscribe_link: Optional[str] = None,
+    language: str = 'ru'
+) -> bool:
+    """Асинхронный вариант send_email"""
+    results = await send_bulk_emails_async([{
+        'to_email': to_email,
+        'subject': subject,
+        'html_body': html_body,
+        'text_body': text_body,
+        'unsubscribe_link': unsubscribe_link,
+        'language': language,
+    }])
+    return results[0]
 
 
 def get_premium_icon(name: str, color: str = "db2777", size: int = 20) -> str:
@@ -323,15 +429,40 @@ def get_premium_icon(name: str, color: str = "db2777", size: int = 20) -> str:
     
     return f'<img src="{url}" width="{size}" height="{size}" style="vertical-align: middle; display: inline-block; margin-right: 8px; margin-bottom: 2px;" alt="{name}" />'
 
-def wrap_email_html(title: str, content: str, unsubscribe_link: Optional[str] = None) -> str:
+# Готовые лейауты по (шаблон, язык, брендинг): при рассылке тысяч писем
+# с одним текстом подставляется только персональная ссылка отписки
+_EMAIL_LAYOUT_CACHE = TTLCache(maxsize=256, ttl=600)
+_UNSUBSCRIBE_PLACEHOLDER = "%%UNSUBSCRIBE_URL%%"
+
+
+def wrap_email_html(
+    title: str,
+    content: str,
+    unsubscribe_link: Optional[str] = None,
+    language: str = 'ru'
+) -> str:
     """Оборачивает контент письма в премиальный лейаут (Weekly Report Style)"""
-    from datetime import datetime
+    from core.config import PUBLIC_URL
     salon_name = get_salon_name()
     logo_url = get_logo_url()
+    year = datetime.now().year
+
+    cache_key = (title, content, language, salon_name, logo_url, year)
+    layout = _EMAIL_LAYOUT_CACHE.get(cache_key)
+    if layout is None:
+        layout = _render_email_layout(title, content, language, salon_name, logo_url, year)
+        _EMAIL_LAYOUT_CACHE.set(cache_key, layout)
+
+    # Unsubscribe link logic
+    final_unsubscribe = unsubscribe_link or f"{PUBLIC_URL.rstrip('/')}/crm/settings"
+    return layout.replace(_UNSUBSCRIBE_PLACEHOLDER, final_unsubscribe)
+
+
+def _render_email_layout(title: str, content: str, language: str, salon_name: str, logo_url: str, year: int) -> str:
     brand_color = "#db2777" # Weekly Report Brand Accent
     bg_color = "#fdf2f8"    # Weekly Report Background
-    year = datetime.now().year
-    
+    t = lambda key: get_email_translation(key, language)
+
     # 1. Расширенная автозамена эмодзи (с учетом вариаций)
     emoji_map = {
         '🗓': get_premium_icon('calendar', brand_color),
@@ -380,10 +511,8 @@ def wrap_email_html(title: str, content: str, unsubscribe_link: Optional[str] =
     logo_src = logo_url.replace('.webp', '.png') if logo_url and logo_url.endswith('.webp') else logo_url
     logo_html = f'<img src="{logo_src}" alt="{salon_name}" style="max-height: 80px; width: auto; height: auto; border: 0; display: block; margin: 0 auto 20px auto;" />' if logo_url else f'<h1 style="margin: 0; font-size: 26px; letter-spacing: 1px; color: #ffffff;">{salon_name}</h1>'
     
-    # Unsubscribe link logic
-    from core.config import PUBLIC_URL
-    final_unsubscribe = unsubscribe_link or f"{PUBLIC_URL.rstrip('/')}/crm/settings"
-    
+    final_unsubscribe = _UNSUBSCRIBE_PLACEHOLDER
+
     html = f"""
     <!DOCTYPE html>
     <html>
@@ -422,11 +551,11 @@ def wrap_email_html(title: str, content: str, unsubscribe_link: Optional[str] =
                                 <p style="margin: 0 0 10px 0; color: #666666; font-weight: bold;">{salon_name}</p>
                                 <p style="margin: 0 0 20px 0;">Professional Business CRM Platform</p>
                                 
-                                {"<div style='margin-bottom: 20px;'><a href='" + final_unsubscribe + "' style='color: " + brand_color + "; text-decoration: none;'>Отписаться от рассылки</a></div>"}
+                                {"<div style='margin-bottom: 20px;'><a href='" + final_unsubscribe + "' style='color: " + brand_color + "; text-decoration: none;'>" + t('email_footer_unsubscribe') + "</a></div>"}
                                 
                                 <p style="margin: 0; opacity: 0.7;">
-                                    Это автоматическое уведомление. Пожалуйста, не отвечайте на него.<br>
-                                    © {year} {salon_name}. Все права защищены.
+                                    {t('email_footer_auto_notice')}<br>
+                                    © {year} {salon_name}. {t('email_footer_rights')}
                                 </p>
                             </td>
                         </tr>
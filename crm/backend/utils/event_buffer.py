@@ -0,0 +1,185 @@
+"""
+Буфер событий с пакетной записью в БД.
+
+Трекинг (визиты лендинга, показы и клики реферальных ссылок) раньше
+писал каждое событие отдельным соединением: SELECT для дедупликации,
+INSERT, commit. Буфер принимает события в памяти (без I/O в запросе), а
+фоновый поток сбрасывает их пачкой — каждые `max_batch` событий или
+`max_delay_ms` миллисекунд, что наступит раньше. Функция сброса получает
+список событий и пишет их одним многострочным INSERT.
+
+Очередь ограничена `max_pending`: при переполнении новые события
+отбрасываются (и считаются), чтобы всплеск трафика не съел память.
+При остановке (`shutdown`, lifespan и atexit) остаток сбрасывается.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.logger import log_error, log_info, log_warning
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+EVENT_BUFFER_MAX_BATCH = max(1, _read_int_env("EVENT_BUFFER_MAX_BATCH", 500))
+EVENT_BUFFER_MAX_DELAY_MS = max(10, _read_int_env("EVENT_BUFFER_MAX_DELAY_MS", 1000))
+EVENT_BUFFER_MAX_PENDING = max(1, _read_int_env("EVENT_BUFFER_MAX_PENDING", 50000))
+
+_buffers: List["EventBuffer"] = []
+_buffers_lock = threading.Lock()
+
+
+class EventBuffer:
+    """
+    Потокобезопасная очередь событий с фоновым сбросом пачками.
+
+    flush_fn(events) вызывается только из одного потока за раз; исключение
+    означает, что пачка не записана — она повторяется один раз при
+    следующем сбросе, затем отбрасывается с записью в лог.
+    """
+
+    def __init__(self, name: str, flush_fn: Callable[[List[Any]], None],
+                 max_batch: int = EVENT_BUFFER_MAX_BATCH,
+                 max_delay_ms: int = EVENT_BUFFER_MAX_DELAY_MS,
+                 max_pending: int = EVENT_BUFFER_MAX_PENDING,
+                 autostart: bool = True):
+        self.name = name
+        self._flush_fn = flush_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = max(0.01, max_delay_ms / 1000)
+        self.max_pending = max(1, int(max_pending))
+        self._pending: deque = deque()
+        self._retry: Optional[List[Any]] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._autostart = autostart
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        with _buffers_lock:
+            _buffers.append(self)
+
+    def add(self, event: Any) -> bool:
+        """Поставить событие; False — буфер переполнен и событие отброшено."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append(event)
+            self.enqueued += 1
+            size = len(self._pending)
+        if self._autostart and (self._thread is None or not self._thread.is_alive()):
+            self._start()
+        if size >= self.max_batch:
+            self._wakeup.set()
+        return True
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=f"event-buffer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log_error(f"Event buffer {self.name} flush loop error: {e}", "event_buffer")
+
+    def _take_batch(self) -> List[Any]:
+        with self._lock:
+            count = min(self.max_batch, len(self._pending))
+            return [self._pending.popleft() for _ in range(count)]
+
+    def flush(self) -> int:
+        """Сбросить всё накопленное пачками по max_batch; возвращает число записанных событий."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                retry, self._retry = self._retry, None
+                batch = retry if retry is not None else self._take_batch()
+                if not batch:
+                    return written
+                started = time.perf_counter()
+                try:
+                    self._flush_fn(batch)
+                except Exception as e:
+                    self.failed_batches += 1
+                    if retry is None:
+                        self._retry = batch
+                        log_warning(f"Event buffer {self.name}: batch of {len(batch)} failed, will retry: {e}", "event_buffer")
+                    else:
+                        self.dropped += len(batch)
+                        log_error(f"Event buffer {self.name}: dropped {len(batch)} events after retry: {e}", "event_buffer")
+                    return written
+                self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+                self.batches += 1
+                self.written += len(batch)
+                written += len(batch)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Остановить поток и сбросить остаток (с одним повтором неудачной пачки)."""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()
+        if self._retry is not None:
+            self.flush()
+        if self.written:
+            log_info(f"📦 Event buffer {self.name} flushed ({self.written} events written)", "event_buffer")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "name": self.name,
+            "pending": pending,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "avg_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+def shutdown_event_buffers(timeout: float = 5.0) -> None:
+    with _buffers_lock:
+        buffers = list(_buffers)
+    for buffer in buffers:
+        try:
+            buffer.shutdown(timeout)
+        except Exception as e:
+            log_error(f"Event buffer {buffer.name} shutdown failed: {e}", "event_buffer")
+
+
+def event_buffer_stats() -> List[Dict[str, Any]]:
+    with _buffers_lock:
+        buffers = list(_buffers)
+    return [buffer.stats() for buffer in buffers]
+
+
+# Страховка для выхода без lifespan (скрипты, SIGTERM без graceful shutdown у gunicorn)
+atexit.register(shutdown_event_buffers)
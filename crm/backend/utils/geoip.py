@@ -0,0 +1,373 @@
+"""
+Офлайн-геолокация IP для трекинга посетителей.
+
+Раньше каждый новый визит делал синхронный запрос к ip-api.com (таймаут 5 с,
+лимит 45 запросов в минуту). Теперь поиск идёт по локальной базе диапазонов:
+
+* MaxMind GeoLite2/GeoIP2 (`.mmdb`) — если установлен пакет `maxminddb`;
+* компактная таблица диапазонов (`.bin`), собранная из CSV
+  `compile_range_table()`; файл отображается в память (mmap), поиск — bisect
+  по отсортированным началам диапазонов, без разбора файла при старте.
+
+Формат файла определяется по содержимому, а не по расширению.
+Результаты (и промахи) кэшируются в LRU по IP. Файл базы можно обновлять
+на месте (os.replace): воркеры замечают новый mtime и переоткрывают его.
+`refresh_geoip_database()` скачивает свежую базу по GEOIP_DB_URL (задача
+планировщика). Без локальной базы остаётся прежний онлайн-запрос, если
+не выключен GEOIP_ONLINE_FALLBACK.
+"""
+import bisect
+import csv
+import importlib.util
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.cache import TTLCache
+from utils.logger import log_error, log_info, log_warning
+
+_MAXMIND_AVAILABLE = importlib.util.find_spec("maxminddb") is not None
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "geoip.bin"))
+GEOIP_DB_URL = os.getenv("GEOIP_DB_URL", "").strip()
+GEOIP_CACHE_SIZE = max(1, _read_int_env("GEOIP_CACHE_SIZE", 50000))
+GEOIP_CACHE_TTL_SECONDS = max(60, _read_int_env("GEOIP_CACHE_TTL_SECONDS", 86400))
+GEOIP_RELOAD_CHECK_SECONDS = max(1, _read_int_env("GEOIP_RELOAD_CHECK_SECONDS", 60))
+GEOIP_ONLINE_FALLBACK = _env_flag("GEOIP_ONLINE_FALLBACK", default=True)
+
+# ===== ТАБЛИЦА ДИАПАЗОНОВ =====
+#
+# Заголовок (32 байта, little-endian): magic, число диапазонов IPv4 и IPv6,
+# смещение и длина JSON-списка локаций. Затем массивы (выровнены по 8 байт):
+#   IPv6: starts[u64] ends[u64] (старшие 64 бита адреса), IPv4: starts[u32] ends[u32],
+#   индексы локаций: IPv6[u32], IPv4[u32]; в конце — JSON [[country, city, lat, lon], ...]
+
+_MAGIC = b"CRMGEO1\0"
+_HEADER = struct.Struct("<8sIIQQ")
+
+
+def _range_rows_from_csv(csv_path: str) -> List[Tuple[int, int, int, Tuple[Any, ...]]]:
+    """
+    Строки CSV: network (CIDR) или start_ip,end_ip + country, city, latitude, longitude.
+    Возвращает (версия, начало, конец, локация).
+    """
+    rows = []
+    with open(csv_path, newline="", encoding="utf-8") as handle:
+        for record in csv.DictReader(handle):
+            if record.get("network"):
+                network = ipaddress.ip_network(record["network"].strip(), strict=False)
+                start, end, version = network.network_address, network.broadcast_address, network.version
+            else:
+                start = ipaddress.ip_address(record["start_ip"].strip())
+                end = ipaddress.ip_address(record["end_ip"].strip())
+                version = start.version
+            try:
+                latitude = float(record.get("latitude") or 0)
+                longitude = float(record.get("longitude") or 0)
+            except ValueError:
+                continue
+            location = (record.get("country") or None, record.get("city") or None, latitude, longitude)
+            rows.append((version, int(start), int(end), location))
+    return rows
+
+
+def compile_range_table(csv_path: str, output_path: str) -> Dict[str, int]:
+    """Собрать бинарную таблицу из CSV; файл пишется рядом и подменяется атомарно."""
+    locations: Dict[Tuple[Any, ...], int] = {}
+    v4: List[Tuple[int, int, int]] = []
+    v6: List[Tuple[int, int, int]] = []
+    for version, start, end, location in _range_rows_from_csv(csv_path):
+        index = locations.setdefault(location, len(locations))
+        if version == 4:
+            v4.append((start, end, index))
+        else:
+            v6.append((start >> 64, end >> 64, index))
+    v4.sort()
+    v6.sort()
+
+    body = b"".join([
+        struct.pack(f"<{len(v6)}Q", *(row[0] for row in v6)),
+        struct.pack(f"<{len(v6)}Q", *(row[1] for row in v6)),
+        struct.pack(f"<{len(v4)}I", *(row[0] for row in v4)),
+        struct.pack(f"<{len(v4)}I", *(row[1] for row in v4)),
+        struct.pack(f"<{len(v6)}I", *(row[2] for row in v6)),
+        struct.pack(f"<{len(v4)}I", *(row[2] for row in v4)),
+    ])
+    locations_blob = json.dumps([list(location) for location in locations], ensure_ascii=False).encode("utf-8")
+    header = _HEADER.pack(_MAGIC, len(v4), len(v6), _HEADER.size + len(body), len(locations_blob))
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(header + body + locations_blob)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return {"ipv4_ranges": len(v4), "ipv6_ranges": len(v6), "locations": len(locations)}
+
+
+class RangeTableBackend:
+    """Поиск по mmap-таблице диапазонов: bisect по memoryview без копирования."""
+
+    name = "range_table"
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, v4_count, v6_count, locations_offset, locations_length = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a CRM geoip range table")
+        if sys.byteorder != "little":
+            self._mmap.close()
+            raise ValueError("geoip range table requires a little-endian host")
+
+        view = self._view = memoryview(self._mmap)
+        offset = _HEADER.size
+
+        def take(count: int, fmt: str, size: int):
+            nonlocal offset
+            array = view[offset:offset + count * size].cast(fmt)
+            offset += count * size
+            return array
+
+        self._v6_starts = take(v6_count, "Q", 8)
+        self._v6_ends = take(v6_count, "Q", 8)
+        self._v4_starts = take(v4_count, "I", 4)
+        self._v4_ends = take(v4_count, "I", 4)
+        self._v6_locations = take(v6_count, "I", 4)
+        self._v4_locations = take(v4_count, "I", 4)
+        self._locations = json.loads(bytes(view[locations_offset:locations_offset + locations_length]).decode("utf-8"))
+        self.size = v4_count + v6_count
+
+    def lookup(self, address) -> Optional[Dict[str, Any]]:
+        if address.version == 4:
+            key, starts, ends, locations = int(address), self._v4_starts, self._v4_ends, self._v4_locations
+        else:
+            key, starts, ends, locations = int(address) >> 64, self._v6_starts, self._v6_ends, self._v6_locations
+        position = bisect.bisect_right(starts, key) - 1
+        if position < 0 or key > ends[position]:
+            return None
+        country, city, latitude, longitude = self._locations[locations[position]]
+        return {"latitude": latitude, "longitude": longitude, "city": city, "country": country}
+
+    def close(self) -> None:
+        for array in (self._v6_starts, self._v6_ends, self._v4_starts, self._v4_ends,
+                      self._v6_locations, self._v4_locations, self._view):
+            array.release()
+        self._mmap.close()
+
+
+class MaxMindBackend:
+    """GeoLite2/GeoIP2 City (.mmdb) через maxminddb в режиме mmap."""
+
+    name = "maxmind"
+
+    def __init__(self, path: str):
+        import maxminddb
+
+        self.path = path
+        self._reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+        self.size = self._reader.metadata().node_count
+
+    def lookup(self, address) -> Optional[Dict[str, Any]]:
+        record = self._reader.get(str(address))
+        if not record or "location" not in record:
+            return None
+        location = record["location"]
+        return {
+            "latitude": location.get("latitude"),
+            "longitude": location.get("longitude"),
+            "city": ((record.get("city") or {}).get("names") or {}).get("en"),
+            "country": ((record.get("country") or {}).get("names") or {}).get("en"),
+        }
+
+    def close(self) -> None:
+        self._reader.close()
+
+
+# Метаданные MaxMind DB лежат в последних 128 КиБ файла после этого маркера
+_MAXMIND_METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+_MAXMIND_METADATA_WINDOW = 128 * 1024
+
+
+def detect_database_format(path: str) -> str:
+    """Формат файла базы по содержимому, а не по расширению: 'range_table' или 'maxmind'."""
+    with open(path, "rb") as handle:
+        if handle.read(len(_MAGIC)) == _MAGIC:
+            return "range_table"
+        size = os.fstat(handle.fileno()).st_size
+        handle.seek(max(0, size - _MAXMIND_METADATA_WINDOW))
+        if _MAXMIND_METADATA_MARKER in handle.read():
+            return "maxmind"
+    raise ValueError(f"{path} is neither a CRM geoip range table nor a MaxMind database")
+
+
+def open_backend(path: str):
+    if detect_database_format(path) == "maxmind":
+        if not _MAXMIND_AVAILABLE:
+            raise RuntimeError("maxminddb is not installed (pip install maxminddb)")
+        return MaxMindBackend(path)
+    return RangeTableBackend(path)
+
+
+def validate_database(path: str) -> str:
+    """Открыть базу и выполнить пробный поиск; описание для лога, иначе исключение."""
+    backend = open_backend(path)
+    try:
+        backend.lookup(ipaddress.ip_address("8.8.8.8"))
+        return f"{backend.name}, {backend.size} entries"
+    finally:
+        backend.close()
+
+
+class GeoLocator:
+    """Локальная база + LRU по IP; база переоткрывается при смене файла."""
+
+    def __init__(self, path: str = GEOIP_DB_PATH, cache_size: int = GEOIP_CACHE_SIZE,
+                 cache_ttl: float = GEOIP_CACHE_TTL_SECONDS):
+        self.path = path
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._backend = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.backend_lookups = 0
+
+    def _current_backend(self):
+        now = time.monotonic()
+        if now - self._checked_at < GEOIP_RELOAD_CHECK_SECONDS:
+            return self._backend
+        with self._lock:
+            if now - self._checked_at < GEOIP_RELOAD_CHECK_SECONDS:
+                return self._backend
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self._swap(mtime)
+        return self._backend
+
+    def _swap(self, mtime: Optional[float]) -> None:
+        # Старый backend не закрываем явно: его ещё может читать другой поток,
+        # mmap освободится вместе с последней ссылкой
+        backend = None
+        if mtime is not None:
+            try:
+                backend = open_backend(self.path)
+                log_info(f"🌍 GeoIP database loaded: {self.path} ({backend.name}, {backend.size} entries)", "geolocation")
+            except Exception as e:
+                log_error(f"GeoIP database {self.path} could not be opened: {e}", "geolocation")
+        self._backend, self._mtime = backend, mtime
+        self._cache.clear()
+
+    def reload(self) -> None:
+        with self._lock:
+            self._checked_at = 0.0
+        self._current_backend()
+
+    @property
+    def available(self) -> bool:
+        return self._current_backend() is not None
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        """Локация по базе; None — база не загружена. Промах базы кэшируется как {}."""
+        self.lookups += 1
+        cached = self._cache.get(ip)
+        if cached is not None:
+            return dict(cached) if cached else {}
+        backend = self._current_backend()
+        if backend is None:
+            return None
+        try:
+            result = backend.lookup(ipaddress.ip_address(ip))
+        except ValueError:
+            result = None
+        self.backend_lookups += 1
+        self._cache.set(ip, result or False)
+        return dict(result) if result else {}
+
+    def stats(self) -> Dict[str, Any]:
+        backend = self._backend
+        return {
+            "path": self.path,
+            "backend": backend.name if backend else None,
+            "entries": backend.size if backend else 0,
+            "lookups": self.lookups,
+            "backend_lookups": self.backend_lookups,
+            "cache": self._cache.stats(),
+        }
+
+
+geo_locator = GeoLocator()
+
+
+async def refresh_geoip_database(url: str = GEOIP_DB_URL, path: str = GEOIP_DB_PATH) -> bool:
+    """
+    Скачать свежую базу (`.mmdb` или CSV диапазонов) и атомарно подменить файл.
+    CSV компилируется в таблицу диапазонов. Новый файл открывается и
+    проверяется до подмены: битая загрузка не затирает рабочую базу.
+    Запускается планировщиком.
+    """
+    if not url:
+        return False
+    from utils.blocking import run_blocking
+    from utils.http_clients import get_http_client
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, download_path = tempfile.mkstemp(dir=directory, suffix=".download")
+    candidate_path = download_path
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            client = get_http_client(url)
+            async with client.stream("GET", url, follow_redirects=True, timeout=120) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    handle.write(chunk)
+        if url.split("?")[0].endswith(".csv"):
+            candidate_path = f"{download_path}.bin"
+            summary = await run_blocking(compile_range_table, download_path, candidate_path)
+            log_info(f"🌍 GeoIP range table compiled from {url}: {summary}", "geolocation")
+        description = await run_blocking(validate_database, candidate_path)
+        os.replace(candidate_path, path)
+        log_info(f"🌍 GeoIP database refreshed from {url} ({description})", "geolocation")
+        geo_locator.reload()
+        return True
+    except Exception as e:
+        log_warning(f"GeoIP refresh from {url} failed: {e}", "geolocation")
+        return False
+    finally:
+        for leftover in {download_path, candidate_path}:
+            if os.path.exists(leftover):
+                os.unlink(leftover)
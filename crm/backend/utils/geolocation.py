@@ -3,14 +3,20 @@ Geolocation utilities for visitor tracking
 """
 import requests
 import hashlib
+import ipaddress
 import math
 from typing import Optional, Dict, Tuple
 from core.config import SALON_LAT as DEFAULT_LOCATION_LAT, SALON_LON as DEFAULT_LOCATION_LON
-from utils.logger import log_info, log_error
+from utils.cache import TTLCache
+from utils.geoip import GEOIP_CACHE_TTL_SECONDS, GEOIP_ONLINE_FALLBACK, geo_locator
+from utils.logger import log_error
 
 DEFAULT_LAT = float(DEFAULT_LOCATION_LAT or 0)
 DEFAULT_LON = float(DEFAULT_LOCATION_LON or 0)
 
+# Ответы ip-api.com, когда локальной базы нет (лимит 45 запросов в минуту)
+_online_cache = TTLCache(maxsize=10000, ttl=GEOIP_CACHE_TTL_SECONDS)
+
 def get_salon_coordinates() -> Tuple[float, float]:
     """Get salon coordinates from database"""
     try:
@@ -28,21 +34,47 @@ def get_ip_hash(ip: str) -> str:
     """Generate SHA256 hash of IP for privacy"""
     return hashlib.sha256(ip.encode()).hexdigest()
 
+def _is_local_address(ip: str) -> bool:
+    if ip == 'localhost':
+        return True
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return address.is_private or address.is_loopback or address.is_link_local
+
+
 def get_location_from_ip(ip: str) -> Optional[Dict]:
     """
-    Get geolocation data from IP address using ip-api.com
+    Get geolocation data from IP address.
+    Local GeoIP database (utils.geoip) first; ip-api.com only when no database is installed.
     Returns: {latitude, longitude, city, country} or None if failed
     """
     # Skip localhost/private IPs
-    if ip in ['127.0.0.1', 'localhost', '::1'] or ip.startswith('192.168.') or ip.startswith('10.'):
-        log_info(f"Using mock geolocation for local IP: {ip}", "geolocation")
+    if _is_local_address(ip):
         return {
             'latitude': DEFAULT_LAT,
             'longitude': DEFAULT_LON,
             'city': 'Localhost',
             'country': 'Local Network'
         }
-    
+
+    location = geo_locator.lookup(ip)
+    if location is not None:
+        return location or None
+    if not GEOIP_ONLINE_FALLBACK:
+        return None
+
+    cached = _online_cache.get(ip)
+    if cached:
+        return dict(cached)
+    location = _get_location_online(ip)
+    if location:
+        _online_cache.set(ip, location)
+    return location
+
+
+def _get_location_online(ip: str) -> Optional[Dict]:
     try:
         # Using ip-api.com (free, no API key needed, 45 req/min limit)
         url = f"http://ip-api.com/json/{ip}?fields=status,message,country,city,lat,lon"
@@ -105,7 +137,7 @@ def get_visitor_location_data(ip: str) -> Optional[Dict]:
     Returns: {ip_hash, latitude, longitude, city, country, distance_km, is_local}
     """
     location = get_location_from_ip(ip)
-    if not location:
+    if not location or location.get('latitude') is None or location.get('longitude') is None:
         return None
     
     # Calculate distance from salon
@@ -0,0 +1,305 @@
+"""
+Общие keep-alive HTTP-клиенты для исходящих интеграций.
+
+Интеграции (Instagram, Telegram, LLM-прокси, вебхуки, записи звонков)
+создавали `httpx.AsyncClient` на каждый вызов: каждый запрос платил DNS +
+TCP + TLS, а с ротацией прокси — ещё и CONNECT. Реестр держит один
+долгоживущий клиент на (event loop, origin, прокси) с пулом соединений и
+HTTP/2, если установлен `h2`. Таймауты и follow_redirects передаются
+на уровне запроса:
+
+    client = get_http_client(url, proxy=proxy_url)
+    response = await client.post(url, json=data, timeout=30.0)
+
+Число клиентов ограничено (HTTP_MAX_CLIENTS, LRU) и простаивающие дольше
+HTTP_CLIENT_IDLE_SECONDS закрываются — ротация прокси не копит пулы.
+Клиент с незавершёнными запросами (в т.ч. непрочитанными стримами) не
+вытесняется, пока они не закончатся.
+Остальные клиенты закрываются в lifespan (`main.py`), метрики — /diagnostics/http.
+"""
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from utils.logger import log_info, log_warning
+
+# httpx поддерживает HTTP/2 только при установленном h2 (pip install httpx[http2])
+_H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
+HTTP_MAX_CONNECTIONS = max(1, _read_int_env("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = max(0, _read_int_env("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = max(1, _read_int_env("HTTP_KEEPALIVE_EXPIRY_SECONDS", 30))
+# По умолчанию — как у голого httpx.AsyncClient() (5 c); длинные вызовы передают timeout сами
+HTTP_TIMEOUT_SECONDS = max(1, _read_int_env("HTTP_TIMEOUT_SECONDS", 5))
+HTTP_CONNECT_TIMEOUT_SECONDS = max(1, _read_int_env("HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+HTTP_MAX_CLIENTS = max(1, _read_int_env("HTTP_MAX_CLIENTS", 64))
+HTTP_CLIENT_IDLE_SECONDS = max(1, _read_int_env("HTTP_CLIENT_IDLE_SECONDS", 600))
+HTTP2_ENABLED = _env_flag("HTTP2_ENABLED", default=True) and _H2_AVAILABLE
+
+
+class ClientMetrics:
+    """Счётчики одного клиента; обновляются только из его event loop'а."""
+
+    __slots__ = ("requests", "errors", "connections", "total_seconds", "max_seconds", "in_flight")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        # Запросы, ответ которых ещё не закрыт (тело стрима не дочитано)
+        self.in_flight = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        requests = self.requests
+        return {
+            "requests": requests,
+            "errors": self.errors,
+            "connections": self.connections,
+            # Доля запросов, обслуженных уже открытым соединением
+            "reuse_ratio": round(max(0.0, 1 - self.connections / requests), 3) if requests else 0.0,
+            "avg_ms": round(self.total_seconds * 1000 / requests, 2) if requests else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2),
+            "in_flight": self.in_flight,
+        }
+
+
+class _InFlightStream(httpx.AsyncByteStream):
+    """Тело ответа: запрос считается завершённым, когда ответ закрыт."""
+
+    def __init__(self, inner: httpx.AsyncByteStream, metrics: ClientMetrics):
+        self._inner = inner
+        self._metrics = metrics
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._metrics.in_flight -= 1
+        await self._inner.aclose()
+
+
+class _MeteredTransport(httpx.AsyncBaseTransport):
+    """Обёртка транспорта: число запросов, новых TCP-соединений и время до заголовков ответа."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, metrics: ClientMetrics):
+        self._inner = inner
+        self._metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        metrics = self._metrics
+        parent_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict) -> None:
+            if event_name == "connection.connect_tcp.started":
+                metrics.connections += 1
+            if parent_trace is not None:
+                await parent_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        started = time.perf_counter()
+        metrics.in_flight += 1
+        try:
+            response = await self._inner.handle_async_request(request)
+            response.stream = _InFlightStream(response.stream, metrics)
+            return response
+        except Exception:
+            metrics.errors += 1
+            metrics.in_flight -= 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.requests += 1
+            metrics.total_seconds += elapsed
+            metrics.max_seconds = max(metrics.max_seconds, elapsed)
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class _ClientEntry:
+    __slots__ = ("loop", "origin", "proxy", "client", "metrics", "created_at", "last_used")
+
+    def __init__(self, loop, origin: str, proxy: Optional[str], client: httpx.AsyncClient, metrics: ClientMetrics):
+        self.loop = loop
+        self.origin = origin
+        self.proxy = proxy
+        self.client = client
+        self.metrics = metrics
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+
+
+def _origin(url: str) -> str:
+    parsed = httpx.URL(url)
+    port = f":{parsed.port}" if parsed.port else ""
+    return f"{parsed.scheme}://{parsed.host}{port}"
+
+
+def _mask_proxy(proxy: Optional[str]) -> Optional[str]:
+    """Прокси без логина/пароля — для метрик и логов."""
+    if not proxy:
+        return None
+    parsed = httpx.URL(proxy)
+    port = f":{parsed.port}" if parsed.port else ""
+    return f"{parsed.scheme}://{parsed.host}{port}"
+
+
+class HttpClientRegistry:
+    """
+    Один httpx.AsyncClient на (event loop, origin, прокси).
+
+    Клиент привязан к loop'у, в котором открыл соединения, поэтому код,
+    запускающий свой loop (asyncio.run в потоке), получает отдельный клиент.
+    Сверх max_clients вытесняются давно не использованные клиенты, а
+    простаивающие дольше idle_seconds закрываются при следующем обращении.
+    Клиенты с запросами в полёте пропускаются: реестр может ненадолго
+    превысить max_clients, но не обрывает чужой стрим.
+    """
+
+    def __init__(self, max_clients: int = HTTP_MAX_CLIENTS, idle_seconds: float = HTTP_CLIENT_IDLE_SECONDS):
+        self._clients: "OrderedDict[Tuple[int, str, str], _ClientEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_clients = max(1, max_clients)
+        self._idle_seconds = idle_seconds
+        self._closing = set()
+
+    def get(self, url: str, proxy: Optional[str] = None) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        origin = _origin(url)
+        key = (id(loop), origin, proxy or "")
+        now = time.monotonic()
+        created = False
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None or entry.loop is not loop or entry.client.is_closed:
+                self._prune_closed_loops()
+                entry = self._create(loop, origin, proxy)
+                self._clients[key] = entry
+                created = True
+            entry.last_used = now
+            self._clients.move_to_end(key)
+            evicted = self._pop_evicted(now)
+        for stale in evicted:
+            self._schedule_close(stale, loop)
+        if not created:
+            return entry.client
+        log_info(
+            f"🌐 HTTP client for {origin}"
+            + (f" via {_mask_proxy(proxy)}" if proxy else "")
+            + (" (HTTP/2)" if HTTP2_ENABLED else ""),
+            "http",
+        )
+        return entry.client
+
+    @staticmethod
+    def _create(loop, origin: str, proxy: Optional[str]) -> _ClientEntry:
+        metrics = ClientMetrics()
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        )
+        transport = httpx.AsyncHTTPTransport(http2=HTTP2_ENABLED, limits=limits, proxy=proxy)
+        client = httpx.AsyncClient(
+            transport=_MeteredTransport(transport, metrics),
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        )
+        return _ClientEntry(loop, origin, proxy, client, metrics)
+
+    def _pop_evicted(self, now: float) -> List[_ClientEntry]:
+        """Снять с головы LRU лишние и простаивающие клиенты (под self._lock)."""
+        evicted = []
+        # Последний — только что выданный клиент, его не трогаем
+        for key, entry in list(self._clients.items())[:-1]:
+            if len(self._clients) <= self._max_clients and now - entry.last_used < self._idle_seconds:
+                break
+            if entry.metrics.in_flight:
+                continue
+            del self._clients[key]
+            evicted.append(entry)
+        return evicted
+
+    def _schedule_close(self, entry: _ClientEntry, current_loop) -> None:
+        # aclose() должен выполниться в loop'е клиента
+        if entry.loop.is_closed():
+            return
+        if entry.loop is current_loop:
+            task = current_loop.create_task(self._close_entry(entry))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        elif entry.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._close_entry(entry), entry.loop)
+
+    @staticmethod
+    async def _close_entry(entry: _ClientEntry) -> None:
+        try:
+            await entry.client.aclose()
+        except Exception as e:
+            log_warning(f"HTTP client {entry.origin} close failed: {e}", "http")
+
+    def _prune_closed_loops(self) -> None:
+        # Клиенты остановленных loop'ов уже не закрыть штатно — просто забываем их
+        for key in [key for key, entry in self._clients.items() if entry.loop.is_closed()]:
+            del self._clients[key]
+
+    async def aclose(self) -> None:
+        """Закрыть клиенты текущего loop'а (shutdown в lifespan)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entries = [entry for entry in self._clients.values() if entry.loop is loop]
+            self._clients = OrderedDict(
+                (key, entry) for key, entry in self._clients.items()
+                if entry.loop is not loop and not entry.loop.is_closed()
+            )
+        for entry in entries:
+            await self._close_entry(entry)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._clients.values())
+        return [
+            {
+                "origin": entry.origin,
+                "proxy": _mask_proxy(entry.proxy),
+                "http2": HTTP2_ENABLED,
+                "created_at": entry.created_at,
+                "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+                **entry.metrics.snapshot(),
+            }
+            for entry in sorted(entries, key=lambda item: item.metrics.requests, reverse=True)
+        ]
+
+
+http_clients = HttpClientRegistry()
+
+
+def get_http_client(url: str, proxy: Optional[str] = None) -> httpx.AsyncClient:
+    """Общий клиент для origin'а url (и прокси). Не закрывать: живёт до shutdown."""
+    return http_clients.get(url, proxy=proxy)
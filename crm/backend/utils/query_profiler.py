@@ -0,0 +1,324 @@
+"""
+Профилирование SQL на уровне CursorWrapper.
+
+`db.connection.CursorWrapper` сообщает о каждом выполненном запросе через
+`record_query()`. Подписчики (`register_query_observer`) получают
+`QueryEvent`; встроенный `QueryProfiler` агрегирует:
+
+- по отпечатку (нормализованный SQL без литералов и плейсхолдеров):
+  количество вызовов, суммарное/среднее/p95/максимальное время, строки;
+- по маршруту (шаблон пути из `TimingMiddleware`) и отпечатку;
+- N+1: один и тот же отпечаток выполнен более QUERY_N_PLUS_ONE_THRESHOLD
+  раз за один запрос.
+
+Контекст запроса хранится в ContextVar и копируется в потоки executor'а
+(`utils.blocking.run_blocking`), поэтому offloaded-роуты учитываются тоже.
+Отчёт — `/api/diagnostics/queries`; статистика своя у каждого воркера.
+"""
+import contextvars
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from utils.logger import log_warning
+
+MAX_FINGERPRINTS = 2000
+MAX_ROUTES = 500
+SAMPLE_SIZE = 256
+OVERFLOW_FINGERPRINT = "<other>"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+PROFILING_ENABLED = os.getenv("QUERY_PROFILING", "1").strip().lower() not in {"0", "false", "no", "off"}
+N_PLUS_ONE_THRESHOLD = max(2, _env_int("QUERY_N_PLUS_ONE_THRESHOLD", 10))
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER_RE = re.compile(r"%\(\w+\)s|%s")
+_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_ROWS_RE = re.compile(r"(\(\s*\?[^()]*\))(?:\s*,\s*\(\s*\?[^()]*\))+")
+_WS_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_sql(sql: str) -> str:
+    """
+    Нормализованный SQL: без комментариев, литералы/плейсхолдеры -> ?,
+    списки IN (?, ?, ...) и VALUES (...), (...) свёрнуты, пробелы схлопнуты.
+    """
+    text = _COMMENT_RE.sub(" ", str(sql or ""))
+    text = _STRING_RE.sub("?", text)
+    text = _PLACEHOLDER_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _LIST_RE.sub("(?, ...)", text)
+    text = _ROWS_RE.sub(r"\1, ...", text)
+    return _WS_RE.sub(" ", text).strip().lower()[:2000]
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_id(fingerprint: str) -> str:
+    return hashlib.md5(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass
+class QueryEvent:
+    sql: str
+    fingerprint: str
+    duration_ms: float
+    rows: int
+    many: bool = False
+
+
+class RequestQueryProfile:
+    """Запросы одного HTTP-запроса (для N+1 и Server-Timing)."""
+
+    __slots__ = ("started", "query_count", "total_ms", "by_fingerprint", "_lock")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.total_ms = 0.0
+        self.by_fingerprint: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, event: QueryEvent) -> None:
+        with self._lock:
+            self.query_count += 1
+            self.total_ms += event.duration_ms
+            stats = self.by_fingerprint.get(event.fingerprint)
+            if stats is None:
+                self.by_fingerprint[event.fingerprint] = [1, event.duration_ms, event.rows, event.duration_ms]
+            else:
+                stats[0] += 1
+                stats[1] += event.duration_ms
+                stats[2] += event.rows
+                stats[3] = max(stats[3], event.duration_ms)
+
+    def server_timing(self) -> str:
+        app_ms = (time.perf_counter() - self.started) * 1000
+        return (
+            f'db;dur={self.total_ms:.1f};desc="{self.query_count} queries", '
+            f"app;dur={app_ms:.1f}"
+        )
+
+
+class _FingerprintStats:
+    __slots__ = ("calls", "total_ms", "max_ms", "rows", "samples")
+
+    def __init__(self, keep_samples: bool):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE) if keep_samples else None
+
+    def add(self, calls: int, duration_ms: float, rows: int, max_ms: Optional[float] = None) -> None:
+        self.calls += calls
+        self.total_ms += duration_ms
+        self.rows += rows
+        peak = duration_ms if max_ms is None else max_ms
+        if peak > self.max_ms:
+            self.max_ms = peak
+        if self.samples is not None:
+            self.samples.append(duration_ms)
+
+    def p95(self) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "total_ms": round(self.total_ms, 2),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "p95_ms": round(self.p95(), 3) if self.samples else None,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "rows_per_call": round(self.rows / self.calls, 2) if self.calls else 0.0,
+        }
+
+
+class QueryProfiler:
+    """Агрегатор статистики по отпечаткам, маршрутам и N+1."""
+
+    def __init__(self, n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._since = time.time()
+            self._fingerprints: Dict[str, _FingerprintStats] = {}
+            self._routes: Dict[str, dict] = {}
+            self._n_plus_one: Dict[tuple, dict] = {}
+
+    def _bucket(self, fingerprint: str) -> str:
+        if fingerprint in self._fingerprints or len(self._fingerprints) < MAX_FINGERPRINTS:
+            return fingerprint
+        return OVERFLOW_FINGERPRINT
+
+    def __call__(self, event: QueryEvent) -> None:
+        with self._lock:
+            key = self._bucket(event.fingerprint)
+            stats = self._fingerprints.get(key)
+            if stats is None:
+                stats = self._fingerprints[key] = _FingerprintStats(keep_samples=True)
+            stats.add(1, event.duration_ms, event.rows)
+
+    def finish_request(self, profile: RequestQueryProfile, route: str) -> List[dict]:
+        """Слить профиль запроса в статистику маршрута; вернуть найденные N+1."""
+        offenders = []
+        with self._lock:
+            if route not in self._routes and len(self._routes) >= MAX_ROUTES:
+                route = OVERFLOW_FINGERPRINT
+            route_stats = self._routes.get(route)
+            if route_stats is None:
+                route_stats = self._routes[route] = {
+                    "requests": 0, "queries": 0, "db_ms": 0.0, "max_queries": 0, "fingerprints": {},
+                }
+            route_stats["requests"] += 1
+            route_stats["queries"] += profile.query_count
+            route_stats["db_ms"] += profile.total_ms
+            route_stats["max_queries"] = max(route_stats["max_queries"], profile.query_count)
+
+            for fingerprint, (calls, total_ms, rows, max_ms) in profile.by_fingerprint.items():
+                key = self._bucket(fingerprint)
+                per_route = route_stats["fingerprints"].get(key)
+                if per_route is None:
+                    per_route = route_stats["fingerprints"][key] = _FingerprintStats(keep_samples=False)
+                per_route.add(calls, total_ms, rows, max_ms=max_ms)
+
+                if calls > self.n_plus_one_threshold:
+                    entry = self._n_plus_one.setdefault((route, key), {
+                        "route": route,
+                        "fingerprint_id": fingerprint_id(key),
+                        "fingerprint": key,
+                        "requests": 0,
+                        "max_calls_per_request": 0,
+                        "total_ms": 0.0,
+                    })
+                    entry["requests"] += 1
+                    entry["max_calls_per_request"] = max(entry["max_calls_per_request"], calls)
+                    entry["total_ms"] += total_ms
+                    offenders.append({"fingerprint": key, "calls": calls})
+        return offenders
+
+    def report(self, sort: str = "total_ms", limit: int = 50, route: Optional[str] = None) -> dict:
+        sort_key = sort if sort in {"total_ms", "mean_ms", "p95_ms", "max_ms", "calls", "rows"} else "total_ms"
+        limit = max(1, min(int(limit or 50), 500))
+
+        def _ranked(items):
+            rows = []
+            for fingerprint, stats in items:
+                row = stats.as_dict()
+                row.update({"fingerprint_id": fingerprint_id(fingerprint), "fingerprint": fingerprint})
+                rows.append(row)
+            rows.sort(key=lambda row: row.get(sort_key) or 0, reverse=True)
+            return rows[:limit]
+
+        with self._lock:
+            fingerprints = _ranked(self._fingerprints.items())
+            routes = []
+            for route_name, stats in self._routes.items():
+                if route and route_name != route:
+                    continue
+                requests = stats["requests"] or 1
+                routes.append({
+                    "route": route_name,
+                    "requests": stats["requests"],
+                    "queries": stats["queries"],
+                    "queries_per_request": round(stats["queries"] / requests, 2),
+                    "max_queries": stats["max_queries"],
+                    "db_ms": round(stats["db_ms"], 2),
+                    "db_ms_per_request": round(stats["db_ms"] / requests, 2),
+                    "top_fingerprints": _ranked(stats["fingerprints"].items())[:10],
+                })
+            routes.sort(key=lambda row: row["db_ms"], reverse=True)
+            n_plus_one = sorted(
+                (dict(entry, total_ms=round(entry["total_ms"], 2)) for entry in self._n_plus_one.values()),
+                key=lambda entry: entry["total_ms"],
+                reverse=True,
+            )
+            return {
+                "pid": os.getpid(),
+                "since": self._since,
+                "enabled": PROFILING_ENABLED,
+                "sort": sort_key,
+                "n_plus_one_threshold": self.n_plus_one_threshold,
+                "fingerprints": fingerprints,
+                "routes": routes[:limit],
+                "n_plus_one": n_plus_one[:limit],
+            }
+
+
+profiler = QueryProfiler()
+_observers: List[Callable[[QueryEvent], None]] = [profiler]
+_current_request: contextvars.ContextVar[Optional[RequestQueryProfile]] = contextvars.ContextVar(
+    "query_profile", default=None
+)
+
+
+def register_query_observer(observer: Callable[[QueryEvent], None]) -> None:
+    """Подключить наблюдателя запросов (вызывается синхронно после каждого execute)."""
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def unregister_query_observer(observer: Callable[[QueryEvent], None]) -> None:
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+def record_query(sql, duration_ms: float, rows: int = 0, many: bool = False) -> None:
+    if not PROFILING_ENABLED or not sql:
+        return
+    text = sql if isinstance(sql, str) else str(sql)
+    event = QueryEvent(text, fingerprint_sql(text), duration_ms, max(0, rows or 0), many)
+    profile = _current_request.get()
+    if profile is not None:
+        profile.add(event)
+    for observer in _observers:
+        try:
+            observer(event)
+        except Exception:
+            pass
+
+
+def start_request_profile() -> Optional[contextvars.Token]:
+    if not PROFILING_ENABLED:
+        return None
+    return _current_request.set(RequestQueryProfile())
+
+
+def current_request_profile() -> Optional[RequestQueryProfile]:
+    return _current_request.get()
+
+
+def finish_request_profile(token: Optional[contextvars.Token], route: str) -> None:
+    if token is None:
+        return
+    profile = _current_request.get()
+    _current_request.reset(token)
+    if profile is None or not profile.query_count:
+        return
+    for offender in profiler.finish_request(profile, route):
+        log_warning(
+            f"🔁 N+1 ({offender['calls']}x) on {route}: {offender['fingerprint'][:160]}",
+            "db_performance",
+        )
@@ -60,6 +60,7 @@ class RedisPubSubManager:
         self._last_connect_error: Optional[str] = None
         self._last_publish_error: Optional[str] = None
         self._handlers: Dict[str, Callable[[str, Dict[str, Any]], Awaitable[None]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
 
     def _pg_connect_kwargs(self) -> dict[str, Any]:
         return {
@@ -289,6 +290,30 @@ class RedisPubSubManager:
 
         return False
 
+    def publish_nowait(self, channel: str, message: Dict[str, Any]) -> bool:
+        """
+        Fire-and-forget publish for sync code (db helpers, worker threads).
+        Schedules `publish()` on the listener's event loop.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        try:
+            if running_loop is loop:
+                loop.create_task(self.publish(channel, message))
+            else:
+                asyncio.run_coroutine_threadsafe(self.publish(channel, message), loop)
+            return True
+        except Exception as error:
+            log_warning(f"⚠️ Could not schedule publish to {channel}: {error}", "pubsub")
+            return False
+
     def _publish_postgres(self, encoded_payload: str) -> None:
         if not self.pg_pub_conn:
             raise RuntimeError("PostgreSQL publisher is not initialized")
@@ -323,6 +348,7 @@ class RedisPubSubManager:
             return
 
         self.is_running = True
+        self._loop = asyncio.get_running_loop()
         log_info("📡 Pub/Sub listener started", "pubsub")
 
         try:
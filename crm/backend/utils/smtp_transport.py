@@ -0,0 +1,295 @@
+"""
+Пул SMTP-сессий для всей исходящей почты.
+
+Раньше каждое письмо открывало своё соединение: TCP + STARTTLS + AUTH на
+одно сообщение, синхронно (и иногда прямо на event loop). Транспорт держит
+авторизованные aiosmtplib-сессии на собственном event loop'е в отдельном
+потоке, поэтому одинаково обслуживает корутины (`send_async`,
+`send_many_async`) и sync-код из пула потоков (`send`, `send_many`).
+
+Пакет писем идёт через несколько сессий параллельно, каждая сессия
+отправляет много писем подряд. Оборванная сессия закрывается, письмо
+повторяется один раз через новое соединение.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from email.message import Message
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiosmtplib
+
+from utils.logger import log_error, log_info, log_warning
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, default)).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+SMTP_POOL_SIZE = max(1, _read_int_env("SMTP_POOL_SIZE", 4))
+SMTP_IDLE_SECONDS = max(5, _read_int_env("SMTP_IDLE_SECONDS", 60))
+# Многие провайдеры ограничивают число писем на одно соединение
+SMTP_MAX_MESSAGES_PER_SESSION = max(1, _read_int_env("SMTP_MAX_MESSAGES_PER_SESSION", 100))
+SMTP_TIMEOUT_SECONDS = max(1, _read_int_env("SMTP_TIMEOUT_SECONDS", 30))
+
+# Ошибки конкретного письма: сервер ответил, сессия остаётся рабочей
+_MESSAGE_ERRORS = (
+    aiosmtplib.SMTPRecipientsRefused,
+    aiosmtplib.SMTPSenderRefused,
+    aiosmtplib.SMTPDataError,
+)
+
+
+def create_smtp_client(config: Dict[str, Any]) -> aiosmtplib.SMTP:
+    """Клиент по конфигу configure_smtp(): 465 — implicit TLS, иначе STARTTLS."""
+    port = int(config["port"])
+    implicit_tls = port == 465
+    return aiosmtplib.SMTP(
+        hostname=config["host"],
+        port=port,
+        use_tls=implicit_tls,
+        start_tls=not implicit_tls,
+        timeout=SMTP_TIMEOUT_SECONDS,
+    )
+
+
+class _Session:
+    __slots__ = ("client", "sent", "last_used")
+
+    def __init__(self, client):
+        self.client = client
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def reusable(self, now: float) -> bool:
+        return (
+            self.client.is_connected
+            and self.sent < SMTP_MAX_MESSAGES_PER_SESSION
+            and now - self.last_used < SMTP_IDLE_SECONDS
+        )
+
+
+class _SessionPool:
+    """Сессии одного SMTP-аккаунта. Используется только из loop'а транспорта."""
+
+    def __init__(self, config: Dict[str, Any], size: int, client_factory: Callable[[Dict[str, Any]], Any]):
+        self.config = config
+        self._client_factory = client_factory
+        self._idle: List[_Session] = []
+        self._slots = asyncio.Semaphore(size)
+        self.connects = 0
+
+    async def acquire(self) -> _Session:
+        await self._slots.acquire()
+        try:
+            now = time.monotonic()
+            while self._idle:
+                session = self._idle.pop()
+                if session.reusable(now):
+                    return session
+                await self._close(session)
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, session: _Session) -> None:
+        session.last_used = time.monotonic()
+        if session.reusable(session.last_used):
+            self._idle.append(session)
+        else:
+            await self._close(session)
+        self._slots.release()
+
+    async def discard(self, session: _Session) -> None:
+        await self._close(session)
+        self._slots.release()
+
+    async def deliver(self, message: Message, session: Optional[_Session] = None) -> Tuple[bool, Optional[_Session]]:
+        """
+        Отправить письмо через сессию вызывающего (или взять новую).
+        Возвращает (успех, сессия для следующего письма).
+        """
+        for attempt in (1, 2):
+            if session is not None and not session.reusable(time.monotonic()):
+                await self.release(session)
+                session = None
+            if session is None:
+                try:
+                    session = await self.acquire()
+                except Exception as e:
+                    log_error(f"SMTP connect to {self.config['host']} failed: {e}", "email")
+                    return False, None
+            try:
+                await session.client.send_message(message)
+                session.sent += 1
+                return True, session
+            except _MESSAGE_ERRORS as e:
+                log_error(f"SMTP rejected message to {message.get('To')}: {e}", "email")
+                return False, session
+            except Exception as e:
+                await self.discard(session)
+                session = None
+                if attempt == 1:
+                    log_warning(f"SMTP session dropped ({e}), reconnecting", "email")
+                else:
+                    log_error(f"Failed to send email to {message.get('To')}: {e}", "email")
+        return False, None
+
+    async def close_idle(self, force: bool = False) -> None:
+        now = time.monotonic()
+        keep = []
+        for session in self._idle:
+            if not force and session.reusable(now):
+                keep.append(session)
+            else:
+                await self._close(session)
+        self._idle = keep
+
+    async def _connect(self) -> _Session:
+        client = self._client_factory(self.config)
+        await client.connect()
+        if self.config.get("user"):
+            await client.login(self.config["user"], self.config["password"])
+        self.connects += 1
+        return _Session(client)
+
+    @staticmethod
+    async def _close(session: _Session) -> None:
+        try:
+            await session.client.quit()
+        except Exception:
+            session.client.close()
+
+
+class SmtpTransport:
+    """Пулы сессий по SMTP-аккаунтам на отдельном event loop'е."""
+
+    def __init__(self, pool_size: int = SMTP_POOL_SIZE, client_factory: Optional[Callable] = None):
+        self.pool_size = max(1, int(pool_size))
+        self._client_factory = client_factory or create_smtp_client
+        self._pools: Dict[Tuple, _SessionPool] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._thread is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._reaper = loop.create_task(self._reap_idle())
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+                    loop.close()
+
+                thread = threading.Thread(target=run, name="smtp-transport", daemon=True)
+                thread.start()
+                ready.wait()
+                self._loop, self._thread = loop, thread
+                self._pools = {}
+                log_info(f"📮 SMTP transport started (pool size {self.pool_size})", "email")
+            return self._loop
+
+    def _get_pool(self, config: Dict[str, Any]) -> _SessionPool:
+        key = (config["host"], int(config["port"]), config.get("user") or "", config.get("password") or "")
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = _SessionPool(config, self.pool_size, self._client_factory)
+            self._pools[key] = pool
+        return pool
+
+    async def _send_many(self, config: Dict[str, Any], messages: List[Message]) -> List[bool]:
+        pool = self._get_pool(config)
+        results = [False] * len(messages)
+        pending = iter(enumerate(messages))
+
+        async def worker():
+            session = None
+            try:
+                for index, message in pending:
+                    results[index], session = await pool.deliver(message, session)
+            finally:
+                if session is not None:
+                    await pool.release(session)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.pool_size, len(messages)))))
+        return results
+
+    async def _reap_idle(self) -> None:
+        while True:
+            await asyncio.sleep(SMTP_IDLE_SECONDS)
+            for pool in list(self._pools.values()):
+                await pool.close_idle()
+
+    async def _close_all(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for pool in list(self._pools.values()):
+            await pool.close_idle(force=True)
+        self._pools = {}
+
+    def _submit(self, config: Dict[str, Any], messages: Sequence[Message]) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(self._send_many(config, list(messages)), self._get_loop())
+
+    async def send_many_async(self, messages: Sequence[Message], config: Dict[str, Any]) -> List[bool]:
+        """Отправить пакет писем одного SMTP-аккаунта; результат по каждому письму."""
+        if not messages:
+            return []
+        try:
+            return await asyncio.wrap_future(self._submit(config, messages))
+        except Exception as e:
+            log_error(f"SMTP batch of {len(messages)} failed: {e}", "email")
+            return [False] * len(messages)
+
+    async def send_async(self, message: Message, config: Dict[str, Any]) -> bool:
+        return (await self.send_many_async([message], config))[0]
+
+    def send_many(self, messages: Sequence[Message], config: Dict[str, Any]) -> List[bool]:
+        """Sync-шим для кода в пуле потоков: ждёт результат loop'а транспорта."""
+        if not messages:
+            return []
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("SmtpTransport.send_many called from the transport loop, use send_many_async")
+        try:
+            return self._submit(config, messages).result()
+        except Exception as e:
+            log_error(f"SMTP batch of {len(messages)} failed: {e}", "email")
+            return [False] * len(messages)
+
+    def send(self, message: Message, config: Dict[str, Any]) -> bool:
+        return self.send_many([message], config)[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.pool_size,
+            "accounts": len(self._pools),
+            "connects": sum(pool.connects for pool in list(self._pools.values())),
+            "idle_sessions": sum(len(pool._idle) for pool in list(self._pools.values())),
+        }
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Закрыть сессии (QUIT) и остановить loop транспорта."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or thread is None or not thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_all(), loop).result(timeout)
+        except Exception as e:
+            log_warning(f"SMTP transport shutdown: {e}", "email")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+
+smtp_transport = SmtpTransport()
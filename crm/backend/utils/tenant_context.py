@@ -12,6 +12,8 @@ _user_id_var: ContextVar[int | None] = ContextVar("tenant_user_id", default=None
 _role_var: ContextVar[str | None] = ContextVar("tenant_user_role", default=None)
 _is_super_admin_var: ContextVar[bool] = ContextVar("tenant_is_super_admin", default=False)
 _bypass_var: ContextVar[bool] = ContextVar("tenant_bypass", default=True)
+# (session_token, user) resolved by TenantContextMiddleware for the current request
+_request_session_var: ContextVar[tuple[str, dict | None] | None] = ContextVar("request_session", default=None)
 
 
 def _normalize_company_id(raw_value: Any) -> int | None:
@@ -89,6 +91,28 @@ def is_tenant_bypass_enabled() -> bool:
     return _bypass_var.get()
 
 
+def set_request_session(session_token: str | None, user: dict | None) -> Token:
+    if not session_token:
+        return _request_session_var.set(None)
+    return _request_session_var.set((session_token, user))
+
+
+def reset_request_session(token: Token | None) -> None:
+    if token is not None:
+        _request_session_var.reset(token)
+
+
+def get_request_session(session_token: str | None) -> tuple[bool, dict | None]:
+    """
+    Return (resolved, user) for the session already resolved in this request.
+    `resolved` is False when the token differs or nothing was resolved yet.
+    """
+    current = _request_session_var.get()
+    if not session_token or current is None or current[0] != session_token:
+        return False, None
+    return True, current[1]
+
+
 @contextmanager
 def platform_access():
     tokens = set_tenant_context(user=None, company_id=None, bypass=True)
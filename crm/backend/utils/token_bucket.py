@@ -0,0 +1,51 @@
+"""
+Токен-бакет для asyncio-кода: ограничение частоты обращений к внешним API.
+"""
+import asyncio
+import time
+from typing import Optional
+
+
+class AsyncTokenBucket:
+    """
+    rate токенов в секунду, накапливается не больше burst.
+    rate <= 0 — без ограничения. Ожидающие обслуживаются по очереди (FIFO через lock).
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(burst) if burst else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill(time.monotonic())
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Сколько секунд до момента, когда try_acquire(tokens) пройдёт (0 — уже можно)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
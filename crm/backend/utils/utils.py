@@ -17,6 +17,7 @@ from db import get_user_by_session, get_all_clients, get_unread_messages_count,
 from db.settings import get_custom_statuses
 from db.connection import get_db_connection
 from core.config import CLIENT_STATUSES, is_localhost
+from utils.tenant_context import get_request_session
 from utils.logger import log_info, log_error, log_debug, log_warning
 
 # ===== ДИРЕКТОРИИ И ФАЙЛЫ =====
@@ -207,6 +208,11 @@ def require_auth(session_token: Optional[str] = Cookie(None)):
         # or if it's just None, we return None
         return None
     
+    # Session already resolved by TenantContextMiddleware for this request
+    is_resolved, user = get_request_session(session_token)
+    if is_resolved:
+        return user if user else None
+    
     auth_start = time.time()
     user = get_user_by_session(session_token)
     auth_duration = (time.time() - auth_start) * 1000
@@ -420,12 +426,14 @@ def get_current_user(session_token: Optional[str] = Cookie(None)):
             detail="Не авторизован. Пожалуйста, войдите в систему."
         )
     
-    auth_start = time.time()
-    user = get_user_by_session(session_token)
-    auth_duration = (time.time() - auth_start) * 1000
-    
-    if auth_duration > 500:
-        log_info(f"⚠️ [get_current_user] Slow auth check: {auth_duration:.2f}ms", "auth")
+    is_resolved, user = get_request_session(session_token)
+    if not is_resolved:
+        auth_start = time.time()
+        user = get_user_by_session(session_token)
+        auth_duration = (time.time() - auth_start) * 1000
+        
+        if auth_duration > 500:
+            log_info(f"⚠️ [get_current_user] Slow auth check: {auth_duration:.2f}ms", "auth")
     
     if not user:
         raise HTTPException(
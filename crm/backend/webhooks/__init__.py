@@ -6,19 +6,22 @@ from fastapi import APIRouter, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 import json
 import httpx
+from utils.http_clients import get_http_client
 import os
+import time
 from datetime import datetime
 
 from core.config import VERIFY_TOKEN, PAGE_ACCESS_TOKEN, INSTAGRAM_BUSINESS_ID, DATABASE_NAME
 from db import (
     get_or_create_client, save_message, get_chat_history,
-    detect_and_save_language, get_client_language, update_client_info,
-    get_client_bot_mode, get_salon_settings
+    get_client_language, update_client_info, get_salon_settings
 )
 from db.clients import (
     auto_fill_name_from_username, 
     track_client_interest, 
-    update_client_temperature
+    update_client_temperature,
+    detect_language,
+    resolve_conversation_company_id
 )
 from db.bookings import (
     get_incomplete_booking,
@@ -27,12 +30,19 @@ from db.bookings import (
 from bot import get_bot
 from integrations import send_message, send_typing_indicator
 from utils.logger import logger, log_info, log_warning, log_error
+from utils.blocking import run_blocking
+from utils.tenant_context import reset_tenant_context, set_tenant_context
+from utils.cache import TTLCache
 from crm_api.chat_ws import notify_new_message
+from services.instagram_inbox import instagram_inbox, split_webhook_events, enqueue_instagram_events
+from services.conversation_state import conversation_states, invalidate_conversation_state
 
 router = APIRouter(tags=["Webhooks"])
 
-_processed_messages = {}  # {mid: timestamp}
+# Недавние mid этого воркера: повтор в пределах окна не ходит в БД.
+# Межворкерную дедупликацию обеспечивает уникальный индекс instagram_inbox.mid
 _DEDUP_WINDOW = 300
+_recent_mids = TTLCache(maxsize=10000, ttl=_DEDUP_WINDOW)
 
 async def fetch_username_from_api(user_id: str) -> tuple:
     """Попытка получить username из Instagram API"""
@@ -45,12 +55,8 @@ async def fetch_username_from_api(user_id: str) -> tuple:
         
         proxy_url = os.getenv("PROXY_URL") if os.getenv("ENVIRONMENT") == "production" else None
 
-        if proxy_url:
-            async with httpx.AsyncClient(timeout=10.0, proxy=proxy_url) as client:
-                response = await client.get(url, params=params)
-        else:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
+        client = get_http_client(url, proxy=proxy_url)
+        response = await client.get(url, params=params, timeout=10.0)
         
         if response.status_code == 200:
             data = response.json()
@@ -129,12 +135,8 @@ async def get_instagram_scoped_id(sender_id: str) -> str:
         
         proxy_url = os.getenv("PROXY_URL") if os.getenv("ENVIRONMENT") == "production" else None
 
-        if proxy_url:
-            async with httpx.AsyncClient(timeout=10.0, proxy=proxy_url) as client:
-                response = await client.get(url, params=params)
-        else:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
+        client = get_http_client(url, proxy=proxy_url)
+        response = await client.get(url, params=params, timeout=10.0)
         
         response.raise_for_status()
         
@@ -153,8 +155,25 @@ async def get_instagram_scoped_id(sender_id: str) -> str:
 
 async def process_message_background(messaging_event: dict):
     """
-    Фоновая задача для обработки сообщения
+    Фоновая задача для обработки сообщения. Ход выполняется в tenant-контексте
+    компании клиента: контекст бота, кэш ответов и очередь LLM берутся этой компании.
     """
+    is_echo = bool(messaging_event.get("message", {}).get("is_echo"))
+    client_key = messaging_event.get("recipient" if is_echo else "sender", {}).get("id")
+    try:
+        company_id = await run_blocking(resolve_conversation_company_id, client_key)
+    except Exception as e:
+        log_error(f"Company not resolved for Instagram conversation {client_key}: {e}", "webhook")
+        company_id = None
+
+    tenant_tokens = set_tenant_context(company_id=company_id, bypass=company_id is None)
+    try:
+        await _process_message_event(messaging_event)
+    finally:
+        reset_tenant_context(tenant_tokens)
+
+
+async def _process_message_event(messaging_event: dict):
     try:
         sender_id = messaging_event.get("sender", {}).get("id")
         sender_id = await get_instagram_scoped_id(sender_id)
@@ -197,6 +216,7 @@ async def process_message_background(messaging_event: dict):
                 # Проверяем: это НЕ fallback-сообщение бота
                 if 'я сейчас перегружен' not in message_text.lower() and '#бот помоги#' not in message_text.lower():
                     save_message(client_id, message_text, "manager", message_type="text")
+                    invalidate_conversation_state(client_id)
                     await notify_new_message(client_id, message_text, "manager", message_type="text")
                     logger.info(f"💾 Manager message saved: {message_text[:50]}")
             
@@ -208,6 +228,7 @@ async def process_message_background(messaging_event: dict):
                     payload = attachment.get("payload", {})
                     file_url = payload.get("url")
                     save_message(client_id, file_url, "manager", message_type=attachment_type)
+                    invalidate_conversation_state(client_id)
                     await notify_new_message(client_id, file_url, "manager", message_type=attachment_type)
             
             return
@@ -340,6 +361,9 @@ async def process_message_background(messaging_event: dict):
         
         log_info(f"📩 Получено сообщение от клиента {sender_id}: {message_text[:50]}", "webhook")
         
+        # Состояние диалога (история, прогресс записи, язык, режим, контексты):
+        # изменения хода пишутся одним statement'ом в finally
+        conversation = None
         try:
             # ✅ ПОЛУЧАЕМ USERNAME И PROFILE_PIC
             username = ""
@@ -362,12 +386,8 @@ async def process_message_background(messaging_event: dict):
 
                     proxy_url = os.getenv("PROXY_URL") if os.getenv("ENVIRONMENT") == "production" else None
 
-                    if proxy_url:
-                        async with httpx.AsyncClient(timeout=10.0, proxy=proxy_url) as client:
-                            response = await client.get(url, params=params)
-                    else:
-                        async with httpx.AsyncClient(timeout=10.0) as client:
-                            response = await client.get(url, params=params)
+                    client = get_http_client(url, proxy=proxy_url)
+                    response = await client.get(url, params=params, timeout=10.0)
 
                     if response.status_code == 200:
                         data_api = response.json()
@@ -410,16 +430,19 @@ async def process_message_background(messaging_event: dict):
             )
             await notify_new_message(sender_id, message_text, "client", message_type="text")
             log_info(f"💾 Сообщение сохранено в БД: {message_text[:30]}...", "webhook")
+
+            conversation = await run_blocking(conversation_states.get, sender_id)
             
             # ✅ ОБРАБОТКА ОТЗЫВОВ (если ждем ответ)
-            try:
-                from bot.feedback_handler import handle_feedback_response
-                is_feedback_handled = await handle_feedback_response(sender_id, message_text)
-                if is_feedback_handled:
-                    log_info("✅ Feedback handled successfully, skipping bot response", "webhook")
-                    return
-            except Exception as fh_err:
-                log_error(f"⚠️ Feedback handler error: {fh_err}", "webhook")
+            if conversation.has_context('awaiting_feedback'):
+                try:
+                    from bot.feedback_handler import handle_feedback_response
+                    is_feedback_handled = await handle_feedback_response(sender_id, message_text)
+                    if is_feedback_handled:
+                        log_info("✅ Feedback handled successfully, skipping bot response", "webhook")
+                        return
+                except Exception as fh_err:
+                    log_error(f"⚠️ Feedback handler error: {fh_err}", "webhook")
             
             
             # ✅ #5 - Отслеживание интереса к услугам
@@ -442,7 +465,8 @@ async def process_message_background(messaging_event: dict):
             
             # ✅ ОПРЕДЕЛЯЕМ ЯЗЫК
             # Определяем язык и используем результат
-            client_language = detect_and_save_language(sender_id, message_text)
+            client_language = detect_language(message_text)
+            conversation.set_language(client_language)
             
             # ✅ ПРОВЕРКА: Поддерживается ли язык?
             try:
@@ -476,7 +500,7 @@ async def process_message_background(messaging_event: dict):
                 return
             
             # ✅ Получаем режим ПОСЛЕ проверки глобальной настройки
-            bot_mode = get_client_bot_mode(sender_id)
+            bot_mode = conversation.bot_mode
             log_info(f"🤖 Bot mode for {sender_id}: {bot_mode}", "webhook")
             
             if bot_mode == 'manual':
@@ -491,7 +515,7 @@ async def process_message_background(messaging_event: dict):
 
             await send_typing_indicator(sender_id)
             
-            history = get_chat_history(sender_id, limit=10)
+            history = conversation.history_tuples()
             
             # ✅ #4 - Проверка незавершённой записи
             incomplete = get_incomplete_booking(sender_id)
@@ -535,8 +559,7 @@ async def process_message_background(messaging_event: dict):
             }
             
             # ✅ ПОЛУЧАЕМ ПРОГРЕСС БРОНИРОВАНИЯ
-            from db.bookings import get_booking_progress, update_booking_progress, clear_booking_progress
-            booking_progress = get_booking_progress(sender_id)
+            booking_progress = conversation.get_booking_progress()
 
             # ✅ #NEW - АВТОМАТИЧЕСКОЕ ИЗВЛЕЧЕНИЕ ТЕЛЕФОНА (REGEX)
             # Это нужно чтобы бот СРАЗУ знал телефон, даже если AI его "не заметил"
@@ -555,14 +578,12 @@ async def process_message_background(messaging_event: dict):
                 
                 # Если прогресс есть - обновляем его
                 if booking_progress:
-                    booking_progress['phone'] = clean_phone
-                    update_booking_progress(sender_id, {'phone': clean_phone})
+                    booking_progress = conversation.update_booking_progress({'phone': clean_phone})
                     log_info(f"💾 Phone saved to booking progress", "webhook")
                 else:
                     # Если прогресса нет, но телефон дали - создаем черновик
                     # Это может быть полезно если клиент сразу пишет "Хочу записаться, мой номер ..."
-                    update_booking_progress(sender_id, {'phone': clean_phone})
-                    booking_progress = {'phone': clean_phone} # Чтобы передать боту
+                    booking_progress = conversation.update_booking_progress({'phone': clean_phone}) # Чтобы передать боту
 
             
             logger.info("🤖 Generating AI response...")
@@ -693,7 +714,7 @@ async def process_message_background(messaging_event: dict):
                                 pass
                         
                         # ✅ ОЧИЩАЕМ ПРОГРЕСС ПОСЛЕ УСПЕШНОЙ ЗАПИСИ
-                        clear_booking_progress(sender_id)
+                        conversation.clear_booking_progress()
                     
                 except Exception as save_error:
                     logger.error(f"❌ Failed to save booking: {save_error}")
@@ -726,7 +747,7 @@ async def process_message_background(messaging_event: dict):
                             key, value = line.split(':', 1)
                             new_progress[key.strip()] = value.strip()
                     
-                    update_booking_progress(sender_id, new_progress)
+                    conversation.update_booking_progress(new_progress)
                     logger.info(f"💾 Progress updated: {new_progress}")
                     
                     # Удаляем тег из ответа
@@ -759,7 +780,7 @@ async def process_message_background(messaging_event: dict):
                         if cancel_booking(active_booking['id']):
                             logger.info(f"✅ Booking {active_booking['id']} cancelled successfully")
                             # Очищаем прогресс на всякий случай
-                            clear_booking_progress(sender_id)
+                            conversation.clear_booking_progress()
                         else:
                             logger.error(f"❌ Failed to cancel booking {active_booking['id']}")
                     else:
@@ -832,6 +853,9 @@ async def process_message_background(messaging_event: dict):
             logger.error(f"❌ Processing error: {e}")
             import traceback
             logger.error(traceback.format_exc())
+        finally:
+            if conversation is not None:
+                await run_blocking(conversation_states.flush, conversation)
 
     except Exception as e:
         logger.error(f"❌ Background task error: {e}")
@@ -840,51 +864,53 @@ async def process_message_background(messaging_event: dict):
 
 @router.post("/webhook")
 async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
-    """Обработка входящих сообщений от Instagram"""
+    """
+    Обработка входящих сообщений от Instagram: события кладутся в общую
+    очередь instagram_inbox, ответ 200 уходит сразу после записи.
+    """
+    started = time.perf_counter()
     try:
-        logger.info("=" * 70)
-        logger.info("📨 WEBHOOK: POST request received")
-        
         body_bytes = await request.body()
-        body_str = body_bytes.decode('utf-8')
-        
-        data = json.loads(body_str)
+        data = json.loads(body_bytes.decode('utf-8'))
         
         if data.get("object") != "instagram":
             logger.warning(f"⚠️ Not Instagram: {data.get('object')}")
             return {"status": "ok"}
         
-        logger.info(f"📦 Full webhook payload: {json.dumps(data, indent=2)[:500]}...")
-        
-        for entry in data.get("entry", []):
-            for messaging in entry.get("messaging", []):
-                # Проверка дедупликации
-                message_data = messaging.get("message", {})
-                mid = message_data.get("mid")
-                
+        logger.info(f"📨 WEBHOOK payload: {json.dumps(data)[:500]}...")
+
+        events, ephemeral = split_webhook_events(data)
+        metrics = instagram_inbox.metrics
+        metrics.received += len(events)
+
+        fresh = []
+        for mid, conversation_id, messaging in events:
+            if mid and mid in _recent_mids:
+                metrics.duplicates += 1
+                logger.info(f"⏭️ Duplicate message {mid}, skipping")
+                continue
+            fresh.append((mid, conversation_id, messaging))
+
+        if fresh:
+            try:
+                accepted = await run_blocking(enqueue_instagram_events, fresh)
+                metrics.accepted += len(accepted)
+                metrics.duplicates += len(fresh) - len(accepted)
+                instagram_inbox.wake()
+            except Exception as e:
+                # Очередь недоступна — обрабатываем в этом воркере, как раньше
+                log_error(f"Instagram inbox enqueue failed, processing in-process: {e}", "webhook")
+                metrics.fallback += len(fresh)
+                for _, _, messaging in fresh:
+                    background_tasks.add_task(process_message_background, messaging)
+            for mid, _, _ in fresh:
                 if mid:
-                    now = datetime.now()
-                    # Очистка старых записей
-                    if len(_processed_messages) > 1000:
-                        _processed_messages.clear()
-                        
-                    for old_mid, old_time in list(_processed_messages.items()):
-                        if (now - old_time).total_seconds() > _DEDUP_WINDOW:
-                            del _processed_messages[old_mid]
-
-                    # Проверка дубликата
-                    if mid in _processed_messages:
-                        time_diff = (now - _processed_messages[mid]).total_seconds()
-                        logger.info(f"⏭️ Duplicate message {mid} (seen {time_diff:.1f}s ago), skipping")
-                        continue
-                    
-                    _processed_messages[mid] = now
-                    logger.info(f"✅ New message {mid}, processing")
+                    _recent_mids.set(mid, True)
 
-                # ✅ ДОБАВЛЯЕМ В ФОНОВУЮ ЗАДАЧУ
-                background_tasks.add_task(process_message_background, messaging)
+        # Набор текста — эфемерное событие, очередь ему не нужна
+        for messaging in ephemeral:
+            background_tasks.add_task(process_message_background, messaging)
         
-        # ✅ СРАЗУ ВОЗВРАЩАЕМ 200 OK
         return {"status": "ok"}
         
     except Exception as e:
@@ -893,6 +919,8 @@ async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
         import traceback
         logger.error(traceback.format_exc())
         return {"status": "ok"}
+    finally:
+        instagram_inbox.metrics.record_ack((time.perf_counter() - started) * 1000)
     
 
 @router.get("/webhook/test")
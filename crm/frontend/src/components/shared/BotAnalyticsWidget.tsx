@@ -3,7 +3,7 @@ import React, { useEffect, useState } from 'react';
 import { AreaChart, Area, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, PieChart, Pie, Cell } from 'recharts';
 import { apiClient } from '@crm/api/client';
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from '../ui/card';
-import { Loader2, MessageSquare, CheckCircle, UserCog, BarChart3 } from 'lucide-react';
+import { Loader2, MessageSquare, CheckCircle, UserCog, BarChart3, Zap } from 'lucide-react';
 import { useTranslation } from 'react-i18next';
 
 interface BotAnalyticsData {
@@ -30,6 +30,14 @@ interface BotAnalyticsData {
         language: string;
         count: number;
     }>;
+    answer_cache?: {
+        hits: number;
+        misses: number;
+        bypassed: number;
+        hit_rate: number;
+        saved_upstream_seconds: number;
+        avg_upstream_ms: number;
+    };
 }
 
 const BotAnalyticsWidget: React.FC = () => {
@@ -72,7 +80,7 @@ const BotAnalyticsWidget: React.FC = () => {
 
     return (
         <div className="space-y-6">
-            <div className="grid grid-cols-1 md:grid-cols-4 gap-4">
+            <div className={`grid grid-cols-1 ${data.answer_cache ? 'md:grid-cols-5' : 'md:grid-cols-4'} gap-4`}>
                 <StatsCard
                     title={t('analytics.total_dialogs', 'Total Dialogs')}
                     value={data.summary.total_sessions}
@@ -97,6 +105,14 @@ const BotAnalyticsWidget: React.FC = () => {
                     subValue={t('analytics.average', 'Average')}
                     Icon={<BarChart3 className="w-6 h-6 text-gray-500" />}
                 />
+                {data.answer_cache && (
+                    <StatsCard
+                        title={t('analytics.answer_cache', 'Cached Answers')}
+                        value={`${data.answer_cache.hit_rate}%`}
+                        subValue={`${data.answer_cache.hits} ${t('analytics.answer_cache_hits', 'answers')} · ${data.answer_cache.saved_upstream_seconds} ${t('analytics.answer_cache_saved', 's of AI time saved')}`}
+                        Icon={<Zap className="w-6 h-6 text-yellow-500" />}
+                    />
+                )}
             </div>
 
             <div className="grid grid-cols-1 md:grid-cols-2 gap-6">